@@ -0,0 +1,169 @@
+"""
+Concurrent polling of device channels.
+
+device-status and device-monitoring are built and deployed separately, so each
+keeps a copy of this module: src/device-status/channel_poller.py and
+src/device-monitoring/helpers/channel_poller.py. Change both copies in the same
+commit, device-monitoring/tests/test_channel_poller.py fails when they differ.
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any
+from urllib.parse import urlsplit
+
+import aiohttp
+
+
+@dataclass
+class ChannelResponse:
+    key: Any
+    status: int
+    body: Any
+    latency: float
+    attempts: int
+
+
+class HostRateLimiter:
+    """
+    Token buckets limiting the requests per second sent to each host.
+    A rate of None disables the limit.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.burst = burst or rate or 1
+        self.buckets = {}
+
+    async def wait(self, host):
+        if not self.rate:
+            return
+
+        while True:
+            now = time.monotonic()
+            tokens, updated_at = self.buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                self.buckets[host] = (tokens - 1, now)
+                return
+            self.buckets[host] = (tokens, now)
+            await asyncio.sleep((1 - tokens) / self.rate)
+
+
+class ChannelPoller:
+    """
+    Polls many channel urls over one pooled HTTP session.
+
+    At most `concurrency` channels are polled at once, each host receives at most
+    `rate_per_host` requests per second and every request times out after
+    `timeout` seconds. A request still pending after `hedge_after` seconds is
+    raced against a second identical request, and failed or timed out requests
+    are retried `retries` times. Responses are yielded as they arrive.
+    """
+
+    def __init__(
+        self,
+        concurrency=100,
+        rate_per_host=None,
+        timeout=10,
+        hedge_after=None,
+        retries=2,
+        verify_ssl=True,
+    ):
+        self.concurrency = concurrency
+        self.rate_limiter = HostRateLimiter(rate_per_host)
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.retries = retries
+        self.verify_ssl = verify_ssl
+
+    async def _request(self, session, url):
+        async with session.get(url) as response:
+            body = None
+            if response.status == 200:
+                body = await response.json(content_type=None)
+            return response.status, body
+
+    async def _timed_request(self, session, url):
+        await self.rate_limiter.wait(urlsplit(url).netloc)
+        return await asyncio.wait_for(self._request(session, url), self.timeout)
+
+    async def _hedged_request(self, session, url):
+        first = asyncio.ensure_future(self._timed_request(session, url))
+        if self.hedge_after is None:
+            return await first
+
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        pending = {first, asyncio.ensure_future(self._timed_request(session, url))}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _poll_channel(self, session, semaphore, key, url):
+        attempts = 0
+        async with semaphore:
+            start = time.monotonic()
+            while attempts <= self.retries:
+                attempts += 1
+                try:
+                    status, body = await self._hedged_request(session, url)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                    continue
+                if status < 500:
+                    return ChannelResponse(
+                        key, status, body, time.monotonic() - start, attempts
+                    )
+
+            return ChannelResponse(key, -1, None, time.monotonic() - start, attempts)
+
+    async def poll(self, channels):
+        """
+        Polls (key, url) pairs, yielding a ChannelResponse per channel in the
+        order the responses complete. The status is -1 when no response was
+        received after all retries.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connections = self.concurrency * (2 if self.hedge_after is not None else 1)
+        connector = aiohttp.TCPConnector(
+            limit=connections,
+            limit_per_host=connections,
+            ssl=None if self.verify_ssl else False,
+        )
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = [
+                asyncio.ensure_future(self._poll_channel(session, semaphore, key, url))
+                for key, url in channels
+            ]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    yield await task
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+
+def poll_channels(channels, on_response, **options):
+    """
+    Polls (key, url) pairs with a ChannelPoller, calling on_response with each
+    ChannelResponse as it arrives.
+    """
+
+    async def poll():
+        async for response in ChannelPoller(**options).poll(channels):
+            on_response(response)
+
+    asyncio.run(poll())
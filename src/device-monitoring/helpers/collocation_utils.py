@@ -1,6 +1,6 @@
-import copy
 import math
 from datetime import datetime, timedelta
+from itertools import combinations
 
 import numpy as np
 import pandas as pd
@@ -37,14 +37,45 @@ def dates_array(start_date_time: datetime, end_date_time: datetime) -> list[date
 
 def device_pairs(devices: list[str]) -> list[list[str]]:
     devices = list(set(devices))
-    pairs = []
-    for device_x in devices:
-        for device_y in devices:
-            if (device_x == device_y) or ([device_y, device_x] in pairs):
-                continue
-            pairs.append([device_x, device_y])
-
-    return pairs
+    return [[device_x, device_y] for device_x, device_y in combinations(devices, 2)]
+
+
+def pivot_devices_data(
+    data: dict[str, pd.DataFrame], devices: list[str], cols: list[str]
+) -> dict[str, pd.DataFrame]:
+    """
+    Aligns the devices' data on one timestamp index, returning a timestamp by
+    device frame for each column. A device whose column is not numeric is left
+    out of that column's frame.
+    """
+    frames: dict[str, dict[str, pd.Series]] = {col: {} for col in cols}
+    for device in devices:
+        device_data = data.get(device, pd.DataFrame())
+        device_data = device_data[["timestamp", *cols]]
+        device_data = device_data.dropna(subset=["timestamp"])
+        device_data = device_data.drop_duplicates(subset=["timestamp"], keep="first")
+        device_data = device_data.set_index("timestamp").select_dtypes(include="number")
+        for col in device_data.columns:
+            frames[col][device] = device_data[col]
+
+    return {
+        col: pd.DataFrame(series, columns=list(series.keys()), dtype=float)
+        for col, series in frames.items()
+    }
+
+
+def inter_sensor_correlation_matrices(
+    data: dict[str, pd.DataFrame], devices: list[str], cols: list[str]
+) -> dict[str, pd.DataFrame]:
+    """
+    Pearson correlations of every pair of devices for each column, computed on
+    the timestamps both devices have values for and rounded to 4 decimal places.
+    """
+    devices = list(dict.fromkeys(devices))
+    return {
+        col: frame.corr().round(4)
+        for col, frame in pivot_devices_data(data, devices, cols).items()
+    }
 
 
 def compute_differences(
@@ -63,40 +94,33 @@ def compute_differences(
             error_devices=[],
         )
 
-    statistics_list = copy.copy(statistics)
-    differences = []
     # TODO compute base device
-    data: dict[str, dict] = {}
-    for device_statistics in statistics_list:
-        device = device_statistics.pop("device_name")
-        data[device] = device_statistics
+    data = pd.DataFrame(statistics).drop_duplicates(subset=["device_name"], keep="last")
+    data = data.set_index("device_name").astype(float)
 
-    pairs = device_pairs(list(data.keys()))
+    pairs = device_pairs(list(data.index))
     passed_devices: list[str] = []
     failed_devices: list[str] = []
 
-    for device_pair in pairs:
-        device_x = device_pair[0]
-        device_y = device_pair[1]
-
-        device_x_data = pd.DataFrame([data.get(device_x)])
-        device_y_data = pd.DataFrame([data.get(device_y)])
-
-        differences_df = abs(device_x_data - device_y_data)
-        differences_df.replace(np.nan, None, inplace=True)
-        results = differences_df.to_dict("records")
-
-        try:
-            results = results[0]
-            passed = (
-                results[f"{parameter}_mean"] <= threshold
-                if results[f"{parameter}_mean"]
-                else False
-            )
-        except IndexError:
-            results = []
-            passed = False
+    # Differences of all the pairs at once, a row per pair
+    positions = data.index.get_indexer([device for pair in pairs for device in pair])
+    values = data.to_numpy()
+    differences_df = pd.DataFrame(
+        np.abs(values[positions[0::2]] - values[positions[1::2]]),
+        columns=data.columns,
+    )
+    parameter_differences = differences_df[f"{parameter}_mean"]
+    pairs_passed = (
+        parameter_differences.notna()
+        & (parameter_differences != 0)
+        & (parameter_differences <= threshold)
+    ).tolist()
+    differences_df = differences_df.astype(object).where(differences_df.notna(), None)
 
+    differences = []
+    for device_pair, passed, results in zip(
+        pairs, pairs_passed, differences_df.to_dict("records")
+    ):
         differences.append(
             {
                 "devices": device_pair,
@@ -106,9 +130,9 @@ def compute_differences(
         )
 
         if passed:
-            passed_devices.extend([device_x, device_y])
+            passed_devices.extend(device_pair)
         else:
-            failed_devices.extend([device_x, device_y])
+            failed_devices.extend(device_pair)
 
     passed_devices = list(set(passed_devices))
     failed_devices = list(set(failed_devices).difference(passed_devices))
@@ -133,8 +157,8 @@ def compute_differences(
     )
 
 
-def compute_devices_inter_sensor_correlation(
-    data: dict[str, pd.DataFrame],
+def pair_inter_sensor_correlation(
+    correlations: dict[str, pd.DataFrame],
     device_x: str,
     device_y: str,
     correlation_cols: list,
@@ -142,38 +166,23 @@ def compute_devices_inter_sensor_correlation(
     r2_threshold: float,
     parameter: str,
 ) -> dict:
-    device_x_data = data.get(device_x, pd.DataFrame())
-
-    device_x_data = device_x_data[correlation_cols]
-    device_x_data = device_x_data.add_prefix(f"{device_x}_")
-    device_x_data.rename(columns={f"{device_x}_timestamp": "timestamp"}, inplace=True)
-
-    device_y_data = data.get(device_y, pd.DataFrame())
-    device_y_data = device_y_data[correlation_cols]
-    device_y_data = device_y_data.add_prefix(f"{device_y}_")
-    device_y_data.rename(columns={f"{device_y}_timestamp": "timestamp"}, inplace=True)
-
-    device_pair_data = pd.merge(
-        left=device_x_data,
-        right=device_y_data,
-        on=["timestamp"],
-    )
-    device_pair_data = device_pair_data.select_dtypes(include="number")
-
     device_pair_correlation: dict = dict()
 
     for col in correlation_cols:
-        try:
-            if col == "timestamp":
-                continue
-
-            comp_cols = [f"{device_x}_{col}", f"{device_y}_{col}"]
+        if col == "timestamp":
+            continue
 
-            device_pair_correlation_data = device_pair_data[comp_cols].corr().round(4)
-            device_pair_correlation_data.replace(np.nan, None, inplace=True)
-            correlation_value = device_pair_correlation_data.iloc[0][comp_cols[1]]
-            device_pair_correlation[f"{col}_pearson"] = correlation_value
+        correlation = correlations.get(col, pd.DataFrame())
+        if device_x not in correlation.index or device_y not in correlation.index:
+            device_pair_correlation[f"{col}_r2_pearson"] = None
+            continue
 
+        correlation_value = correlation.at[device_x, device_y]
+        correlation_value = (
+            None if pd.isna(correlation_value) else float(correlation_value)
+        )
+        device_pair_correlation[f"{col}_pearson"] = correlation_value
+        try:
             device_pair_correlation[f"{col}_r2_pearson"] = math.sqrt(correlation_value)
         except Exception:
             device_pair_correlation[f"{col}_r2_pearson"] = None
@@ -194,6 +203,29 @@ def compute_devices_inter_sensor_correlation(
     return device_pair_correlation
 
 
+def compute_devices_inter_sensor_correlation(
+    data: dict[str, pd.DataFrame],
+    device_x: str,
+    device_y: str,
+    correlation_cols: list,
+    threshold: float,
+    r2_threshold: float,
+    parameter: str,
+) -> dict:
+    cols = [col for col in correlation_cols if col != "timestamp"]
+    return pair_inter_sensor_correlation(
+        correlations=inter_sensor_correlation_matrices(
+            data=data, devices=[device_x, device_y], cols=cols
+        ),
+        device_x=device_x,
+        device_y=device_y,
+        correlation_cols=correlation_cols,
+        threshold=threshold,
+        r2_threshold=r2_threshold,
+        parameter=parameter,
+    )
+
+
 def compute_inter_sensor_correlation(
     devices: list[str],
     data: dict[str, pd.DataFrame],
@@ -219,17 +251,21 @@ def compute_inter_sensor_correlation(
     correlation_cols = ["timestamp", parameter]
     correlation_cols.extend(other_parameters)
     correlation_cols = list(set(correlation_cols))
+    cols = [col for col in correlation_cols if col != "timestamp"]
 
     if base_device is not None and base_device != "":
+        correlations = inter_sensor_correlation_matrices(
+            data=data, devices=[base_device, *data.keys()], cols=cols
+        )
         for device in data.keys():
             if device == base_device:
                 continue
 
-            device_pair_correlation = compute_devices_inter_sensor_correlation(
+            device_pair_correlation = pair_inter_sensor_correlation(
                 correlation_cols=correlation_cols,
                 device_x=base_device,
                 device_y=device,
-                data=data,
+                correlations=correlations,
                 parameter=parameter,
                 threshold=threshold,
                 r2_threshold=r2_threshold,
@@ -245,16 +281,19 @@ def compute_inter_sensor_correlation(
     else:
         passed_pairs: list[tuple[str, str]] = []
         pairs = device_pairs(devices)
+        correlations = inter_sensor_correlation_matrices(
+            data=data, devices=devices, cols=cols
+        )
 
         for device_pair in pairs:
             device_x = device_pair[0]
             device_y = device_pair[1]
 
-            device_pair_correlation = compute_devices_inter_sensor_correlation(
+            device_pair_correlation = pair_inter_sensor_correlation(
                 correlation_cols=correlation_cols,
                 device_x=device_x,
                 device_y=device_y,
-                data=data,
+                correlations=correlations,
                 parameter=parameter,
                 threshold=threshold,
                 r2_threshold=r2_threshold,
@@ -1,310 +1,440 @@
-import base64
-import datetime as dt
-from bson import json_util, ObjectId
-import json
-from datetime import datetime, timedelta
-from pymongo import MongoClient
-import requests
-import math
-from google.cloud import bigquery
-import pandas as pd
-import numpy as np
-import os
-
-
-MONGO_URI = os.getenv("MONGO_URI")
-client = MongoClient(MONGO_URI)
-db = client['airqo_netmanager_airqo']
-
-
-def function_to_execute(event, context):
-    """Triggered from a message on a Cloud Pub/Sub topic.
-    Args:
-         event (dict): Event payload.
-         context (google.cloud.functions.Context): Metadata for the event.
-    """
-    action = base64.b64decode(event['data']).decode('utf-8')
-
-    if (action == "compute_uptime_for_all_devices"):
-        compute_uptime_for_all_devices()
-
-
-def str_to_date(st):
-    """
-    Converts a string to datetime
-    """
-    return datetime.strptime(st, '%Y-%m-%dT%H:%M:%S.%fZ')
-
-
-def date_to_str(date):
-    """
-    Converts datetime to a string
-    """
-    return datetime.strftime(date, '%Y-%m-%dT%H:%M:%S.%fZ')
-
-
-def str_to_date_find(st):
-    """
-    Converts a string of different format to datetime
-    """
-    return datetime.strptime(st, '%Y-%m-%dT%H:%M:%SZ')
-
-
-def date_to_formated_str(date):
-    """
-    Converts datetime to a string
-    """
-    return datetime.strftime(date, '%Y-%m-%d %H:%M')
-
-
-def get_all_devices():
-    results = list(db.devices.find({"locationID": {'$ne': ''}}))
-    active_devices = []
-    for device in results:
-        print(device['name'])
-        device_id = device['_id']
-        print(device_id)
-        if(device['isActive'] == True):
-            active_devices.append(device)
-    return active_devices
-
-
-def compute_number_of_months_between_two_dates(start_date, end_date):
-    number_of_months = (end_date.year - start_date.year) * \
-        12 + (end_date.month - start_date.month)
-    return number_of_months
-
-
-def get_raw_channel_data(channel_id: int, hours=24):
-    channel_id = str(channel_id)
-    client = bigquery.Client()
-    sql_query = """ 
-           
-            SELECT SAFE_CAST(TIMESTAMP(created_at) as DATETIME) as time, channel_id,field1 as s1_pm2_5,
-            field2 as s1_pm10, field3 as s2_pm2_5, field4 as s2_pm10, field7 as battery_voltage
-            FROM `airqo-250220.thingspeak.raw_feeds_pms` 
-            WHERE channel_id = {0} AND CAST(created_at as TIMESTAMP) >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {1} HOUR) 
-            ORDER BY time DESC           
-            
-        """
-    xx = "'" + channel_id + "'"
-    sql_query = sql_query.format(xx, hours)
-
-    job_config = bigquery.QueryJobConfig()
-    job_config.use_legacy_sql = False
-
-    df = client.query(sql_query, job_config=job_config).to_dataframe()
-    df['time'] = pd.to_datetime(df['time'])
-    df['time'] = df['time']
-    df['s1_pm2_5'] = pd.to_numeric(df['s1_pm2_5'], errors='coerce')
-    df['channel_id'] = pd.to_numeric(df['channel_id'], errors='coerce')
-    df['s1_pm10'] = pd.to_numeric(df['s1_pm10'], errors='coerce')
-    df['s2_pm2_5'] = pd.to_numeric(df['s2_pm2_5'], errors='coerce')
-    df['s2_pm10'] = pd.to_numeric(df['s2_pm10'], errors='coerce')
-    df['s1_s2_average_pm2_5'] = df[[
-        's1_pm2_5', 's2_pm2_5']].mean(axis=1).round(2)
-    df['s1_s2_average_pm10'] = df[['s1_pm10', 's2_pm10']].mean(axis=1).round(2)
-    df['battery_voltage'] = pd.to_numeric(
-        df['battery_voltage'], errors='coerce')
-    time_indexed_data = df.set_index('time')
-    final_hourly_data = time_indexed_data.resample('H').mean().round(2)
-
-    final_hourly_data_copy = final_hourly_data.resample('D').mean().dropna()
-    sensor_one_pm2_5_readings = final_hourly_data_copy['s1_pm2_5'].tolist()
-    sensor_two_pm2_5_readings = final_hourly_data_copy['s2_pm2_5'].tolist()
-    battery_voltage_readings = final_hourly_data_copy['battery_voltage'].tolist(
-    )
-    time_readings = final_hourly_data_copy.index.tolist()
-
-    total_hourly_records_count = final_hourly_data.shape[0]
-
-    records_with_valid_values = final_hourly_data[final_hourly_data['s1_s2_average_pm2_5'] <= 500.4]
-    records_with_valid_values = final_hourly_data[final_hourly_data['s1_s2_average_pm2_5'] > 0]
-
-    records_with_valid_values_count = records_with_valid_values.shape[0]
-
-    invalid_records_count = records_with_valid_values - records_with_valid_values_count
-
-    valid_hourly_records_with_out_null_values = records_with_valid_values.dropna().reset_index()
-    valid_hourly_records_with_out_null_values_count = valid_hourly_records_with_out_null_values.shape[
-        0]
-
-    return valid_hourly_records_with_out_null_values_count, total_hourly_records_count, sensor_one_pm2_5_readings, sensor_two_pm2_5_readings, battery_voltage_readings, time_readings
-
-
-def calculate_device_uptime(expected_total_records_count, actual_valid_records_count):
-    device_uptime_in_percentage = round(
-        ((actual_valid_records_count/expected_total_records_count) * 100), 2)
-    device_downtime_in_percentage = round(
-        ((expected_total_records_count-actual_valid_records_count)/expected_total_records_count) * 100)
-    if device_uptime_in_percentage > 100:
-        device_uptime_in_percentage = 100
-    if device_downtime_in_percentage < 0:
-        device_downtime_in_percentage = 0
-
-    return device_uptime_in_percentage, device_downtime_in_percentage
-
-
-def compute_uptime_for_all_devices():
-
-    time_periods = [{'label': 'twenty_four_hours', 'specified_hours': 24, 'specifed_hours_mobile': 12}, {'label': 'seven_days', 'specified_hours': 168, 'specifed_hours_mobile': 84},
-                    {'label': 'twenty_eight_days', 'specified_hours': 672, 'specifed_hours_mobile': 336}, {'label': 'twelve_months', 'specified_hours': 0, 'specifed_hours_mobile': 0}, {'label': 'all_time', 'specified_hours': 0, 'specifed_hours_mobile': 0}]
-
-    average_uptime_for_entire_network_in_percentage_for_twentyfour_hours = {}
-    twentyfour_hours = 0
-    average_uptime_for_entire_network_in_percentage_for_seven_days = {}
-    seven_days = 0
-    average_uptime_for_entire_network_in_percentage_for_twenty_eight_days = {}
-    twenty_eight_days = 0
-    average_uptime_for_entire_network_in_percentage_for_twelve_months = {}
-    twelve_months = 0
-    average_uptime_for_entire_network_in_percentage_for_all_time = {}
-    all_time = 0
-
-    for time_period in time_periods:
-        results = get_all_devices()
-        specified_hours = int(time_period['specified_hours'])
-        device_uptime_records = []
-        all_devices_uptime_series = []
-
-        if time_period['label'] == 'twelve_months':
-            today = dt.date.today()
-            past_day = today.day
-            past_month = (today.month - 12) % 12
-            past_year = today.year - ((today.month + 12)//12)
-            twelve_months_later = dt.date(past_year, past_month, past_day)
-            delta = datetime.now().date() - twelve_months_later
-            no_of_days = delta.days
-            specified_hours = no_of_days * 24
-
-        elif time_period['label'] == 'all_time':
-            no_of_days = 365
-            specified_hours = no_of_days * 24
-
-        print('specified hours\t' + str(specified_hours))
-        for device in results:
-            channel_id = device['channelID']
-            mobililty = device['mobility']
-            device_id = device['_id']
-            device_name = device['name']
-
-            if time_period['label'] == 'twelve_months':
-                device_registration_date = device['createdAt']
-                end_date = datetime.now().date()
-                start_date = device_registration_date.date()
-                number_of_months = compute_number_of_months_between_two_dates(
-                    start_date, end_date)
-                if number_of_months < 12:
-                    delta = end_date - device_registration_date.date()
-                    no_of_days = delta.days
-                    specified_hours = no_of_days * 24
-
-            if time_period['label'] == 'all_time':
-                device_registration_date = device['createdAt']
-                delta = datetime.now().date() - device_registration_date.date()
-                no_of_days = delta.days
-                specified_hours = no_of_days * 24
-
-            if mobililty == 'Mobile':
-                # divide the specified hours by 2.. for mobile devices, use 12 hours
-                specified_hours = int(specified_hours/2)
-
-            valid_hourly_records_with_out_null_values_count, total_hourly_records_count, sensor_one_pm2_5_readings, sensor_two_pm2_5_readings, battery_voltage_readings, time_readings = get_raw_channel_data(
-                channel_id, specified_hours)
-            print('valid records count' +
-                  str(valid_hourly_records_with_out_null_values_count))
-            device_uptime_in_percentage, device_downtime_in_percentage = calculate_device_uptime(
-                specified_hours, valid_hourly_records_with_out_null_values_count)
-            print('device-uptime \t' + str(device_uptime_in_percentage) +
-                  '\n downtime \t' + str(device_downtime_in_percentage))
-
-            created_at = str_to_date(date_to_str(datetime.now()))
-
-            all_devices_uptime_series.append(device_uptime_in_percentage)
-            device_uptime_record = {"device_uptime_in_percentage": device_uptime_in_percentage,
-                                    "device_downtime_in_percentage": device_downtime_in_percentage, "created_at": created_at,
-                                    "device_channel_id": channel_id, "specified_time_in_hours": specified_hours, "device_name": device_name, "device_id": device_id}
-
-            if time_period['label'] == 'twenty_eight_days':
-                device_uptime_record["device_sensor_one_pm2_5_readings"] = sensor_one_pm2_5_readings
-                device_uptime_record["device_sensor_two_pm2_5_readings"] = sensor_two_pm2_5_readings
-                device_uptime_record["device_battery_voltage_readings"] = battery_voltage_readings
-                device_uptime_record["device_time_readings"] = time_readings
-
-            device_uptime_records.append(device_uptime_record)
-
-        average_uptime_for_entire_network_in_percentage_for_selected_timeperiod = round(
-            np.mean(all_devices_uptime_series), 2)
-        created_at = str_to_date(date_to_str(datetime.now()))
-
-        print('average uptime for entire network in percentage is : {}%'.format(
-            average_uptime_for_entire_network_in_percentage_for_selected_timeperiod))
-
-        if time_period['label'] == 'twenty_four_hours':
-            entire_network_uptime_record = {"average_uptime_for_entire_network_in_percentage": average_uptime_for_entire_network_in_percentage_for_selected_timeperiod,
-                                            "device_uptime_records": device_uptime_records, "created_at": created_at, 'specified_time_in_hours': specified_hours}
-
-            twentyfour_hours = average_uptime_for_entire_network_in_percentage_for_selected_timeperiod
-            average_uptime_for_entire_network_in_percentage_for_twentyfour_hours = entire_network_uptime_record
-            print('twenty four hours' +
-                  str(average_uptime_for_entire_network_in_percentage_for_selected_timeperiod))
-        elif time_period['label'] == 'seven_days':
-            entire_network_uptime_record = {"average_uptime_for_entire_network_in_percentage": average_uptime_for_entire_network_in_percentage_for_selected_timeperiod,
-                                            "device_uptime_records": device_uptime_records, "created_at": created_at, 'specified_time_in_hours': specified_hours}
-
-            seven_days = average_uptime_for_entire_network_in_percentage_for_selected_timeperiod
-            average_uptime_for_entire_network_in_percentage_for_seven_days = entire_network_uptime_record
-        elif time_period['label'] == 'twelve_months':
-            entire_network_uptime_record = {"average_uptime_for_entire_network_in_percentage": average_uptime_for_entire_network_in_percentage_for_selected_timeperiod,
-                                            "device_uptime_records": device_uptime_records, "created_at": created_at, 'specified_time_in_hours': specified_hours}
-
-            twelve_months = average_uptime_for_entire_network_in_percentage_for_selected_timeperiod
-            print('twelve_months' +
-                  str(average_uptime_for_entire_network_in_percentage_for_selected_timeperiod))
-            average_uptime_for_entire_network_in_percentage_for_twelve_months = entire_network_uptime_record
-        elif time_period['label'] == 'twenty_eight_days':
-            entire_network_uptime_record = {"average_uptime_for_entire_network_in_percentage": average_uptime_for_entire_network_in_percentage_for_selected_timeperiod,
-                                            "device_uptime_records": device_uptime_records, "created_at": created_at, 'specified_time_in_hours': specified_hours}
-
-            twenty_eight_days = average_uptime_for_entire_network_in_percentage_for_selected_timeperiod
-            print(
-                '28 days' + str(average_uptime_for_entire_network_in_percentage_for_selected_timeperiod))
-            average_uptime_for_entire_network_in_percentage_for_twenty_eight_days = entire_network_uptime_record
-        elif time_period['label'] == 'all_time':
-            entire_network_uptime_record = {"average_uptime_for_entire_network_in_percentage": average_uptime_for_entire_network_in_percentage_for_selected_timeperiod,
-                                            "device_uptime_records": device_uptime_records, "created_at": created_at, 'specified_time_in_hours': specified_hours}
-
-            all_time = average_uptime_for_entire_network_in_percentage_for_selected_timeperiod
-            print(
-                'alltime' + str(average_uptime_for_entire_network_in_percentage_for_selected_timeperiod))
-            average_uptime_for_entire_network_in_percentage_for_all_time = entire_network_uptime_record
-
-    all_network_device_uptime_records = []
-
-    entire_network_uptime_record_for_all_periods = {"average_uptime_for_entire_network_for_twentyfour_hours": average_uptime_for_entire_network_in_percentage_for_twentyfour_hours,
-                                                    "average_uptime_for_entire_network_for_seven_days": average_uptime_for_entire_network_in_percentage_for_seven_days,
-                                                    "average_uptime_for_entire_network_for_twenty_eight_days": average_uptime_for_entire_network_in_percentage_for_twenty_eight_days,
-                                                    "average_uptime_for_entire_network_for_twelve_months": average_uptime_for_entire_network_in_percentage_for_twelve_months,
-                                                    "average_uptime_for_entire_network_for_all_time": average_uptime_for_entire_network_in_percentage_for_all_time,
-                                                    "created_at": created_at}
-
-    all_network_device_uptime_records.append(
-        entire_network_uptime_record_for_all_periods)
-
-    # print('average uptime for entire network is : {}%'.format(
-    # entire_network_uptime_record_for_all_periods))
-
-    save_network_uptime_analysis_results(all_network_device_uptime_records)
-
-
-def save_network_uptime_analysis_results(data):
-    """
-    """
-    for i in data:
-        print(i)
-        db.network_uptime_analysis_results.insert_one(i)
-        print('saved')
-
-
-if __name__ == '__main__':
-    compute_uptime_for_all_devices()
+import base64
+import datetime as dt
+from bson import json_util, ObjectId
+import json
+from datetime import datetime, timedelta
+from pymongo import MongoClient
+import requests
+import math
+from google.cloud import bigquery
+import pandas as pd
+import numpy as np
+import os
+
+
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client['airqo_netmanager_airqo']
+
+
+def function_to_execute(event, context):
+    """Triggered from a message on a Cloud Pub/Sub topic.
+    Args:
+         event (dict): Event payload.
+         context (google.cloud.functions.Context): Metadata for the event.
+    """
+    action = base64.b64decode(event['data']).decode('utf-8')
+
+    if (action == "compute_uptime_for_all_devices"):
+        compute_uptime_for_all_devices()
+
+
+def str_to_date(st):
+    """
+    Converts a string to datetime
+    """
+    return datetime.strptime(st, '%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def date_to_str(date):
+    """
+    Converts datetime to a string
+    """
+    return datetime.strftime(date, '%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def str_to_date_find(st):
+    """
+    Converts a string of different format to datetime
+    """
+    return datetime.strptime(st, '%Y-%m-%dT%H:%M:%SZ')
+
+
+def date_to_formated_str(date):
+    """
+    Converts datetime to a string
+    """
+    return datetime.strftime(date, '%Y-%m-%d %H:%M')
+
+
+def get_all_devices():
+    results = list(db.devices.find({"locationID": {'$ne': ''}}))
+    active_devices = []
+    for device in results:
+        print(device['name'])
+        device_id = device['_id']
+        print(device_id)
+        if(device['isActive'] == True):
+            active_devices.append(device)
+    return active_devices
+
+
+def compute_number_of_months_between_two_dates(start_date, end_date):
+    number_of_months = (end_date.year - start_date.year) * \
+        12 + (end_date.month - start_date.month)
+    return number_of_months
+
+
+RAW_FEEDS_TABLE = "airqo-250220.thingspeak.raw_feeds_pms"
+
+HOURLY_COLUMNS = [
+    "s1_pm2_5",
+    "s1_pm10",
+    "s2_pm2_5",
+    "s2_pm10",
+    "s1_s2_average_pm2_5",
+    "s1_s2_average_pm10",
+    "battery_voltage",
+]
+
+TIME_PERIODS = [
+    {"label": "twenty_four_hours", "specified_hours": 24, "specifed_hours_mobile": 12},
+    {"label": "seven_days", "specified_hours": 168, "specifed_hours_mobile": 84},
+    {"label": "twenty_eight_days", "specified_hours": 672, "specifed_hours_mobile": 336},
+    {"label": "twelve_months", "specified_hours": 0, "specifed_hours_mobile": 0},
+    {"label": "all_time", "specified_hours": 0, "specifed_hours_mobile": 0},
+]
+
+
+NETWORK_UPTIME_KEYS = {
+    "twenty_four_hours": "average_uptime_for_entire_network_for_twentyfour_hours",
+    "seven_days": "average_uptime_for_entire_network_for_seven_days",
+    "twenty_eight_days": "average_uptime_for_entire_network_for_twenty_eight_days",
+    "twelve_months": "average_uptime_for_entire_network_for_twelve_months",
+    "all_time": "average_uptime_for_entire_network_for_all_time",
+}
+
+
+# Periods whose valid hours are counted by the data source instead of being
+# computed from hourly data, which would hold a row per hour of each device
+AGGREGATED_PERIODS = ["twelve_months", "all_time"]
+
+HOURLY_DATA_QUERY = f"""
+    WITH feeds AS (
+        SELECT channel_id,
+        DATETIME_TRUNC(SAFE_CAST(TIMESTAMP(created_at) AS DATETIME), HOUR) AS hour,
+        SAFE_CAST(field1 AS FLOAT64) AS s1_pm2_5,
+        SAFE_CAST(field2 AS FLOAT64) AS s1_pm10,
+        SAFE_CAST(field3 AS FLOAT64) AS s2_pm2_5,
+        SAFE_CAST(field4 AS FLOAT64) AS s2_pm10,
+        SAFE_CAST(field7 AS FLOAT64) AS battery_voltage
+        FROM `{RAW_FEEDS_TABLE}`
+        WHERE channel_id IN UNNEST(@channel_ids)
+        AND CAST(created_at AS TIMESTAMP) >= @start
+    ),
+    hourly AS (
+        SELECT channel_id, hour,
+        AVG(s1_pm2_5) AS s1_pm2_5,
+        AVG(s1_pm10) AS s1_pm10,
+        AVG(s2_pm2_5) AS s2_pm2_5,
+        AVG(s2_pm10) AS s2_pm10,
+        AVG(ROUND((IFNULL(s1_pm2_5, s2_pm2_5) + IFNULL(s2_pm2_5, s1_pm2_5)) / 2, 2)) AS s1_s2_average_pm2_5,
+        AVG(ROUND((IFNULL(s1_pm10, s2_pm10) + IFNULL(s2_pm10, s1_pm10)) / 2, 2)) AS s1_s2_average_pm10,
+        AVG(battery_voltage) AS battery_voltage
+        FROM feeds
+        WHERE hour IS NOT NULL
+        GROUP BY channel_id, hour
+    )
+"""
+
+
+class BigQueryDeviceDataSource:
+    """
+    Hourly averages of the raw ThingSpeak feeds of many channels,
+    computed by a single BigQuery scan
+    """
+
+    def __init__(self, client=None):
+        self.client = client or bigquery.Client()
+
+    def get_hourly_data(self, channel_ids: list, start: datetime) -> pd.DataFrame:
+        """
+        Returns a row per channel_id and hour with data since start, with the
+        hourly averages of the HOURLY_COLUMNS
+        """
+        sql_query = HOURLY_DATA_QUERY + "SELECT * FROM hourly"
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("channel_ids", "STRING", channel_ids),
+                bigquery.ScalarQueryParameter("start", "TIMESTAMP", start),
+            ]
+        )
+        job_config.use_legacy_sql = False
+
+        df = self.client.query(sql_query, job_config=job_config).to_dataframe()
+        df["channel_id"] = df["channel_id"].astype(str)
+        df["hour"] = pd.to_datetime(df["hour"])
+        return df
+
+    def count_valid_hours(self, channel_ids: list, starts: list) -> pd.DataFrame:
+        """
+        Returns the number of valid hours of each channel_id since the start at
+        the same position, as defined by count_valid_hours
+        """
+        valid = " AND ".join(
+            ["ROUND(hourly.s1_s2_average_pm2_5, 2) > 0"]
+            + [f"hourly.{column} IS NOT NULL" for column in HOURLY_COLUMNS]
+        )
+        sql_query = HOURLY_DATA_QUERY + f"""
+            , windows AS (
+                SELECT channel_id, @starts[OFFSET(window_index)] AS start
+                FROM UNNEST(@channel_ids) AS channel_id WITH OFFSET AS window_index
+            )
+            SELECT windows.channel_id, windows.start, COUNT(hourly.hour) AS valid_hours
+            FROM windows
+            LEFT JOIN hourly
+            ON hourly.channel_id = windows.channel_id
+            AND hourly.hour >= windows.start
+            AND {valid}
+            GROUP BY windows.channel_id, windows.start
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("channel_ids", "STRING", channel_ids),
+                bigquery.ArrayQueryParameter("starts", "DATETIME", starts),
+                bigquery.ScalarQueryParameter("start", "TIMESTAMP", min(starts)),
+            ]
+        )
+        job_config.use_legacy_sql = False
+
+        df = self.client.query(sql_query, job_config=job_config).to_dataframe()
+        df["channel_id"] = df["channel_id"].astype(str)
+        df["start"] = pd.to_datetime(df["start"])
+        return df
+
+
+def one_year_before(date):
+    try:
+        return date.replace(year=date.year - 1)
+    except ValueError:
+        # 29th February
+        return date.replace(year=date.year - 1, day=28)
+
+
+def get_period_hours(time_period, now):
+    """
+    Returns the hours of a time period for the entire network
+    """
+    if time_period["label"] == "twelve_months":
+        return (now.date() - one_year_before(now.date())).days * 24
+    elif time_period["label"] == "all_time":
+        return 365 * 24
+    return int(time_period["specified_hours"])
+
+
+def get_device_hours(device, time_period, now):
+    """
+    Returns the hours of a time period for a device, accounting for devices
+    registered within the period and for mobile devices
+    """
+    specified_hours = get_period_hours(time_period, now)
+
+    if time_period["label"] in ["twelve_months", "all_time"]:
+        start_date = device["createdAt"].date()
+        end_date = now.date()
+        if time_period["label"] == "all_time" or (
+            compute_number_of_months_between_two_dates(start_date, end_date) < 12
+        ):
+            specified_hours = (end_date - start_date).days * 24
+
+    if device["mobility"] == "Mobile":
+        # divide the specified hours by 2.. for mobile devices, use 12 hours
+        specified_hours = int(specified_hours / 2)
+
+    return specified_hours
+
+
+def count_valid_hours(hourly_data, windows):
+    """
+    Counts the valid hours of each window, a row with a device, channel_id and
+    the start hour of a time period. An hour is valid when its average pm2_5 is
+    positive and none of its averages is missing
+    """
+    valid = (hourly_data["s1_s2_average_pm2_5"] > 0) & hourly_data[
+        HOURLY_COLUMNS
+    ].notna().all(axis=1)
+    valid_hours = hourly_data.loc[valid, ["channel_id", "hour"]].sort_values("hour")
+    # The number of valid hours of the channel from each hour onwards
+    valid_hours["count"] = (
+        valid_hours.groupby("channel_id").cumcount(ascending=False) + 1
+    )
+
+    counts = pd.merge_asof(
+        windows.reset_index().sort_values("start"),
+        valid_hours,
+        left_on="start",
+        right_on="hour",
+        by="channel_id",
+        direction="forward",
+    )
+    return counts.set_index("index")["count"].reindex(windows.index).fillna(0)
+
+
+def get_daily_readings(hourly_data, windows):
+    """
+    Returns the daily averages of each device's hourly data since its window
+    start, indexed by device
+    """
+    data = hourly_data[hourly_data["hour"] >= windows["start"].min()]
+    data = data.merge(windows, on="channel_id")
+    data = data[data["hour"] >= data["start"]]
+    daily = (
+        data.groupby(["device", pd.Grouper(key="hour", freq="D")])[HOURLY_COLUMNS]
+        .mean()
+        .dropna()
+        .reset_index()
+    )
+    return {
+        device: {
+            "device_sensor_one_pm2_5_readings": readings["s1_pm2_5"].tolist(),
+            "device_sensor_two_pm2_5_readings": readings["s2_pm2_5"].tolist(),
+            "device_battery_voltage_readings": readings["battery_voltage"].tolist(),
+            "device_time_readings": readings["hour"].tolist(),
+        }
+        for device, readings in daily.groupby("device")
+    }
+
+
+def calculate_device_uptime(expected_total_records_count, actual_valid_records_count):
+    if expected_total_records_count <= 0:
+        # Registered today, no hours are expected of the device yet
+        return 0, 0
+    device_uptime_in_percentage = round(
+        ((actual_valid_records_count/expected_total_records_count) * 100), 2)
+    device_downtime_in_percentage = round(
+        ((expected_total_records_count-actual_valid_records_count)/expected_total_records_count) * 100)
+    if device_uptime_in_percentage > 100:
+        device_uptime_in_percentage = 100
+    if device_downtime_in_percentage < 0:
+        device_downtime_in_percentage = 0
+
+    return device_uptime_in_percentage, device_downtime_in_percentage
+
+
+def get_aggregated_valid_hours(windows, data_source):
+    """
+    Counts the valid hours of each window with one aggregated query of the
+    data source, rather than loading its hourly data
+    """
+    unique_windows = windows[["channel_id", "start"]].drop_duplicates()
+    counts = data_source.count_valid_hours(
+        unique_windows["channel_id"].tolist(),
+        [start.to_pydatetime() for start in unique_windows["start"]],
+    )
+    counts = windows[["channel_id", "start"]].merge(
+        counts, on=["channel_id", "start"], how="left"
+    )
+    return pd.Series(counts["valid_hours"].fillna(0).values, index=windows.index)
+
+
+def compute_network_uptime(devices, data_source, now):
+    """
+    Computes the uptime of the devices for every time period from one query of
+    the hourly data of the twenty eight days period, and one query counting the
+    valid hours of the AGGREGATED_PERIODS
+    """
+    windows = pd.DataFrame(
+        [
+            {
+                "label": time_period["label"],
+                "device": index,
+                "channel_id": str(device["channelID"]),
+                "specified_hours": get_device_hours(device, time_period, now),
+            }
+            for time_period in TIME_PERIODS
+            for index, device in enumerate(devices)
+        ],
+        columns=["label", "device", "channel_id", "specified_hours"],
+    )
+    windows["start"] = (
+        pd.Timestamp(now) - pd.to_timedelta(windows["specified_hours"], unit="h")
+    ).dt.floor("H")
+
+    aggregated = windows["label"].isin(AGGREGATED_PERIODS)
+    hourly_windows = windows[~aggregated]
+
+    if windows.empty:
+        hourly_data = pd.DataFrame(columns=["channel_id", "hour"] + HOURLY_COLUMNS)
+        windows["valid_hours"] = 0
+    else:
+        hourly_data = data_source.get_hourly_data(
+            sorted(hourly_windows["channel_id"].unique()),
+            hourly_windows["start"].min().to_pydatetime(),
+        )
+        windows["valid_hours"] = get_aggregated_valid_hours(
+            windows[aggregated], data_source
+        )
+    hourly_data[HOURLY_COLUMNS] = hourly_data[HOURLY_COLUMNS].astype(float).round(2)
+    hourly_data["hour"] = pd.to_datetime(hourly_data["hour"])
+
+    windows.loc[~aggregated, "valid_hours"] = count_valid_hours(
+        hourly_data, hourly_windows
+    )
+    daily_readings = get_daily_readings(
+        hourly_data,
+        windows.loc[
+            windows["label"] == "twenty_eight_days", ["device", "channel_id", "start"]
+        ],
+    )
+
+    network_uptime_record = {}
+    for time_period in TIME_PERIODS:
+        device_uptime_records = []
+        all_devices_uptime_series = []
+        created_at = str_to_date(date_to_str(datetime.now()))
+
+        for window in windows[windows["label"] == time_period["label"]].itertuples():
+            device = devices[window.device]
+            device_uptime_in_percentage, device_downtime_in_percentage = calculate_device_uptime(
+                window.specified_hours, int(window.valid_hours))
+
+            all_devices_uptime_series.append(device_uptime_in_percentage)
+            device_uptime_record = {"device_uptime_in_percentage": device_uptime_in_percentage,
+                                    "device_downtime_in_percentage": device_downtime_in_percentage, "created_at": created_at,
+                                    "device_channel_id": device["channelID"], "specified_time_in_hours": window.specified_hours,
+                                    "device_name": device["name"], "device_id": device["_id"]}
+
+            if time_period["label"] == "twenty_eight_days":
+                device_uptime_record.update(daily_readings.get(window.device, {
+                    "device_sensor_one_pm2_5_readings": [],
+                    "device_sensor_two_pm2_5_readings": [],
+                    "device_battery_voltage_readings": [],
+                    "device_time_readings": [],
+                }))
+
+            device_uptime_records.append(device_uptime_record)
+
+        average_uptime_for_entire_network_in_percentage_for_selected_timeperiod = round(
+            np.mean(all_devices_uptime_series), 2)
+        print('average uptime for entire network for {} in percentage is : {}%'.format(
+            time_period["label"], average_uptime_for_entire_network_in_percentage_for_selected_timeperiod))
+
+        network_uptime_record[NETWORK_UPTIME_KEYS[time_period["label"]]] = {
+            "average_uptime_for_entire_network_in_percentage": average_uptime_for_entire_network_in_percentage_for_selected_timeperiod,
+            "device_uptime_records": device_uptime_records,
+            "created_at": created_at,
+            "specified_time_in_hours": get_period_hours(time_period, now),
+        }
+
+    network_uptime_record["created_at"] = str_to_date(date_to_str(datetime.now()))
+    return network_uptime_record
+
+
+def compute_uptime_for_all_devices(data_source=None, now=None):
+    network_uptime_record = compute_network_uptime(
+        get_all_devices(),
+        data_source or BigQueryDeviceDataSource(),
+        now or datetime.utcnow(),
+    )
+    save_network_uptime_analysis_results([network_uptime_record])
+
+
+def save_network_uptime_analysis_results(data):
+    """
+    """
+    db.network_uptime_analysis_results.insert_many(data)
+    print('saved')
+
+
+if __name__ == '__main__':
+    compute_uptime_for_all_devices()
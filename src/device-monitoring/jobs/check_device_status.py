@@ -7,6 +7,12 @@ from pymongo import MongoClient
 import requests
 import math
 import os
+import sys
+
+# The job also runs as a script from jobs/, where the service's helpers are not importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers.channel_poller import poll_channels
 
 
 MONGO_URI = os.getenv("MONGO_URI")
@@ -80,13 +86,14 @@ def get_device_channel_status():
         online_devices=[]
         offline_devices=[]
         count_of_offline_devices =0
-        for channel in results:
+
+        def add_channel_status(response):
+            nonlocal count, count_of_online_devices, count_of_offline_devices
+            channel = results[response.key]
             print(channel['channelID'])
-            latest_device_status_request_api_url = '{0}{1}{2}'.format(BASE_API_URL,'feeds/recent/', channel['channelID'] )
-            latest_device_status_response = requests.get(latest_device_status_request_api_url)
-            if latest_device_status_response.status_code == 200:
-                print(latest_device_status_response.json())
-                result = latest_device_status_response.json()
+            if response.status == 200:
+                print(response.body)
+                result = response.body
                 count += 1
                 current_datetime=   datetime.now()
                 
@@ -105,6 +112,18 @@ def get_device_channel_status():
                     count_of_online_devices +=1
                     online_devices.append(channel)
 
+        # Channels are polled concurrently and counted as their responses arrive
+        poll_channels(
+            [(index, '{0}{1}{2}'.format(BASE_API_URL,'feeds/recent/', channel['channelID']))
+             for index, channel in enumerate(results)],
+            add_channel_status,
+            concurrency=int(os.getenv("STATUS_POLL_CONCURRENCY", 100)),
+            timeout=float(os.getenv("STATUS_POLL_TIMEOUT", 30)),
+            hedge_after=float(os.getenv("STATUS_POLL_HEDGE_AFTER", 5)),
+            retries=int(os.getenv("STATUS_POLL_RETRIES", 2)),
+            verify_ssl=True,
+        )
+
         print(count)
         print(count_of_online_devices)
         print(count_of_offline_devices)
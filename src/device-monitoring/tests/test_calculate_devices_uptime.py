@@ -0,0 +1,253 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from jobs.calculate_devices_uptime import (
+    HOURLY_COLUMNS,
+    TIME_PERIODS,
+    calculate_device_uptime,
+    compute_network_uptime,
+    get_device_hours,
+)
+
+NOW = datetime(2023, 8, 1, 12)
+
+
+class SQLiteDeviceDataSource:
+    """Local stand-in for BigQueryDeviceDataSource"""
+
+    def __init__(self, raw_feeds: pd.DataFrame):
+        self.connection = sqlite3.connect(":memory:")
+        raw_feeds.assign(
+            created_at=raw_feeds["created_at"].dt.strftime("%Y-%m-%d %H:%M:%S")
+        ).to_sql("raw_feeds_pms", self.connection, index=False)
+        self.queries = 0
+        self.hourly_starts = []
+
+    def hourly_query(self, channel_ids):
+        return f"""
+            WITH feeds AS (
+                SELECT channel_id,
+                strftime('%Y-%m-%d %H:00:00', created_at) AS hour,
+                field1 AS s1_pm2_5, field2 AS s1_pm10, field3 AS s2_pm2_5,
+                field4 AS s2_pm10, field7 AS battery_voltage
+                FROM raw_feeds_pms
+                WHERE channel_id IN ({", ".join("?" for _ in channel_ids)})
+                AND created_at >= ?
+            ),
+            hourly AS (
+                SELECT channel_id, hour,
+                AVG(s1_pm2_5) AS s1_pm2_5, AVG(s1_pm10) AS s1_pm10,
+                AVG(s2_pm2_5) AS s2_pm2_5, AVG(s2_pm10) AS s2_pm10,
+                AVG(ROUND((IFNULL(s1_pm2_5, s2_pm2_5) + IFNULL(s2_pm2_5, s1_pm2_5)) / 2, 2)) AS s1_s2_average_pm2_5,
+                AVG(ROUND((IFNULL(s1_pm10, s2_pm10) + IFNULL(s2_pm10, s1_pm10)) / 2, 2)) AS s1_s2_average_pm10,
+                AVG(battery_voltage) AS battery_voltage
+                FROM feeds GROUP BY channel_id, hour
+            )
+        """
+
+    def get_hourly_data(self, channel_ids: list, start: datetime) -> pd.DataFrame:
+        self.queries += 1
+        self.hourly_starts.append(start)
+        df = pd.read_sql_query(
+            self.hourly_query(channel_ids) + "SELECT * FROM hourly",
+            self.connection,
+            params=[*channel_ids, start.strftime("%Y-%m-%d %H:%M:%S")],
+        )
+        df["hour"] = pd.to_datetime(df["hour"])
+        return df
+
+    def count_valid_hours(self, channel_ids: list, starts: list) -> pd.DataFrame:
+        self.queries += 1
+        starts = [start.strftime("%Y-%m-%d %H:%M:%S") for start in starts]
+        valid = " AND ".join(
+            ["ROUND(hourly.s1_s2_average_pm2_5, 2) > 0"]
+            + [f"hourly.{column} IS NOT NULL" for column in HOURLY_COLUMNS]
+        )
+        sql_query = self.hourly_query(channel_ids) + f"""
+            , windows (channel_id, start) AS (
+                VALUES {", ".join("(?, ?)" for _ in channel_ids)}
+            )
+            SELECT windows.channel_id, windows.start, COUNT(hourly.hour) AS valid_hours
+            FROM windows
+            LEFT JOIN hourly
+            ON hourly.channel_id = windows.channel_id
+            AND hourly.hour >= windows.start
+            AND {valid}
+            GROUP BY windows.channel_id, windows.start
+        """
+        df = pd.read_sql_query(
+            sql_query,
+            self.connection,
+            params=[
+                *channel_ids,
+                min(starts),
+                *[value for window in zip(channel_ids, starts) for value in window],
+            ],
+        )
+        df["start"] = pd.to_datetime(df["start"])
+        return df
+
+
+def generate_raw_feeds(channel_ids, days, seed=0):
+    """Two minute feeds with gaps, missing fields and negative readings"""
+    rng = np.random.default_rng(seed)
+    feeds = []
+    for channel_id in channel_ids:
+        times = pd.date_range(NOW - timedelta(days=days), NOW, freq="2min")
+        # Devices go offline for whole days
+        offline = rng.choice(days, size=days // 3, replace=False)
+        times = times[~np.isin((NOW - times).days, offline)]
+        times = times[rng.random(len(times)) < 0.5]
+        size = len(times)
+
+        def field(low, high, missing):
+            values = rng.uniform(low, high, size)
+            values[rng.random(size) < missing] = np.nan
+            return values
+
+        feeds.append(
+            pd.DataFrame(
+                {
+                    "created_at": times,
+                    "channel_id": channel_id,
+                    "field1": field(-5, 80, 0.05),
+                    "field2": field(0, 120, 0.05),
+                    "field3": field(-5, 80, 0.3 if channel_id == "3" else 0.05),
+                    "field4": field(0, 120, 0.05),
+                    "field7": field(3, 4.2, 0.2 if channel_id == "2" else 0.01),
+                }
+            )
+        )
+    if not feeds:
+        return pd.DataFrame(
+            {"created_at": pd.to_datetime([]), "channel_id": []}
+            | {
+                field: []
+                for field in ["field1", "field2", "field3", "field4", "field7"]
+            }
+        )
+    return pd.concat(feeds, ignore_index=True)
+
+
+def per_device_uptime(raw_feeds, channel_id, specified_hours):
+    """The uptime computation of the job when it queried each device separately"""
+    df = raw_feeds[
+        (raw_feeds["channel_id"] == channel_id)
+        & (raw_feeds["created_at"] >= NOW - timedelta(hours=specified_hours))
+    ].rename(
+        columns={
+            "created_at": "time",
+            "field1": "s1_pm2_5",
+            "field2": "s1_pm10",
+            "field3": "s2_pm2_5",
+            "field4": "s2_pm10",
+            "field7": "battery_voltage",
+        }
+    )
+    df["channel_id"] = pd.to_numeric(df["channel_id"])
+    df["s1_s2_average_pm2_5"] = df[["s1_pm2_5", "s2_pm2_5"]].mean(axis=1).round(2)
+    df["s1_s2_average_pm10"] = df[["s1_pm10", "s2_pm10"]].mean(axis=1).round(2)
+    hourly = df.set_index("time").resample("H").mean().round(2)
+    daily = hourly.resample("D").mean().dropna()
+    valid = hourly[hourly["s1_s2_average_pm2_5"] > 0].dropna().shape[0]
+    return valid, daily
+
+
+@pytest.fixture
+def devices():
+    return [
+        {
+            "_id": f"device_{channel_id}",
+            "name": f"aq_{channel_id}",
+            "channelID": int(channel_id),
+            "mobility": "Mobile" if channel_id == "4" else "Static",
+            "createdAt": NOW - timedelta(days=days),
+        }
+        for channel_id, days in [("1", 500), ("2", 400), ("3", 90), ("4", 40), ("5", 3)]
+    ]
+
+
+def test_compute_network_uptime_matches_per_device_queries(devices):
+    raw_feeds = generate_raw_feeds(["1", "2", "3", "4", "5", "6"], days=400)
+    data_source = SQLiteDeviceDataSource(raw_feeds)
+
+    record = compute_network_uptime(devices, data_source, NOW)
+
+    # The hourly data of the twenty eight days, and the valid hours of the
+    # longer periods counted by the data source
+    assert data_source.queries == 2
+    assert data_source.hourly_starts == [NOW - timedelta(days=28)]
+    for time_period, key in zip(
+        TIME_PERIODS,
+        [
+            "average_uptime_for_entire_network_for_twentyfour_hours",
+            "average_uptime_for_entire_network_for_seven_days",
+            "average_uptime_for_entire_network_for_twenty_eight_days",
+            "average_uptime_for_entire_network_for_twelve_months",
+            "average_uptime_for_entire_network_for_all_time",
+        ],
+    ):
+        period_record = record[key]
+        uptimes = []
+        for device, device_record in zip(
+            devices, period_record["device_uptime_records"]
+        ):
+            specified_hours = get_device_hours(device, time_period, NOW)
+            valid, daily = per_device_uptime(
+                raw_feeds, str(device["channelID"]), specified_hours
+            )
+            uptime, downtime = calculate_device_uptime(specified_hours, valid)
+            uptimes.append(uptime)
+
+            assert device_record["device_id"] == device["_id"]
+            assert device_record["specified_time_in_hours"] == specified_hours
+            assert device_record["device_uptime_in_percentage"] == uptime
+            assert device_record["device_downtime_in_percentage"] == downtime
+
+            if time_period["label"] == "twenty_eight_days":
+                assert device_record["device_time_readings"] == daily.index.tolist()
+                np.testing.assert_allclose(
+                    device_record["device_sensor_one_pm2_5_readings"],
+                    daily["s1_pm2_5"],
+                )
+                np.testing.assert_allclose(
+                    device_record["device_battery_voltage_readings"],
+                    daily["battery_voltage"],
+                )
+
+        assert period_record["average_uptime_for_entire_network_in_percentage"] == (
+            round(np.mean(uptimes), 2)
+        )
+
+
+def test_get_device_hours(devices):
+    twelve_months, all_time = TIME_PERIODS[3], TIME_PERIODS[4]
+
+    assert get_device_hours(devices[0], twelve_months, NOW) == 365 * 24
+    assert get_device_hours(devices[2], twelve_months, NOW) == 90 * 24
+    assert get_device_hours(devices[0], all_time, NOW) == 500 * 24
+    assert get_device_hours(devices[3], TIME_PERIODS[0], NOW) == 12
+    assert get_device_hours(devices[3], all_time, NOW) == 20 * 24
+    assert get_device_hours(devices[0], twelve_months, datetime(2024, 3, 1)) == (
+        366 * 24
+    )
+
+
+def test_compute_network_uptime_without_data(devices):
+    record = compute_network_uptime(
+        devices[:1], SQLiteDeviceDataSource(generate_raw_feeds([], days=1)), NOW
+    )
+
+    device_record = record["average_uptime_for_entire_network_for_twenty_eight_days"][
+        "device_uptime_records"
+    ][0]
+    assert device_record["device_uptime_in_percentage"] == 0
+    assert device_record["device_time_readings"] == []
+
+
+def test_calculate_device_uptime_without_expected_hours():
+    assert calculate_device_uptime(0, 0) == (0, 0)
@@ -0,0 +1,163 @@
+import asyncio
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from aiohttp import web
+
+from helpers.channel_poller import ChannelPoller, HostRateLimiter, poll_channels
+
+
+class StubThingspeak:
+    """
+    Serves /channels/<id> with a latency per channel. Channels listed in
+    `behaviours` fail, hang or return errors on their first requests.
+    """
+
+    def __init__(self, latencies, behaviours=None):
+        self.latencies = latencies
+        self.behaviours = behaviours or {}
+        self.requests = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, request):
+        channel = int(request.match_info["channel"])
+        attempt = self.requests.get(channel, 0)
+        self.requests[channel] = attempt + 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            behaviour = self.behaviours.get(channel, [])
+            action = behaviour[attempt] if attempt < len(behaviour) else "ok"
+            if action == "hang":
+                await asyncio.sleep(2)
+            await asyncio.sleep(self.latencies.get(channel, 0))
+            if action == "error":
+                return web.Response(status=500)
+            if action == "missing":
+                return web.Response(status=404)
+            return web.json_response(
+                {"channel": channel, "created_at": "2023-08-01T10:00:00Z"}
+            )
+        finally:
+            self.in_flight -= 1
+
+    async def run(self, poller, channels):
+        app = web.Application()
+        app.router.add_get("/channels/{channel}", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            return [
+                response
+                async for response in poller.poll(
+                    (channel, f"http://127.0.0.1:{port}/channels/{channel}")
+                    for channel in channels
+                )
+            ]
+        finally:
+            await runner.cleanup()
+
+
+def test_full_status_sweep():
+    random.seed(0)
+    channels = range(3000)
+    # Mostly fast channels with a slow tail
+    latencies = {
+        channel: random.choice([0.5, 1.0]) if random.random() < 0.02 else 0.01
+        for channel in channels
+    }
+    stub = StubThingspeak(latencies)
+    poller = ChannelPoller(concurrency=200, timeout=5)
+
+    responses = asyncio.run(stub.run(poller, channels))
+
+    assert sorted(response.key for response in responses) == list(channels)
+    assert all(response.status == 200 for response in responses)
+    assert all(response.body["channel"] == response.key for response in responses)
+    assert stub.max_in_flight <= 200
+    # Responses stream in completion order, the slow channels come last
+    assert latencies[responses[-1].key] >= 0.5
+
+
+def test_hedged_request_answers_before_a_hung_request():
+    stub = StubThingspeak({}, {1: ["hang"]})
+    poller = ChannelPoller(timeout=5, hedge_after=0.1, retries=0)
+
+    (response,) = asyncio.run(stub.run(poller, [1]))
+
+    assert response.status == 200
+    assert response.attempts == 1
+    assert response.latency < 5
+    assert stub.requests[1] == 2
+
+
+def test_retries_server_errors_and_timeouts():
+    stub = StubThingspeak({}, {1: ["error", "error"], 2: ["hang"], 3: ["missing"]})
+    poller = ChannelPoller(timeout=0.2, retries=2)
+
+    responses = {
+        response.key: response for response in asyncio.run(stub.run(poller, [1, 2, 3]))
+    }
+
+    assert (responses[1].status, responses[1].attempts) == (200, 3)
+    assert (responses[2].status, responses[2].attempts) == (200, 2)
+    # Client errors are final
+    assert (responses[3].status, responses[3].attempts) == (404, 1)
+
+
+def test_gives_up_after_the_retries():
+    stub = StubThingspeak({}, {1: ["hang", "hang", "hang"]})
+    poller = ChannelPoller(timeout=0.1, retries=1)
+
+    (response,) = asyncio.run(stub.run(poller, [1]))
+
+    assert (response.status, response.body, response.attempts) == (-1, None, 2)
+
+
+def test_rate_limits_each_host():
+    async def take(limiter, host, count):
+        for _ in range(count):
+            await limiter.wait(host)
+
+    async def run():
+        limiter = HostRateLimiter(rate=50, burst=5)
+        start = time.monotonic()
+        await asyncio.gather(take(limiter, "a", 30), take(limiter, "b", 30))
+        return time.monotonic() - start
+
+    # 5 requests of each host go out at once, the other 25 at 50 per second
+    assert asyncio.run(run()) >= 0.45
+
+
+def test_poll_channels_calls_back_with_each_response():
+    responses = []
+    poll_channels([(1, "http://127.0.0.1:1/unreachable")], responses.append, retries=0)
+
+    assert [(response.key, response.status) for response in responses] == [(1, -1)]
+
+
+def test_device_status_keeps_the_same_poller():
+    service = Path(__file__).resolve().parents[1]
+    copy = service.parent / "device-status" / "channel_poller.py"
+
+    assert copy.read_text() == (service / "helpers" / "channel_poller.py").read_text()
+
+
+def test_check_device_status_imports_when_run_from_jobs():
+    jobs = Path(__file__).resolve().parents[1] / "jobs"
+    result = subprocess.run(
+        [sys.executable, "-c", "import check_device_status"],
+        cwd=jobs,
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode == 0, result.stderr
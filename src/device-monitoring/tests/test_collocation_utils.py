@@ -1,3 +1,4 @@
+import math
 import uuid
 from datetime import datetime, timedelta
 
@@ -5,7 +6,14 @@ import numpy as np
 import pandas as pd
 import pytest
 
-from helpers.collocation_utils import compute_data_completeness_using_hourly_records
+from helpers.collocation_utils import (
+    compute_data_completeness_using_hourly_records,
+    compute_devices_inter_sensor_correlation,
+    compute_differences,
+    compute_inter_sensor_correlation,
+    compute_statistics,
+    device_pairs,
+)
 from models.collocation import (
     CollocationBatch,
     CollocationBatchStatus,
@@ -258,3 +266,203 @@ def test_differences_threshold(collocation_batch):
     collocation_batch.differences_threshold = 6
     valid = collocation_batch.validate(raise_exception=False)
     assert valid is False
+
+
+def pair_correlation_reference(
+    data, device_x, device_y, correlation_cols, threshold, r2_threshold, parameter
+):
+    device_x_data = data.get(device_x, pd.DataFrame())[correlation_cols]
+    device_x_data = device_x_data.add_prefix(f"{device_x}_")
+    device_x_data.rename(columns={f"{device_x}_timestamp": "timestamp"}, inplace=True)
+    device_y_data = data.get(device_y, pd.DataFrame())[correlation_cols]
+    device_y_data = device_y_data.add_prefix(f"{device_y}_")
+    device_y_data.rename(columns={f"{device_y}_timestamp": "timestamp"}, inplace=True)
+    device_pair_data = pd.merge(
+        left=device_x_data, right=device_y_data, on=["timestamp"]
+    )
+    device_pair_data = device_pair_data.select_dtypes(include="number")
+
+    device_pair_correlation = dict()
+    for col in correlation_cols:
+        try:
+            if col == "timestamp":
+                continue
+            comp_cols = [f"{device_x}_{col}", f"{device_y}_{col}"]
+            correlation_data = device_pair_data[comp_cols].corr().round(4)
+            correlation_data.replace(np.nan, None, inplace=True)
+            correlation_value = correlation_data.iloc[0][comp_cols[1]]
+            device_pair_correlation[f"{col}_pearson"] = correlation_value
+            device_pair_correlation[f"{col}_r2_pearson"] = math.sqrt(correlation_value)
+        except Exception:
+            device_pair_correlation[f"{col}_r2_pearson"] = None
+
+    parameter_value = device_pair_correlation.get(f"{parameter}_pearson", None)
+    parameter_r2_value = device_pair_correlation.get(f"{parameter}_r2_pearson", None)
+    passed = False if parameter_value is None else bool(parameter_value >= threshold)
+    if passed:
+        passed = (
+            False
+            if parameter_r2_value is None
+            else bool(parameter_r2_value >= r2_threshold)
+        )
+    device_pair_correlation["passed"] = passed
+    device_pair_correlation["devices"] = [device_x, device_y]
+    return device_pair_correlation
+
+
+def pair_differences_reference(statistics, device_x, device_y, parameter, threshold):
+    data = {
+        device_statistics["device_name"]: {
+            key: value
+            for key, value in device_statistics.items()
+            if key != "device_name"
+        }
+        for device_statistics in statistics
+    }
+    differences_df = abs(
+        pd.DataFrame([data[device_x]]) - pd.DataFrame([data[device_y]])
+    )
+    differences_df.replace(np.nan, None, inplace=True)
+    results = differences_df.to_dict("records")[0]
+    passed = (
+        results[f"{parameter}_mean"] <= threshold
+        if results[f"{parameter}_mean"]
+        else False
+    )
+    return {"devices": [device_x, device_y], "passed": passed, "differences": results}
+
+
+@pytest.fixture
+def collocated_data():
+    np.random.seed(7)
+    start_time = datetime(2023, 1, 1)
+    end_time = start_time + timedelta(days=7)
+    data = {
+        device: generate_test_data(device, 120, start_time, end_time)
+        for device in ["a", "b", "c", "d", "e", "f"]
+    }
+
+    # Devices tracking a common signal, one tracking it inversely
+    signal = pd.Series(
+        np.random.uniform(20, 100, 169),
+        index=pd.date_range(start_time, end_time, freq="H"),
+    )
+    for device, sign in [("a", 1), ("b", 1), ("c", -1)]:
+        noise = np.random.normal(0, 2, len(data[device]))
+        for col in ["pm2_5", "pm10", "s1_pm2_5"]:
+            values = signal.loc[data[device]["timestamp"]].to_numpy()
+            data[device][col] = sign * values + noise
+
+    data["d"]["pm10"] = np.nan
+    data["e"]["pm10"] = None
+    data["e"] = data["e"].iloc[:1]
+    data["f"]["pm2_5"] = data["f"]["pm2_5"].astype(object)
+    return data
+
+
+def assert_same_correlation(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        if isinstance(value, float):
+            assert actual[key] == pytest.approx(value, abs=1e-12)
+        else:
+            assert actual[key] == value
+
+
+def test_device_pairs():
+    pairs = device_pairs(["x", "y", "z", "y"])
+    assert len(pairs) == 3
+    assert {frozenset(pair) for pair in pairs} == {
+        frozenset(["x", "y"]),
+        frozenset(["x", "z"]),
+        frozenset(["y", "z"]),
+    }
+
+
+def test_devices_inter_sensor_correlation_matches_pair_merge(collocated_data):
+    correlation_cols = ["timestamp", "pm2_5", "pm10", "s1_pm2_5"]
+    for device_x, device_y in device_pairs(list(collocated_data.keys())):
+        args = dict(
+            data=collocated_data,
+            device_x=device_x,
+            device_y=device_y,
+            correlation_cols=correlation_cols,
+            threshold=0.9,
+            r2_threshold=0.5,
+            parameter="pm2_5",
+        )
+        assert_same_correlation(
+            compute_devices_inter_sensor_correlation(**args),
+            pair_correlation_reference(**args),
+        )
+
+
+@pytest.mark.parametrize("base_device", ["", "a"])
+def test_inter_sensor_correlation_matches_pair_merge(collocated_data, base_device):
+    devices = list(collocated_data.keys())
+    result = compute_inter_sensor_correlation(
+        devices=devices,
+        data=collocated_data,
+        threshold=0.9,
+        r2_threshold=0.5,
+        parameter="pm2_5",
+        base_device=base_device,
+        other_parameters=["pm10", "s1_pm2_5"],
+    )
+
+    assert len(result.results) == (5 if base_device else 15)
+    for pair_result in result.results:
+        expected = pair_correlation_reference(
+            data=collocated_data,
+            device_x=pair_result["devices"][0],
+            device_y=pair_result["devices"][1],
+            correlation_cols=list(set(["timestamp", "pm2_5", "pm10", "s1_pm2_5"])),
+            threshold=0.9,
+            r2_threshold=0.5,
+            parameter="pm2_5",
+        )
+        assert_same_correlation(pair_result, expected)
+
+    passed_pairs = [
+        set(pair_result["devices"])
+        for pair_result in result.results
+        if pair_result["passed"]
+    ]
+    assert passed_pairs == [{"a", "b"}]
+
+
+def test_differences_match_pair_subtraction(collocated_data):
+    collocated_data["f"]["pm2_5"] = collocated_data["f"]["pm2_5"].astype(float)
+    statistics = compute_statistics(collocated_data)
+    statistics.append({**statistics[0], "device_name": "g"})
+    devices = [device_statistics["device_name"] for device_statistics in statistics]
+
+    result = compute_differences(
+        statistics=statistics,
+        parameter="pm2_5",
+        threshold=5,
+        base_device="",
+        devices=devices,
+    )
+
+    assert len(result.results) == 21
+    for pair_result in result.results:
+        expected = pair_differences_reference(
+            statistics, *pair_result["devices"], parameter="pm2_5", threshold=5
+        )
+        assert pair_result["passed"] == expected["passed"]
+        assert pair_result["differences"].keys() == expected["differences"].keys()
+        for key, value in expected["differences"].items():
+            if value is None:
+                assert pair_result["differences"][key] is None
+            else:
+                assert pair_result["differences"][key] == pytest.approx(value)
+
+    # Identical statistics have no difference, which the threshold check fails
+    (identical_pair,) = [
+        pair_result
+        for pair_result in result.results
+        if set(pair_result["devices"]) == {devices[0], "g"}
+    ]
+    assert identical_pair["differences"]["pm2_5_mean"] == 0
+    assert identical_pair["passed"] is False
@@ -24,6 +24,17 @@ class Config:
     BASE_API_URL = os.getenv("BASE_API_URL")
     RECENT_FEEDS_URL = f"{BASE_API_URL}/feeds/transform/recent"
 
+    # Channel polling
+    STATUS_POLL_CONCURRENCY = int(os.getenv("STATUS_POLL_CONCURRENCY", 100))
+    STATUS_POLL_RATE_PER_HOST = (
+        float(os.getenv("STATUS_POLL_RATE_PER_HOST"))
+        if os.getenv("STATUS_POLL_RATE_PER_HOST")
+        else None
+    )
+    STATUS_POLL_TIMEOUT = float(os.getenv("STATUS_POLL_TIMEOUT", 30))
+    STATUS_POLL_HEDGE_AFTER = float(os.getenv("STATUS_POLL_HEDGE_AFTER", 5))
+    STATUS_POLL_RETRIES = int(os.getenv("STATUS_POLL_RETRIES", 2))
+
     # Mongo Connections
     REGISTRY_MONGO_URI = os.getenv("REGISTRY_MONGO_GCE_URI")
     MONITORING_MONGO_URI = os.getenv("MONITORING_MONGO_GCE_URI")
@@ -1,10 +1,9 @@
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import requests
 import logging
 from dataclasses import dataclass
 import urllib3
 
+from channel_poller import poll_channels
 from models import Device, DeviceStatus as DeviceStatusModel
 from config import configuration
 
@@ -30,19 +29,14 @@ def get_all_devices(tenant):
     ]
 
 
-def get_device_status(device):
-    print("Scheduled querying channel for", device.get("device_number"))
-    channel_id = device["device_number"]
-    api_url = f'{configuration.RECENT_FEEDS_URL}?channel={channel_id}'
-    if not channel_id:
+def get_device_status(device, response):
+    """
+    Returns the status of a device from the response of its channel's recent feeds
+    """
+    if response is None or response.status != 200:
         return DeviceStatus(is_online=False, elapsed_time=-1, device=device)
 
-    device_status = requests.get(api_url, verify=False)
-
-    if device_status.status_code != 200:
-        return DeviceStatus(is_online=False, elapsed_time=-1, device=device)
-
-    result = device_status.json()
+    result = response.body
 
     device['latitude'] = device.get(
         'latitude') or float(result.get('latitude'))
@@ -61,31 +55,24 @@ def get_device_status(device):
     return DeviceStatus(is_online=False, elapsed_time=time_difference, device=device)
 
 
-def compute_device_channel_status(tenant):
-    devices = get_all_devices(tenant)
-    count_of_online_devices = 0
-    online_devices = []
-    offline_devices = []
-    count_of_offline_devices = 0
-    count_of_solar_devices = 0
-    count_of_alternator_devices = 0
-    count_of_mains = 0
-    count_due_maintenance = 0
-    count_overdue_maintenance = 0
-    count_unspecified_maintenance = 0
-
-    futures = []
-    executor = ThreadPoolExecutor()
-
-    for device in devices:
-        futures.append(executor.submit(get_device_status, device))
-
-    for future in futures:
-        try:
-            device_status = future.result()
-        except Exception as ex:
-            print("Cannot process channel", ex)
-            continue
+class DeviceStatusSummary:
+    """
+    Counts of the device statuses, updated as each status arrives
+    """
+
+    def __init__(self):
+        self.count_of_online_devices = 0
+        self.online_devices = []
+        self.offline_devices = []
+        self.count_of_offline_devices = 0
+        self.count_of_solar_devices = 0
+        self.count_of_alternator_devices = 0
+        self.count_of_mains = 0
+        self.count_due_maintenance = 0
+        self.count_overdue_maintenance = 0
+        self.count_unspecified_maintenance = 0
+
+    def add(self, device_status):
         device = device_status.device
 
         try:
@@ -95,58 +82,86 @@ def compute_device_channel_status(tenant):
             if last_maintained_duration <= 0:
                 if abs(last_maintained_duration) <= configuration.DUE_FOR_MAINTENANCE_DURATION:
                     device["maintenance_status"] = "due"
-                    count_due_maintenance += 1
+                    self.count_due_maintenance += 1
                 else:
                     device["maintenance_status"] = "good"
             else:
                 device["maintenance_status"] = "overdue"
-                count_overdue_maintenance += 1
+                self.count_overdue_maintenance += 1
 
         except Exception:
             device["nextMaintenance"] = None
             device["maintenance_status"] = -1
-            count_unspecified_maintenance += 1
+            self.count_unspecified_maintenance += 1
 
         def check_power_type(power):
             return (device.get("powerType") or device.get("power") or "").lower() == power
 
         if check_power_type("solar"):
-            count_of_solar_devices += 1
+            self.count_of_solar_devices += 1
         elif check_power_type("mains"):
-            count_of_mains += 1
+            self.count_of_mains += 1
         elif check_power_type("alternator") or check_power_type("battery"):
-            count_of_alternator_devices += 1
+            self.count_of_alternator_devices += 1
 
         device['elapsed_time'] = device_status.elapsed_time
 
         if device_status.is_online:
-            count_of_online_devices += 1
-            online_devices.append(device)
+            self.count_of_online_devices += 1
+            self.online_devices.append(device)
         else:
-            count_of_offline_devices += 1
-            offline_devices.append(device)
+            self.count_of_offline_devices += 1
+            self.offline_devices.append(device)
+
+    def to_record(self, total_active_device_count):
+        return {
+            "created_at": datetime.utcnow(),
+            "total_active_device_count": total_active_device_count,
+            "count_of_online_devices": self.count_of_online_devices,
+            "count_of_offline_devices": self.count_of_offline_devices,
+            "count_of_mains": self.count_of_mains,
+            "count_of_solar_devices": self.count_of_solar_devices,
+            "count_of_alternator_devices": self.count_of_alternator_devices,
+            "count_due_maintenance": self.count_due_maintenance,
+            "count_overdue_maintenance": self.count_overdue_maintenance,
+            "count_unspecified_maintenance": self.count_unspecified_maintenance,
+            "online_devices": self.online_devices,
+            "offline_devices": self.offline_devices
+        }
 
+
+def compute_device_channel_status(tenant):
+    devices = get_all_devices(tenant)
+    summary = DeviceStatusSummary()
+
+    def add_device_status(device, response=None):
+        try:
+            summary.add(get_device_status(device, response))
+        except Exception as ex:
+            print("Cannot process channel", ex)
+            return
         print("Done processing channel", device.get("device_number"))
 
-    device_status_results = []
-
-    created_at = datetime.utcnow()
-    record = {
-        "created_at": created_at,
-        "total_active_device_count": len(devices),
-        "count_of_online_devices": count_of_online_devices,
-        "count_of_offline_devices": count_of_offline_devices,
-        "count_of_mains": count_of_mains,
-        "count_of_solar_devices": count_of_solar_devices,
-        "count_of_alternator_devices": count_of_alternator_devices,
-        "count_due_maintenance": count_due_maintenance,
-        "count_overdue_maintenance": count_overdue_maintenance,
-        "count_unspecified_maintenance": count_unspecified_maintenance,
-        "online_devices": online_devices,
-        "offline_devices": offline_devices
-    }
-
-    device_status_results.append(record)
+    channels = []
+    for index, device in enumerate(devices):
+        if device.get("device_number"):
+            channels.append(
+                (index, f'{configuration.RECENT_FEEDS_URL}?channel={device["device_number"]}'))
+        else:
+            add_device_status(device)
+
+    poll_channels(
+        channels,
+        lambda response: add_device_status(devices[response.key], response),
+        concurrency=configuration.STATUS_POLL_CONCURRENCY,
+        rate_per_host=configuration.STATUS_POLL_RATE_PER_HOST,
+        timeout=configuration.STATUS_POLL_TIMEOUT,
+        hedge_after=configuration.STATUS_POLL_HEDGE_AFTER,
+        retries=configuration.STATUS_POLL_RETRIES,
+        verify_ssl=False,
+    )
+
+    device_status_results = [summary.to_record(len(devices))]
 
     device_status_model = DeviceStatusModel(tenant)
     device_status_model.save_device_status(device_status_results)
@@ -13,6 +13,8 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY")
     DB_NAME = os.getenv("DB_NAME_PROD")
     MONGO_URI = os.getenv('MONGO_GCE_URI')
+    # Hours recounted on each run, to count readings that are inserted late
+    EXCEEDANCE_LATENESS_HOURS = int(os.getenv("EXCEEDANCE_LATENESS_HOURS", 6))
 
 
 class ProductionConfig(Config):
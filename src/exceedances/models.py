@@ -1,3 +1,5 @@
+from pymongo import ASCENDING, UpdateOne
+
 from config import connect_mongo
 
 
@@ -6,6 +8,7 @@ class Event:
         self.tenant = tenant
 
     def get_events(self, start_date, end_date):
+        """Readings measured from start_date up to end_date, one document per reading"""
         tenant = self.tenant
         db = connect_mongo(tenant)
         return db.events.aggregate([
@@ -24,21 +27,21 @@ class Event:
                 "$replaceRoot": {"newRoot": "$values"}
             },
             {
-                "$project": {
-                    "pm2_5": 1,
-                    "pm10": 1,
-                    "no2": 1,
-                    "site_id": {"$toString": "$site_id"}
+                "$match": {
+                    "time": {
+                        "$gte": start_date,
+                        "$lt": end_date
+                    }
                 }
             },
             {
-                "$group": {
-                    "_id": "$site_id",
-                    "reading": {"$push": {
-                        "pm2_5": "$pm2_5.value",
-                        "pm10": "$pm10.value",
-                        "no2": "$no2.value",
-                    }}
+                "$project": {
+                    "_id": 0,
+                    "time": 1,
+                    "site_id": {"$toString": "$site_id"},
+                    "pm2_5": "$pm2_5.value",
+                    "pm10": "$pm10.value",
+                    "no2": "$no2.value",
                 }
             }
         ])
@@ -52,3 +55,96 @@ class Exceedance:
         tenant = self.tenant
         db = connect_mongo(tenant)
         return db.exceedances.insert_one(records)
+
+
+class ExceedanceRollup:
+    """
+    Exceedance counts of each site and day, kept per hour of the day as
+    hours.<hour>.<counter> so recounted hours are replaced with $set.
+    The watermark is the time up to which readings have been counted.
+    """
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+
+    def get_watermark(self):
+        tenant = self.tenant
+        db = connect_mongo(tenant)
+        state = db.exceedance_rollup_watermarks.find_one({"_id": "events"})
+        return state["time"] if state else None
+
+    def save_rollups(self, rollups, watermark):
+        """
+        Replaces the counts of the recounted hours and moves the watermark.
+
+        :param rollups: (site_id, day, counts) tuples, counts mapping hours.<hour>.<counter> paths to numbers
+        """
+        tenant = self.tenant
+        db = connect_mongo(tenant)
+        db.exceedance_rollups.create_index([("day", ASCENDING), ("site_id", ASCENDING)], unique=True)
+
+        updates = [
+            UpdateOne(
+                {"site_id": site_id, "day": day},
+                {"$set": counts},
+                upsert=True
+            )
+            for site_id, day, counts in rollups
+        ]
+        if updates:
+            db.exceedance_rollups.bulk_write(updates, ordered=False)
+
+        db.exceedance_rollup_watermarks.update_one(
+            {"_id": "events"}, {"$set": {"time": watermark}}, upsert=True
+        )
+
+    def get_site_counts(self, hours, counters):
+        """
+        Sums the rollups of each site over the given hours.
+
+        :param hours: the hours of each day to sum, as a dict of day to a list of hours
+        :param counters: counter paths to sum
+        :return: dicts with the site_id and the sum of each counter
+        """
+        tenant = self.tenant
+        db = connect_mongo(tenant)
+        if not hours:
+            return []
+
+        sums = db.exceedance_rollups.aggregate([
+            {
+                "$match": {"day": {"$in": list(hours)}}
+            },
+            {
+                "$project": {
+                    "site_id": 1,
+                    "day": 1,
+                    "hours": {"$objectToArray": "$hours"}
+                }
+            },
+            {
+                "$unwind": "$hours"
+            },
+            {
+                "$match": {
+                    "$or": [
+                        {"day": day, "hours.k": {"$in": [f"{hour:02d}" for hour in day_hours]}}
+                        for day, day_hours in hours.items()
+                    ]
+                }
+            },
+            {
+                "$group": {
+                    "_id": "$site_id",
+                    **{f"counter_{index}": {"$sum": f"$hours.v.{counter}"} for index, counter in enumerate(counters)}
+                }
+            }
+        ], allowDiskUse=True)
+
+        return [
+            {
+                "site_id": site_sums["_id"],
+                **{counter: site_sums[f"counter_{index}"] for index, counter in enumerate(counters)}
+            }
+            for site_sums in sums
+        ]
@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+import numpy as np
+import pytest
+from bson import ObjectId
+from mongomock import MongoClient
+
+import models
+from utils.exceedances import CalculateExceedances, floor_hour
+
+WHO_LIMIT = {"pm2_5": 25, "pm10": 50, "no2": 40}
+AQI_LIMITS = {
+    "pm2_5": {
+        "Good": [0, 12],
+        "Moderate": [12, 35.4],
+        "UHFSG": [35.4, 55.4],
+        "Unhealthy": [55.4, 150.4],
+        "VeryUnhealthy": [150.4, 250.4],
+        "Hazardous": [250.4, 500.4],
+    },
+    "pm10": {
+        "Good": [0, 54],
+        "Moderate": [54, 154],
+        "UHFSG": [154, 254],
+        "Unhealthy": [254, 354],
+        "VeryUnhealthy": [354, 424],
+        "Hazardous": [424, 604],
+    },
+    "no2": {
+        "Good": [0, 53],
+        "Moderate": [53, 100],
+        "UHFSG": [100, 360],
+        "Unhealthy": [360, 649],
+        "VeryUnhealthy": [649, 1249],
+        "Hazardous": [1249, 2049],
+    },
+}
+
+
+def reference_exceedances(readings):
+    """The exceedances of readings, counted one reading at a time"""
+    who = {pollutant: 0 for pollutant in WHO_LIMIT}
+    aqi = {
+        pollutant: {category: 0 for category in limits}
+        for pollutant, limits in AQI_LIMITS.items()
+    }
+    for reading in readings:
+        for pollutant, limit in WHO_LIMIT.items():
+            who[pollutant] += float(reading.get(pollutant) or -1) > limit and 1 or 0
+        for pollutant, limits in AQI_LIMITS.items():
+            for category, [min_value, max_value] in limits.items():
+                if min_value < float(reading.get(pollutant) or -1) <= max_value:
+                    aqi[pollutant][category] += 1
+                    break
+    return {**who, "total": len(readings)}, {**aqi, "total": len(readings)}
+
+
+def synthetic_events(sites, start, end, seed):
+    """Hourly event documents of each site, with missing and out of range values"""
+    rng = np.random.default_rng(seed)
+    documents = []
+    for site_id in sites:
+        values = []
+        time = start
+        while time < end:
+            value = {"time": time, "site_id": site_id}
+            for pollutant, scale in [("pm2_5", 80), ("pm10", 200), ("no2", 400)]:
+                if rng.random() > 0.1:
+                    value[pollutant] = {
+                        "value": float(rng.choice([0, 12, rng.exponential(scale)]))
+                    }
+            values.append(value)
+            time += timedelta(minutes=int(rng.integers(20, 90)))
+        documents.append({"values": values})
+    return documents
+
+
+@pytest.fixture
+def db():
+    db = MongoClient().db
+    with mock.patch.object(models, "connect_mongo", return_value=db):
+        yield db
+
+
+def events_in_window(db, end_date):
+    start_date = floor_hour(end_date - timedelta(days=1))
+    readings = {}
+    for document in db.events.find():
+        for value in document["values"]:
+            if start_date <= value["time"] < end_date:
+                readings.setdefault(str(value["site_id"]), []).append(
+                    {
+                        pollutant: value.get(pollutant, {}).get("value")
+                        for pollutant in WHO_LIMIT
+                    }
+                )
+    return readings
+
+
+def assert_matches_reference(exceedances, readings):
+    assert {exceedance["site_id"] for exceedance in exceedances} == set(readings)
+    for exceedance in exceedances:
+        who, aqi = reference_exceedances(readings[exceedance["site_id"]])
+        assert exceedance["who"] == who
+        assert exceedance["aqi"] == aqi
+
+
+def test_counts_match_reference():
+    readings = [
+        {"pm2_5": value, "pm10": value, "no2": value}
+        for value in [
+            None,
+            0,
+            -3,
+            12,
+            12.01,
+            25,
+            25.5,
+            35.4,
+            500.4,
+            501,
+            604,
+            2049,
+            3000,
+            "40.5",
+        ]
+    ]
+    calculator = CalculateExceedances("airqo")
+    who, aqi = reference_exceedances(readings)
+
+    assert calculator.calculate_WHO_exceedance(readings) == who
+    assert calculator.calculate_aqi_exceedance(readings) == aqi
+    assert calculator.calculate_WHO_exceedance([])["total"] == 0
+
+
+def test_incremental_runs_match_full_recount(db):
+    sites = [ObjectId() for _ in range(5)]
+    first_run = datetime(2023, 5, 10, 14, 20)
+    db.events.insert_many(
+        synthetic_events(sites, first_run - timedelta(days=2), first_run, seed=1)
+    )
+    calculator = CalculateExceedances("airqo")
+
+    exceedances = calculator.calculate_exceedances(end_date=first_run)
+    assert_matches_reference(exceedances, events_in_window(db, first_run))
+
+    # The second run only recounts the hours in the lateness window
+    second_run = first_run + timedelta(hours=3, minutes=10)
+    db.events.insert_many(synthetic_events(sites[2:], first_run, second_run, seed=2))
+    with mock.patch.object(
+        calculator, "get_events", wraps=calculator.get_events
+    ) as get_events:
+        exceedances = calculator.calculate_exceedances(end_date=second_run)
+    get_events.assert_called_once_with(
+        floor_hour(second_run - calculator.lateness), second_run
+    )
+    assert_matches_reference(exceedances, events_in_window(db, second_run))
+
+    assert db.exceedance_rollups.count_documents({}) == len(sites) * 2
+
+
+def test_late_readings_are_counted(db):
+    sites = [ObjectId() for _ in range(3)]
+    first_run = datetime(2023, 5, 10, 14, 20)
+    db.events.insert_many(
+        synthetic_events(sites, first_run - timedelta(days=1), first_run, seed=3)
+    )
+    calculator = CalculateExceedances("airqo")
+    calculator.calculate_exceedances(end_date=first_run)
+
+    # Readings measured before the first run, inserted after it
+    db.events.insert_many(
+        synthetic_events(sites[:1], first_run - timedelta(hours=2), first_run, seed=4)
+    )
+    second_run = first_run + timedelta(hours=1)
+    exceedances = calculator.calculate_exceedances(end_date=second_run)
+
+    assert_matches_reference(exceedances, events_in_window(db, second_run))
+
+
+def test_reruns_do_not_count_readings_twice(db):
+    sites = [ObjectId() for _ in range(3)]
+    end_date = datetime(2023, 5, 10, 14, 20)
+    db.events.insert_many(
+        synthetic_events(sites, end_date - timedelta(days=1), end_date, seed=5)
+    )
+    calculator = CalculateExceedances("airqo")
+
+    first = calculator.calculate_exceedances(end_date=end_date)
+    # A rerun, as after a failure between saving the rollups and moving the watermark
+    db.exceedance_rollup_watermarks.delete_many({})
+    second = calculator.calculate_exceedances(end_date=end_date)
+
+    assert first == second
+    assert_matches_reference(second, events_in_window(db, end_date))
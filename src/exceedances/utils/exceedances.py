@@ -1,124 +1,195 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from dateutil.tz import UTC
 from dateutil.relativedelta import relativedelta
-from models import Event, Exceedance
+import numpy as np
+from config import configuration
+from models import ExceedanceRollup, Exceedance, Event
+
+POLLUTANTS = ["pm2_5", "pm10", "no2"]
+
+WHO_LIMITS = {"pm2_5": 25, "pm10": 50, "no2": 40}
+
+AQI_CATEGORIES = ['Good', 'Moderate', 'UHFSG', 'Unhealthy', 'VeryUnhealthy', 'Hazardous']
+
+# A value is in a category when the previous breakpoint < value <= the category's breakpoint
+AQI_BREAKPOINTS = {
+    "pm2_5": [0, 12, 35.4, 55.4, 150.4, 250.4, 500.4],
+    "pm10": [0, 54, 154, 254, 354, 424, 604],
+    "no2": [0, 53, 100, 360, 649, 1249, 2049],
+}
+
+COUNTERS = (
+    ["total"]
+    + [f"who.{pollutant}" for pollutant in POLLUTANTS]
+    + [f"aqi.{pollutant}.{category}" for pollutant in POLLUTANTS for category in AQI_CATEGORIES]
+)
+
+
+def readings_to_arrays(readings):
+    """The pollutant values of readings as float arrays, NaN where a value is missing"""
+    return {
+        pollutant: np.array([reading.get(pollutant) for reading in readings], dtype=float)
+        for pollutant in POLLUTANTS
+    }
+
+
+def count_exceedances(groups, values, n_groups):
+    """
+    Counts the readings, WHO limit exceedances and AQI categories of each group.
+
+    :param groups: the group index of each reading
+    :param values: the pollutant values of each reading
+    :return: an array of n_groups counts for each counter
+    """
+    counts = {"total": np.bincount(groups, minlength=n_groups)}
+    for pollutant in POLLUTANTS:
+        pollutant_values = values[pollutant]
+        with np.errstate(invalid="ignore"):
+            exceeding = pollutant_values > WHO_LIMITS[pollutant]
+        counts[f"who.{pollutant}"] = np.bincount(groups[exceeding], minlength=n_groups)
+
+        categories = np.digitize(pollutant_values, AQI_BREAKPOINTS[pollutant], right=True) - 1
+        for index, category in enumerate(AQI_CATEGORIES):
+            counts[f"aqi.{pollutant}.{category}"] = np.bincount(
+                groups[categories == index], minlength=n_groups
+            )
+    return counts
+
+
+def format_counts(counts):
+    """The who and aqi summaries of a mapping of counter to count"""
+    return {
+        "who": {
+            **{pollutant: counts[f"who.{pollutant}"] for pollutant in POLLUTANTS},
+            "total": counts["total"],
+        },
+        "aqi": {
+            **{
+                pollutant: {
+                    category: counts[f"aqi.{pollutant}.{category}"] for category in AQI_CATEGORIES
+                }
+                for pollutant in POLLUTANTS
+            },
+            "total": counts["total"],
+        },
+    }
+
+
+def floor_hour(time):
+    return time.replace(minute=0, second=0, microsecond=0)
 
 
 class CalculateExceedances:
+    """
+    Calculates the exceedances of each site over the last day.
+
+    Readings are counted into per-site daily rollups holding hourly counts, so each
+    run only recounts the hours since the previous run, and the last
+    EXCEEDANCE_LATENESS_HOURS hours to take in readings that arrive late, and sums
+    the rollups of the hours in the window. Recounted hours replace their previous
+    counts, so a rerun never counts a reading twice.
+    """
 
     def __init__(self, tenant):
         self.tenant = tenant
-        self.WHO_LIMIT = {"pm2_5": 25, "pm10": 50, "no2": 40}
-        self.events = self.get_events()
-        self.PM_25_AQI_LIMIT = {
-            'Good': [0, 12],
-            'Moderate': [12, 35.4],
-            'UHFSG': [35.4, 55.4],
-            'Unhealthy': [55.4, 150.4],
-            'VeryUnhealthy': [150.4, 250.4],
-            'Hazardous': [250.4, 500.4],
-        }
-        self.PM_10_AQI_LIMIT = {
-            'Good': [0, 54],
-            'Moderate': [54, 154],
-            'UHFSG': [154, 254],
-            'Unhealthy': [254, 354],
-            'VeryUnhealthy': [354, 424],
-            'Hazardous': [424, 604],
-        }
-        self.NO2_AQI_LIMIT = {
-            'Good': [0, 53],
-            'Moderate': [53, 100],
-            'UHFSG': [100, 360],
-            'Unhealthy': [360, 649],
-            'VeryUnhealthy': [649, 1249],
-            'Hazardous': [1249, 2049],
-        }
+        self.rollup_model = ExceedanceRollup(tenant)
+        self.lateness = timedelta(hours=configuration.EXCEEDANCE_LATENESS_HOURS)
 
     def calculate_WHO_exceedance(self, events):
-        exceednace_pm2_5, exceedance_pm10, exceedance_no2 = 0, 0, 0
+        values = readings_to_arrays(events)
+        counts = count_exceedances(np.zeros(len(events), dtype=int), values, 1)
+        return format_counts({counter: int(count[0]) for counter, count in counts.items()})["who"]
 
-        for event in events:
-            exceednace_pm2_5 += float(event.get("pm2_5") or -1) > self.WHO_LIMIT.get("pm2_5") and 1 or 0
-            exceedance_pm10 += float(event.get("pm10") or -1) > self.WHO_LIMIT.get("pm10") and 1 or 0
-            exceedance_no2 += float(event.get("no2") or -1) > self.WHO_LIMIT.get("no2") and 1 or 0
+    def calculate_aqi_exceedance(self, events):
+        values = readings_to_arrays(events)
+        counts = count_exceedances(np.zeros(len(events), dtype=int), values, 1)
+        return format_counts({counter: int(count[0]) for counter, count in counts.items()})["aqi"]
 
-        return {
-            "pm2_5": exceednace_pm2_5,
-            "pm10": exceedance_pm10,
-            "no2": exceedance_no2,
-            "total": len(events)
-        }
+    def calculate_rollups(self, readings):
+        """
+        Counts readings by site and hour of the day.
 
-    def calculate_aqi_exceedance(self, events):
-        pm2_5 = {
-            'Good': 0,
-            'Moderate': 0,
-            'UHFSG': 0,
-            'Unhealthy': 0,
-            'VeryUnhealthy': 0,
-            'Hazardous': 0,
-        }
-        pm10 = {
-            'Good': 0,
-            'Moderate': 0,
-            'UHFSG': 0,
-            'Unhealthy': 0,
-            'VeryUnhealthy': 0,
-            'Hazardous': 0,
-        }
-        no2 = {
-            'Good': 0,
-            'Moderate': 0,
-            'UHFSG': 0,
-            'Unhealthy': 0,
-            'VeryUnhealthy': 0,
-            'Hazardous': 0,
-        }
-
-        for event in events:
-            for key, [min_value, max_value] in self.PM_25_AQI_LIMIT.items():
-                if min_value < float(event.get("pm2_5") or -1) <= max_value:
-                    pm2_5[key] = pm2_5.get(key, 0) + 1
-                    break
-
-            for key, [min_value, max_value] in self.PM_10_AQI_LIMIT.items():
-                if min_value < float(event.get("pm10") or -1) <= max_value:
-                    pm10[key] = pm10.get(key, 0) + 1
-                    break
-
-            for key, [min_value, max_value] in self.NO2_AQI_LIMIT.items():
-                if min_value < float(event.get("no2") or -1) <= max_value:
-                    no2[key] = no2.get(key, 0) + 1
-                    break
-
-        return {
-            "pm2_5": pm2_5,
-            "pm10": pm10,
-            "no2": no2,
-            "total": len(events)
-        }
-
-    def calculate_exceedances(self):
+        :return: (site_id, day, counts) tuples, counts mapping the hours.<hour>.<counter>
+        path of every counter of each hour counted to its count
         """
-        get the measurements for all sites accordingly
-        Using a loop, calculate each Site's exceedance accordingly
-        return the exceedance list for all sites accordingly
+        if not readings:
+            return []
+
+        site_ids, sites = np.unique([reading["site_id"] for reading in readings], return_inverse=True)
+        # Hours since the start of the proleptic Gregorian calendar
+        hours = np.array([reading["time"].toordinal() * 24 + reading["time"].hour for reading in readings])
+        first_hour = hours.min()
+        hour_offsets = hours - first_hour
+        n_hours = hour_offsets.max() + 1
+
+        # Groups sorted by site then hour, so the groups of a site's day are contiguous
+        keys, groups = np.unique(sites * n_hours + hour_offsets, return_inverse=True)
+        counts = count_exceedances(groups, readings_to_arrays(readings), len(keys))
+        counts = np.column_stack([counts[counter] for counter in COUNTERS]).tolist()
+
+        group_sites = keys // n_hours
+        group_hours = first_hour + keys % n_hours
+        group_days, hour_of_day = np.divmod(group_hours, 24)
+        hour_of_day = hour_of_day.tolist()
+        paths = [[f"hours.{hour:02d}.{counter}" for counter in COUNTERS] for hour in range(24)]
+
+        new_document = np.ones(len(keys), dtype=bool)
+        new_document[1:] = (group_sites[1:] != group_sites[:-1]) | (group_days[1:] != group_days[:-1])
+        documents = np.flatnonzero(new_document).tolist()
+
+        return [
+            (
+                str(site_ids[group_sites[start]]),
+                datetime.fromordinal(int(group_days[start])),
+                {
+                    path: count
+                    for group in range(start, end)
+                    for path, count in zip(paths[hour_of_day[group]], counts[group])
+                },
+            )
+            for start, end in zip(documents, documents[1:] + [len(keys)])
+        ]
+
+    def update_rollups(self, end_date):
         """
-        created_at = datetime.utcnow()
+        Recounts the hours from the last run, or from EXCEEDANCE_LATENESS_HOURS ago
+        when that is earlier, up to end_date
+        """
+        start_date = floor_hour(end_date - self.lateness)
+        watermark = self.rollup_model.get_watermark()
+        if watermark is None:
+            start_date = floor_hour(end_date - relativedelta(days=1))
+        elif watermark < start_date:
+            start_date = floor_hour(watermark)
+
+        readings = self.get_events(start_date, end_date)
+        self.rollup_model.save_rollups(self.calculate_rollups(readings), end_date)
+
+    def calculate_exceedances(self, end_date=None):
+        """
+        Counts the new readings into the rollups and returns the exceedances of each
+        site over the hours from the last day, starting at the hour a day ago.
+        """
+        created_at = end_date or datetime.utcnow()
+        end_date = created_at
+        self.update_rollups(end_date)
+
+        hours = {}
+        hour = floor_hour(end_date - relativedelta(days=1))
+        while hour < end_date:
+            hours.setdefault(datetime(hour.year, hour.month, hour.day), []).append(hour.hour)
+            hour += timedelta(hours=1)
+
         created_at = created_at.replace(tzinfo=UTC)
-        grouped_events = self.events
         exceedances = []
 
-        for site_events in grouped_events:
-            WHO = self.calculate_WHO_exceedance(site_events["reading"])
-            aqi = self.calculate_aqi_exceedance(site_events["reading"])
-
+        for site_counts in self.rollup_model.get_site_counts(hours, COUNTERS):
+            if not site_counts["total"]:
+                continue
             exceedances.append({
-                "site_id": site_events["_id"],
+                "site_id": site_counts["site_id"],
                 "time": created_at,
-                "who": WHO,
-                "aqi": aqi,
+                **format_counts(site_counts),
             })
 
         return exceedances
@@ -130,9 +201,7 @@ class CalculateExceedances:
         record = {"day": created_at, "exceedances": exceedances}
         return exceedance_model.save_exceedance(record)
 
-    def get_events(self):
-        end_date = datetime.utcnow()
-        start_date = end_date - relativedelta(days=1)
+    def get_events(self, start_date, end_date):
         event_model = Event(self.tenant)
 
         return list(event_model.get_events(start_date, end_date))
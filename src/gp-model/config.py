@@ -28,6 +28,19 @@ class Config:
     BIGQUERY_AIRQLOUDS_SITES = os.getenv("BIGQUERY_AIRQLOUDS_SITES")
     BIGQUERY_HOURLY_DATA = os.getenv("BIGQUERY_HOURLY_DATA")
 
+    GP_MODEL_WORKERS = int(os.getenv("GP_MODEL_WORKERS", 1))
+    GP_MODEL_INTRA_OP_THREADS = int(os.getenv("GP_MODEL_INTRA_OP_THREADS", 1))
+
+    # Airqlouds with more training rows get a sparse variational model
+    GP_MODEL_EXACT_MAX_ROWS = int(os.getenv("GP_MODEL_EXACT_MAX_ROWS", 9000))
+    GP_MODEL_INDUCING_POINTS = int(os.getenv("GP_MODEL_INDUCING_POINTS", 500))
+    GP_MODEL_BATCH_SIZE = int(os.getenv("GP_MODEL_BATCH_SIZE", 1024))
+    GP_MODEL_SPARSE_ITERATIONS = int(os.getenv("GP_MODEL_SPARSE_ITERATIONS", 1000))
+
+    # Predictions are made on a GP_MODEL_GRID_SIZE x GP_MODEL_GRID_SIZE grid
+    GP_MODEL_GRID_SIZE = int(os.getenv("GP_MODEL_GRID_SIZE", 10))
+    GP_MODEL_PREDICT_BATCH_SIZE = int(os.getenv("GP_MODEL_PREDICT_BATCH_SIZE", 10000))
+
 class ProductionConfig(Config):
     MONGO_URI_NETMANAGER = os.getenv('MONGO_GCE_URI_NETMANAGER')
     DB_NAME_NETMANAGER = os.getenv("DB_NAME_PROD_NETMANAGER")
@@ -3,12 +3,20 @@ from datetime import datetime
 import pandas as pd
 import numpy as np
 import gpflow
+import tensorflow as tf
 from google.cloud import bigquery
 from gpflow import set_trainable
 from config import connect_mongo, Config
 from config import configuration
 import argparse
-from threading import Thread
+import multiprocessing
+import shapely
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+import pyarrow as pa
+from pymongo import DeleteMany, InsertOne
+from scipy.cluster.vq import kmeans2
 from shapely.geometry import Point, Polygon
 from data.data import (
     get_airqloud_data,
@@ -39,61 +47,54 @@ def get_airqloud_polygon(tenant, airqloud_id):
     return polygon, min_long, max_long, min_lat, max_lat
 
 
-def train_model(X, Y, airqloud):
+def get_kernel(airqloud, num_features):
     """
-    Creates a model and trains it using given data
+    Returns the kernel of an airqloud's model
     """
-    print("training model function")
-
-    if X.shape[0] > 9000:
-        Xtraining = X[::2, :]
-        Ytraining = Y[::2, :]
+    if airqloud in ["kampala", "jinja"]:
+        return (
+            gpflow.kernels.RBF(lengthscales=np.ones(num_features))
+            + gpflow.kernels.Bias()
+        )
+    elif airqloud == "kira":
+        return gpflow.kernels.RBF() + gpflow.kernels.Bias()
     else:
-        Xtraining = X
-        Ytraining = Y.reshape(-1, 1)
+        return gpflow.kernels.RBF(variance=625) + gpflow.kernels.Bias()
 
-    print(
-        "Number of rows in Xtraining for " +
-        airqloud + " airqloud", Xtraining.shape[0]
-    )
 
+def set_fixed_parameters(m, airqloud):
+    """
+    Fixes the parameters that are not trained for an airqloud
+    """
     if airqloud == "kampala":
-        k = (
-            gpflow.kernels.RBF(lengthscales=np.ones(Xtraining.shape[1]))
-            + gpflow.kernels.Bias()
-        )
-        m = gpflow.models.GPR(data=(Xtraining, Ytraining),
-                              kernel=k, mean_function=None)
         set_trainable(m.kernel.kernels[0].lengthscales, False)
     elif airqloud == "kawempe":
-        k = gpflow.kernels.RBF(variance=625) + gpflow.kernels.Bias()
-        m = gpflow.models.GPR(data=(Xtraining, Ytraining),
-                              kernel=k, mean_function=None)
         set_trainable(m.kernel.kernels[0].variance, False)
-    elif airqloud == "kira":
-        k = gpflow.kernels.RBF() + gpflow.kernels.Bias()
-        m = gpflow.models.GPR(data=(Xtraining, Ytraining),
-                              kernel=k, mean_function=None)
-    elif airqloud == "jinja":
-        k = (
-            gpflow.kernels.RBF(lengthscales=np.ones(Xtraining.shape[1]))
-            + gpflow.kernels.Bias()
-        )
-        m = gpflow.models.GPR(data=(Xtraining, Ytraining),
-                              kernel=k, mean_function=None)
-    elif airqloud == "makindye":
-        k = gpflow.kernels.RBF(variance=625) + gpflow.kernels.Bias()
-        m = gpflow.models.GPR(data=(Xtraining, Ytraining),
-                              kernel=k, mean_function=None)
-    else:
-        k = gpflow.kernels.RBF(variance=625) + gpflow.kernels.Bias()
-        m = gpflow.models.GPR(data=(Xtraining, Ytraining),
-                              kernel=k, mean_function=None)
 
     if airqloud != "kampala":
         m.likelihood.variance.assign(400)
         set_trainable(m.likelihood.variance, False)
 
+
+def select_inducing_points(X, num_inducing):
+    """
+    Selects the inducing points of a sparse model as the k-means centroids of X
+    """
+    if X.shape[0] <= num_inducing:
+        return X.copy()
+    centroids, _ = kmeans2(X, num_inducing, minit="++", seed=0)
+    return centroids
+
+
+def train_exact_model(X, Y, airqloud):
+    """
+    Trains an exact GP regression model
+    """
+    m = gpflow.models.GPR(
+        data=(X, Y), kernel=get_kernel(airqloud, X.shape[1]), mean_function=None
+    )
+    set_fixed_parameters(m, airqloud)
+
     opt = gpflow.optimizers.Scipy()
 
     def objective_closure():
@@ -106,31 +107,109 @@ def train_model(X, Y, airqloud):
     return m
 
 
-def point_in_polygon(row, polygon):
+def train_sparse_model(
+    X,
+    Y,
+    airqloud,
+    num_inducing=Config.GP_MODEL_INDUCING_POINTS,
+    batch_size=Config.GP_MODEL_BATCH_SIZE,
+    iterations=Config.GP_MODEL_SPARSE_ITERATIONS,
+):
     """
-    Checks whether a geometric point lies within a given polygon
+    Trains a sparse variational GP model on minibatches of the data.
+    The variational distribution is optimised with natural gradients
+    and the remaining parameters with Adam
     """
-    mypoint = Point(row.longitude, row.latitude)
-    if polygon.contains(mypoint):
-        return "True"
-    else:
-        return "False"
+    m = gpflow.models.SVGP(
+        kernel=get_kernel(airqloud, X.shape[1]),
+        likelihood=gpflow.likelihoods.Gaussian(),
+        inducing_variable=select_inducing_points(X, num_inducing),
+        num_data=X.shape[0],
+    )
+    set_fixed_parameters(m, airqloud)
+    set_trainable(m.q_mu, False)
+    set_trainable(m.q_sqrt, False)
+
+    batches = iter(
+        tf.data.Dataset.from_tensor_slices((X, Y))
+        .repeat()
+        .shuffle(X.shape[0], seed=0)
+        .batch(batch_size)
+    )
+    training_loss = m.training_loss_closure(batches, compile=True)
+    natgrad = gpflow.optimizers.NaturalGradient(gamma=0.1)
+    adam = tf.optimizers.Adam(learning_rate=0.01)
 
+    @tf.function
+    def optimization_step():
+        natgrad.minimize(training_loss, var_list=[(m.q_mu, m.q_sqrt)])
+        adam.minimize(training_loss, var_list=m.trainable_variables)
 
-def save_predictions_on_bigquery(predictions):
-    predictions = predictions[0]
-    airqloud_id = predictions["airqloud_id"]
-    timestamp = date_to_str(predictions["created_at"])
+    for _ in range(iterations):
+        optimization_step()
+
+    return m
 
-    data = list(map(lambda record: {
-        "airqloud_id": airqloud_id,
-        "timestamp": timestamp,
-        "pm2_5": record["predicted_value"],
-        "pm2_5_variance": record["variance"],
-        "pm2_5_confidence_interval": record["interval"],
-        "location": Point(record["longitude"], record["latitude"]).wkt,
 
-    }, predictions["values"]))
+def train_model(X, Y, airqloud):
+    """
+    Creates a model and trains it using given data. Airqlouds with more rows than
+    an exact model can handle get a sparse variational model
+    """
+    print("training model function")
+
+    Y = Y.reshape(-1, 1)
+    print(
+        "Number of rows in Xtraining for " +
+        airqloud + " airqloud", X.shape[0]
+    )
+
+    if X.shape[0] > Config.GP_MODEL_EXACT_MAX_ROWS:
+        print(f"Training a sparse model for {airqloud} airqloud")
+        return train_sparse_model(X, Y, airqloud)
+
+    return train_exact_model(X, Y, airqloud)
+
+
+@lru_cache(maxsize=64)
+def get_grid_points(geometry, x1, x2, y1, y2, grid_size):
+    """
+    Returns the longitudes and latitudes of the grid points within a polygon.
+    The grids are cached by the WKB of the polygon and the grid parameters
+    """
+    longitudes, latitudes = np.meshgrid(
+        np.linspace(x1, x2, grid_size), np.linspace(y1, y2, grid_size)
+    )
+    longitudes, latitudes = longitudes.ravel(), latitudes.ravel()
+    mask = shapely.contains_xy(shapely.from_wkb(geometry), longitudes, latitudes)
+
+    longitudes, latitudes = longitudes[mask], latitudes[mask]
+    longitudes.flags.writeable = False
+    latitudes.flags.writeable = False
+    return longitudes, latitudes
+
+
+def save_predictions_on_bigquery(predictions):
+    """
+    Inserts the predictions of one or more airqlouds with a single request,
+    then removes the older predictions of each airqloud
+    """
+    data = []
+    airqloud_timestamps = {}
+    for prediction in predictions:
+        airqloud_id = prediction["airqloud_id"]
+        timestamp = date_to_str(prediction["created_at"])
+        airqloud_timestamps[airqloud_id] = timestamp
+
+        data.extend(map(lambda record: {
+            "airqloud_id": airqloud_id,
+            "timestamp": timestamp,
+            "pm2_5": record["predicted_value"],
+            "pm2_5_variance": record["variance"],
+            "pm2_5_confidence_interval": record["interval"],
+            "location": Point(record["longitude"], record["latitude"]).wkt,
+
+        }, prediction["values"]))
 
     client = bigquery.Client()
     errors = client.insert_rows_json(
@@ -140,15 +219,28 @@ def save_predictions_on_bigquery(predictions):
     if errors:
         print("Encountered errors while inserting rows:", errors)
     else:
-        client.query(f"DELETE FROM `{Config.BIGQUERY_MEASUREMENTS_PREDICTIONS}` "
-                     f"WHERE airqloud_id ='{airqloud_id}' "
-                     f"AND timestamp < {timestamp}")
+        for airqloud_id, timestamp in airqloud_timestamps.items():
+            client.query(f"DELETE FROM `{Config.BIGQUERY_MEASUREMENTS_PREDICTIONS}` "
+                         f"WHERE airqloud_id ='{airqloud_id}' "
+                         f"AND timestamp < '{timestamp}'").result()
         print("Data inserted successfully.")
 
 
-def predict_model(m, tenant, airqloud, aq_id, poly, x1, x2, y1, y2):
+def save_predictions(db, predictions):
+    """
+    Replaces the stored predictions of each airqloud in one bulk write
     """
-    Makes the predictions and stores them in a database
+    requests = []
+    for prediction in predictions:
+        requests.append(DeleteMany({"airqloud": prediction["airqloud"]}))
+        requests.append(InsertOne(prediction))
+    db["gp_model_predictions"].bulk_write(requests, ordered=True)
+    save_predictions_on_bigquery(predictions)
+
+
+def predict_model(m, airqloud, aq_id, poly, x1, x2, y1, y2):
+    """
+    Makes the predictions over a grid of points within the airqloud
     """
     time =(
         datetime.now()
@@ -156,25 +248,24 @@ def predict_model(m, tenant, airqloud, aq_id, poly, x1, x2, y1, y2):
         .strftime("%Y-%m-%dT%H:%M:%SZ")
     )
 
-    longitudes = np.linspace(x1, x2, 10)
-    latitudes = np.linspace(y1, y2, 10)
-    locations = np.meshgrid(longitudes, latitudes)
-    locations_flat = np.c_[locations[0].flatten(), locations[1].flatten()]
-
-    df = pd.DataFrame(locations_flat, columns=["longitude", "latitude"])
-    df["point_exists"] = df.apply(
-        lambda row: point_in_polygon(row, poly), axis=1)
-    new_df = df[df.point_exists == "True"]
-    new_df.drop("point_exists", axis=1, inplace=True)
-    new_df.reset_index(drop=True, inplace=True)
+    longitudes, latitudes = get_grid_points(
+        poly.wkb, x1, x2, y1, y2, Config.GP_MODEL_GRID_SIZE
+    )
+    new_df = pd.DataFrame({"longitude": longitudes, "latitude": latitudes})
     new_df["time"] = time
-    new_df_preprocess = preprocess(new_df)
-    pred_set = new_df_preprocess.values
-    new_array = np.asarray(new_df)
-    mean, var = m.predict_f(pred_set)
+    pred_set = preprocess(new_df).values
 
-    means = mean.numpy().flatten()
-    variances = var.numpy().flatten()
+    # Predicting in chunks bounds the size of the kernel matrices
+    means, variances = [], []
+    for start in range(0, pred_set.shape[0], Config.GP_MODEL_PREDICT_BATCH_SIZE):
+        mean, var = m.predict_f(
+            pred_set[start : start + Config.GP_MODEL_PREDICT_BATCH_SIZE]
+        )
+        means.append(mean.numpy().flatten())
+        variances.append(var.numpy().flatten())
+
+    means = np.concatenate(means) if means else np.array([])
+    variances = np.concatenate(variances) if variances else np.array([])
     std_dev = np.sqrt(variances)
     interval = 1.96 * std_dev
 
@@ -184,31 +275,77 @@ def predict_model(m, tenant, airqloud, aq_id, poly, x1, x2, y1, y2):
         "airqloud_id": aq_id,
         "created_at": datetime.now(),
     }
-    values = []
-    for i in range(pred_set.shape[0]):
-        latitude = new_array[i][1]
-        longitude = new_array[i][0]
-        values.append(
-            {
-                "latitude": latitude,
-                "longitude": longitude,
-                "predicted_value": means[i],
-                "variance": variances[i],
-                "interval": interval[i],
-            }
-        )
-    result_builder["values"] = values
+    result_builder["values"] = pd.DataFrame(
+        {
+            "latitude": latitudes,
+            "longitude": longitudes,
+            "predicted_value": means,
+            "variance": variances,
+            "interval": interval,
+        }
+    ).to_dict("records")
     result.append(result_builder)
 
-    db = connect_mongo(tenant)
-    collection = db["gp_model_predictions"]
+    return result
 
-    if collection.count_documents({"airqloud": airqloud}) != 0:
-        collection.delete_many({"airqloud": airqloud})
-    collection.insert_many(result)
-    save_predictions_on_bigquery(result)
 
-    return result
+def get_training_data(airqloud, aq_id):
+    """
+    Returns the preprocessed training data of an airqloud,
+    or None when it has no data within the specified time range
+    """
+    all_sites_data = get_airqloud_data(airqloud_id=aq_id)
+
+    if len(all_sites_data) < 1:
+        print(
+            "No training data available for "
+            + airqloud
+            + " airqloud within the specified time range."
+        )
+        return None
+
+    train_data_df = data_to_df(data=all_sites_data)
+    train_data_df = drop_missing_value(train_data_df)
+    train_data_df = train_data_df.drop('site_id', axis=1)
+    return preprocess(df=train_data_df)
+
+
+def dataframe_to_ipc(df):
+    """
+    Serializes a dataframe to an Arrow IPC stream
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def ipc_to_training_arrays(buffer):
+    """
+    Reads the features and target from an Arrow IPC stream. The columns are
+    views on the buffer, only the feature matrix is assembled from them
+    """
+    table = pa.ipc.open_stream(pa.py_buffer(buffer)).read_all()
+    features = [name for name in table.column_names if name != "pm2_5"]
+    X = np.column_stack(
+        [table.column(name).to_numpy().astype(np.float64) for name in features]
+    )
+    Y = table.column("pm2_5").to_numpy().astype(np.float64).reshape(-1, 1)
+    return X, Y
+
+
+def train_and_predict(airqloud, aq_id, poly, training_data):
+    """
+    Trains the model of an airqloud and returns its predictions.
+    training_data is the Arrow IPC stream of the preprocessed training data
+    """
+    X, Y = ipc_to_training_arrays(training_data)
+    m = train_model(X, Y, airqloud)
+    min_long, min_lat, max_long, max_lat = poly.bounds
+    return predict_model(
+        m, airqloud, aq_id, poly, min_long, max_long, min_lat, max_lat
+    )
 
 
 def periodic_function(tenant, airqloud, aq_id):
@@ -218,28 +355,124 @@ def periodic_function(tenant, airqloud, aq_id):
 
     poly, min_long, max_long, min_lat, max_lat = get_airqloud_polygon(
         tenant, aq_id)
-    all_sites_data = get_airqloud_data(airqloud_id=aq_id)
+    train_data_preprocessed = get_training_data(airqloud, aq_id)
 
-    if len(all_sites_data) >= 1:
-        train_data_df = data_to_df(data=all_sites_data)
-        train_data_df = drop_missing_value(train_data_df)
-        train_data_df = train_data_df.drop('site_id', axis=1)
-        train_data_preprocessed = preprocess(df=train_data_df)
+    if train_data_preprocessed is not None:
         X_features = np.asarray(
             train_data_preprocessed.drop("pm2_5", axis=1).values)
         Y_target = np.asarray(train_data_preprocessed["pm2_5"].values)
         X = X_features
         Y = Y_target.reshape(-1, 1)
         m = train_model(X, Y, airqloud)
-        predict_model(
-            m, tenant, airqloud, aq_id, poly, min_long, max_long, min_lat, max_lat
-        )
-    else:
-        print(
-            "No training data available for "
-            + airqloud
-            + " airqloud within the specified time range."
+        result = predict_model(
+            m, airqloud, aq_id, poly, min_long, max_long, min_lat, max_lat
         )
+        save_predictions(connect_mongo(tenant), result)
+
+
+def init_worker(intra_op_threads):
+    """
+    Limits the TensorFlow thread pools of a worker, so that the workers
+    together do not oversubscribe the CPUs
+    """
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def write_predictions(tenant, predictions_queue, batch_size=10):
+    """
+    Writes the predictions put on the queue until it receives None.
+    Runs in a process of its own, so that a single set of database clients
+    writes the results of all the workers.
+    """
+    db = connect_mongo(tenant)
+    done = False
+    while not done:
+        batch = [predictions_queue.get()]
+        while batch[-1] is not None and len(batch) < batch_size:
+            if predictions_queue.empty():
+                break
+            batch.append(predictions_queue.get())
+
+        if batch[-1] is None:
+            done = True
+            batch.pop()
+        if not batch:
+            continue
+
+        predictions = [prediction for result in batch for prediction in result]
+        try:
+            save_predictions(db, predictions)
+            print(f"Saved predictions of {len(predictions)} airqloud(s)")
+        except Exception as ex:
+            print(ex)
+            traceback.print_exc()
+
+
+def run_in_series(tenant, airqloud_names, aq_ids):
+    """
+    Trains, predicts and saves the airqlouds one after the other.
+    A failing airqloud is reported and skipped.
+    """
+    for name, aq_id in zip(airqloud_names, aq_ids):
+        try:
+            periodic_function(tenant, name, aq_id)
+        except Exception as ex:
+            print(f"Failed to train and predict {name} airqloud: {ex}")
+            traceback.print_exc()
+
+
+def run_in_parallel(tenant, airqloud_names, aq_ids, workers, intra_op_threads):
+    """
+    Trains and predicts the airqlouds in a pool of worker processes.
+    The training data of each airqloud is submitted as soon as it is downloaded
+    and the predictions are handed to a single writer process.
+    """
+    # TensorFlow is not fork safe
+    context = multiprocessing.get_context("spawn")
+    predictions_queue = context.Queue()
+    writer = context.Process(
+        target=write_predictions, args=(tenant, predictions_queue)
+    )
+    writer.start()
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=init_worker,
+            initargs=(intra_op_threads,),
+        ) as executor:
+            futures = {}
+            for name, aq_id in zip(airqloud_names, aq_ids):
+                try:
+                    poly = get_airqloud_polygon(tenant, aq_id)[0]
+                    training_data = get_training_data(name, aq_id)
+                except Exception as ex:
+                    print(f"Failed to get the data of {name} airqloud: {ex}")
+                    traceback.print_exc()
+                    continue
+                if training_data is None:
+                    continue
+
+                future = executor.submit(
+                    train_and_predict,
+                    name,
+                    aq_id,
+                    poly,
+                    dataframe_to_ipc(training_data),
+                )
+                futures[future] = name
+
+            for future in as_completed(futures):
+                try:
+                    predictions_queue.put(future.result())
+                except Exception as ex:
+                    print(f"Failed to train and predict {futures[future]} airqloud: {ex}")
+                    traceback.print_exc()
+    finally:
+        predictions_queue.put(None)
+        writer.join()
 
 
 def get_all_airqlouds(tenant):
@@ -277,11 +510,24 @@ if __name__ == "__main__":
         "--tenant", default="airqo", help="the tenant key is the organisation name"
     )
 
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=Config.GP_MODEL_WORKERS,
+        help="the number of airqlouds trained in parallel",
+    )
+    parser.add_argument(
+        "--intra-op-threads",
+        type=int,
+        default=Config.GP_MODEL_INTRA_OP_THREADS,
+        help="the number of TensorFlow threads of each worker",
+    )
+
     args = parser.parse_args()
-    for index, name in enumerate(airqloud_names):
-        exec(
-            f"thread{index} = Thread(target=periodic_function, args = [args.tenant, name, aq_ids[index]])"
+    if args.workers > 1:
+        run_in_parallel(
+            args.tenant, airqloud_names, aq_ids, args.workers, args.intra_op_threads
         )
-        exec(f"thread{index}.start()")
-        exec(f"thread{index}.join()")
+    else:
+        run_in_series(args.tenant, airqloud_names, aq_ids)
 
@@ -0,0 +1,285 @@
+import queue
+import unittest
+from unittest import mock
+
+import gpflow
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from shapely.geometry import Point, Polygon
+
+import main
+from data.preprocess import data_to_df, drop_missing_value, preprocess
+
+
+def synthetic_airqloud(sites=8, days=3, seed=0):
+    """
+    A square airqloud with hourly pm2_5 measurements of randomly placed sites,
+    in the format returned by get_airqloud_data
+    """
+    rng = np.random.default_rng(seed)
+    min_long, min_lat = 32.5, 0.25
+    polygon = Polygon(
+        [
+            (min_long, min_lat),
+            (min_long + 0.1, min_lat),
+            (min_long + 0.1, min_lat + 0.1),
+            (min_long, min_lat + 0.1),
+        ]
+    )
+    times = pd.date_range("2023-01-01", periods=days * 24, freq="H")
+    records = []
+    for site in range(sites):
+        latitude = min_lat + rng.uniform(0, 0.1)
+        longitude = min_long + rng.uniform(0, 0.1)
+        level = rng.uniform(20, 60)
+        for time in times:
+            records.append(
+                {
+                    "pm2_5": round(
+                        level
+                        + 10 * np.sin(2 * np.pi * time.hour / 24)
+                        + rng.normal(0, 3),
+                        2,
+                    ),
+                    "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "latitude": latitude,
+                    "longitude": longitude,
+                    "site_id": f"site_{site}",
+                }
+            )
+    return polygon, records
+
+
+def training_data(records):
+    df = drop_missing_value(data_to_df(records)).drop("site_id", axis=1)
+    return preprocess(df)
+
+
+class TestParallelTraining(unittest.TestCase):
+    def setUp(self):
+        self.polygon, records = synthetic_airqloud()
+        self.data = training_data(records)
+
+    def test_ipc_round_trip(self):
+        X, Y = main.ipc_to_training_arrays(main.dataframe_to_ipc(self.data))
+
+        np.testing.assert_array_equal(
+            X, np.asarray(self.data.drop("pm2_5", axis=1).values)
+        )
+        np.testing.assert_array_equal(
+            Y, np.asarray(self.data["pm2_5"].values).reshape(-1, 1)
+        )
+
+    def test_train_and_predict_matches_sequential_training(self):
+        X = np.asarray(self.data.drop("pm2_5", axis=1).values)
+        Y = np.asarray(self.data["pm2_5"].values).reshape(-1, 1)
+        min_long, min_lat, max_long, max_lat = self.polygon.bounds
+        expected = main.predict_model(
+            main.train_model(X, Y, "kira"),
+            "kira",
+            "aq_id",
+            self.polygon,
+            min_long,
+            max_long,
+            min_lat,
+            max_lat,
+        )
+
+        result = main.train_and_predict(
+            "kira", "aq_id", self.polygon, main.dataframe_to_ipc(self.data)
+        )
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]["airqloud_id"], "aq_id")
+        pd.testing.assert_frame_equal(
+            pd.DataFrame(result[0]["values"]), pd.DataFrame(expected[0]["values"])
+        )
+
+
+class TestSparseModel(unittest.TestCase):
+    def setUp(self):
+        _, records = synthetic_airqloud(sites=10, days=3, seed=1)
+        data = training_data(records)
+        X = np.asarray(data.drop("pm2_5", axis=1).values)
+        Y = np.asarray(data["pm2_5"].values).reshape(-1, 1)
+        index = np.random.default_rng(0).permutation(len(X))
+        self.train, self.test = index[:500], index[500:]
+        self.X, self.Y = X, Y
+
+    def rmse(self, m):
+        mean, _ = m.predict_f(self.X[self.test])
+        return np.sqrt(np.mean((mean.numpy() - self.Y[self.test]) ** 2))
+
+    def test_select_inducing_points(self):
+        X = self.X[self.train]
+        self.assertEqual(main.select_inducing_points(X, 50).shape, (50, X.shape[1]))
+        np.testing.assert_array_equal(main.select_inducing_points(X[:20], 50), X[:20])
+
+    def test_sparse_model_is_as_accurate_as_exact_model(self):
+        X, Y = self.X[self.train], self.Y[self.train]
+        exact = main.train_exact_model(X, Y, "kira")
+        sparse = main.train_sparse_model(
+            X, Y, "kira", num_inducing=100, batch_size=128, iterations=600
+        )
+
+        self.assertIsInstance(sparse, gpflow.models.SVGP)
+        self.assertLess(self.rmse(sparse), 1.1 * self.rmse(exact))
+
+    @mock.patch("main.train_sparse_model")
+    @mock.patch("main.train_exact_model")
+    def test_train_model_picks_the_mode_by_row_count(self, exact, sparse):
+        X, Y = self.X[self.train], self.Y[self.train]
+
+        with mock.patch.object(main.Config, "GP_MODEL_EXACT_MAX_ROWS", len(X)):
+            main.train_model(X, Y, "kira")
+        exact.assert_called_once()
+        sparse.assert_not_called()
+
+        with mock.patch.object(main.Config, "GP_MODEL_EXACT_MAX_ROWS", len(X) - 1):
+            main.train_model(X, Y, "kira")
+        sparse.assert_called_once()
+
+
+class FeatureModel:
+    """Predicts the x coordinate feature of a location"""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict_f(self, X):
+        self.batch_sizes.append(X.shape[0])
+        mean = X[:, 4:5].astype(np.float64)
+        return tf.constant(mean), tf.constant(np.ones_like(mean))
+
+
+class TestPredictionGrid(unittest.TestCase):
+    def setUp(self):
+        main.get_grid_points.cache_clear()
+        # A concave, L shaped airqloud
+        self.polygon = Polygon(
+            [
+                (32.5, 0.2),
+                (32.7, 0.2),
+                (32.7, 0.3),
+                (32.6, 0.3),
+                (32.6, 0.4),
+                (32.5, 0.4),
+            ]
+        )
+        self.bounds = (32.5, 32.7, 0.2, 0.4)
+
+    def test_grid_points_match_point_by_point_containment(self):
+        for grid_size in [10, 37, 100]:
+            longitudes, latitudes = main.get_grid_points(
+                self.polygon.wkb, *self.bounds, grid_size
+            )
+
+            expected = [
+                (longitude, latitude)
+                for latitude in np.linspace(0.2, 0.4, grid_size)
+                for longitude in np.linspace(32.5, 32.7, grid_size)
+                if self.polygon.contains(Point(longitude, latitude))
+            ]
+            self.assertEqual(list(zip(longitudes, latitudes)), expected)
+
+    def test_grid_points_are_cached(self):
+        main.get_grid_points(self.polygon.wkb, *self.bounds, 50)
+        main.get_grid_points(Polygon(self.polygon.exterior).wkb, *self.bounds, 50)
+        main.get_grid_points(self.polygon.wkb, *self.bounds, 20)
+
+        info = main.get_grid_points.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 2))
+
+    def test_predict_model_predicts_in_chunks(self):
+        m = FeatureModel()
+        with mock.patch.object(
+            main.Config, "GP_MODEL_GRID_SIZE", 40
+        ), mock.patch.object(main.Config, "GP_MODEL_PREDICT_BATCH_SIZE", 300):
+            result = main.predict_model(m, "kira", "aq_id", self.polygon, *self.bounds)
+
+        values = pd.DataFrame(result[0]["values"])
+        self.assertEqual(len(values), sum(m.batch_sizes))
+        self.assertTrue(all(size <= 300 for size in m.batch_sizes))
+        self.assertGreater(len(m.batch_sizes), 1)
+        np.testing.assert_allclose(
+            values["predicted_value"],
+            np.cos(values["latitude"]) * np.cos(values["longitude"]),
+        )
+        np.testing.assert_allclose(values["interval"], 1.96)
+
+
+class TestWritePredictions(unittest.TestCase):
+    @mock.patch("main.connect_mongo")
+    @mock.patch("main.save_predictions")
+    def test_writes_queued_predictions_in_batches(
+        self, save_predictions, connect_mongo
+    ):
+        predictions_queue = queue.Queue()
+        for airqloud in ["kira", "jinja", "kawempe"]:
+            predictions_queue.put([{"airqloud": airqloud}])
+        predictions_queue.put(None)
+
+        main.write_predictions("airqo", predictions_queue, batch_size=2)
+
+        batches = [call.args[1] for call in save_predictions.call_args_list]
+        self.assertEqual(
+            batches,
+            [[{"airqloud": "kira"}, {"airqloud": "jinja"}], [{"airqloud": "kawempe"}]],
+        )
+        connect_mongo.assert_called_once_with("airqo")
+
+    @mock.patch("main.connect_mongo")
+    @mock.patch("main.save_predictions", side_effect=Exception("unavailable"))
+    def test_continues_after_a_failed_write(self, save_predictions, connect_mongo):
+        predictions_queue = queue.Queue()
+        predictions_queue.put([{"airqloud": "kira"}])
+        predictions_queue.put(None)
+
+        main.write_predictions("airqo", predictions_queue)
+
+        save_predictions.assert_called_once()
+
+
+class TestRunInSeries(unittest.TestCase):
+    @mock.patch(
+        "main.periodic_function", side_effect=[Exception("no data"), None, None]
+    )
+    def test_continues_after_a_failed_airqloud(self, periodic_function):
+        main.run_in_series("airqo", ["kira", "jinja", "kawempe"], [1, 2, 3])
+
+        self.assertEqual(
+            [call.args for call in periodic_function.call_args_list],
+            [("airqo", "kira", 1), ("airqo", "jinja", 2), ("airqo", "kawempe", 3)],
+        )
+
+
+class TestSavePredictionsOnBigquery(unittest.TestCase):
+    @mock.patch("main.bigquery.Client")
+    def test_waits_for_older_predictions_to_be_deleted(self, client):
+        client.return_value.insert_rows_json.return_value = []
+        predictions = [
+            {
+                "airqloud_id": airqloud_id,
+                "created_at": pd.Timestamp("2023-08-01T10:00:00"),
+                "values": [
+                    {
+                        "latitude": 0.3,
+                        "longitude": 32.5,
+                        "predicted_value": 30.0,
+                        "variance": 1.0,
+                        "interval": 1.96,
+                    }
+                ],
+            }
+            for airqloud_id in ["kira", "jinja"]
+        ]
+
+        main.save_predictions_on_bigquery(predictions)
+
+        self.assertEqual(client.return_value.query.call_count, 2)
+        self.assertEqual(client.return_value.query.return_value.result.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import time
+import traceback
+from typing import Callable
+
+from kafka import TopicPartition
+
+
+class MicroBatchConsumer:
+    """
+    Reads messages in micro batches and applies each batch at once.
+
+    A batch holds at most `max_messages` messages, or the messages received within
+    `max_seconds` of its first message. Offsets are committed manually, only after
+    a batch has been applied, so a batch that fails, or whose process stops before
+    the commit, is read again. Batches must therefore be applied idempotently.
+    """
+
+    def __init__(
+        self,
+        consumer,
+        apply_batch: Callable[[list], None],
+        max_messages: int = 5000,
+        max_seconds: float = 10,
+        retry_seconds: float = 5,
+    ):
+        self.consumer = consumer
+        self.apply_batch = apply_batch
+        self.max_messages = max_messages
+        self.max_seconds = max_seconds
+        self.retry_seconds = retry_seconds
+
+    def next_batch(self) -> list:
+        batch = []
+        deadline = None
+        while len(batch) < self.max_messages:
+            timeout = (
+                self.max_seconds if deadline is None else deadline - time.monotonic()
+            )
+            if timeout <= 0:
+                break
+
+            records = self.consumer.poll(
+                timeout_ms=int(timeout * 1000),
+                max_records=self.max_messages - len(batch),
+            )
+            for partition_records in records.values():
+                batch.extend(partition_records)
+
+            if not batch:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + self.max_seconds
+        return batch
+
+    def rewind(self, batch: list):
+        """Moves each partition back to the first offset of the batch"""
+        offsets = {}
+        for message in batch:
+            partition = TopicPartition(message.topic, message.partition)
+            offsets[partition] = min(
+                offsets.get(partition, message.offset), message.offset
+            )
+
+        for partition, offset in offsets.items():
+            self.consumer.seek(partition, offset)
+
+    def process_batch(self, batch: list) -> bool:
+        try:
+            self.apply_batch(batch)
+        except Exception as ex:
+            print(ex)
+            traceback.print_exc()
+            self.rewind(batch)
+            return False
+
+        self.consumer.commit()
+        print(f"Applied {len(batch)} messages")
+        return True
+
+    def run(self, max_batches: int = None):
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            batch = self.next_batch()
+            if not batch:
+                continue
+
+            batches += 1
+            if not self.process_batch(batch):
+                time.sleep(self.retry_seconds)
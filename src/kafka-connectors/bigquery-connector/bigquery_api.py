@@ -1,3 +1,6 @@
+import uuid
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
 from typing import Union
 
 import pandas as pd
@@ -5,46 +8,112 @@ from google.cloud import bigquery
 
 from models import AirQloud, Site, Device, AirQloudSite
 
+# Staging tables left behind by a killed process are removed by BigQuery
+STAGING_TABLE_EXPIRATION = timedelta(hours=1)
+
+
+def latest_records(records: pd.DataFrame, key_fields: list) -> pd.DataFrame:
+    """
+    One record per key, holding the latest value of each column.
+    Missing values do not replace earlier ones, as when records are merged one at a time.
+    """
+    return (
+        records.groupby(key_fields, sort=False, dropna=False)
+        .last()
+        .reset_index()[list(records.columns)]
+    )
+
+
+def merge_query(target: str, source: str, columns: list, key_fields: list) -> str:
+    """
+    Upserts the source into the target table. Missing source values keep the
+    target's values, and missing keys match missing keys so a replayed batch
+    does not insert duplicates. Table names must already be quoted.
+    """
+    condition = " AND ".join(
+        f"T.{field} IS NOT DISTINCT FROM S.{field}" for field in key_fields
+    )
+    updates = ", ".join(
+        f"{column} = COALESCE(S.{column}, T.{column})"
+        for column in columns
+        if column not in key_fields
+    )
+    matched = f"WHEN MATCHED THEN UPDATE SET {updates} " if updates else ""
+
+    return (
+        f"MERGE INTO {target} AS T USING {source} AS S ON {condition} "
+        f"{matched}"
+        f"WHEN NOT MATCHED THEN INSERT ({', '.join(columns)}) "
+        f"VALUES ({', '.join(f'S.{column}' for column in columns)})"
+    )
+
 
 class BigQueryAPI:
     def __init__(self):
         self.client = bigquery.Client()
 
-    def __query_records(self, table: str) -> pd.DataFrame:
-        query = f"SELECT * FROM `{table}`"
-        dataframe = self.client.query(query=query).result().to_dataframe()
-        return dataframe
-
-    def __update_records(self, records: pd.DataFrame, table: str):
-        job_config = bigquery.LoadJobConfig(
-            write_disposition="WRITE_TRUNCATE",
+    def merge(self, records: pd.DataFrame, table: str, key_fields: list):
+        """Stages the records in a temporary table and merges it into the table"""
+        schema = [
+            field
+            for field in self.client.get_table(table).schema
+            if field.name in records.columns
+        ]
+        staging_table = f"{table}_staging_{uuid.uuid4().hex}"
+        staging_definition = bigquery.Table(
+            bigquery.TableReference.from_string(
+                staging_table, default_project=self.client.project
+            ),
+            schema=schema,
         )
-        job = self.client.load_table_from_dataframe(
-            records, table, job_config=job_config
+        staging_definition.expires = (
+            datetime.now(timezone.utc) + STAGING_TABLE_EXPIRATION
+        )
+        self.client.create_table(staging_definition)
+        job_config = bigquery.LoadJobConfig(
+            schema=schema,
+            write_disposition="WRITE_APPEND",
         )
-        job.result()
-        print("Successfully updated records")
 
-    def update(self, data: Union[AirQloud, Site, Device]):
-        records = data.to_dataframe().set_index(data.id_field, drop=False)
+        try:
+            self.client.load_table_from_dataframe(
+                records, staging_table, job_config=job_config
+            ).result()
+            query = merge_query(
+                target=f"`{table}`",
+                source=f"`{staging_table}`",
+                columns=list(records.columns),
+                key_fields=key_fields,
+            )
+            self.client.query(query=query).result()
+        finally:
+            self.client.delete_table(staging_table, not_found_ok=True)
 
-        existing_records = self.__query_records(data.table)
-        existing_records.set_index(data.id_field, inplace=True, drop=False)
-        existing_records.update(records)
+        print(f"Successfully merged {len(records)} records")
 
-        new_records = records.subtract(existing_records, fill_value=0)
+    def upsert(self, data: list[Union[AirQloud, Site, Device]]):
+        if not data:
+            return
 
-        records = pd.concat([new_records, existing_records], ignore_index=True)
+        model = type(data[0])
+        records = pd.DataFrame([asdict(row) for row in data])
+        records = latest_records(records, [model.id_field])
+        self.merge(records=records, table=model.table, key_fields=[model.id_field])
 
-        self.__update_records(records=records, table=data.table)
+    def update(self, data: Union[AirQloud, Site, Device]):
+        self.upsert([data])
 
     def update_airqloud_sites(self, data: list[AirQloudSite]):
-        records = pd.DataFrame([row.to_dict() for row in data])
-        existing_records = self.__query_records(AirQloudSite.table)
+        if not data:
+            return
 
-        records = pd.concat([records, existing_records], ignore_index=True)
+        records = pd.DataFrame([row.to_dict() for row in data])
         records.drop_duplicates(
             inplace=True, subset=["airqloud_id", "site_id", "tenant"]
         )
 
-        self.__update_records(records=records, table=AirQloudSite.table)
+        self.merge(
+            records=records,
+            table=AirQloudSite.table,
+            key_fields=["airqloud_id", "site_id", "tenant"],
+        )
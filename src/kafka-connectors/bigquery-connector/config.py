@@ -12,6 +12,9 @@ class Config:
     SITES_TOPIC = os.getenv("SITES_TOPIC")
     DEVICES_TOPIC = os.getenv("DEVICES_TOPIC")
     BOOTSTRAP_SERVERS = os.getenv("BOOTSTRAP_SERVERS")
+    CONSUMER_GROUP = os.getenv("CONSUMER_GROUP", "bigquery-connector")
+    BATCH_MAX_MESSAGES = int(os.getenv("BATCH_MAX_MESSAGES", 5000))
+    BATCH_MAX_SECONDS = float(os.getenv("BATCH_MAX_SECONDS", 10))
 
     AIRQLOUDS_TABLE = os.getenv("AIRQLOUDS_TABLE")
     SITES_TABLE = os.getenv("SITES_TABLE")
@@ -3,125 +3,158 @@ import traceback
 
 from kafka import KafkaConsumer
 
+from batch_consumer import MicroBatchConsumer
 from bigquery_api import BigQueryAPI
 from config import Config
 from models import Site, Device, AirQloud, AirQloudSite
 
 
+def to_models(batch: list, to_model) -> list:
+    """The valid models of the messages, skipping messages that cannot be read"""
+    models = []
+    for msg in batch:
+        try:
+            model = to_model(msg.value)
+            if model.is_valid():
+                models.append(model)
+        except Exception as ex:
+            print(ex)
+            traceback.print_exc()
+    return models
+
+
 class MessageBroker:
     @staticmethod
-    def listen_to_sites():
-        connector = KafkaConsumer(
-            Config.SITES_TOPIC,
+    def consumer(topic: str) -> KafkaConsumer:
+        return KafkaConsumer(
+            topic,
             bootstrap_servers=Config.BOOTSTRAP_SERVERS,
+            group_id=Config.CONSUMER_GROUP,
+            enable_auto_commit=False,
             value_deserializer=lambda x: json.loads(x.decode("utf-8")),
         )
-        bigquery_api = BigQueryAPI()
 
-        print("listening to sites.....")
+    @staticmethod
+    def batch_consumer(topic: str, apply_batch) -> MicroBatchConsumer:
+        return MicroBatchConsumer(
+            consumer=MessageBroker.consumer(topic),
+            apply_batch=apply_batch,
+            max_messages=Config.BATCH_MAX_MESSAGES,
+            max_seconds=Config.BATCH_MAX_SECONDS,
+        )
+
+    @staticmethod
+    def to_site(data: dict) -> Site:
+        return Site(
+            id=data.get("_id", None),
+            latitude=data.get("latitude", None),
+            longitude=data.get("longitude", None),
+            tenant=data.get("network", None),
+            name=data.get("name", None),
+            location=data.get("location", None),
+            city=data.get("city", None),
+            region=data.get("region", None),
+            country=data.get("country", None),
+            approximate_latitude=data.get("approximate_latitude", None),
+            approximate_longitude=data.get("approximate_longitude", None),
+            display_name=data.get("search_name", None),
+            display_location=data.get("location_name", None),
+            description=data.get("description", None),
+        )
+
+    @staticmethod
+    def to_device(data: dict) -> Device:
+        return Device(
+            device_id=data.get("name", None),
+            latitude=data.get("latitude", None),
+            longitude=data.get("longitude", None),
+            tenant=data.get("network", None),
+            name=data.get("name", None),
+            device_manufacturer=data.get("device_manufacturer", None),
+            device_category=data.get("device_category", None),
+            approximate_latitude=data.get("approximate_latitude", None),
+            approximate_longitude=data.get("approximate_longitude", None),
+            device_number=data.get("device_number", None),
+            site_id=data.get("site_id", None),
+            description=data.get("description", None),
+        )
+
+    @staticmethod
+    def to_airqloud(data: dict) -> AirQloud:
+        return AirQloud(
+            id=data.get("_id", None),
+            tenant=data.get("network", None),
+            name=data.get("name", None),
+        )
+
+    @staticmethod
+    def apply_sites(batch: list, bigquery_api: BigQueryAPI):
+        bigquery_api.upsert(to_models(batch, MessageBroker.to_site))
 
-        for msg in connector:
+    @staticmethod
+    def apply_devices(batch: list, bigquery_api: BigQueryAPI):
+        bigquery_api.upsert(to_models(batch, MessageBroker.to_device))
+
+    @staticmethod
+    def apply_airqlouds(batch: list, bigquery_api: BigQueryAPI):
+        airqlouds = []
+        air_qloud_sites = []
+        for msg in batch:
             try:
                 data = msg.value
-                site = Site(
-                    id=data.get("_id", None),
-                    latitude=data.get("latitude", None),
-                    longitude=data.get("longitude", None),
-                    tenant=data.get("network", None),
-                    name=data.get("name", None),
-                    location=data.get("location", None),
-                    city=data.get("city", None),
-                    region=data.get("region", None),
-                    country=data.get("country", None),
-                    approximate_latitude=data.get("approximate_latitude", None),
-                    approximate_longitude=data.get("approximate_longitude", None),
-                    display_name=data.get("search_name", None),
-                    display_location=data.get("location_name", None),
-                    description=data.get("description", None),
+                airqloud = MessageBroker.to_airqloud(data)
+                if not airqloud.is_valid():
+                    continue
+
+                sites = data.get("sites", [])
+                sites = list(
+                    map(
+                        lambda site: AirQloudSite(
+                            site_id=site.get("_id", None),
+                            airqloud_id=airqloud.id,
+                            tenant=airqloud.tenant,
+                        ),
+                        sites,
+                    )
                 )
-                if site.is_valid():
-                    bigquery_api.update(site)
-
+                air_qloud_sites.extend(filter(lambda x: x.is_valid(), sites))
+                airqlouds.append(airqloud)
             except Exception as ex:
                 print(ex)
                 traceback.print_exc()
-                continue
+
+        bigquery_api.upsert(airqlouds)
+        bigquery_api.update_airqloud_sites(air_qloud_sites)
+
+    @staticmethod
+    def listen_to_sites():
+        bigquery_api = BigQueryAPI()
+        consumer = MessageBroker.batch_consumer(
+            Config.SITES_TOPIC,
+            lambda batch: MessageBroker.apply_sites(batch, bigquery_api),
+        )
+
+        print("listening to sites.....")
+        consumer.run()
 
     @staticmethod
     def listen_to_devices():
-        connector = KafkaConsumer(
+        bigquery_api = BigQueryAPI()
+        consumer = MessageBroker.batch_consumer(
             Config.DEVICES_TOPIC,
-            bootstrap_servers=Config.BOOTSTRAP_SERVERS,
-            value_deserializer=lambda x: json.loads(x.decode("utf-8")),
+            lambda batch: MessageBroker.apply_devices(batch, bigquery_api),
         )
-        bigquery_api = BigQueryAPI()
 
         print("listening to devices.....")
-
-        for msg in connector:
-            try:
-                data = msg.value
-                device = Device(
-                    device_id=data.get("name", None),
-                    latitude=data.get("latitude", None),
-                    longitude=data.get("longitude", None),
-                    tenant=data.get("network", None),
-                    name=data.get("name", None),
-                    device_manufacturer=data.get("device_manufacturer", None),
-                    device_category=data.get("device_category", None),
-                    approximate_latitude=data.get("approximate_latitude", None),
-                    approximate_longitude=data.get("approximate_longitude", None),
-                    device_number=data.get("device_number", None),
-                    site_id=data.get("site_id", None),
-                    description=data.get("description", None),
-                )
-                if device.is_valid():
-                    bigquery_api.update(device)
-
-            except Exception as ex:
-                print(ex)
-                traceback.print_exc()
-                continue
+        consumer.run()
 
     @staticmethod
     def listen_to_airqlouds():
-        connector = KafkaConsumer(
+        bigquery_api = BigQueryAPI()
+        consumer = MessageBroker.batch_consumer(
             Config.AIRQLOUDS_TOPIC,
-            bootstrap_servers=Config.BOOTSTRAP_SERVERS,
-            value_deserializer=lambda x: json.loads(x.decode("utf-8")),
+            lambda batch: MessageBroker.apply_airqlouds(batch, bigquery_api),
         )
-        bigquery_api = BigQueryAPI()
 
         print("listening to airqlouds.....")
-
-        for msg in connector:
-            try:
-                data = msg.value
-                airqloud = AirQloud(
-                    id=data.get("_id", None),
-                    tenant=data.get("network", None),
-                    name=data.get("name", None),
-                )
-                if airqloud.is_valid():
-                    bigquery_api.update(airqloud)
-
-                    sites = data.get("sites", [])
-                    air_qloud_sites = list(
-                        map(
-                            lambda site: AirQloudSite(
-                                site_id=site.get("_id", None),
-                                airqloud_id=airqloud.id,
-                                tenant=airqloud.tenant,
-                            ),
-                            sites,
-                        )
-                    )
-                    air_qloud_sites = list(
-                        filter(lambda x: x.is_valid(), air_qloud_sites)
-                    )
-                    bigquery_api.update_airqloud_sites(air_qloud_sites)
-
-            except Exception as ex:
-                print(ex)
-                traceback.print_exc()
-                continue
+        consumer.run()
@@ -0,0 +1,6 @@
+import os
+
+os.environ.setdefault("SITES_TABLE", "sites")
+os.environ.setdefault("DEVICES_TABLE", "devices")
+os.environ.setdefault("AIRQLOUDS_TABLE", "airqlouds")
+os.environ.setdefault("AIRQLOUDS_SITES_TABLE", "airqlouds_sites")
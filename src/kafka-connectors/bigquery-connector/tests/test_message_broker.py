@@ -0,0 +1,270 @@
+import random
+import zlib
+from collections import namedtuple
+from datetime import datetime, timezone
+from unittest import mock
+
+import duckdb
+import pandas as pd
+import pytest
+from kafka import TopicPartition
+
+from batch_consumer import MicroBatchConsumer
+from bigquery_api import STAGING_TABLE_EXPIRATION, BigQueryAPI, merge_query
+from message_broker import MessageBroker
+
+FakeRecord = namedtuple("FakeRecord", ["topic", "partition", "offset", "value"])
+
+
+class FakeBroker:
+    """An in-memory topic with committed offsets of one consumer group"""
+
+    def __init__(self, topic="sites", partitions=3):
+        self.topic = topic
+        self.logs = {partition: [] for partition in range(partitions)}
+        self.committed = {}
+
+    def produce(self, key: str, value: dict):
+        partition = zlib.crc32(key.encode()) % len(self.logs)
+        log = self.logs[partition]
+        log.append(FakeRecord(self.topic, partition, len(log), value))
+
+
+class FakeConsumer:
+    def __init__(self, broker: FakeBroker):
+        self.broker = broker
+        self.positions = {
+            TopicPartition(broker.topic, partition): broker.committed.get(
+                TopicPartition(broker.topic, partition), 0
+            )
+            for partition in broker.logs
+        }
+
+    def poll(self, timeout_ms=0, max_records=None):
+        records = {}
+        remaining = max_records
+        for partition, position in self.positions.items():
+            partition_records = self.broker.logs[partition.partition][position:]
+            partition_records = partition_records[:remaining]
+            if partition_records:
+                records[partition] = partition_records
+                self.positions[partition] += len(partition_records)
+                remaining -= len(partition_records)
+        return records
+
+    def seek(self, partition, offset):
+        self.positions[partition] = offset
+
+    def commit(self):
+        self.broker.committed = dict(self.positions)
+
+
+class DuckDBWarehouse(BigQueryAPI):
+    """A stand-in for BigQuery running the same MERGE statements on DuckDB"""
+
+    def __init__(self):
+        self.connection = duckdb.connect()
+        self.connection.execute(
+            "CREATE TABLE sites (id VARCHAR, tenant VARCHAR, name VARCHAR, "
+            "location VARCHAR, display_name VARCHAR, display_location VARCHAR, "
+            "description VARCHAR, city VARCHAR, region VARCHAR, country VARCHAR, "
+            "latitude DOUBLE, longitude DOUBLE, approximate_latitude DOUBLE, "
+            "approximate_longitude DOUBLE)"
+        )
+        self.connection.execute(
+            "CREATE TABLE airqlouds (id VARCHAR, name VARCHAR, tenant VARCHAR)"
+        )
+        self.connection.execute(
+            "CREATE TABLE airqlouds_sites (tenant VARCHAR, airqloud_id VARCHAR, site_id VARCHAR)"
+        )
+        self.merges = 0
+
+    def merge(self, records, table, key_fields):
+        self.connection.register("staging", records)
+        try:
+            self.connection.execute(
+                merge_query(
+                    target=table,
+                    source="staging",
+                    columns=list(records.columns),
+                    key_fields=key_fields,
+                )
+            )
+        finally:
+            self.connection.unregister("staging")
+        self.merges += 1
+
+    def rows(self, table, columns):
+        return sorted(
+            self.connection.execute(f"SELECT {columns} FROM {table}").fetchall(),
+            key=str,
+        )
+
+
+class Crash(BaseException):
+    """Stops the consumer as a killed process would"""
+
+
+def site_messages(count, sites=50, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for version in range(count):
+        site_id = f"site_{rng.randrange(sites)}"
+        message = {"_id": site_id, "network": "airqo", "name": f"{site_id} v{version}"}
+        if rng.random() < 0.3:
+            message["city"] = f"city {version}"
+        messages.append(message)
+    return messages
+
+
+def expected_sites(messages):
+    """The sites after applying the messages one at a time"""
+    sites = {}
+    for message in messages:
+        site = sites.setdefault(message["_id"], {"name": None, "city": None})
+        for field in site:
+            if message.get(field) is not None:
+                site[field] = message[field]
+    return sorted(
+        [(site_id, site["name"], site["city"]) for site_id, site in sites.items()],
+        key=str,
+    )
+
+
+def sites_consumer(broker, warehouse, max_messages=100):
+    return MicroBatchConsumer(
+        consumer=FakeConsumer(broker),
+        apply_batch=lambda batch: MessageBroker.apply_sites(batch, warehouse),
+        max_messages=max_messages,
+        max_seconds=0.01,
+        retry_seconds=0,
+    )
+
+
+@pytest.fixture
+def broker():
+    broker = FakeBroker()
+    for message in site_messages(1000):
+        broker.produce(message["_id"], message)
+    return broker
+
+
+def test_batches_merge_latest_site_versions(broker):
+    warehouse = DuckDBWarehouse()
+    sites_consumer(broker, warehouse).run(max_batches=10)
+
+    assert warehouse.merges == 10
+    assert warehouse.rows("sites", "id, name, city") == expected_sites(
+        site_messages(1000)
+    )
+    assert sum(broker.committed.values()) == 1000
+
+
+def test_invalid_messages_are_skipped(broker):
+    broker.produce("", {"_id": "", "name": "no id"})
+    broker.produce("x", "not a site")
+    warehouse = DuckDBWarehouse()
+    sites_consumer(broker, warehouse, max_messages=2000).run(max_batches=1)
+
+    assert warehouse.rows("sites", "id, name, city") == expected_sites(
+        site_messages(1000)
+    )
+
+
+def test_failed_batch_is_read_again(broker):
+    warehouse = DuckDBWarehouse()
+    merge = warehouse.merge
+    failures = []
+
+    def failing_merge(records, table, key_fields):
+        if not failures:
+            failures.append(table)
+            raise RuntimeError("warehouse unavailable")
+        merge(records, table, key_fields)
+
+    warehouse.merge = failing_merge
+    consumer = sites_consumer(broker, warehouse)
+    consumer.run(max_batches=11)
+
+    assert failures == ["sites"]
+    assert warehouse.rows("sites", "id, name, city") == expected_sites(
+        site_messages(1000)
+    )
+    assert sum(broker.committed.values()) == 1000
+
+
+@pytest.mark.parametrize("merged_before_crash", [True, False])
+def test_crash_replays_uncommitted_batches_exactly_once(broker, merged_before_crash):
+    warehouse = DuckDBWarehouse()
+    consumer = sites_consumer(broker, warehouse)
+    consumer.run(max_batches=4)
+    committed = dict(broker.committed)
+
+    # The process dies while merging the fifth batch, or after merging it
+    def crash(batch):
+        if merged_before_crash:
+            MessageBroker.apply_sites(batch, warehouse)
+        raise Crash()
+
+    consumer.apply_batch = crash
+    with pytest.raises(Crash):
+        consumer.run(max_batches=1)
+    assert broker.committed == committed
+
+    # A restarted consumer resumes from the committed offsets
+    sites_consumer(broker, warehouse).run(max_batches=6)
+
+    assert warehouse.rows("sites", "id, name, city") == expected_sites(
+        site_messages(1000)
+    )
+    assert warehouse.rows("sites", "count(*)") == [(50,)]
+    assert sum(broker.committed.values()) == 1000
+
+
+def test_airqloud_sites_are_inserted_once():
+    broker = FakeBroker(topic="airqlouds")
+    for version in range(3):
+        broker.produce(
+            "aq_1",
+            {
+                "_id": "aq_1",
+                "name": f"kampala v{version}",
+                "sites": [{"_id": "site_1"}, {"_id": "site_2"}, {"_id": None}],
+            },
+        )
+    warehouse = DuckDBWarehouse()
+    consumer = MicroBatchConsumer(
+        consumer=FakeConsumer(broker),
+        apply_batch=lambda batch: MessageBroker.apply_airqlouds(batch, warehouse),
+        max_messages=2,
+        max_seconds=0.01,
+    )
+    consumer.run(max_batches=2)
+
+    assert warehouse.rows("airqlouds", "id, name, tenant") == [
+        ("aq_1", "kampala v2", None)
+    ]
+    assert warehouse.rows("airqlouds_sites", "tenant, airqloud_id, site_id") == [
+        (None, "aq_1", "site_1"),
+        (None, "aq_1", "site_2"),
+    ]
+
+
+@mock.patch("bigquery_api.bigquery.Client")
+def test_merge_stages_records_in_an_expiring_table(client):
+    client.return_value.project = "airqo"
+    client.return_value.get_table.return_value.schema = []
+    client.return_value.query.side_effect = ValueError("merge failed")
+    records = pd.DataFrame({"id": ["site_1"], "name": ["Kawempe"]})
+
+    with pytest.raises(ValueError):
+        BigQueryAPI().merge(records, "airqo.metadata.sites", ["id"])
+
+    (staging,) = client.return_value.create_table.call_args.args
+    assert staging.table_id.startswith("sites_staging_")
+    assert (staging.project, staging.dataset_id) == ("airqo", "metadata")
+    assert staging.expires <= datetime.now(timezone.utc) + STAGING_TABLE_EXPIRATION
+    assert staging.expires > datetime.now(timezone.utc)
+    client.return_value.delete_table.assert_called_once_with(
+        f"airqo.metadata.{staging.table_id}", not_found_ok=True
+    )
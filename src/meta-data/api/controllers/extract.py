@@ -4,6 +4,7 @@ from api.models.extract import Extract
 from api.routes import api
 from flask import Blueprint, request, jsonify
 from api.models import extract as ext
+from api.models.meta_data import BatchMetaData
 from api.helpers import validation
 from config import Config
 
@@ -14,6 +15,14 @@ extract_bp_v2 = Blueprint(
     name="extract_v2", import_name=__name__, url_prefix=Config.BASE_URL_V2
 )
 
+batch_meta_data = BatchMetaData(
+    model=ext.Extract(),
+    road_networks=ext.road_networks,
+    weather_station_distance_threshold=Config.WEATHER_STATION_AIRQUALITY_SITE_DISTANCE_THRESHOLD,
+    max_workers=Config.META_DATA_MAX_WORKERS,
+    geohash_precision=Config.META_DATA_GEOHASH_PRECISION,
+)
+
 
 @extract_bp_v1.route(api.ALL_META_DATA_URL, methods=["GET"])
 @extract_bp_v2.route(api.ALL_META_DATA_URL, methods=["GET"])
@@ -93,6 +102,54 @@ def get_all_meta_data():
     return jsonify(dict(message="Operation successful", data=data)), 200
 
 
+@extract_bp_v1.route(api.ALL_META_DATA_BATCH_URL, methods=["POST"])
+@extract_bp_v2.route(api.ALL_META_DATA_BATCH_URL, methods=["POST"])
+def get_all_meta_data_batch():
+    sites = request.get_json(silent=True) or {}
+    sites = sites.get("sites", None)
+
+    if not isinstance(sites, list) or not sites:
+        return (
+            jsonify(
+                {
+                    "message": "Please specify a list of sites, each with a latitude and longitude"
+                }
+            ),
+            400,
+        )
+
+    if len(sites) > Config.META_DATA_BATCH_SIZE:
+        return (
+            jsonify(
+                {
+                    "message": f"Please specify at most {Config.META_DATA_BATCH_SIZE} sites"
+                }
+            ),
+            400,
+        )
+
+    input_data, errors = validation.validate_spatial_data_batch(input_data=sites)
+
+    if errors:
+        return (
+            jsonify(
+                {
+                    "message": "Some errors occurred while processing this request",
+                    "errors": errors,
+                }
+            ),
+            400,
+        )
+
+    meta_data = batch_meta_data.compute(
+        latitudes=[float(site["latitude"]) for site in input_data],
+        longitudes=[float(site["longitude"]) for site in input_data],
+    )
+    data = BatchMetaData.to_records(meta_data)
+
+    return jsonify(dict(message="Operation successful", data=data)), 200
+
+
 @extract_bp_v1.route(api.NEAREST_WEATHER_STATIONS, methods=["GET"])
 @extract_bp_v2.route(api.NEAREST_WEATHER_STATIONS, methods=["GET"])
 @swag_from("/api/docs/get-nearest-stations.yml")
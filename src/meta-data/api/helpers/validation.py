@@ -76,6 +76,19 @@ def validate_spatial_data(input_data):
     return validated_input, errors
 
 
+def validate_spatial_data_batch(input_data):
+    """Check a list of inputs against spatial schema."""
+    schema = SpatialSchema(many=True)
+
+    errors = None
+    try:
+        schema.load(input_data)
+    except ValidationError as exc:
+        errors = exc.messages
+
+    return input_data, errors
+
+
 def remove_invalidate_meta_data_values(data: dict) -> dict:
     validated_data = dict()
     for key, value in data.items():
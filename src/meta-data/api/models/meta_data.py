@@ -0,0 +1,247 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from geopy import distance
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Attributes read from remote providers, computed once per geohash cell
+CELL_ATTRIBUTES = {
+    "altitude": "get_altitude",
+    "aspect": "get_aspect_270",
+    "landform_90": "get_landform90",
+    "landform_270": "get_landform270",
+    "land_use": "get_landuse",
+}
+
+# Attributes computed locally, at each site
+SITE_ATTRIBUTES = {
+    "bearing_to_kampala_center": "get_bearing_from_kampala",
+    "distance_to_kampala_center": "get_distance_from_kampala",
+}
+
+# Road distances as (radius in metres, highway class)
+ROAD_DISTANCES = {
+    "distance_to_nearest_road": (1000, None),
+    "distance_to_nearest_secondary_road": (1000, "secondary"),
+    "distance_to_nearest_primary_road": (1000, "primary"),
+    "distance_to_nearest_residential_road": (1000, "residential"),
+    "distance_to_nearest_tertiary_road": (1000, "tertiary"),
+    "distance_to_nearest_trunk": (30000, "trunk"),
+    "distance_to_nearest_unclassified_road": (1000, "unclassified"),
+    "distance_to_nearest_motorway": (10000, "motorway"),
+}
+
+META_DATA_COLUMNS = [
+    "latitude",
+    "longitude",
+    "geohash",
+    "altitude",
+    "aspect",
+    "landform_90",
+    "landform_270",
+    "bearing_to_kampala_center",
+    "distance_to_kampala_center",
+    *ROAD_DISTANCES.keys(),
+    "weather_stations",
+    "land_use",
+]
+
+
+def geohash(latitude, longitude, precision=8) -> str:
+    latitude_range = [-90.0, 90.0]
+    longitude_range = [-180.0, 180.0]
+    code = []
+    bits = 0
+    value = 0
+    is_longitude = True
+    while len(code) < precision:
+        coordinate, coordinate_range = (
+            (longitude, longitude_range) if is_longitude else (latitude, latitude_range)
+        )
+        middle = (coordinate_range[0] + coordinate_range[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            coordinate_range[0] = middle
+        else:
+            coordinate_range[1] = middle
+        is_longitude = not is_longitude
+        bits += 1
+        if bits == 5:
+            code.append(GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+    return "".join(code)
+
+
+def nearest_weather_stations(
+    stations: list, latitude, longitude, threshold_distance
+) -> list:
+    """
+    The weather stations within threshold_distance kilometres of the location,
+    nearest first
+    """
+    stations_with_distances = []
+    specified_coordinates = (latitude, longitude)
+
+    for station in stations:
+        station_coordinates = (
+            station["latitude"],
+            station["longitude"],
+        )
+        distance_between_coordinates = distance.distance(
+            specified_coordinates, station_coordinates
+        ).km
+        if float(distance_between_coordinates) <= float(threshold_distance):
+            stations_with_distances.append(
+                {
+                    "distance": distance_between_coordinates,
+                    "code": station.get("code", ""),
+                    "country": station.get("countrycode", ""),
+                    "id": station.get("id", ""),
+                    "latitude": station.get("latitude", None),
+                    "longitude": station.get("longitude", None),
+                    "name": station.get("name", ""),
+                    "timezone": station.get("timezone", ""),
+                    "type": station.get("type", ""),
+                }
+            )
+    return sorted(stations_with_distances, key=lambda x: float(x["distance"]))
+
+
+def safely(function, *args):
+    try:
+        return function(*args)
+    except Exception as ex:
+        print(ex)
+        return None
+
+
+class BatchMetaData:
+    """
+    Computes the meta data of many sites at once.
+
+    Sites in the same geohash cell of `geohash_precision` characters share the
+    attributes read from remote providers, which are requested concurrently on a
+    thread pool. Road distances are measured for each site on the same pool, one
+    network lookup per road network tile. An attribute that fails is None.
+    """
+
+    def __init__(
+        self,
+        model,
+        road_networks,
+        weather_station_distance_threshold,
+        max_workers: int = 16,
+        geohash_precision: int = 8,
+    ):
+        self.model = model
+        self.road_networks = road_networks
+        self.weather_station_distance_threshold = weather_station_distance_threshold
+        self.geohash_precision = geohash_precision
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, safely, function, *args)
+
+    async def cell_attribute(self, method: str, cells: pd.DataFrame) -> list:
+        function = getattr(self.model, method)
+        return await asyncio.gather(
+            *[
+                self.run(function, latitude, longitude)
+                for latitude, longitude in zip(cells["latitude"], cells["longitude"])
+            ]
+        )
+
+    async def road_distances(self, sites: pd.DataFrame) -> dict:
+        columns = list(ROAD_DISTANCES.keys())
+        distances = await asyncio.gather(
+            *[
+                self.run(
+                    self.road_networks.nearest_road_distances,
+                    sites["latitude"].values,
+                    sites["longitude"].values,
+                    radius,
+                    highway,
+                )
+                for radius, highway in ROAD_DISTANCES.values()
+            ]
+        )
+        return {
+            column: values if values is not None else [None] * len(sites)
+            for column, values in zip(columns, distances)
+        }
+
+    async def weather_stations(self, sites: pd.DataFrame) -> list:
+        stations = await self.run(
+            self.model.get_all_weather_station_account_has_access_on
+        )
+        if stations is None:
+            return [None] * len(sites)
+        return await asyncio.gather(
+            *[
+                self.run(
+                    nearest_weather_stations,
+                    stations,
+                    latitude,
+                    longitude,
+                    self.weather_station_distance_threshold,
+                )
+                for latitude, longitude in zip(sites["latitude"], sites["longitude"])
+            ]
+        )
+
+    async def compute_async(self, latitudes, longitudes) -> pd.DataFrame:
+        sites = pd.DataFrame(
+            {
+                "latitude": pd.Series(latitudes, dtype=float),
+                "longitude": pd.Series(longitudes, dtype=float),
+            }
+        )
+        sites["geohash"] = [
+            geohash(latitude, longitude, self.geohash_precision)
+            for latitude, longitude in zip(sites["latitude"], sites["longitude"])
+        ]
+        cells = sites.drop_duplicates(subset="geohash").set_index("geohash")
+
+        cell_attributes, road_distances, weather_stations = await asyncio.gather(
+            asyncio.gather(
+                *[
+                    self.cell_attribute(method, cells)
+                    for method in CELL_ATTRIBUTES.values()
+                ]
+            ),
+            self.road_distances(sites),
+            self.weather_stations(sites),
+        )
+
+        for column, values in zip(CELL_ATTRIBUTES.keys(), cell_attributes):
+            sites[column] = sites["geohash"].map(
+                pd.Series(values, index=cells.index, dtype=object)
+            )
+        for column, method in SITE_ATTRIBUTES.items():
+            function = getattr(self.model, method)
+            sites[column] = [
+                safely(function, latitude, longitude)
+                for latitude, longitude in zip(sites["latitude"], sites["longitude"])
+            ]
+        for column, values in road_distances.items():
+            sites[column] = pd.Series(values, index=sites.index, dtype=object)
+        sites["weather_stations"] = pd.Series(
+            weather_stations, index=sites.index, dtype=object
+        )
+
+        return sites[META_DATA_COLUMNS]
+
+    def compute(self, latitudes, longitudes) -> pd.DataFrame:
+        """The meta data of each site, one row per site in the order given"""
+        return asyncio.run(self.compute_async(latitudes, longitudes))
+
+    @staticmethod
+    def to_records(meta_data: pd.DataFrame) -> list:
+        return (
+            meta_data.astype(object).where(meta_data.notna(), None).to_dict("records")
+        )
@@ -0,0 +1,223 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import geopandas as gpd
+import numpy as np
+import osmnx as ox
+import pyproj
+import shapely
+
+# Road distances have always been measured in this projection
+ROADS_CRS = "EPSG:3310"
+EARTH_RADIUS_IN_METRES = 6371009
+
+to_roads_crs = pyproj.Transformer.from_crs("EPSG:4326", ROADS_CRS, always_xy=True)
+
+
+def graph_edges(graph) -> gpd.GeoDataFrame:
+    """
+    The projected roads of a graph. Roads merged from several highway classes
+    have no single class and are only counted as roads.
+    """
+    edges = ox.graph_to_gdfs(graph, nodes=False, fill_edge_geometry=True)
+    edges = edges.to_crs(ROADS_CRS).reset_index()
+    edges["highway"] = edges["highway"].map(
+        lambda highway: highway if isinstance(highway, str) else None
+    )
+    return edges[["highway", "geometry"]]
+
+
+def download_road_edges(latitude, longitude, radius) -> gpd.GeoDataFrame:
+    graph = ox.graph_from_point(
+        (latitude, longitude), dist=radius, network_type="drive"
+    )
+    return graph_edges(graph)
+
+
+def search_areas(latitudes, longitudes, radius) -> np.ndarray:
+    """The squares of half side radius metres around the points, projected"""
+    latitude_delta = np.degrees(radius / EARTH_RADIUS_IN_METRES)
+    longitude_delta = latitude_delta / np.cos(np.radians(latitudes))
+    areas = shapely.segmentize(
+        shapely.box(
+            longitudes - longitude_delta,
+            latitudes - latitude_delta,
+            longitudes + longitude_delta,
+            latitudes + latitude_delta,
+        ),
+        max_segment_length=latitude_delta / 16,
+    )
+    return shapely.transform(
+        areas,
+        lambda coordinates: np.column_stack(to_roads_crs.transform(*coordinates.T)),
+    )
+
+
+class RoadNetwork:
+    """The roads of an area with an STRtree over each highway class"""
+
+    def __init__(self, edges: gpd.GeoDataFrame):
+        self.trees = {None: shapely.STRtree(edges.geometry.values)}
+        for highway, highway_edges in edges.dropna(subset=["highway"]).groupby(
+            "highway"
+        ):
+            self.trees[highway] = shapely.STRtree(highway_edges.geometry.values)
+
+    def nearest_distances(
+        self, latitudes, longitudes, radius, highway=None
+    ) -> np.ndarray:
+        """
+        Distances in metres from each point to the nearest road of the highway class,
+        or to the nearest road of any class. NaN where that road is outside the
+        square of half side radius around the point, the area a network fetched
+        around the point with that radius covers.
+        """
+        latitudes = np.atleast_1d(np.asarray(latitudes, dtype=float))
+        longitudes = np.atleast_1d(np.asarray(longitudes, dtype=float))
+        distances = np.full(len(latitudes), np.nan)
+
+        tree = self.trees.get(highway)
+        if tree is None or len(tree) == 0:
+            return distances
+
+        points = shapely.points(*to_roads_crs.transform(longitudes, latitudes))
+        (points_index, roads_index), nearest = tree.query_nearest(
+            points, return_distance=True, all_matches=False
+        )
+        in_area = shapely.intersects(
+            search_areas(latitudes, longitudes, radius)[points_index],
+            tree.geometries[roads_index],
+        )
+        distances[points_index[in_area]] = nearest[in_area]
+        return distances
+
+
+class RoadNetworkCache:
+    """
+    Road networks fetched once per tile, a rounded location and a radius, and
+    kept as Parquet edges in cache_dir and in memory.
+
+    A tile's network covers the radius around every location rounding to it.
+    Roads outside a location's search area are left out, as they would be from
+    a network fetched around the location itself.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        precision: int = 2,
+        max_networks: int = 32,
+        edges_loader=download_road_edges,
+    ):
+        self.cache_dir = cache_dir
+        self.precision = precision
+        self.max_networks = max_networks
+        self.edges_loader = edges_loader
+        self.networks = OrderedDict()
+        # Futures of the networks being loaded, so each tile is loaded once
+        self.loading = {}
+        self.lock = threading.Lock()
+
+        # Furthest a location can be from the centre of its tile
+        self.margin = math.ceil(
+            math.sqrt(2) * math.radians(0.5 * 10**-precision) * EARTH_RADIUS_IN_METRES
+        )
+
+    def tile(self, latitude, longitude, radius) -> tuple:
+        return (
+            round(latitude, self.precision),
+            round(longitude, self.precision),
+            int(radius),
+        )
+
+    def tile_path(self, tile) -> str:
+        latitude, longitude, radius = tile
+        return os.path.join(
+            self.cache_dir, f"roads_{latitude}_{longitude}_{radius}.parquet"
+        )
+
+    def load_edges(self, tile) -> gpd.GeoDataFrame:
+        path = self.tile_path(tile)
+        if os.path.exists(path):
+            return gpd.read_parquet(path)
+
+        latitude, longitude, radius = tile
+        edges = self.edges_loader(latitude, longitude, radius + self.margin)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        edges.to_parquet(temporary_path)
+        os.replace(temporary_path, path)
+        return edges
+
+    def get(self, latitude, longitude, radius) -> RoadNetwork:
+        """
+        The network of the location's tile. The lock is only held to read and
+        update the cache, so a tile being loaded does not hold up the others.
+        """
+        tile = self.tile(latitude, longitude, radius)
+        with self.lock:
+            network = self.networks.get(tile)
+            if network is not None:
+                self.networks.move_to_end(tile)
+                return network
+            future = self.loading.get(tile)
+            loads_network = future is None
+            if loads_network:
+                future = self.loading[tile] = Future()
+
+        if not loads_network:
+            return future.result()
+
+        try:
+            network = RoadNetwork(self.load_edges(tile))
+        except BaseException as ex:
+            with self.lock:
+                del self.loading[tile]
+            future.set_exception(ex)
+            raise
+
+        with self.lock:
+            self.networks[tile] = network
+            if len(self.networks) > self.max_networks:
+                self.networks.popitem(last=False)
+            del self.loading[tile]
+        future.set_result(network)
+        return network
+
+    def nearest_road_distances(
+        self, latitudes, longitudes, radius, highway=None
+    ) -> list:
+        """
+        Distances in metres, rounded to 2 decimal places, from each location to the
+        nearest road of the highway class within the radius. None where there is
+        none. Locations in the same tile share one network lookup.
+        """
+        latitudes = np.atleast_1d(np.asarray(latitudes, dtype=float))
+        longitudes = np.atleast_1d(np.asarray(longitudes, dtype=float))
+        distances = np.full(len(latitudes), np.nan)
+
+        tiles = {}
+        for index, (latitude, longitude) in enumerate(zip(latitudes, longitudes)):
+            tiles.setdefault(self.tile(latitude, longitude, radius), []).append(index)
+
+        for (latitude, longitude, _), indexes in tiles.items():
+            network = self.get(latitude, longitude, radius)
+            distances[indexes] = network.nearest_distances(
+                latitudes[indexes], longitudes[indexes], radius, highway
+            )
+
+        return [
+            None if np.isnan(distance) else round(float(distance), 2)
+            for distance in distances
+        ]
+
+    def nearest_road_distance(self, latitude, longitude, radius, highway=None):
+        """
+        Distance in metres, rounded to 2 decimal places, from the location to the
+        nearest road of the highway class within the radius. None if there is none.
+        """
+        return self.nearest_road_distances([latitude], [longitude], radius, highway)[0]
@@ -1,4 +1,5 @@
 ALL_META_DATA_URL = "/all"
+ALL_META_DATA_BATCH_URL = "/all/batch"
 NEAREST_WEATHER_STATIONS = "/nearest-weather-stations"
 ADMINISTRATIVE_LEVELS = "/administrative-levels"
 IP_GEO_COORDINATES = "/ip-geo-coordinates"
@@ -36,6 +36,13 @@ class Config:
     )
     CENTER_OF_KAMPALA_LATITUDE = os.getenv("CENTER_OF_KAMPALA_LATITUDE")
     CENTER_OF_KAMPALA_LONGITUDE = os.getenv("CENTER_OF_KAMPALA_LONGITUDE")
+    ROAD_NETWORK_CACHE_DIR = os.getenv("ROAD_NETWORK_CACHE_DIR", "road-network-cache")
+    ROAD_NETWORK_CACHE_PRECISION = int(os.getenv("ROAD_NETWORK_CACHE_PRECISION", 2))
+    META_DATA_BATCH_SIZE = int(os.getenv("META_DATA_BATCH_SIZE", 100))
+    META_DATA_MAX_WORKERS = int(os.getenv("META_DATA_MAX_WORKERS", 16))
+    META_DATA_GEOHASH_PRECISION = int(os.getenv("META_DATA_GEOHASH_PRECISION", 8))
+    META_DATA_CONSUMER_GROUP = os.getenv("META_DATA_CONSUMER_GROUP", "meta-data-sites")
+    META_DATA_RETRY_SECONDS = int(os.getenv("META_DATA_RETRY_SECONDS", 5))
     SWAGGER_CONFIG = {
         **Swagger.DEFAULT_CONFIG,
         **{"specs_route": f"{BASE_URL_V2}/apidocs/"},
@@ -1,54 +1,172 @@
 import argparse
 import json
+import time
 import traceback
 
-from kafka import KafkaConsumer
+from kafka import KafkaConsumer, TopicPartition
 
 from airqo_api import AirQoApi
 from api.helpers.validation import remove_invalidate_meta_data_values
 from config import Config
 from api.models import extract as ext
+from api.models.meta_data import BatchMetaData
+
+NON_NUMERIC_META_DATA = [
+    "latitude",
+    "longitude",
+    "geohash",
+    "weather_stations",
+    "land_use",
+]
 
 
 class MessageBroker:
     @staticmethod
-    def listen_to_created_sites():
+    def site_coordinates(site: dict):
+        """The id, latitude and longitude of a valid site, None otherwise"""
+        try:
+            data_is_valid = True
+
+            for field in ["latitude", "longitude", "_id"]:
+                if not site.get(field, None):
+                    print(f"Error : {field} is missing in site details")
+                    data_is_valid = False
+
+            if not data_is_valid:
+                return None
+
+            return (
+                site.get("_id"),
+                float(site.get("latitude")),
+                float(site.get("longitude")),
+            )
+
+        except Exception as ex:
+            print(ex)
+            traceback.print_exc()
+            return None
+
+    @staticmethod
+    def rewind(consumer: KafkaConsumer, messages: list):
+        """
+        Moves each partition back to the first offset of the messages.
+        The bigquery-connector rewinds its batches the same way, in
+        MicroBatchConsumer.rewind.
+        """
+        offsets = {}
+        for message in messages:
+            partition = TopicPartition(message.topic, message.partition)
+            offsets[partition] = min(
+                offsets.get(partition, message.offset), message.offset
+            )
+
+        for partition, offset in offsets.items():
+            consumer.seek(partition, offset)
+
+    @staticmethod
+    def save_sites_meta_data(airqo_api: AirQoApi, site_ids, meta_data):
+        for site_id, site_meta_data in zip(
+            site_ids, BatchMetaData.to_records(meta_data)
+        ):
+            try:
+                validated_data = remove_invalidate_meta_data_values(
+                    {
+                        key: value
+                        for key, value in site_meta_data.items()
+                        if key not in NON_NUMERIC_META_DATA
+                    }
+                )
+                airqo_api.update_site_meta_data(
+                    {
+                        "id": site_id,
+                        **validated_data,
+                        "weather_stations": site_meta_data["weather_stations"],
+                        "land_use": site_meta_data["land_use"],
+                    }
+                )
+            except Exception as ex:
+                print(f"Error saving meta data for site {site_id} : {ex}")
+                traceback.print_exc()
+
+    @staticmethod
+    def listen_to_created_sites_in_batches():
+        """
+        Drains the created sites in batches of at most META_DATA_BATCH_SIZE sites
+        and computes the meta data of each batch at once.
+
+        Offsets are committed after a batch is saved. A batch whose meta data
+        cannot be computed is read again after META_DATA_RETRY_SECONDS.
+        """
         airqo_api = AirQoApi()
         consumer = KafkaConsumer(
             Config.SITES_TOPIC,
             bootstrap_servers=Config.BOOTSTRAP_SERVERS,
+            group_id=Config.META_DATA_CONSUMER_GROUP,
+            enable_auto_commit=False,
             value_deserializer=lambda x: json.loads(x.decode("utf-8")),
         )
-        model = ext.Extract()
-
-        print("Listening to created sites.....")
+        batch_meta_data = BatchMetaData(
+            model=ext.Extract(),
+            road_networks=ext.road_networks,
+            weather_station_distance_threshold=Config.WEATHER_STATION_AIRQUALITY_SITE_DISTANCE_THRESHOLD,
+            max_workers=Config.META_DATA_MAX_WORKERS,
+            geohash_precision=Config.META_DATA_GEOHASH_PRECISION,
+        )
 
-        for msg in consumer:
-            try:
-                site = msg.value
-                print(f"\nReceived site : {site}")
-                data_is_valid = True
+        print("Listening to created sites in batches.....")
 
-                for field in ["latitude", "longitude", "_id"]:
-                    if not site.get(field, None):
-                        print(f"Error : {field} is missing in site details")
-                        data_is_valid = False
+        while True:
+            records = consumer.poll(
+                timeout_ms=1000, max_records=Config.META_DATA_BATCH_SIZE
+            )
+            messages = [
+                msg
+                for partition_records in records.values()
+                for msg in partition_records
+            ]
+            if not messages:
+                continue
 
-                if not data_is_valid:
+            sites = [MessageBroker.site_coordinates(msg.value) for msg in messages]
+            sites = [site for site in sites if site]
+            if sites:
+                print(f"Computing meta data for {len(sites)} sites .....")
+                site_ids, latitudes, longitudes = zip(*sites)
+                try:
+                    meta_data = batch_meta_data.compute(latitudes, longitudes)
+                except Exception as ex:
+                    print(ex)
+                    traceback.print_exc()
+                    MessageBroker.rewind(consumer, messages)
+                    time.sleep(Config.META_DATA_RETRY_SECONDS)
                     continue
 
-                site_latitude = site.get("latitude")
-                site_longitude = site.get("longitude")
-                site_id = site.get("_id")
+                print(f"Saving meta data for {len(sites)} sites .....")
+                MessageBroker.save_sites_meta_data(airqo_api, site_ids, meta_data)
 
-                site_latitude = float(site_latitude)
-                site_longitude = float(site_longitude)
+            consumer.commit()
 
-            except Exception as ex:
-                print(ex)
-                traceback.print_exc()
+    @staticmethod
+    def listen_to_created_sites():
+        airqo_api = AirQoApi()
+        consumer = KafkaConsumer(
+            Config.SITES_TOPIC,
+            bootstrap_servers=Config.BOOTSTRAP_SERVERS,
+            value_deserializer=lambda x: json.loads(x.decode("utf-8")),
+        )
+        model = ext.Extract()
+
+        print("Listening to created sites.....")
+
+        for msg in consumer:
+            site = msg.value
+            print(f"\nReceived site : {site}")
+            site_coordinates = MessageBroker.site_coordinates(site)
+            if not site_coordinates:
                 continue
 
+            site_id, site_latitude, site_longitude = site_coordinates
+
             site_meta_data = {
                 "id": site_id,
             }
@@ -186,6 +304,7 @@ if __name__ == "__main__":
         choices=[
             "air-qlouds-consumer",
             "sites-consumer",
+            "sites-batch-consumer",
             "devices-consumer",
         ],
     )
@@ -197,5 +316,8 @@ if __name__ == "__main__":
     elif args.target == "sites-consumer":
         MessageBroker.listen_to_created_sites()
 
+    elif args.target == "sites-batch-consumer":
+        MessageBroker.listen_to_created_sites_in_batches()
+
     elif args.target == "devices-consumer":
         pass
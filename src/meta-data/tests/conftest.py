@@ -0,0 +1,48 @@
+import sys
+import types
+
+import osmnx as ox
+import pytest
+
+from api.models.road_network import RoadNetworkCache, graph_edges
+from fake_extract import FakeExtract
+from synthetic_roads import synthetic_graph
+
+
+@pytest.fixture
+def graph_path(tmp_path):
+    path = tmp_path / "synthetic.graphml"
+    ox.save_graphml(synthetic_graph(), path)
+    return path
+
+
+@pytest.fixture
+def loader(graph_path):
+    calls = []
+
+    def load(latitude, longitude, radius):
+        calls.append((latitude, longitude, radius))
+        return graph_edges(ox.load_graphml(graph_path))
+
+    load.calls = calls
+    return load
+
+
+@pytest.fixture
+def road_networks(tmp_path, loader):
+    return RoadNetworkCache(cache_dir=str(tmp_path / "cache"), edges_loader=loader)
+
+
+@pytest.fixture
+def extract_module(monkeypatch, road_networks):
+    """
+    Stands in for api.models.extract, which signs in to Earth Engine when it is
+    imported. Modules importing it are imported again by each test.
+    """
+    module = types.ModuleType("api.models.extract")
+    module.Extract = FakeExtract
+    module.road_networks = road_networks
+    monkeypatch.setitem(sys.modules, "api.models.extract", module)
+    for name in ["app", "api.controllers.extract", "message_broker"]:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    return module
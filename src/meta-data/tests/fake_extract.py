@@ -0,0 +1,69 @@
+import threading
+import time
+
+from synthetic_roads import CENTER
+
+STATIONS = [
+    {"id": 1, "code": "TA00001", "latitude": 0.3201, "longitude": 32.5712},
+    {"id": 2, "code": "TA00002", "latitude": 0.3501, "longitude": 32.6012},
+    {"id": 3, "code": "TA00003", "latitude": 1.3501, "longitude": 33.6012},
+]
+
+
+class FakeExtract:
+    """Answers like Extract, after a delay, and records the locations asked for"""
+
+    def __init__(self, latency=0.0, failing_latitudes=(), stations=STATIONS):
+        self.latency = latency
+        self.failing_latitudes = failing_latitudes
+        self.stations = stations
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def remote_call(self, method, latitude, longitude=None):
+        with self.lock:
+            self.calls.append((method, latitude, longitude))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+        if latitude in self.failing_latitudes:
+            raise ValueError(f"{method} is unavailable")
+
+    def get_altitude(self, lat, lon):
+        self.remote_call("get_altitude", lat, lon)
+        return round(1100 + lat * 100, 2)
+
+    def get_aspect_270(self, lat, lon):
+        self.remote_call("get_aspect_270", lat, lon)
+        return 180.0
+
+    def get_landform90(self, lat, lon):
+        self.remote_call("get_landform90", lat, lon)
+        return 21
+
+    def get_landform270(self, lat, lon):
+        self.remote_call("get_landform270", lat, lon)
+        return -3.5
+
+    def get_landuse(self, lat, lon):
+        self.remote_call("get_landuse", lat, lon)
+        return [{"highway": "residential", "landuse": "residential"}]
+
+    def get_all_weather_station_account_has_access_on(self):
+        self.remote_call("get_all_weather_station_account_has_access_on", None)
+        if self.stations is None:
+            raise ValueError("TAHMO is unavailable")
+        return self.stations
+
+    def get_bearing_from_kampala(self, lat, lon):
+        return 90.0
+
+    def get_distance_from_kampala(self, lat, lon):
+        return abs(lat - CENTER[0]) * 111
+
+    def cell_calls(self, method):
+        return [call[1:] for call in self.calls if call[0] == method]
@@ -0,0 +1,45 @@
+import networkx as nx
+import numpy as np
+
+CENTER = (0.3136, 32.5811)
+
+
+def synthetic_graph(size=15, spacing=0.003, seed=0):
+    """
+    A grid of drivable roads around the center, with a primary road along the
+    bottom row, secondary roads every fifth column, a tertiary road in the middle
+    row and residential roads elsewhere. One road has merged highway classes.
+    """
+    rng = np.random.default_rng(seed)
+    graph = nx.MultiDiGraph(crs="epsg:4326")
+    first_lat = CENTER[0] - spacing * size / 2
+    first_lon = CENTER[1] - spacing * size / 2
+    for row in range(size):
+        for column in range(size):
+            graph.add_node(
+                row * size + column,
+                x=first_lon + column * spacing + rng.uniform(-1, 1) * spacing / 10,
+                y=first_lat + row * spacing + rng.uniform(-1, 1) * spacing / 10,
+            )
+
+    osmid = 0
+    for row in range(size):
+        for column in range(size):
+            node = row * size + column
+            neighbours = []
+            if column + 1 < size:
+                highway = "primary" if row == 0 else "residential"
+                if row == size // 2:
+                    highway = "tertiary"
+                neighbours.append((node + 1, highway))
+            if row + 1 < size:
+                highway = "secondary" if column % 5 == 0 else "residential"
+                neighbours.append((node + size, highway))
+            for neighbour, highway in neighbours:
+                osmid += 1
+                graph.add_edge(node, neighbour, osmid=osmid, highway=highway)
+                graph.add_edge(neighbour, node, osmid=osmid, highway=highway)
+
+    graph[0][1][0]["highway"] = ["primary", "secondary"]
+    graph[1][0][0]["highway"] = ["primary", "secondary"]
+    return graph
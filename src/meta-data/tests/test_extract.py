@@ -0,0 +1,53 @@
+import importlib
+
+import pytest
+
+from config import Config
+from fake_extract import FakeExtract
+from synthetic_roads import CENTER
+
+BATCH_URL = f"{Config.BASE_URL_V2}/all/batch"
+
+
+@pytest.fixture
+def client(extract_module, monkeypatch):
+    monkeypatch.setattr(
+        Config, "WEATHER_STATION_AIRQUALITY_SITE_DISTANCE_THRESHOLD", 20
+    )
+    monkeypatch.setattr(Config, "META_DATA_BATCH_SIZE", 3)
+    app = importlib.import_module("app").app
+    return app.test_client()
+
+
+def test_batch_returns_the_meta_data_of_each_site(client):
+    sites = [
+        {"latitude": CENTER[0], "longitude": CENTER[1]},
+        {"latitude": str(CENTER[0] + 0.01), "longitude": str(CENTER[1])},
+    ]
+
+    response = client.post(BATCH_URL, json={"sites": sites})
+
+    assert response.status_code == 200
+    data = response.get_json()["data"]
+    assert [site["latitude"] for site in data] == [CENTER[0], CENTER[0] + 0.01]
+    assert [site["altitude"] for site in data] == [
+        FakeExtract().get_altitude(float(site["latitude"]), float(site["longitude"]))
+        for site in sites
+    ]
+    assert all(site["distance_to_nearest_road"] is not None for site in data)
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        None,
+        {"sites": []},
+        {"sites": {"latitude": 0.3, "longitude": 32.5}},
+        {"sites": [{"latitude": 0.3, "longitude": 32.5}] * 4},
+        {"sites": [{"latitude": 0.3}]},
+    ],
+)
+def test_batch_rejects_invalid_sites(client, body):
+    response = client.post(BATCH_URL, json=body)
+
+    assert response.status_code == 400
@@ -0,0 +1,146 @@
+import importlib.util
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from kafka import TopicPartition
+
+from config import Config
+from synthetic_roads import CENTER
+
+SITES_PARTITION = TopicPartition("sites", 0)
+
+
+class StopConsuming(Exception):
+    pass
+
+
+class FakeKafkaConsumer:
+    """
+    A consumer of one partition with manual commits. Polling past the last
+    message stops the consumer loop.
+    """
+
+    def __init__(self, sites, events):
+        self.messages = [
+            SimpleNamespace(topic="sites", partition=0, offset=offset, value=site)
+            for offset, site in enumerate(sites)
+        ]
+        self.events = events
+        self.position = 0
+
+    def poll(self, timeout_ms, max_records):
+        if self.position >= len(self.messages):
+            raise StopConsuming()
+        messages = self.messages[self.position : self.position + max_records]
+        self.position += len(messages)
+        return {SITES_PARTITION: messages}
+
+    def seek(self, partition, offset):
+        self.events.append(("seek", partition, offset))
+        self.position = offset
+
+    def commit(self):
+        self.events.append(("commit", self.position))
+
+
+class FakeAirQoApi:
+    def __init__(self, events):
+        self.events = events
+
+    def update_site_meta_data(self, site_details):
+        self.events.append(("save", site_details["id"]))
+
+
+def import_message_broker():
+    path = Path(__file__).resolve().parents[1] / "message-broker.py"
+    spec = importlib.util.spec_from_file_location("message_broker", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def message_broker(extract_module, monkeypatch):
+    monkeypatch.setattr(
+        Config, "WEATHER_STATION_AIRQUALITY_SITE_DISTANCE_THRESHOLD", 20
+    )
+    monkeypatch.setattr(Config, "META_DATA_BATCH_SIZE", 2)
+    monkeypatch.setattr(Config, "META_DATA_RETRY_SECONDS", 0)
+    return import_message_broker()
+
+
+def site(site_id, offset=0.0):
+    return {"_id": site_id, "latitude": CENTER[0] + offset, "longitude": CENTER[1]}
+
+
+def listen(message_broker, monkeypatch, sites):
+    events = []
+    consumer = FakeKafkaConsumer(sites, events)
+    monkeypatch.setattr(
+        message_broker, "KafkaConsumer", lambda *args, **kwargs: consumer
+    )
+    monkeypatch.setattr(message_broker, "AirQoApi", lambda: FakeAirQoApi(events))
+
+    with pytest.raises(StopConsuming):
+        message_broker.MessageBroker.listen_to_created_sites_in_batches()
+    return events
+
+
+def test_batches_are_committed_after_they_are_saved(message_broker, monkeypatch):
+    sites = [site("s0"), site("s1", 0.001), {"_id": "s2"}, site("s3", 0.002)]
+
+    events = listen(message_broker, monkeypatch, sites)
+
+    assert events == [
+        ("save", "s0"),
+        ("save", "s1"),
+        ("commit", 2),
+        ("save", "s3"),
+        ("commit", 4),
+    ]
+
+
+def test_failed_batch_is_rewound_and_read_again(message_broker, monkeypatch):
+    compute = message_broker.BatchMetaData.compute
+    computed = []
+
+    def fail_second_batch(self, latitudes, longitudes):
+        computed.append(len(latitudes))
+        if len(computed) == 2:
+            raise ValueError("Earth Engine is unavailable")
+        return compute(self, latitudes, longitudes)
+
+    monkeypatch.setattr(message_broker.BatchMetaData, "compute", fail_second_batch)
+    sites = [site(f"s{index}", index / 1000) for index in range(5)]
+
+    events = listen(message_broker, monkeypatch, sites)
+
+    assert computed == [2, 2, 2, 1]
+    assert events == [
+        ("save", "s0"),
+        ("save", "s1"),
+        ("commit", 2),
+        ("seek", SITES_PARTITION, 2),
+        ("save", "s2"),
+        ("save", "s3"),
+        ("commit", 4),
+        ("save", "s4"),
+        ("commit", 5),
+    ]
+
+
+def test_rewind_seeks_each_partition_to_its_first_offset(message_broker):
+    events = []
+    consumer = FakeKafkaConsumer([], events)
+    messages = [
+        SimpleNamespace(topic="sites", partition=partition, offset=offset, value=None)
+        for partition, offset in [(0, 7), (1, 3), (0, 5), (1, 4)]
+    ]
+
+    message_broker.MessageBroker.rewind(consumer, messages)
+
+    assert events == [
+        ("seek", TopicPartition("sites", 0), 5),
+        ("seek", TopicPartition("sites", 1), 3),
+    ]
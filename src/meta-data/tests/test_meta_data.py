@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+from api.models.meta_data import (
+    CELL_ATTRIBUTES,
+    META_DATA_COLUMNS,
+    ROAD_DISTANCES,
+    BatchMetaData,
+    geohash,
+    nearest_weather_stations,
+)
+from fake_extract import STATIONS, FakeExtract
+from synthetic_roads import CENTER
+
+
+def batch_meta_data(model, road_networks, **kwargs):
+    return BatchMetaData(
+        model=model,
+        road_networks=road_networks,
+        weather_station_distance_threshold=20,
+        **kwargs,
+    )
+
+
+def test_geohash():
+    assert geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geohash(0.3136, 32.5811, 8).startswith(geohash(0.3136, 32.5811, 5))
+
+
+def test_meta_data_of_each_site_in_order(road_networks):
+    model = FakeExtract()
+    rng = np.random.default_rng(0)
+    latitudes, longitudes = (rng.uniform(-0.01, 0.01, (10, 2)) + CENTER).T
+
+    meta_data = batch_meta_data(model, road_networks).compute(latitudes, longitudes)
+
+    assert list(meta_data.columns) == META_DATA_COLUMNS
+    assert meta_data["latitude"].tolist() == latitudes.tolist()
+    assert meta_data["altitude"].tolist() == [
+        model.get_altitude(latitude, longitude)
+        for latitude, longitude in zip(latitudes, longitudes)
+    ]
+    for column, (radius, highway) in ROAD_DISTANCES.items():
+        assert meta_data[column].tolist() == [
+            road_networks.nearest_road_distance(latitude, longitude, radius, highway)
+            for latitude, longitude in zip(latitudes, longitudes)
+        ]
+    assert meta_data["weather_stations"].tolist() == [
+        nearest_weather_stations(STATIONS, latitude, longitude, 20)
+        for latitude, longitude in zip(latitudes, longitudes)
+    ]
+    assert meta_data["distance_to_kampala_center"].tolist() == [
+        model.get_distance_from_kampala(latitude, longitude)
+        for latitude, longitude in zip(latitudes, longitudes)
+    ]
+
+
+def test_nearby_sites_share_remote_attributes(road_networks):
+    model = FakeExtract()
+    latitudes = [0.3136, 0.31361, 0.3136, 0.3236]
+    longitudes = [32.5811, 32.58111, 32.5811, 32.5811]
+
+    meta_data = batch_meta_data(model, road_networks).compute(latitudes, longitudes)
+
+    assert meta_data["geohash"].nunique() == 2
+    for method in CELL_ATTRIBUTES.values():
+        assert model.cell_calls(method) == [(0.3136, 32.5811), (0.3236, 32.5811)]
+    assert model.cell_calls("get_all_weather_station_account_has_access_on") == [
+        (None, None)
+    ]
+    assert meta_data["altitude"].tolist() == [1131.36, 1131.36, 1131.36, 1132.36]
+
+    # Road distances are still measured at each site
+    assert (
+        meta_data.loc[0, "distance_to_nearest_road"]
+        != meta_data.loc[1, "distance_to_nearest_road"]
+    )
+
+
+def test_remote_attributes_are_requested_concurrently(road_networks):
+    model = FakeExtract(latency=0.1)
+    batch = batch_meta_data(model, road_networks, max_workers=64)
+    latitudes = np.linspace(0.30, 0.32, 10)
+    longitudes = np.full(10, CENTER[1])
+    batch.compute(latitudes[:1], longitudes[:1])
+
+    batch.compute(latitudes, longitudes)
+
+    # 51 requests of 0.1 seconds each, several in flight at once
+    assert len(model.calls) == 6 + 51
+    assert model.max_in_flight > 1
+
+
+def test_failed_attributes_are_none(road_networks):
+    model = FakeExtract(failing_latitudes=[0.3236], stations=None)
+
+    meta_data = batch_meta_data(model, road_networks).compute(
+        [0.3136, 0.3236], [32.5811, 32.5811]
+    )
+
+    assert meta_data["altitude"].tolist() == [1131.36, None]
+    assert meta_data["landform_90"].tolist() == [21, None]
+    assert meta_data["weather_stations"].tolist() == [None, None]
+    assert meta_data["distance_to_nearest_road"].notna().all()
+
+
+def test_records_hold_none_for_missing_values():
+    meta_data = pd.DataFrame(
+        {"altitude": [1131.36, np.nan], "weather_stations": [[], None]}
+    )
+
+    assert BatchMetaData.to_records(meta_data) == [
+        {"altitude": 1131.36, "weather_stations": []},
+        {"altitude": None, "weather_stations": None},
+    ]
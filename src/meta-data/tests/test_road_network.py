@@ -0,0 +1,108 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import osmnx as ox
+import pytest
+from shapely.geometry import Point
+
+from api.models.road_network import ROADS_CRS, RoadNetworkCache, to_roads_crs
+from synthetic_roads import CENTER, synthetic_graph
+
+
+def brute_force_distance(graph_path, latitude, longitude, highway=None):
+    """The nearest road distance measured as each road type function used to"""
+    edges = ox.graph_to_gdfs(
+        ox.load_graphml(graph_path), nodes=False, fill_edge_geometry=True
+    )
+    edges = edges.to_crs(ROADS_CRS)
+    if highway is not None:
+        edges = edges[edges["highway"] == highway]
+    if edges.shape[0] == 0:
+        return None
+    point = Point(*to_roads_crs.transform(longitude, latitude))
+    return round(min(point.distance(road) for road in edges.geometry), 2)
+
+
+@pytest.mark.parametrize(
+    "highway", [None, "primary", "secondary", "tertiary", "residential"]
+)
+def test_distances_match_brute_force(tmp_path, loader, graph_path, highway):
+    cache = RoadNetworkCache(cache_dir=str(tmp_path / "cache"), edges_loader=loader)
+    rng = np.random.default_rng(1)
+    for latitude, longitude in rng.uniform(-0.015, 0.015, (10, 2)) + CENTER:
+        assert cache.nearest_road_distance(
+            latitude, longitude, 10000, highway
+        ) == brute_force_distance(graph_path, latitude, longitude, highway)
+
+
+def test_roads_outside_the_radius_are_left_out(tmp_path, loader, graph_path):
+    cache = RoadNetworkCache(cache_dir=str(tmp_path / "cache"), edges_loader=loader)
+    latitude, longitude = CENTER[0] + 0.02, CENTER[1]
+
+    # The primary road runs along the bottom of the grid, about 4.5km away
+    assert cache.nearest_road_distance(latitude, longitude, 1000, "primary") is None
+    assert cache.nearest_road_distance(
+        latitude, longitude, 10000, "primary"
+    ) == brute_force_distance(graph_path, latitude, longitude, "primary")
+    assert cache.nearest_road_distance(*CENTER, 1000, "motorway") is None
+
+
+def test_merged_highway_classes_only_count_as_roads(tmp_path, loader):
+    cache = RoadNetworkCache(cache_dir=str(tmp_path / "cache"), edges_loader=loader)
+    network = cache.get(*CENTER, 1000)
+    node = synthetic_graph().nodes[0]
+
+    assert network.nearest_distances([node["y"]], [node["x"]], 1000)[0] == 0
+    assert network.nearest_distances([node["y"]], [node["x"]], 1000, "primary")[0] > 0
+
+
+def test_networks_are_fetched_once_per_tile(tmp_path, loader):
+    cache_dir = str(tmp_path / "cache")
+    cache = RoadNetworkCache(cache_dir=cache_dir, precision=2, edges_loader=loader)
+
+    cache.nearest_road_distance(0.3136, 32.5811, 1000, "primary")
+    cache.nearest_road_distance(0.3141, 32.5789, 1000, "secondary")
+    cache.nearest_road_distance(0.3136, 32.5811, 10000, "primary")
+    assert [radius for _, _, radius in loader.calls] == [
+        1000 + cache.margin,
+        10000 + cache.margin,
+    ]
+    assert loader.calls[0][:2] == (0.31, 32.58)
+
+    # Another process reads the tiles from the cache directory
+    other_cache = RoadNetworkCache(
+        cache_dir=cache_dir, precision=2, edges_loader=loader
+    )
+    assert other_cache.nearest_road_distance(
+        0.3136, 32.5811, 1000, "primary"
+    ) == cache.nearest_road_distance(0.3136, 32.5811, 1000, "primary")
+    assert len(loader.calls) == 2
+
+
+def test_slow_tiles_do_not_hold_up_other_tiles(tmp_path, loader):
+    slow_tile_loading = threading.Event()
+    release_slow_tile = threading.Event()
+
+    def load(latitude, longitude, radius):
+        if latitude == 0.31:
+            slow_tile_loading.set()
+            release_slow_tile.wait(5)
+        return loader(latitude, longitude, radius)
+
+    cache = RoadNetworkCache(cache_dir=str(tmp_path / "cache"), edges_loader=load)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        slow_tile = [
+            executor.submit(cache.get, 0.3136, 32.5811, 1000) for _ in range(3)
+        ]
+        slow_tile_loading.wait(5)
+
+        # Another tile loads while the slow one is still downloading
+        assert cache.get(0.3536, 32.5811, 1000) is not None
+        assert not any(future.done() for future in slow_tile)
+
+        release_slow_tile.set()
+        networks = [future.result() for future in slow_tile]
+
+    assert all(network is networks[0] for network in networks)
+    assert [call[:2] for call in loader.calls] == [(0.35, 32.58), (0.31, 32.58)]
@@ -1,6 +1,7 @@
 import logging
 import os
 
+import click
 from dotenv import load_dotenv
 from flask import Flask
 from flask_caching import Cache
@@ -56,5 +57,23 @@ class Predictions(postgres_db.Model):
     timestamp = postgres_db.Column(postgres_db.DateTime())
 
 
+@application.cli.command("materialize-forecasts")
+@click.argument("frequency", type=click.Choice(["hourly", "daily"]))
+def materialize_forecasts_command(frequency):
+    """Writes the latest forecasts to Redis."""
+    from forecast_cache import ForecastStore
+    from helpers import materialize_latest_forecasts
+
+    materialize_latest_forecasts(frequency=frequency, store=ForecastStore())
+
+
+@application.cli.command("create-indexes")
+def create_indexes_command():
+    """Creates the database indexes used by the API."""
+    from helpers import create_predictions_indexes
+
+    create_predictions_indexes()
+
+
 if __name__ == "__main__":
     application.run(debug=True)
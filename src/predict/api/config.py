@@ -22,9 +22,22 @@ class Config:
     DB_NAME = os.getenv("DB_NAME", "test_airqo_db")
     MONGO_URI = os.getenv("MONGO_GCE_URI", "mongodb://localhost:27017/test_airqo_db")
     REDIS_SERVER = os.getenv("REDIS_SERVER", "localhost")
+    REDIS_PORT = os.getenv("REDIS_PORT", 6379)
+    REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 1))
+    # Seconds the materialized forecasts are served for, a little longer than
+    # the daily forecast job interval
+    FORECAST_CACHE_TIMEOUT = int(os.getenv("FORECAST_CACHE_TIMEOUT", 90000))
+    # Comma separated health tip languages of the materialized forecasts
+    FORECAST_CACHE_LANGUAGES = os.getenv("FORECAST_CACHE_LANGUAGES", "").split(",")
     POSTGRES_CONNECTION_URL = os.getenv("POSTGRES_CONNECTION_URL", "postgresql://localhost:5432/test_airqo_db")
     CACHE_TIMEOUT = os.getenv("CACHE_TIMEOUT", 3600)
     PARISH_PREDICTIONS_QUERY_LIMIT = os.getenv("PARISH_PREDICTIONS_QUERY_LIMIT", 100)
+    SPATIAL_INDEX_REFRESH_INTERVAL = int(
+        os.getenv("SPATIAL_INDEX_REFRESH_INTERVAL", 300)
+    )
+    SPATIAL_INDEX_BATCH_SIZE = int(os.getenv("SPATIAL_INDEX_BATCH_SIZE", 20))
+    # Heatmap predictions beyond this many values are read from BigQuery instead
+    SPATIAL_INDEX_MAX_POINTS = int(os.getenv("SPATIAL_INDEX_MAX_POINTS", 500000))
 
 
 class ProductionConfig(Config):
@@ -0,0 +1,211 @@
+import bisect
+import json
+import uuid
+from datetime import date
+
+import redis
+from werkzeug.http import http_date
+
+from config import Config
+
+FORECAST_COLLECTIONS = {
+    "hourly": "hourly_forecasts_1",
+    "daily": "daily_forecasts_1",
+}
+
+FORECAST_QUERY_PARAMS = [
+    "device_id",
+    "site_id",
+    "site_name",
+    "parish",
+    "county",
+    "city",
+    "district",
+    "region",
+]
+
+
+class HealthTipsIndex:
+    """
+    Health tips bucketed by the aqi category bounds, so the tips of a pm2_5 value
+    are found with a binary search instead of a scan of every tip.
+    A value matches a tip when min <= value <= max, as in add_forecast_health_tips.
+    """
+
+    def __init__(self, health_tips: list):
+        self.bounds = sorted(
+            {
+                bound
+                for tip in health_tips
+                for bound in (tip["aqi_category"]["min"], tip["aqi_category"]["max"])
+            }
+        )
+
+        def matching_tips(value) -> list:
+            return [
+                tip
+                for tip in health_tips
+                if tip["aqi_category"]["max"] >= value >= tip["aqi_category"]["min"]
+            ]
+
+        # Tips of values equal to a bound, and of values between two bounds.
+        # Values below the first or above the last bound match no tip.
+        self.tips_at_bounds = [matching_tips(bound) for bound in self.bounds]
+        self.tips_between_bounds = (
+            [[]]
+            + [
+                matching_tips((lower + upper) / 2)
+                for lower, upper in zip(self.bounds, self.bounds[1:])
+            ]
+            + [[]]
+        )
+
+    def get_tips(self, pm2_5) -> list:
+        if pm2_5 is None or pm2_5 != pm2_5:
+            return []
+
+        index = bisect.bisect_left(self.bounds, pm2_5)
+        if index < len(self.bounds) and self.bounds[index] == pm2_5:
+            return self.tips_at_bounds[index]
+        return self.tips_between_bounds[index]
+
+
+def format_forecasts(document: dict) -> dict:
+    return {
+        "forecasts": [
+            {"time": time, "pm2_5": pm2_5}
+            for time, pm2_5 in zip(document["timestamp"], document["pm2_5"])
+        ]
+    }
+
+
+def to_json(value) -> str:
+    """Encodes value as the API's jsonify responses do."""
+
+    def default(obj):
+        if isinstance(obj, date):
+            return http_date(obj)
+        return str(obj)
+
+    return json.dumps(value, default=default, sort_keys=True, separators=(",", ":"))
+
+
+class ForecastStore:
+    """
+    Forecasts materialized in Redis, already formatted and enriched with health
+    tips, so the forecast endpoints are served with two hash lookups.
+
+    forecasts:<frequency>:<language> maps a forecast document id to its response.
+    forecasts:<frequency>:index maps <param>:<value> to the id of the latest
+    document with that value, mirroring the $natural sort of get_forecasts.
+    Both expire after `timeout` seconds, so forecasts that are not materialized
+    again, and the health tips baked into them, are read from the database.
+    """
+
+    def __init__(self, client=None, timeout: int = None):
+        self.client = client or redis.Redis(
+            host=Config.REDIS_SERVER,
+            port=int(Config.REDIS_PORT),
+            socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=Config.REDIS_SOCKET_TIMEOUT,
+        )
+        self.timeout = timeout or Config.FORECAST_CACHE_TIMEOUT
+
+    @staticmethod
+    def forecasts_key(frequency: str, language: str) -> str:
+        return f"forecasts:{frequency}:{language}"
+
+    @staticmethod
+    def index_key(frequency: str) -> str:
+        return f"forecasts:{frequency}:index"
+
+    def save(self, frequency: str, documents: list, health_tips: dict):
+        """
+        Replaces the materialized forecasts of a frequency.
+
+        :param documents: forecast documents, oldest first
+        :param health_tips: health tips of each materialized language
+        """
+        index = {}
+        responses = {language: {} for language in health_tips}
+        tips_indexes = {
+            language: HealthTipsIndex(tips) for language, tips in health_tips.items()
+        }
+
+        for document in documents:
+            document_id = str(document["_id"])
+            for param in FORECAST_QUERY_PARAMS:
+                if document.get(param) is not None:
+                    index[f"{param}:{document[param]}"] = document_id
+
+            for language, tips_index in tips_indexes.items():
+                result = format_forecasts(document)
+                if health_tips[language]:
+                    for forecast in result["forecasts"]:
+                        forecast["health_tips"] = tips_index.get_tips(forecast["pm2_5"])
+                responses[language][document_id] = to_json(result)
+
+        # Write to temporary keys and swap them in, so readers never see a partial set
+        suffix = uuid.uuid4().hex
+        keys = {self.index_key(frequency): index}
+        for language, language_responses in responses.items():
+            keys[self.forecasts_key(frequency, language)] = language_responses
+
+        pipeline = self.client.pipeline(transaction=True)
+        for key, mapping in keys.items():
+            if mapping:
+                pipeline.hset(f"{key}:{suffix}", mapping=mapping)
+        for key, mapping in keys.items():
+            if mapping:
+                pipeline.rename(f"{key}:{suffix}", key)
+                pipeline.expire(key, self.timeout)
+            else:
+                pipeline.delete(key)
+        pipeline.execute()
+
+    def get(self, frequency: str, language: str = "", **params):
+        """
+        The materialized response of a query on a single parameter, or None when
+        it is not materialized and has to be read from the database.
+        """
+        params = {name: value for name, value in params.items() if value is not None}
+        if len(params) != 1:
+            return None
+
+        ((param, value),) = params.items()
+        try:
+            document_id = self.client.hget(
+                self.index_key(frequency), f"{param}:{value}"
+            )
+            if document_id is None:
+                return None
+            response = self.client.hget(
+                self.forecasts_key(frequency, language), document_id
+            )
+        except redis.RedisError as ex:
+            print("Error reading materialized forecasts", ex)
+            return None
+
+        return response.decode("utf-8") if response is not None else None
+
+
+def materialize_forecasts(
+    frequency: str, db, store: ForecastStore, health_tips: dict
+) -> int:
+    """
+    Materializes the forecasts of a frequency. The forecast job requests it
+    after saving its forecasts.
+
+    :param db: database holding the forecast collections
+    :param health_tips: health tips of each language to materialize
+    :return: number of materialized forecast documents
+    """
+    if frequency not in FORECAST_COLLECTIONS:
+        raise ValueError("Invalid frequency argument")
+
+    documents = list(
+        db[FORECAST_COLLECTIONS[frequency]].find({}).sort([("$natural", 1)])
+    )
+    store.save(frequency=frequency, documents=documents, health_tips=health_tips)
+    print(f"Materialized {len(documents)} {frequency} forecasts")
+    return len(documents)
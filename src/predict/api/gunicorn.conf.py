@@ -0,0 +1,8 @@
+# Read by gunicorn from the working directory
+
+
+def post_worker_init(worker):
+    """Starts building the spatial indexes as each worker starts"""
+    from helpers import spatial_indexes
+
+    spatial_indexes.start()
@@ -1,17 +1,33 @@
+import base64
+import hmac
 import json
 import math
 import traceback
 from datetime import datetime
+from functools import wraps
 
 import pandas as pd
 import requests
+from bson import ObjectId
 from dotenv import load_dotenv
-from flask import request
+from flask import jsonify, request
 from google.cloud import bigquery
 from sqlalchemy import func
 
 from app import cache
 from config import connect_mongo, Config
+from forecast_cache import (
+    ForecastStore,
+    HealthTipsIndex,
+    format_forecasts,
+    materialize_forecasts,
+)
+from spatial_index import (
+    ParishIndex,
+    PointPredictionIndex,
+    SpatialIndexCache,
+    SpatialIndexes,
+)
 
 load_dotenv()
 db = connect_mongo()
@@ -21,6 +37,19 @@ def date_to_str(date: datetime):
     return date.isoformat()
 
 
+def token_required(view):
+    """Rejects requests whose token parameter is not AIRQO_API_AUTH_TOKEN."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = request.args.get("token", default="", type=str)
+        if not hmac.compare_digest(token, Config.AIRQO_API_AUTH_TOKEN):
+            return jsonify({"message": "Invalid token", "success": False}), 401
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
 # Ensure these are updated when the API query parameters are changed
 def heatmap_cache_key():
     args = request.args
@@ -28,41 +57,8 @@ def heatmap_cache_key():
     airqloud = args.get("airqloud")
     page = args.get("page")
     limit = args.get("limit")
-    return f"{current_hour}_{airqloud}_{page}_{limit}"
-
-
-def daily_forecasts_cache_key():
-    current_day = datetime.now().strftime("%Y-%m-%d")
-    args = request.args
-    site_name = args.get("site_name")
-    region = args.get("region")
-    sub_county = args.get("sub_county")
-    county = args.get("county")
-    district = args.get("district")
-    parish = args.get("parish")
-    language = args.get("language")
-    city = args.get("city")
-    site_id = args.get("site_id")
-    device_id = args.get("device_id")
-
-    return f"daily_{current_day}_{site_name}_{region}_{sub_county}_{language}_{county}_{district}_{parish}_{city}_{site_id}_{device_id}"
-
-
-def hourly_forecasts_cache_key():
-    current_day = datetime.now().strftime("%Y-%m-%d")
-    args = request.args
-    site_name = args.get("site_name")
-    region = args.get("region")
-    sub_county = args.get("sub_county")
-    county = args.get("county")
-    district = args.get("district")
-    parish = args.get("parish")
-    language = args.get("language")
-    city = args.get("city")
-    site_id = args.get("site_id")
-    device_id = args.get("device_id")
-
-    return f"hourly_{current_day}_{site_name}_{region}_{sub_county}_{county}_{language}_{district}_{parish}_{city}_{site_id}_{device_id}"
+    cursor = args.get("cursor")
+    return f"{current_hour}_{airqloud}_{page}_{limit}_{cursor}"
 
 
 def get_faults_cache_key():
@@ -112,10 +108,129 @@ def get_health_tips(language="") -> list[dict]:
         return []
 
 
+def parish_records(parishes) -> list:
+    return [
+        {
+            "parish": parish.parish,
+            "pm2_5": parish.pm2_5,
+            "district": parish.district,
+            "timestamp": parish.timestamp,
+            "geometry": json.loads(parish.geometry),
+        }
+        for parish in parishes
+    ]
+
+
+def load_spatial_indexes_version():
+    from app import application, postgres_db, Predictions
+
+    # Spatial indexes are loaded on a background thread, outside of any request
+    with application.app_context():
+        parishes = postgres_db.session.query(
+            func.max(Predictions.timestamp), func.count(Predictions.parish)
+        ).one()
+    latest_predictions = db.gp_model_predictions.find_one(
+        {}, {"created_at": 1}, sort=[("created_at", -1)]
+    )
+    return (
+        tuple(parishes),
+        latest_predictions["created_at"] if latest_predictions else None,
+        db.gp_model_predictions.estimated_document_count(),
+    )
+
+
+def load_prediction_points():
+    """
+    The values of the latest heatmap predictions, read in batches of
+    SPATIAL_INDEX_BATCH_SIZE documents. None when there are more than
+    SPATIAL_INDEX_MAX_POINTS values, to keep them out of the worker's memory.
+
+    These are the values the gp-model job also writes to
+    BIGQUERY_MEASUREMENTS_PREDICTIONS, where the row timestamp is the document's
+    created_at, so the index answers as the BigQuery query it replaces. The only
+    difference is that the job inserts an airqloud's new rows into BigQuery before
+    deleting its older ones, so for that moment BigQuery may still answer with an
+    older prediction while the index only has the latest.
+    """
+    documents = db.gp_model_predictions.find(
+        {},
+        {
+            "created_at": 1,
+            "values.latitude": 1,
+            "values.longitude": 1,
+            "values.predicted_value": 1,
+            "values.interval": 1,
+        },
+    ).batch_size(Config.SPATIAL_INDEX_BATCH_SIZE)
+
+    points = []
+    for document in documents:
+        if len(points) + len(document["values"]) > Config.SPATIAL_INDEX_MAX_POINTS:
+            documents.close()
+            print(
+                f"More than {Config.SPATIAL_INDEX_MAX_POINTS} predictions, "
+                f"heatmap predictions are not indexed"
+            )
+            return None
+
+        timestamp = date_to_str(
+            pd.Timestamp(document["created_at"]).tz_localize("UTC").floor("s")
+        )
+        for value in document["values"]:
+            points.append(
+                {
+                    "latitude": value["latitude"],
+                    "longitude": value["longitude"],
+                    "pm2_5": value["predicted_value"],
+                    "pm2_5_confidence_interval": value["interval"],
+                    "timestamp": timestamp,
+                }
+            )
+    return points
+
+
+def load_spatial_indexes() -> SpatialIndexes:
+    """Indexes the parish predictions and the latest heatmap predictions."""
+    from app import application, postgres_db, Predictions
+
+    with application.app_context():
+        parishes = postgres_db.session.query(
+            func.ST_AsGeoJSON(Predictions.geometry).label("geometry"),
+            Predictions.parish.label("parish"),
+            Predictions.district.label("district"),
+            Predictions.timestamp.label("timestamp"),
+            Predictions.pm2_5.label("pm2_5"),
+        ).all()
+    points = load_prediction_points()
+
+    return SpatialIndexes(
+        parishes=ParishIndex(parish_records(parishes)),
+        points=PointPredictionIndex(points) if points is not None else None,
+    )
+
+
+spatial_indexes = SpatialIndexCache(
+    version_loader=load_spatial_indexes_version,
+    indexes_loader=load_spatial_indexes,
+    refresh_interval=Config.SPATIAL_INDEX_REFRESH_INTERVAL,
+)
+
+
 @cache.memoize(timeout=Config.CACHE_TIMEOUT)
 def get_predictions_by_geo_coordinates(
     latitude: float, longitude: float, distance_in_metres: int
 ) -> dict:
+    indexes = spatial_indexes.get()
+    if indexes is not None and indexes.points is not None:
+        prediction = indexes.points.find([latitude], [longitude], distance_in_metres)[0]
+        if prediction is None:
+            return {}
+        return {
+            "pm2_5": prediction["pm2_5"],
+            "timestamp": prediction["timestamp"],
+            "pm2_5_confidence_interval": prediction["pm2_5_confidence_interval"],
+        }
+
     client = bigquery.Client()
 
     query = (
@@ -153,6 +268,12 @@ def geo_coordinates_cache_key_v2():
 def get_parish_predictions(
     parish: str, district: str, page_size: int, offset: int
 ) -> []:
+    indexes = spatial_indexes.get()
+    if indexes is not None:
+        return indexes.parishes.search(
+            parish=parish, district=district, page_size=page_size, offset=offset
+        )
+
     from app import postgres_db, Predictions
 
     query = postgres_db.session.query(
@@ -174,21 +295,22 @@ def get_parish_predictions(
     total_rows = query.count()
     total_pages = math.ceil(total_rows / page_size)
 
-    data = [
-        {
-            "parish": parish.parish,
-            "pm2_5": parish.pm2_5,
-            "district": parish.district,
-            "timestamp": parish.timestamp,
-            "geometry": json.loads(parish.geometry),
-        }
-        for parish in parishes
-    ]
-
-    return data, total_pages
+    return parish_records(parishes), total_pages
 
 
 def get_predictions_by_geo_coordinates_v2(latitude: float, longitude: float) -> dict:
+    indexes = spatial_indexes.get()
+    if indexes is not None:
+        parish = indexes.parishes.find([latitude], [longitude])[0]
+        if parish is None:
+            return {}
+        return {
+            "parish": parish["parish"],
+            "district": parish["district"],
+            "pm2_5": parish["pm2_5"],
+            "timestamp": parish["timestamp"],
+        }
+
     from app import postgres_db, Predictions
 
     point = func.ST_MakePoint(longitude, latitude)
@@ -236,65 +358,128 @@ def get_forecasts(
         db[db_name].find(query, {"_id": 0}).sort([("$natural", -1)]).limit(1)
     )
 
-    results = []
     if site_forecasts:
-        for time, pm2_5 in zip(
-            site_forecasts[0]["timestamp"],
-            site_forecasts[0]["pm2_5"],
-            # site_forecasts[0]["margin_of_error"],
-            # site_forecasts[0]["adjusted_forecast"],
-        ):
-            result = {
-                key: value
-                for key, value in zip(
-                    ["time", "pm2_5"],
-                    [time, pm2_5],
-                )
-            }
-            results.append(result)
+        return format_forecasts(site_forecasts[0])
+    return {"forecasts": []}
 
-    formatted_results = {"forecasts": results}
-    return formatted_results
 
+def encode_predictions_cursor(value: dict) -> str:
+    # Documents without created_at are sorted first, and ordered by _id only
+    created_at = value.get("created_at")
+    cursor = {
+        "created_at": created_at.isoformat() if created_at else None,
+        "id": str(value["_id"]),
+        "index": value["value_index"],
+    }
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode("utf-8")).decode("ascii")
 
-@cache.memoize(timeout=Config.CACHE_TIMEOUT)
-def read_predictions_from_db(airqloud=None, page_number=1, limit=1000):
-    collection = db.gp_model_predictions
 
-    pipeline = []
+def decode_predictions_cursor(cursor: str) -> dict:
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        created_at = value["created_at"]
+        return {
+            "created_at": datetime.fromisoformat(created_at) if created_at else None,
+            "_id": ObjectId(value["id"]),
+            "value_index": int(value["index"]),
+        }
+    except Exception:
+        raise ValueError("Invalid cursor")
 
+
+def predictions_pipeline(airqloud=None, page_number=1, limit=1000, cursor=None):
+    """
+    Streams the prediction values of a page, in (created_at, _id) order.
+    Pages after a cursor are read from the cursor position using the
+    (airqloud, created_at, _id) index, other pages skip the preceding values.
+    """
+    match = {}
     if airqloud:
-        pipeline.append({"$match": {"airqloud": airqloud}})
+        match["airqloud"] = airqloud
+
+    position = decode_predictions_cursor(cursor) if cursor else None
+    if position:
+        after_created_at = (
+            {"created_at": {"$ne": None}}
+            if position["created_at"] is None
+            else {"created_at": {"$gt": position["created_at"]}}
+        )
+        match["$or"] = [
+            after_created_at,
+            {"created_at": position["created_at"], "_id": {"$gte": position["_id"]}},
+        ]
 
-    pipeline.extend(
-        [
-            {"$unwind": "$values"},
-            {
-                "$group": {
-                    "_id": None,
-                    "total": {"$sum": 1},
-                    "values": {"$push": "$values"},
-                }
-            },
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"created_at": 1, "_id": 1}},
+        {"$unwind": {"path": "$values", "includeArrayIndex": "value_index"}},
+    ]
+
+    if position:
+        pipeline.append(
             {
-                "$project": {
-                    "total": 1,
-                    "values": {"$slice": ["$values", (page_number - 1) * limit, limit]},
+                "$match": {
+                    "$or": [
+                        {"_id": {"$ne": position["_id"]}},
+                        {"value_index": {"$gt": position["value_index"]}},
+                    ]
                 }
-            },
+            }
+        )
+    elif page_number > 1:
+        pipeline.append({"$skip": (page_number - 1) * limit})
+
+    pipeline.extend(
+        [
+            {"$limit": limit + 1},
+            {"$project": {"created_at": 1, "value_index": 1, "values": 1}},
         ]
     )
+    return pipeline
+
 
-    result = collection.aggregate(pipeline)
+@cache.memoize(timeout=Config.CACHE_TIMEOUT)
+def read_predictions_from_db(airqloud=None, page_number=1, limit=1000, cursor=None):
+    """
+    Returns a page of prediction values, the total number of values and the cursor
+    of the next page, None on the last page.
+    Raises ValueError for an invalid cursor.
+    """
+    collection = db.gp_model_predictions
+
+    documents = list(
+        collection.aggregate(
+            predictions_pipeline(
+                airqloud=airqloud, page_number=page_number, limit=limit, cursor=cursor
+            )
+        )
+    )
+    next_cursor = (
+        encode_predictions_cursor(documents[limit - 1])
+        if len(documents) > limit
+        else None
+    )
+    values = [document["values"] for document in documents[:limit]]
+
+    match = {"airqloud": airqloud} if airqloud else {}
+    totals = list(
+        collection.aggregate(
+            [
+                {"$match": match},
+                {"$group": {"_id": None, "total": {"$sum": {"$size": "$values"}}}},
+            ]
+        )
+    )
+    total = totals[0]["total"] if totals else 0
 
-    total = 0
-    values = []
+    return values, total, next_cursor
 
-    for document in result:
-        total = document["total"]
-        values = document.get("values", [])
 
-    return values, total
+def create_predictions_indexes():
+    """Indexes backing the keyset pagination of read_predictions_from_db."""
+    collection = db.gp_model_predictions
+    collection.create_index([("airqloud", 1), ("created_at", 1), ("_id", 1)])
+    collection.create_index([("created_at", 1), ("_id", 1)])
 
 
 @cache.memoize(timeout=Config.CACHE_TIMEOUT)
@@ -341,18 +526,29 @@ def read_faulty_devices(query):
 def add_forecast_health_tips(result: dict, language: str = ""):
     health_tips = get_health_tips(language=language)
     if health_tips:
+        health_tips_index = HealthTipsIndex(health_tips)
         for i in result["forecasts"]:
-            pm2_5 = i["pm2_5"]
-            i["health_tips"] = list(
-                filter(
-                    lambda x: x["aqi_category"]["max"]
-                    >= pm2_5
-                    >= x["aqi_category"]["min"],
-                    health_tips,
-                )
-            )
+            i["health_tips"] = health_tips_index.get_tips(i["pm2_5"])
     else:
         print("Error: could not get health tips from external API")
         return result
 
     return result
+
+
+def materialize_latest_forecasts(frequency: str, store: ForecastStore) -> int:
+    """
+    Materializes the forecasts of a frequency with the health tips of each
+    FORECAST_CACHE_LANGUAGES language.
+    """
+    health_tips = {}
+    for language in Config.FORECAST_CACHE_LANGUAGES:
+        tips = get_health_tips(language=language)
+        if tips:
+            health_tips[language] = tips
+        else:
+            print(f"Skipping language '{language}', no health tips available")
+
+    return materialize_forecasts(
+        frequency=frequency, db=db, store=store, health_tips=health_tips
+    )
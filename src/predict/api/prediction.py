@@ -2,17 +2,16 @@ import logging
 import traceback
 
 from dotenv import load_dotenv
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response
 
 import routes
 from app import cache
 from config import Config
+from forecast_cache import FORECAST_COLLECTIONS, ForecastStore
 from helpers import (
     get_parish_predictions,
     convert_to_geojson,
     get_forecasts,
-    hourly_forecasts_cache_key,
-    daily_forecasts_cache_key,
     get_predictions_by_geo_coordinates_v2,
     get_predictions_by_geo_coordinates,
     get_health_tips,
@@ -23,6 +22,8 @@ from helpers import (
     validate_param_values,
     get_faults_cache_key,
     add_forecast_health_tips,
+    materialize_latest_forecasts,
+    token_required,
 )
 
 load_dotenv()
@@ -30,6 +31,7 @@ load_dotenv()
 _logger = logging.getLogger(__name__)
 
 ml_app = Blueprint("ml_app", __name__)
+forecast_store = ForecastStore()
 
 
 @ml_app.route(routes.route["fetch_faulty_devices"], methods=["GET"])
@@ -74,7 +76,6 @@ def fetch_faulty_devices():
 
 
 @ml_app.route(routes.route["next_24hr_forecasts"], methods=["GET"])
-@cache.cached(timeout=Config.CACHE_TIMEOUT, key_prefix=hourly_forecasts_cache_key)
 def get_next_24hr_forecasts():
     """
     Get forecasts for the next 24 hours from specified start time.
@@ -102,6 +103,10 @@ def get_next_24hr_forecasts():
             400,
         )
     language = request.args.get("language", default="", type=str)
+    materialized_forecasts = forecast_store.get("hourly", language=language, **params)
+    if materialized_forecasts:
+        return Response(materialized_forecasts, mimetype="application/json"), 200
+
     result = get_forecasts(**params, db_name="hourly_forecasts_1")
     if result:
         try:
@@ -119,7 +124,6 @@ def get_next_24hr_forecasts():
 
 
 @ml_app.route(routes.route["next_1_week_forecasts"], methods=["GET"])
-@cache.cached(timeout=Config.CACHE_TIMEOUT, key_prefix=daily_forecasts_cache_key)
 def get_next_1_week_forecasts():
     """
     Get forecasts for the next 1 week from specified start day.
@@ -148,6 +152,10 @@ def get_next_1_week_forecasts():
             400,
         )
     language = request.args.get("language", default="", type=str)
+    materialized_forecasts = forecast_store.get("daily", language=language, **params)
+    if materialized_forecasts:
+        return Response(materialized_forecasts, mimetype="application/json"), 200
+
     result = get_forecasts(**params, db_name="daily_forecasts_1")
     if result:
         try:
@@ -165,28 +173,74 @@ def get_next_1_week_forecasts():
     return data, 200
 
 
+@ml_app.route(routes.route["materialize_forecasts"], methods=["PUT"])
+@token_required
+def refresh_materialized_forecasts():
+    """
+    Materializes the latest forecasts of a frequency. Requested by the forecast
+    job after it saves its forecasts.
+    """
+    frequency = request.args.get("frequency", default=None, type=str)
+    if frequency not in FORECAST_COLLECTIONS:
+        return (
+            jsonify(
+                {
+                    "message": "Please specify an hourly or daily frequency",
+                    "success": False,
+                }
+            ),
+            400,
+        )
+    try:
+        count = materialize_latest_forecasts(frequency=frequency, store=forecast_store)
+    except Exception as ex:
+        print(ex)
+        traceback.print_exc()
+        return (
+            jsonify({"message": "Could not materialize forecasts", "success": False}),
+            500,
+        )
+    return (
+        jsonify(
+            {
+                "message": f"Materialized {count} {frequency} forecasts",
+                "success": True,
+            }
+        ),
+        200,
+    )
+
+
 @ml_app.route(routes.route["predict_for_heatmap"], methods=["GET"])
 @cache.cached(timeout=Config.CACHE_TIMEOUT, key_prefix=heatmap_cache_key)
 def predictions_for_heatmap():
     airqloud = request.args.get("airqloud")
     page = int(request.args.get("page", 1))
     limit = int(request.args.get("limit", 1000))
+    cursor = request.args.get("cursor")
 
     response = {}
 
     try:
-        values, total = read_predictions_from_db(airqloud, page, limit)
+        values, total, next_cursor = read_predictions_from_db(
+            airqloud, page, limit, cursor
+        )
         if values:
             response["predictions"] = convert_to_geojson(values)
             response["total"] = total
             response["pages"] = (total // limit) + (1 if total % limit else 0)
             response["page"] = page
+            if next_cursor:
+                response["next"] = next_cursor
             if airqloud:
                 response["airqloud"] = airqloud
             status_code = 200
         else:
             response["error"] = "No data found."
             status_code = 404
+    except ValueError as e:
+        response["error"] = str(e)
+        status_code = 400
     except Exception as e:
         response["error"] = f"Unfortunately an error occured"
         status_code = 500
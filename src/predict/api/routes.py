@@ -7,4 +7,5 @@ route = {
     "predict_for_heatmap": f"{base_url}/predict/heatmap",
     "parish_predictions": f"{base_url}/predict/parishes",
     "fetch_faulty_devices": f"{base_url}/predict/faulty-devices",
+    "materialize_forecasts": f"{base_url}/predict/forecasts/materialize",
 }
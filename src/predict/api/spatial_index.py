@@ -0,0 +1,241 @@
+import threading
+import time
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+# Mean earth radius used by BigQuery's ST_DISTANCE
+EARTH_RADIUS_IN_METRES = 6371008.8
+METRES_PER_DEGREE = 2 * np.pi * EARTH_RADIUS_IN_METRES / 360
+
+
+def haversine_distance(latitudes_1, longitudes_1, latitudes_2, longitudes_2):
+    latitudes_1, longitudes_1 = np.radians(latitudes_1), np.radians(longitudes_1)
+    latitudes_2, longitudes_2 = np.radians(latitudes_2), np.radians(longitudes_2)
+    a = (
+        np.sin((latitudes_2 - latitudes_1) / 2) ** 2
+        + np.cos(latitudes_1)
+        * np.cos(latitudes_2)
+        * np.sin((longitudes_2 - longitudes_1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_IN_METRES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def first_matches(inputs_index, matches_index, ranks) -> dict:
+    """The best ranked match of each input, given the (input, match) pairs of a query."""
+    order = np.lexsort((ranks, inputs_index))
+    inputs_index, matches_index = inputs_index[order], matches_index[order]
+    first = np.ones(len(inputs_index), dtype=bool)
+    first[1:] = inputs_index[1:] != inputs_index[:-1]
+    return dict(zip(inputs_index[first].tolist(), matches_index[first].tolist()))
+
+
+class TrigramIndex:
+    """
+    Case insensitive substring search over names, the equivalent of
+    ilike '%text%'. Candidates sharing every trigram of the text are
+    verified with a substring test.
+    """
+
+    def __init__(self, names: list):
+        self.names = [(name or "").lower() for name in names]
+        postings = {}
+        for row, name in enumerate(self.names):
+            for trigram in self.trigrams(name):
+                postings.setdefault(trigram, []).append(row)
+        self.postings = {
+            trigram: np.array(rows, dtype=np.int64)
+            for trigram, rows in postings.items()
+        }
+
+    @staticmethod
+    def trigrams(text: str) -> set:
+        return {text[i : i + 3] for i in range(len(text) - 2)}
+
+    def search(self, text: str) -> np.ndarray:
+        """Rows whose name contains text, in row order."""
+        text = text.lower()
+        trigrams = self.trigrams(text)
+        if trigrams:
+            if not trigrams.issubset(self.postings):
+                return np.array([], dtype=np.int64)
+            postings = sorted((self.postings[trigram] for trigram in trigrams), key=len)
+            candidates = postings[0]
+            for rows in postings[1:]:
+                candidates = np.intersect1d(candidates, rows, assume_unique=True)
+        else:
+            candidates = np.arange(len(self.names))
+
+        return np.array(
+            [row for row in candidates if text in self.names[row]], dtype=np.int64
+        )
+
+
+class ParishIndex:
+    """
+    Parish predictions indexed by their polygons and names.
+
+    :param records: dicts with parish, district, pm2_5, timestamp and a GeoJSON geometry
+    """
+
+    def __init__(self, records: list):
+        self.records = records
+        self.geometries = np.array(
+            [shape(record["geometry"]) for record in records], dtype=object
+        )
+        self.tree = shapely.STRtree(self.geometries)
+        self.parishes = TrigramIndex([record["parish"] for record in records])
+        self.districts = TrigramIndex([record["district"] for record in records])
+
+    def find(self, latitudes, longitudes) -> list:
+        """The parish prediction containing each point, None for points outside every parish."""
+        points = shapely.points(np.asarray(longitudes), np.asarray(latitudes))
+        points_index, parishes_index = self.tree.query(points, predicate="within")
+        matches = first_matches(points_index, parishes_index, ranks=parishes_index)
+        return [
+            self.records[matches[point]] if point in matches else None
+            for point in range(len(points))
+        ]
+
+    def search(self, parish: str, district: str, page_size: int, offset: int):
+        """A page of the parish predictions matching the parish and district names."""
+        rows = np.arange(len(self.records))
+        if parish:
+            rows = self.parishes.search(parish)
+        if district:
+            rows = np.intersect1d(rows, self.districts.search(district))
+
+        total_pages = int(np.ceil(len(rows) / page_size))
+        page = [self.records[row] for row in rows[offset : offset + page_size]]
+        return page, total_pages
+
+
+class PointPredictionIndex:
+    """
+    Point predictions indexed by location.
+
+    :param records: dicts with latitude, longitude, pm2_5, pm2_5_confidence_interval and timestamp
+    """
+
+    def __init__(self, records: list):
+        self.records = records
+        self.latitudes = np.array([record["latitude"] for record in records], float)
+        self.longitudes = np.array([record["longitude"] for record in records], float)
+        self.intervals = np.array(
+            [record["pm2_5_confidence_interval"] for record in records], float
+        )
+        self.tree = shapely.STRtree(shapely.points(self.longitudes, self.latitudes))
+
+    def find(self, latitudes, longitudes, distance_in_metres: float) -> list:
+        """
+        The prediction with the smallest confidence interval within the distance of
+        each point, None for points without predictions in range.
+        """
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+
+        # Bounding boxes of the search circles select the candidates
+        latitude_delta = distance_in_metres / METRES_PER_DEGREE
+        longitude_delta = np.minimum(
+            latitude_delta / np.maximum(np.cos(np.radians(latitudes)), 1e-6), 180
+        )
+        boxes = shapely.box(
+            longitudes - longitude_delta,
+            latitudes - latitude_delta,
+            longitudes + longitude_delta,
+            latitudes + latitude_delta,
+        )
+        points_index, predictions_index = self.tree.query(boxes, predicate="intersects")
+
+        distances = haversine_distance(
+            latitudes[points_index],
+            longitudes[points_index],
+            self.latitudes[predictions_index],
+            self.longitudes[predictions_index],
+        )
+        in_range = distances <= distance_in_metres
+
+        matches = first_matches(
+            points_index[in_range],
+            predictions_index[in_range],
+            ranks=self.intervals[predictions_index[in_range]],
+        )
+        return [
+            self.records[matches[point]] if point in matches else None
+            for point in range(len(latitudes))
+        ]
+
+
+class SpatialIndexes:
+    """The parish and point prediction indexes, points is None when not indexed."""
+
+    def __init__(self, parishes: ParishIndex, points: PointPredictionIndex = None):
+        self.parishes = parishes
+        self.points = points
+
+
+class SpatialIndexCache:
+    """
+    Holds the current spatial indexes of the process. The source version is checked
+    at most once per refresh interval, and indexes are rebuilt only when it changed.
+    A rebuilt set of indexes replaces the current one in a single assignment, so
+    queries always see a complete set.
+
+    Indexes are built on a background thread, started when the worker starts and
+    when the refresh interval has passed, so requests never wait for a build.
+    Until the first build completes there are no indexes and queries are answered
+    by the databases.
+
+    :param version_loader: returns a value that changes when new predictions land
+    :param indexes_loader: builds SpatialIndexes from the latest predictions
+    """
+
+    def __init__(self, version_loader, indexes_loader, refresh_interval: float):
+        self.version_loader = version_loader
+        self.indexes_loader = indexes_loader
+        self.refresh_interval = refresh_interval
+        self.indexes = None
+        self.version = None
+        self.checked_at = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """The current indexes, None until they are first built."""
+        if self.is_stale(time.monotonic()):
+            self.start()
+        return self.indexes
+
+    def is_stale(self, now: float) -> bool:
+        return self.checked_at is None or now - self.checked_at >= self.refresh_interval
+
+    def start(self) -> threading.Thread:
+        """
+        Refreshes the indexes on a background thread. Only one refresh runs at a
+        time, the running refresh thread is returned while it is busy.
+        """
+        if self.lock.acquire(blocking=False):
+            self.thread = threading.Thread(target=self.refresh_in_thread, daemon=True)
+            self.thread.start()
+        return self.thread
+
+    def refresh_in_thread(self):
+        try:
+            self.refresh(time.monotonic())
+        finally:
+            self.lock.release()
+
+    def refresh(self, now: float):
+        if not self.is_stale(now):
+            return
+        try:
+            version = self.version_loader()
+            if self.indexes is None or version != self.version:
+                self.indexes = self.indexes_loader()
+                self.version = version
+        except Exception as ex:
+            # Left unchecked, so the next request tries again
+            print("Error refreshing spatial indexes", ex)
+            return
+        self.checked_at = now
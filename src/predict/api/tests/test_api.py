@@ -1,14 +1,30 @@
+from datetime import datetime, timedelta
 from unittest.mock import patch
 
+import fakeredis
+import pandas as pd
 import pytest
 import requests
 from flask import json
 from mongomock import MongoClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import StaticPool
 
-from app import create_app
+from app import application, create_app, postgres_db
+import routes
 from config import Config
+from forecast_cache import ForecastStore
+from spatial_index import SpatialIndexCache
 from tests.conftest import monkeypatch
-from helpers import read_predictions_from_db, add_forecast_health_tips, get_health_tips
+from helpers import (
+    read_predictions_from_db,
+    add_forecast_health_tips,
+    get_health_tips,
+    load_prediction_points,
+    load_spatial_indexes,
+    load_spatial_indexes_version,
+    get_predictions_by_geo_coordinates,
+)
 from prediction import validate_param_values
 
 valid_params = [
@@ -36,167 +52,233 @@ def invalid_param(request):
     return request.param
 
 
+def read_predictions_by_slicing(collection, airqloud=None, page_number=1, limit=1000):
+    """The unwind, group and slice pipeline read_predictions_from_db replaced."""
+    pipeline = [{"$match": {"airqloud": airqloud}}] if airqloud else []
+    pipeline.extend(
+        [
+            {"$unwind": "$values"},
+            {
+                "$group": {
+                    "_id": None,
+                    "total": {"$sum": 1},
+                    "values": {"$push": "$values"},
+                }
+            },
+            {
+                "$project": {
+                    "total": 1,
+                    "values": {"$slice": ["$values", (page_number - 1) * limit, limit]},
+                }
+            },
+        ]
+    )
+    total, values = 0, []
+    for document in collection.aggregate(pipeline):
+        total = document["total"]
+        values = document.get("values", [])
+    return values, total
+
+
 @pytest.fixture
-def mock_collection(mocker):
-    collection = mocker.Mock()
-    mocker.patch("db.gp_predictions", collection)
-    return collection
-
-
-# test the read_predictions_from_db function with different parameters and expected results
-@pytest.mark.parametrize(
-    "airqloud, page_number, limit, pipeline, result, expected_values, expected_total",
-    [
-        # test case 1: airqloud is None, page_number is 1, limit is 1000
-        (
-            None,
-            1,
-            1000,
-            [
-                {"$unwind": "$values"},
-                {
-                    "$group": {
-                        "_id": None,
-                        "total": {"$sum": 1},
-                        "values": {"$push": "$values"},
-                    }
-                },
-                {
-                    "$project": {
-                        "total": 1,
-                        "values": {"$slice": ["$values", 0, 1000]},
-                    }
-                },
-            ],
-            [{"total": 2000, "values": list(range(1000))}],
-            list(range(1000)),
-            2000,
-        ),
-        # test case 2: airqloud is "foo", page_number is 2, limit is 500
-        (
-            "foo",
-            2,
-            500,
-            [
-                {"$match": {"airqloud": "foo"}},
-                {"$unwind": "$values"},
-                {
-                    "$group": {
-                        "_id": None,
-                        "total": {"$sum": 1},
-                        "values": {"$push": "$values"},
-                    }
-                },
-                {
-                    "$project": {
-                        "total": 1,
-                        "values": {"$slice": ["$values", 500, 500]},
-                    }
-                },
-            ],
-            [{"total": 1500, "values": list(range(500, 1000))}],
-            list(range(500, 1000)),
-            1500,
-        ),
-        # test case 3: airqloud is "bar", page_number is 3, limit is 100
-        (
-            "bar",
-            3,
-            100,
-            [
-                {"$match": {"airqloud": "bar"}},
-                {"$unwind": "$values"},
-                {
-                    "$group": {
-                        "_id": None,
-                        "total": {"$sum": 1},
-                        "values": {"$push": "$values"},
-                    }
-                },
-                {
-                    "$project": {
-                        "total": 1,
-                        "values": {"$slice": ["$values", 200, 100]},
-                    }
-                },
-            ],
-            [{"total": 500, "values": list(range(200, 300))}],
-            list(range(200, 300)),
-            500,
-        ),
-        # test case 4: airqloud is "baz", page_number is 4, limit is 10
-        (
-            "baz",
-            4,
-            10,
-            [
-                {"$match": {"airqloud": "baz"}},
-                {"$unwind": "$values"},
-                {
-                    "$group": {
-                        "_id": None,
-                        "total": {"$sum": 1},
-                        "values": {"$push": "$values"},
-                    }
-                },
-                {
-                    "$project": {
-                        "total": 1,
-                        "values": {"$slice": ["$values", 30, 10]},
-                    }
-                },
-            ],
-            [{"total": 100, "values": list(range(30, 40))}],
-            list(range(30, 40)),
-            100,
-        ),
-        # test case 5: airqloud is None, page_number is -1, limit is -1
-        (
-            None,
-            -1,
-            -1,
-            [
-                {"$unwind": "$values"},
-                {
-                    "$group": {
-                        "_id": None,
-                        "total": {"$sum": 1},
-                        "values": {"$push": "$values"},
-                    }
-                },
+def predictions_db(monkeypatch):
+    mock_db = MongoClient().db
+    created_at = datetime(2023, 8, 1)
+    for airqloud, documents in [("foo", 3), ("bar", 2)]:
+        for i in range(documents):
+            mock_db.gp_model_predictions.insert_one(
                 {
-                    "$project": {
-                        "total": 1,
-                        # this will return an empty array
-                        "values": {"$slice": ["$values", -2, -1]},
-                    }
-                },
-            ],
-            [{"total": -2, "values": []}],
-            [],
-            -2,
-        ),
-    ],
-)
-@pytest.mark.xfail
-def test_read_predictions_from_db(
-    mock_collection,
-    airqloud,
-    page_number,
-    limit,
-    pipeline,
-    result,
-    expected_values,
-    expected_total,
+                    "airqloud": airqloud,
+                    "created_at": created_at + timedelta(hours=i % 2),
+                    "values": [
+                        {
+                            "latitude": i,
+                            "longitude": j,
+                            "predicted_value": float(i * 100 + j),
+                            "variance": 1.0,
+                            "interval": 1.96,
+                        }
+                        for j in range(7 * (i + 1))
+                    ],
+                }
+            )
+    monkeypatch.setattr("helpers.db", mock_db)
+    return mock_db
+
+
+def sort_values(values):
+    return sorted(values, key=lambda x: (x["latitude"], x["longitude"]))
+
+
+@pytest.mark.parametrize("airqloud", [None, "foo", "bar", "baz"])
+@pytest.mark.parametrize("limit", [1, 5, 1000])
+def test_read_predictions_from_db_pages(predictions_db, airqloud, limit):
+    read_predictions = read_predictions_from_db.uncached
+    expected_values, expected_total = read_predictions_by_slicing(
+        predictions_db.gp_model_predictions, airqloud, 1, 10000
+    )
+
+    page_values, cursor_values = [], []
+    cursor = None
+    for page_number in range(1, expected_total // limit + 2):
+        values, total, _ = read_predictions(airqloud, page_number, limit)
+        assert total == expected_total
+        page_values.extend(values)
+
+        values, total, cursor = read_predictions(airqloud, 1, limit, cursor)
+        assert total == expected_total
+        cursor_values.extend(values)
+        if cursor is None:
+            break
+
+    assert cursor is None
+    assert sort_values(page_values) == sort_values(expected_values)
+    assert cursor_values == page_values
+
+
+def test_read_predictions_from_db_matches_sliced_pages(predictions_db):
+    # Documents inserted in (created_at, _id) order are paged in the same order
+    collection = predictions_db.gp_model_predictions
+    collection.delete_many({"airqloud": "bar"})
+    collection.delete_many({"airqloud": "foo", "values": {"$size": 14}})
+
+    for page_number in range(1, 5):
+        values, total, _ = read_predictions_from_db.uncached("foo", page_number, 5)
+        assert (values, total) == read_predictions_by_slicing(
+            collection, "foo", page_number, 5
+        )
+
+
+def test_read_predictions_from_db_without_created_at(predictions_db):
+    collection = predictions_db.gp_model_predictions
+    collection.update_many({"airqloud": "bar"}, {"$unset": {"created_at": ""}})
+    expected_values, _ = read_predictions_by_slicing(collection, None, 1, 10000)
+
+    cursor_values, cursor = [], None
+    while True:
+        values, _, cursor = read_predictions_from_db.uncached(None, 1, 5, cursor)
+        cursor_values.extend(values)
+        if cursor is None:
+            break
+
+    assert sort_values(cursor_values) == sort_values(expected_values)
+
+
+def test_read_predictions_from_db_invalid_cursor(predictions_db):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        read_predictions_from_db.uncached("foo", 1, 10, "not-a-cursor")
+
+
+def test_load_prediction_points(predictions_db, monkeypatch):
+    monkeypatch.setattr(Config, "SPATIAL_INDEX_BATCH_SIZE", 2)
+    points = load_prediction_points()
+
+    assert len(points) == 7 * (1 + 2 + 3) + 7 * (1 + 2)
+    assert set(points[0]) == {
+        "latitude",
+        "longitude",
+        "pm2_5",
+        "pm2_5_confidence_interval",
+        "timestamp",
+    }
+
+    monkeypatch.setattr(Config, "SPATIAL_INDEX_MAX_POINTS", len(points) - 1)
+    assert load_prediction_points() is None
+
+
+@pytest.fixture
+def parishes_db(monkeypatch):
+    # SQLite stands in for PostGIS, geometries are stored as GeoJSON. The one
+    # in-memory database is shared with the spatial index refresh thread
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+
+    @event.listens_for(engine, "connect")
+    def add_geojson_functions(connection, _):
+        connection.create_function("ST_AsGeoJSON", 1, lambda geometry: geometry)
+        connection.create_function("AsGeoJSON", 1, lambda geometry: geometry)
+
+    polygon = {
+        "type": "Polygon",
+        "coordinates": [[[32.5, 0.3], [32.6, 0.3], [32.6, 0.4], [32.5, 0.3]]],
+    }
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE predictions (id INTEGER PRIMARY KEY, parish TEXT, "
+            "district TEXT, pm2_5 FLOAT, geometry TEXT, timestamp DATETIME)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO predictions (parish, district, pm2_5, geometry, timestamp) "
+            "VALUES ('Kawempe', 'Kampala', 30.0, ?, '2023-08-01 10:00:00')",
+            (json.dumps(polygon),),
+        )
+    monkeypatch.setitem(postgres_db._app_engines, application, {None: engine})
+    return engine
+
+
+def test_spatial_index_cache_builds_from_loaders(predictions_db, parishes_db):
+    # Loaders run on the refresh thread, outside of any application context
+    cache = SpatialIndexCache(
+        load_spatial_indexes_version, load_spatial_indexes, refresh_interval=60
+    )
+    cache.start().join()
+
+    assert cache.checked_at is not None
+    assert cache.version[0] == (datetime(2023, 8, 1, 10), 1)
+    assert [parish["parish"] for parish in cache.indexes.parishes.records] == [
+        "Kawempe"
+    ]
+    assert len(cache.indexes.points.latitudes) == len(load_prediction_points())
+
+
+def test_spatial_index_cache_retries_failed_refresh(predictions_db, parishes_db):
+    with parishes_db.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE predictions")
+    cache = SpatialIndexCache(
+        load_spatial_indexes_version, load_spatial_indexes, refresh_interval=60
+    )
+    cache.start().join()
+
+    assert cache.indexes is None
+    assert cache.checked_at is None
+
+
+def test_geo_coordinates_index_matches_bigquery(
+    predictions_db, parishes_db, monkeypatch
 ):
-    mock_collection.aggregate.return_value = result
+    # BigQuery rows as saved by the gp-model job, the timestamp is created_at
+    document = predictions_db.gp_model_predictions.find_one(
+        {"airqloud": "foo", "values": {"$size": 21}}
+    )
+    value = document["values"][3]
+    rows = pd.DataFrame(
+        [
+            {
+                "pm2_5": value["predicted_value"],
+                "timestamp": pd.Timestamp(
+                    document["created_at"].strftime("%Y-%m-%dT%H:%M:%SZ")
+                ),
+                "pm2_5_confidence_interval": value["interval"],
+            }
+        ]
+    )
+    coordinates = (value["latitude"], value["longitude"], 100)
 
-    values, total = read_predictions_from_db(airqloud, page_number, limit)
+    indexes = load_spatial_indexes()
+    monkeypatch.setattr("helpers.spatial_indexes.get", lambda: indexes)
+    from_index = get_predictions_by_geo_coordinates.uncached(*coordinates)
 
-    mock_collection.aggregate.assert_called_once_with(pipeline)
+    monkeypatch.setattr("helpers.spatial_indexes.get", lambda: None)
+    with patch("helpers.bigquery.Client") as client:
+        client.return_value.query.return_value.result.return_value.to_dataframe.return_value = (
+            rows
+        )
+        from_bigquery = get_predictions_by_geo_coordinates.uncached(*coordinates)
 
-    assert values == expected_values
-    assert total == expected_total
+    assert from_index == from_bigquery
 
 
 def test_validate_param_values_with_valid_params(valid_param):
@@ -246,6 +328,46 @@ def test_client():
     ctx.pop()
 
 
+def test_materialize_forecasts_requires_the_api_token(test_client):
+    url = routes.route["materialize_forecasts"]
+
+    assert test_client.put(f"{url}?frequency=hourly").status_code == 401
+    assert test_client.put(f"{url}?frequency=hourly&token=wrong").status_code == 401
+
+
+def test_forecasts_are_served_as_soon_as_they_are_materialized(
+    test_client, monkeypatch
+):
+    mock_db = MongoClient().db
+    store = ForecastStore(client=fakeredis.FakeRedis())
+    monkeypatch.setattr("helpers.db", mock_db)
+    monkeypatch.setattr("prediction.forecast_store", store)
+    monkeypatch.setattr(Config, "FORECAST_CACHE_LANGUAGES", [""])
+    monkeypatch.setattr(
+        "helpers.get_health_tips",
+        lambda language="": [{"_id": "good", "aqi_category": {"min": 0, "max": 500}}],
+    )
+    materialize_url = (
+        f"{routes.route['materialize_forecasts']}?frequency=hourly"
+        f"&token={Config.AIRQO_API_AUTH_TOKEN}"
+    )
+    forecasts_url = f"{routes.route['next_24hr_forecasts']}?site_id=site_1"
+
+    for pm2_5 in [10.0, 20.0]:
+        mock_db.hourly_forecasts_1.insert_one(
+            {
+                "site_id": "site_1",
+                "pm2_5": [pm2_5],
+                "timestamp": [datetime(2023, 8, 1)],
+            }
+        )
+        assert test_client.put(materialize_url).status_code == 200
+
+        response = test_client.get(forecasts_url)
+        assert response.status_code == 200
+        assert response.get_json()["forecasts"][0]["pm2_5"] == pm2_5
+
+
 @pytest.mark.xfail
 def test_fetch_faulty_devices(test_client):
     with patch("prediction.mongo", test_client.application.config["DB_NAME"]):
@@ -0,0 +1,133 @@
+import random
+from datetime import datetime, timedelta
+
+import fakeredis
+import pytest
+from mongomock import MongoClient
+
+from forecast_cache import (
+    ForecastStore,
+    HealthTipsIndex,
+    format_forecasts,
+    materialize_forecasts,
+    to_json,
+)
+
+health_tips = [
+    {"_id": "good", "aqi_category": {"min": 0, "max": 12.09}},
+    {"_id": "moderate", "aqi_category": {"min": 12.1, "max": 35.49}},
+    {"_id": "sensitive", "aqi_category": {"min": 35.5, "max": 55.49}},
+    {"_id": "everyone", "aqi_category": {"min": 12.1, "max": 500}},
+    {"_id": "unhealthy", "aqi_category": {"min": 55.5, "max": 150.49}},
+]
+
+
+def linear_tips(pm2_5, tips):
+    return [
+        tip
+        for tip in tips
+        if tip["aqi_category"]["max"] >= pm2_5 >= tip["aqi_category"]["min"]
+    ]
+
+
+def forecast_document(site_id, start, values):
+    return {
+        "device_id": f"device_{site_id}",
+        "site_id": site_id,
+        "pm2_5": values,
+        "timestamp": [start + timedelta(hours=i) for i in range(len(values))],
+    }
+
+
+@pytest.fixture
+def db():
+    return MongoClient().db
+
+
+@pytest.fixture
+def store():
+    return ForecastStore(client=fakeredis.FakeRedis())
+
+
+def test_health_tips_index_matches_linear_scan():
+    index = HealthTipsIndex(health_tips)
+    bounds = [bound for tip in health_tips for bound in tip["aqi_category"].values()]
+    values = bounds + [-1, 12.095, 600] + [random.uniform(0, 550) for _ in range(500)]
+
+    for value in values:
+        assert index.get_tips(value) == linear_tips(value, health_tips)
+
+
+def test_health_tips_index_without_tips():
+    assert HealthTipsIndex([]).get_tips(10) == []
+    assert HealthTipsIndex(health_tips).get_tips(None) == []
+
+
+def test_materialized_forecasts_match_database_reads(db, store):
+    start = datetime(2023, 8, 1)
+    db.hourly_forecasts_1.insert_many(
+        [
+            forecast_document("site_1", start, [10.0, 20.0]),
+            forecast_document("site_2", start, [40.0, 60.5]),
+            forecast_document("site_1", start, [12.1, 35.5]),
+        ]
+    )
+
+    assert (
+        materialize_forecasts(
+            "hourly", db=db, store=store, health_tips={"": health_tips}
+        )
+        == 3
+    )
+
+    expected = format_forecasts(forecast_document("site_1", start, [12.1, 35.5]))
+    for forecast in expected["forecasts"]:
+        forecast["health_tips"] = linear_tips(forecast["pm2_5"], health_tips)
+
+    assert store.get("hourly", site_id="site_1") == to_json(expected)
+    assert store.get("hourly", device_id="device_site_1") == to_json(expected)
+    assert '"pm2_5":60.5' in store.get("hourly", site_id="site_2")
+
+
+def test_unmaterialized_queries_fall_back_to_the_database(db, store):
+    db.daily_forecasts_1.insert_one(
+        forecast_document("site_1", datetime(2023, 8, 1), [10.0])
+    )
+    materialize_forecasts("daily", db=db, store=store, health_tips={"": health_tips})
+
+    assert store.get("daily", site_id="site_3") is None
+    assert store.get("daily", site_id="site_1", language="lg") is None
+    assert store.get("daily", site_id="site_1", device_id="device_site_1") is None
+    assert store.get("hourly", site_id="site_1") is None
+
+
+def test_materialization_replaces_previous_forecasts(db, store):
+    start = datetime(2023, 8, 1)
+    db.hourly_forecasts_1.insert_one(forecast_document("site_1", start, [10.0]))
+    materialize_forecasts("hourly", db=db, store=store, health_tips={"": health_tips})
+
+    db.hourly_forecasts_1.delete_many({})
+    db.hourly_forecasts_1.insert_one(forecast_document("site_2", start, [20.0]))
+    materialize_forecasts("hourly", db=db, store=store, health_tips={"": health_tips})
+
+    assert store.get("hourly", site_id="site_1") is None
+    assert store.get("hourly", site_id="site_2") is not None
+
+
+def test_unavailable_redis_falls_back_to_the_database():
+    server = fakeredis.FakeServer()
+    server.connected = False
+    store = ForecastStore(client=fakeredis.FakeRedis(server=server))
+
+    assert store.get("hourly", site_id="site_1") is None
+
+
+def test_materialized_forecasts_expire(db):
+    store = ForecastStore(client=fakeredis.FakeRedis(), timeout=60)
+    db.hourly_forecasts_1.insert_one(
+        forecast_document("site_1", datetime(2023, 8, 1), [10.0])
+    )
+    materialize_forecasts("hourly", db=db, store=store, health_tips={"": health_tips})
+
+    assert 0 < store.client.ttl(store.index_key("hourly")) <= 60
+    assert 0 < store.client.ttl(store.forecasts_key("hourly", "")) <= 60
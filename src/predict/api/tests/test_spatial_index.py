@@ -0,0 +1,203 @@
+import random
+import threading
+
+import numpy as np
+import pytest
+from shapely.geometry import Point, shape
+
+from spatial_index import (
+    ParishIndex,
+    PointPredictionIndex,
+    SpatialIndexCache,
+    TrigramIndex,
+    haversine_distance,
+)
+
+names = ["Kawempe", "Kamwokya", "Nakawa", "Bukoto", "Kisenyi", "Makindye", "Wandegeya"]
+
+
+@pytest.fixture(scope="module")
+def parishes():
+    # A 10 x 10 grid of square parishes around Kampala
+    records = []
+    for row in range(10):
+        for column in range(10):
+            longitude, latitude = 32.5 + column * 0.01, 0.3 + row * 0.01
+            records.append(
+                {
+                    "parish": f"{names[(row + column) % len(names)]} {row}",
+                    "district": names[column % len(names)],
+                    "pm2_5": float(row * 10 + column),
+                    "timestamp": None,
+                    "geometry": {
+                        "type": "Polygon",
+                        "coordinates": [
+                            [
+                                [longitude, latitude],
+                                [longitude + 0.01, latitude],
+                                [longitude + 0.01, latitude + 0.01],
+                                [longitude, latitude + 0.01],
+                                [longitude, latitude],
+                            ]
+                        ],
+                    },
+                }
+            )
+    return records
+
+
+@pytest.fixture(scope="module")
+def point_predictions():
+    random.seed(7)
+    return [
+        {
+            "latitude": random.uniform(0.2, 0.5),
+            "longitude": random.uniform(32.4, 32.7),
+            "pm2_5": random.uniform(5, 100),
+            "pm2_5_confidence_interval": random.uniform(1, 20),
+            "timestamp": "2023-08-01T10:00:00+00:00",
+        }
+        for _ in range(2000)
+    ]
+
+
+def test_parish_index_finds_containing_parish(parishes):
+    index = ParishIndex(parishes)
+    random.seed(1)
+    latitudes = [random.uniform(0.28, 0.42) for _ in range(500)]
+    longitudes = [random.uniform(32.48, 32.62) for _ in range(500)]
+
+    results = index.find(latitudes, longitudes)
+
+    for latitude, longitude, result in zip(latitudes, longitudes, results):
+        expected = [
+            parish
+            for parish in parishes
+            if Point(longitude, latitude).within(shape(parish["geometry"]))
+        ]
+        assert result == (expected[0] if expected else None)
+
+
+@pytest.mark.parametrize("distance_in_metres", [100, 1000, 5000])
+def test_point_prediction_index_matches_brute_force(
+    point_predictions, distance_in_metres
+):
+    index = PointPredictionIndex(point_predictions)
+    random.seed(2)
+    latitudes = np.array([random.uniform(0.2, 0.5) for _ in range(200)])
+    longitudes = np.array([random.uniform(32.4, 32.7) for _ in range(200)])
+
+    results = index.find(latitudes, longitudes, distance_in_metres)
+
+    for latitude, longitude, result in zip(latitudes, longitudes, results):
+        in_range = [
+            prediction
+            for prediction in point_predictions
+            if haversine_distance(
+                latitude, longitude, prediction["latitude"], prediction["longitude"]
+            )
+            <= distance_in_metres
+        ]
+        expected = min(
+            in_range,
+            key=lambda x: x["pm2_5_confidence_interval"],
+            default=None,
+        )
+        assert result == expected
+
+
+def test_haversine_distance():
+    # One degree of latitude on BigQuery's spherical earth
+    assert haversine_distance(0, 32, 1, 32) == pytest.approx(111195.08, abs=0.01)
+
+
+@pytest.mark.parametrize("text", ["kawa", "KA", "a", "", "wempe", "kisenyi 3", "xyz"])
+def test_trigram_index_matches_substring_search(text):
+    index = TrigramIndex(names)
+    expected = [row for row, name in enumerate(names) if text.lower() in name.lower()]
+    assert index.search(text).tolist() == expected
+
+
+@pytest.mark.parametrize(
+    "parish, district, page_size, offset",
+    [
+        (None, None, 10, 0),
+        ("kaw", None, 7, 7),
+        ("e 3", "nakawa", 2, 0),
+        ("zz", "", 5, 0),
+    ],
+)
+def test_parish_search_matches_filters(parishes, parish, district, page_size, offset):
+    index = ParishIndex(parishes)
+    expected = [
+        record
+        for record in parishes
+        if (not parish or parish.lower() in record["parish"].lower())
+        and (not district or district.lower() in record["district"].lower())
+    ]
+
+    page, total_pages = index.search(parish, district, page_size, offset)
+
+    assert page == expected[offset : offset + page_size]
+    assert total_pages == -(-len(expected) // page_size)
+
+
+def refreshed(cache: SpatialIndexCache):
+    cache.start().join()
+    return cache.indexes
+
+
+def test_spatial_index_cache_rebuilds_when_the_version_changes():
+    versions, builds = [1], []
+
+    def build():
+        builds.append(versions[0])
+        return f"indexes {versions[0]}"
+
+    cache = SpatialIndexCache(lambda: versions[0], build, refresh_interval=0)
+    assert refreshed(cache) == "indexes 1"
+    assert refreshed(cache) == "indexes 1"
+    assert builds == [1]
+
+    versions[0] = 2
+    assert refreshed(cache) == "indexes 2"
+    assert builds == [1, 2]
+
+
+def test_spatial_index_cache_keeps_indexes_when_a_refresh_fails():
+    versions = [1]
+
+    def build():
+        if versions[0] == 2:
+            raise Exception("database unavailable")
+        return "indexes"
+
+    cache = SpatialIndexCache(lambda: versions[0], build, refresh_interval=0)
+    assert refreshed(cache) == "indexes"
+    versions[0] = 2
+    assert refreshed(cache) == "indexes"
+
+    failing = SpatialIndexCache(lambda: 2, build, refresh_interval=60)
+    assert refreshed(failing) is None
+
+
+def test_spatial_index_cache_builds_in_the_background():
+    building, release = threading.Event(), threading.Event()
+    builds = []
+
+    def build():
+        building.set()
+        release.wait(5)
+        builds.append(1)
+        return "indexes"
+
+    cache = SpatialIndexCache(lambda: 1, build, refresh_interval=60)
+    assert cache.get() is None
+    assert building.wait(5)
+    # Requests made during the build neither wait nor start another build
+    assert cache.get() is None
+
+    release.set()
+    cache.thread.join()
+    assert cache.get() == "indexes"
+    assert builds == [1]
@@ -1,59 +1,36 @@
 import os
-import uuid
 from typing import Any
 
 import pandas as pd
 from airflow.models.xcom import BaseXCom
-from google.cloud import storage
-from pandas.errors import EmptyDataError, ParserError
+
+from xcom_storage import (
+    GCSObjectStore,
+    XComCache,
+    download_dataframe,
+    upload_dataframe,
+)
 
 
 class GCSXComBackend(BaseXCom):
     BUCKET_NAME = os.getenv("AIRFLOW_XCOM_BUCKET")
-
-    @staticmethod
-    def download_file_from_gcs(
-        bucket_name: str, source_file: str, destination_file: str
-    ):
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(source_file)
-        blob.download_to_filename(destination_file)
-        print(
-            f"file: {destination_file} downloaded from bucket: {bucket_name} successfully"
-        )
-        return destination_file
-
-    @staticmethod
-    def upload_dataframe_to_gcs(
-        bucket_name: str, contents: pd.DataFrame, destination_file: str
-    ):
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(destination_file)
-        contents.reset_index(drop=True, inplace=True)
-        blob.upload_from_string(contents.to_csv(index=False), "text/csv")
-
-        print(
-            "{} with contents {} has been uploaded to {}.".format(
-                destination_file, len(contents), bucket_name
-            )
-        )
-
-        return f"gs://{bucket_name}/{blob.name}"
+    # parquet or csv. Stored objects are read according to their file extension,
+    # so switching modes does not break XComs written in the other format.
+    SERIALIZATION = os.getenv("AIRFLOW_XCOM_SERIALIZATION", "parquet")
+    CACHE = XComCache(
+        cache_dir=os.getenv("AIRFLOW_XCOM_CACHE_DIR", "/tmp/airflow_xcom_cache"),
+        max_bytes=int(os.getenv("AIRFLOW_XCOM_CACHE_MAX_BYTES", 2 * 1024**3)),
+    )
 
     @staticmethod
     def serialize_value(value: Any):
         if isinstance(value, pd.DataFrame):
-            filename = f"airflow_data_{str(uuid.uuid4())}.csv"
-
-            uploaded_file_path = GCSXComBackend.upload_dataframe_to_gcs(
-                bucket_name=GCSXComBackend.BUCKET_NAME,
-                contents=value,
-                destination_file=filename,
+            value = upload_dataframe(
+                data=value,
+                store=GCSObjectStore(GCSXComBackend.BUCKET_NAME),
+                cache=GCSXComBackend.CACHE,
+                serialization=GCSXComBackend.SERIALIZATION,
             )
-            last_index = uploaded_file_path.rindex("/")
-            value = uploaded_file_path[last_index + 1 :]
 
         return BaseXCom.serialize_value(value)
 
@@ -61,25 +38,11 @@ class GCSXComBackend(BaseXCom):
     def deserialize_value(result) -> Any:
         result = BaseXCom.deserialize_value(result)
         if isinstance(result, str):
-            filename = f"/tmp/airflow_data_{str(uuid.uuid4())}.csv"
-            GCSXComBackend.download_file_from_gcs(
-                bucket_name=GCSXComBackend.BUCKET_NAME,
-                source_file=result,
-                destination_file=filename,
+            result = download_dataframe(
+                file_name=result,
+                store=GCSObjectStore(GCSXComBackend.BUCKET_NAME),
+                cache=GCSXComBackend.CACHE,
             )
-            try:
-                result = pd.read_csv(filename)
-                result.reset_index(drop=True, inplace=True)
-            except EmptyDataError:
-                result = pd.DataFrame([])
-            except ParserError:
-                result = pd.read_csv(filename, lineterminator="\n")
-
-            try:
-                os.remove(filename)
-            except Exception as ex:
-                print(ex)
-                pass
 
         return result
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The XCom backend folder is put on PYTHONPATH by the Airflow deployment
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from xcom_storage import (
+    LocalObjectStore,
+    XComCache,
+    download_dataframe,
+    upload_dataframe,
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalObjectStore(root=str(tmp_path / "bucket"))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return XComCache(cache_dir=str(tmp_path / "cache"), max_bytes=1024**3)
+
+
+@pytest.fixture
+def measurements():
+    return pd.DataFrame(
+        {
+            "device_id": ["aq_g5_1", "aq_g5_2", None],
+            "device_number": pd.array([1, 2, None], dtype="Int64"),
+            "pm2_5": [10.5, np.nan, 30.25],
+            "timestamp": pd.to_datetime(
+                ["2023-01-01T00:00:00Z", "2023-01-01T01:00:00Z", None], utc=True
+            ),
+            "site_id": pd.Categorical(["a", "b", "a"]),
+        }
+    )
+
+
+def test_parquet_round_trip_preserves_dtypes(store, cache, tmp_path, measurements):
+    file_name = upload_dataframe(
+        data=measurements.copy(), store=store, cache=cache, serialization="parquet"
+    )
+    assert file_name.endswith(".parquet")
+
+    # A different worker, with an empty cache
+    other_cache = XComCache(cache_dir=str(tmp_path / "other"), max_bytes=1024**3)
+    data = download_dataframe(file_name=file_name, store=store, cache=other_cache)
+
+    pd.testing.assert_frame_equal(data, measurements)
+
+
+def test_cached_objects_are_not_downloaded_again(store, cache, measurements):
+    file_name = upload_dataframe(
+        data=measurements, store=store, cache=cache, serialization="parquet"
+    )
+
+    for _ in range(3):
+        download_dataframe(file_name=file_name, store=store, cache=cache)
+
+    assert store.downloads == 0
+
+    os.remove(cache.path(file_name))
+    download_dataframe(file_name=file_name, store=store, cache=cache)
+    download_dataframe(file_name=file_name, store=store, cache=cache)
+    assert store.downloads == 1
+
+
+def test_identical_frames_share_an_object(store, cache, measurements):
+    first = upload_dataframe(
+        data=measurements.copy(), store=store, cache=cache, serialization="parquet"
+    )
+    second = upload_dataframe(
+        data=measurements.copy(), store=store, cache=cache, serialization="parquet"
+    )
+    assert first == second
+
+
+def test_mixed_type_columns_fall_back_to_csv(store, cache):
+    data = pd.DataFrame({"value": [1, "a", 2.5]})
+
+    file_name = upload_dataframe(
+        data=data, store=store, cache=cache, serialization="parquet"
+    )
+
+    assert file_name.endswith(".csv")
+    result = download_dataframe(file_name=file_name, store=store, cache=cache)
+    assert result["value"].astype(str).tolist() == ["1", "a", "2.5"]
+
+
+def test_csv_objects_are_still_readable(store, cache, measurements):
+    file_name = upload_dataframe(
+        data=measurements, store=store, cache=cache, serialization="csv"
+    )
+    assert file_name.endswith(".csv")
+
+    result = download_dataframe(file_name=file_name, store=store, cache=cache)
+    assert result["pm2_5"].tolist()[0] == 10.5
+    assert len(result) == 3
+
+
+def test_empty_frames_round_trip(store, cache):
+    file_name = upload_dataframe(
+        data=pd.DataFrame([]), store=store, cache=cache, serialization="parquet"
+    )
+    result = download_dataframe(file_name=file_name, store=store, cache=cache)
+    assert result.empty
+
+
+def test_cache_evicts_least_recently_used_objects(tmp_path):
+    cache = XComCache(cache_dir=str(tmp_path / "cache"), max_bytes=150)
+    cache.put("first.parquet", contents=b"x" * 100)
+    os.utime(cache.path("first.parquet"), (0, 0))
+    cache.put("second.parquet", contents=b"x" * 100)
+
+    assert cache.get("first.parquet") is None
+    assert cache.get("second.parquet") is not None
@@ -0,0 +1,183 @@
+import hashlib
+import io
+import os
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.errors import EmptyDataError, ParserError
+
+PARQUET_EXTENSION = ".parquet"
+CSV_EXTENSION = ".csv"
+
+
+class GCSObjectStore:
+    def __init__(self, bucket_name: str):
+        from google.cloud import storage
+
+        self.bucket_name = bucket_name
+        self.bucket = storage.Client().bucket(bucket_name)
+
+    def upload(self, contents: bytes, destination_file: str, content_type: str):
+        blob = self.bucket.blob(destination_file)
+        blob.upload_from_string(contents, content_type)
+        return f"gs://{self.bucket_name}/{blob.name}"
+
+    def download(self, source_file: str, destination_file: str):
+        self.bucket.blob(source_file).download_to_filename(destination_file)
+        return destination_file
+
+
+class LocalObjectStore:
+    """Filesystem stand-in for a GCS bucket."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.downloads = 0
+
+    def upload(self, contents: bytes, destination_file: str, content_type: str):
+        with open(os.path.join(self.root, destination_file), "wb") as file:
+            file.write(contents)
+        return f"file://{self.root}/{destination_file}"
+
+    def download(self, source_file: str, destination_file: str):
+        self.downloads += 1
+        with open(os.path.join(self.root, source_file), "rb") as source:
+            with open(destination_file, "wb") as destination:
+                destination.write(source.read())
+        return destination_file
+
+
+class XComCache:
+    """
+    Local disk cache of XCom objects. Objects are named after the hash of their
+    contents, so a cached file never needs to be invalidated.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def path(self, file_name: str) -> str:
+        return os.path.join(self.cache_dir, file_name)
+
+    def get(self, file_name: str):
+        path = self.path(file_name)
+        if os.path.exists(path):
+            os.utime(path)
+            return path
+        return None
+
+    def put(self, file_name: str, contents: bytes = None, store=None) -> str:
+        """Writes contents, or downloads the object from the store, into the cache."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(file_name)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+
+        if contents is None:
+            store.download(source_file=file_name, destination_file=temp_path)
+        else:
+            with open(temp_path, "wb") as file:
+                file.write(contents)
+
+        os.replace(temp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        entries = [
+            entry
+            for entry in os.scandir(self.cache_dir)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        ]
+        total_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in sorted(entries, key=lambda x: x.stat().st_mtime):
+            if total_bytes <= self.max_bytes:
+                break
+            total_bytes -= entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def dataframe_to_parquet(data: pd.DataFrame) -> bytes:
+    """Parquet (zstd) bytes embedding the pandas schema of the dataframe."""
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="zstd")
+    return buffer.getvalue()
+
+
+def parquet_file_name(contents: bytes) -> str:
+    return f"airflow_data_{hashlib.sha256(contents).hexdigest()}{PARQUET_EXTENSION}"
+
+
+def read_parquet(path: str) -> pd.DataFrame:
+    return pq.read_table(path, memory_map=True).to_pandas()
+
+
+def dataframe_to_csv(data: pd.DataFrame) -> bytes:
+    return data.to_csv(index=False).encode("utf-8")
+
+
+def csv_file_name() -> str:
+    return f"airflow_data_{str(uuid.uuid4())}{CSV_EXTENSION}"
+
+
+def read_csv(path: str) -> pd.DataFrame:
+    try:
+        data = pd.read_csv(path)
+        data.reset_index(drop=True, inplace=True)
+    except EmptyDataError:
+        data = pd.DataFrame([])
+    except ParserError:
+        data = pd.read_csv(path, lineterminator="\n")
+    return data
+
+
+def upload_dataframe(
+    data: pd.DataFrame, store, cache: XComCache, serialization: str
+) -> str:
+    """
+    Uploads the dataframe and returns the object name stored in the XCom.
+    Falls back to CSV for frames pyarrow cannot convert, e.g. mixed type columns.
+    """
+    data.reset_index(drop=True, inplace=True)
+
+    if serialization == "parquet":
+        try:
+            contents = dataframe_to_parquet(data)
+        except (pa.ArrowException, ValueError, TypeError) as ex:
+            print(f"Falling back to CSV serialization: {ex}")
+        else:
+            file_name = parquet_file_name(contents)
+            store.upload(contents, file_name, "application/vnd.apache.parquet")
+            cache.put(file_name, contents=contents)
+            print(f"{file_name} with contents {len(data)} has been uploaded.")
+            return file_name
+
+    file_name = csv_file_name()
+    store.upload(dataframe_to_csv(data), file_name, "text/csv")
+    print(f"{file_name} with contents {len(data)} has been uploaded.")
+    return file_name
+
+
+def download_dataframe(file_name: str, store, cache: XComCache) -> pd.DataFrame:
+    if file_name.endswith(PARQUET_EXTENSION):
+        path = cache.get(file_name)
+        if path is None:
+            path = cache.put(file_name, store=store)
+        return read_parquet(path)
+
+    path = f"/tmp/airflow_data_{str(uuid.uuid4())}{CSV_EXTENSION}"
+    store.download(source_file=file_name, destination_file=path)
+    try:
+        return read_csv(path)
+    finally:
+        try:
+            os.remove(path)
+        except Exception as ex:
+            print(ex)
@@ -188,6 +188,16 @@ class AirQoApi:
 
         return []
 
+    def materialize_forecasts(self, frequency) -> None:
+        try:
+            self.__request(
+                endpoint="predict/forecasts/materialize",
+                params={"frequency": frequency},
+                method="put",
+            )
+        except Exception as ex:
+            print(ex)
+
     def get_nearest_weather_stations(self, latitude, longitude) -> list:
         response = self.__request(
             endpoint="meta-data/nearest-weather-stations",
@@ -1,4 +1,6 @@
-import pickle
+import copy
+import os
+import tempfile
 import traceback
 from datetime import datetime
 
@@ -8,11 +10,19 @@ import pymongo as pm
 
 from .airqo_api import AirQoApi
 from .bigquery_api import BigQueryApi
-from .commons import download_file_from_gcs
 from .config import configuration
-from .constants import DeviceCategory, Tenant, Frequency, DataSource, DataType
+from .constants import (
+    DeviceCategory,
+    Tenant,
+    Frequency,
+    DataSource,
+    DataType,
+    ColumnDataType,
+)
 from .data_validator import DataValidationUtils
 from .date import date_to_str
+from .model_registry import GCSModelStore, ModelRegistry
+from .schema_registry import SchemaRegistry, ALL_TABLES_SCHEMA
 from .thingspeak_api import ThingspeakApi
 from .utils import Utils
 from .weather_data_utils import WeatherDataUtils
@@ -60,30 +70,10 @@ class AirQoDataUtils:
         cols.remove("device_number")
         data.dropna(subset=cols, how="all", inplace=True)
         data["timestamp"] = pd.to_datetime(data["timestamp"])
-        data["duplicated"] = data.duplicated(
-            keep=False, subset=["device_number", "timestamp"]
+        return DataValidationUtils.merge_duplicates(
+            data=data, unique_cols=["device_number", "timestamp"]
         )
 
-        if True not in data["duplicated"].values:
-            return data
-
-        duplicated_data = data.loc[data["duplicated"]]
-        not_duplicated_data = data.loc[~data["duplicated"]]
-
-        for _, by_device_number in duplicated_data.groupby(by="device_number"):
-            for _, by_timestamp in by_device_number.groupby(by="timestamp"):
-                by_timestamp = by_timestamp.copy()
-                by_timestamp.fillna(inplace=True, method="ffill")
-                by_timestamp.fillna(inplace=True, method="bfill")
-                by_timestamp.drop_duplicates(
-                    subset=["device_number", "timestamp"], inplace=True, keep="first"
-                )
-                not_duplicated_data = pd.concat(
-                    [not_duplicated_data, by_timestamp], ignore_index=True
-                )
-
-        return not_duplicated_data
-
     @staticmethod
     def extract_aggregated_raw_data(start_date_time, end_date_time) -> pd.DataFrame:
         bigquery_api = BigQueryApi()
@@ -138,6 +128,80 @@ class AirQoDataUtils:
 
         return series
 
+    @staticmethod
+    def decode_field_8(
+        field_8: pd.Series, device_category: DeviceCategory, engine: str = "pandas"
+    ) -> pd.DataFrame:
+        """
+        Vectorized equivalent of flatten_field_8 over a whole column. Splits every
+        record once and returns the mapped columns, with missing values for short
+        or empty records. Columns other than timestamps are coerced to floats.
+
+        :param field_8: series of comma separated field8 records
+        :param device_category: BAM or low cost sensors
+        :param engine: "pandas" or "pyarrow" to split the records with pyarrow compute
+        :return: a dataframe with a column for each field8 mapping, indexed like field_8
+        """
+        mappings = (
+            configuration.AIRQO_BAM_CONFIG
+            if device_category == DeviceCategory.BAM
+            else configuration.AIRQO_LOW_COST_CONFIG
+        )
+        timestamp_columns = SchemaRegistry.get_columns(
+            ALL_TABLES_SCHEMA, column_type=ColumnDataType.TIMESTAMP
+        )
+
+        records = field_8.astype(object)
+        records = records.where(records.str.len() > 0)
+
+        if engine == "pyarrow":
+            values = AirQoDataUtils.__split_field_8_pyarrow(
+                records=records, indices=list(mappings.keys())
+            )
+        else:
+            split_records = records.str.split(",", expand=True)
+            values = {
+                index: (
+                    split_records[index]
+                    if index in split_records.columns
+                    else pd.Series(None, index=records.index, dtype=object)
+                )
+                for index in mappings.keys()
+            }
+
+        data = pd.DataFrame(index=field_8.index)
+        for index, column in mappings.items():
+            if column in timestamp_columns:
+                data[column] = values[index].where(values[index].notna(), np.nan)
+            else:
+                data[column] = pd.to_numeric(values[index], errors="coerce").astype(
+                    np.float64
+                )
+
+        return data
+
+    @staticmethod
+    def __split_field_8_pyarrow(records: pd.Series, indices: list) -> dict:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        split_records = pc.split_pattern(
+            pa.array(records, type=pa.string(), from_pandas=True), pattern=","
+        )
+        offsets = split_records.offsets.to_numpy()
+        starts, ends = offsets[:-1], offsets[1:]
+        tokens = split_records.values.to_numpy(zero_copy_only=False)
+        is_null = split_records.is_null().to_numpy(zero_copy_only=False)
+
+        values = {}
+        for index in indices:
+            valid = (starts + index < ends) & ~is_null
+            column = np.full(len(records), None, dtype=object)
+            column[valid] = tokens[starts[valid] + index]
+            values[index] = pd.Series(column, index=records.index)
+
+        return values
+
     @staticmethod
     def flatten_meta_data(meta_data: list) -> list:
         data = []
@@ -275,6 +339,7 @@ class AirQoDataUtils:
         device_category: DeviceCategory,
         device_numbers: list = None,
         remove_outliers: bool = True,
+        checkpoint: bool = False,
     ) -> pd.DataFrame:
         """
         Returns a dataframe of AiQo sensors measurements.
@@ -284,6 +349,7 @@ class AirQoDataUtils:
         :param device_category: BAM or low cost sensors
         :param device_numbers: list of device numbers whose data you want to extract. Defaults to all AirQo devices
         :param remove_outliers: Removes outliers if set to true.
+        :param checkpoint: Records completed Thingspeak queries in a local file so that a retried extraction resumes from where it stopped.
         :return: a dataframe of measurements recorded between start date time and end date time
         """
 
@@ -325,13 +391,14 @@ class AirQoDataUtils:
 
         read_keys = airqo_api.get_thingspeak_read_keys(devices=devices)
 
-        devices_data = pd.DataFrame()
         dates = Utils.query_dates_array(
             start_date_time=start_date_time,
             end_date_time=end_date_time,
             data_source=DataSource.THINGSPEAK,
         )
 
+        queries = []
+        queries_devices = []
         for device in devices:
             device_number = device.get("device_number", None)
             read_key = read_keys.get(device_number, None)
@@ -341,56 +408,81 @@ class AirQoDataUtils:
                 continue
 
             for start, end in dates:
-                data = thingspeak_api.query_data(
-                    device_number=device_number,
-                    start_date_time=start,
-                    end_date_time=end,
-                    read_key=read_key,
+                queries.append(
+                    {
+                        "device_number": device_number,
+                        "start_date_time": start,
+                        "end_date_time": end,
+                        "read_key": read_key,
+                    }
                 )
+                queries_devices.append(device)
 
-                if data.empty:
-                    print(
-                        f"{device_number} does not have data between {start} and {end}"
-                    )
-                    continue
+        checkpoint_file = None
+        if checkpoint:
+            file_name = (
+                f"thingspeak_{device_category}_{start_date_time}_{end_date_time}"
+            )
+            checkpoint_file = os.path.join(
+                tempfile.gettempdir(), f"{file_name.replace(':', '-')}.jsonl"
+            )
+
+        results = thingspeak_api.query_devices_data(
+            queries=queries, checkpoint_file=checkpoint_file
+        )
 
-                meta_data = data.attrs.pop("meta_data", {})
+        devices_data = []
+        for query, device, data in zip(queries, queries_devices, results):
+            device_number = query["device_number"]
 
-                if "field8" not in data.columns.to_list():
-                    data = DataValidationUtils.fill_missing_columns(
-                        data=data, cols=data_columns
-                    )
-                else:
-                    data[field_8_cols] = data["field8"].apply(
-                        lambda x: AirQoDataUtils.flatten_field_8(
-                            device_category=device_category, field_8=x
-                        )
-                    )
+            if data.empty:
+                print(
+                    f"{device_number} does not have data between {query['start_date_time']} and {query['end_date_time']}"
+                )
+                continue
 
-                data["device_number"] = device_number
-                data["device_id"] = device.get("device_id")
-                data["site_id"] = device.get("site_id")
-
-                if device_category == DeviceCategory.BAM:
-                    data["latitude"] = meta_data.get("latitude", None)
-                    data["longitude"] = meta_data.get("longitude", None)
-
-                if device_category == DeviceCategory.LOW_COST:
-                    data.rename(
-                        columns={
-                            "field1": "s1_pm2_5",
-                            "field2": "s1_pm10",
-                            "field3": "s2_pm2_5",
-                            "field4": "s2_pm10",
-                            "field7": "battery",
-                            "created_at": "timestamp",
-                        },
-                        inplace=True,
-                    )
+            meta_data = data.attrs.pop("meta_data", {})
 
-                devices_data = pd.concat(
-                    [devices_data, data[data_columns]], ignore_index=True
+            if "field8" not in data.columns.to_list():
+                data = DataValidationUtils.fill_missing_columns(
+                    data=data, cols=data_columns
                 )
+            else:
+                data[field_8_cols] = AirQoDataUtils.decode_field_8(
+                    field_8=data["field8"], device_category=device_category
+                )
+
+            data["device_number"] = device_number
+            data["device_id"] = device.get("device_id")
+            data["site_id"] = device.get("site_id")
+
+            if device_category == DeviceCategory.BAM:
+                data["latitude"] = meta_data.get("latitude", None)
+                data["longitude"] = meta_data.get("longitude", None)
+
+            if device_category == DeviceCategory.LOW_COST:
+                data.rename(
+                    columns={
+                        "field1": "s1_pm2_5",
+                        "field2": "s1_pm10",
+                        "field3": "s2_pm2_5",
+                        "field4": "s2_pm10",
+                        "field7": "battery",
+                        "created_at": "timestamp",
+                    },
+                    inplace=True,
+                )
+
+            devices_data.append(data[data_columns])
+
+        devices_data = (
+            pd.concat(devices_data, ignore_index=True)
+            if devices_data
+            else pd.DataFrame()
+        )
+
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
 
         if remove_outliers:
             if "vapor_pressure" in devices_data.columns.to_list():
@@ -708,114 +800,83 @@ class AirQoDataUtils:
         return measurements
 
     @staticmethod
-    def calibrate_using_pickle_file(measurements: pd.DataFrame) -> list:
-        if measurements.empty:
-            return []
-
-        pm_2_5_model_file = download_file_from_gcs(
-            bucket_name="airqo_prediction_bucket",
-            source_file="PM2.5_calibrate_model.pkl",
-            destination_file="pm2_5_model.pkl",
-        )
+    def calibration_features(measurements: pd.DataFrame) -> np.ndarray:
+        """
+        Input variables of the pickled calibration models, as a contiguous float32
+        array with one row per measurement.
+        """
+        avg_pm2_5 = measurements[["s1_pm2_5", "s2_pm2_5"]].mean(axis=1).round(2)
+        avg_pm10 = measurements[["s1_pm10", "s2_pm10"]].mean(axis=1).round(2)
+        pm2_5_pm10 = avg_pm2_5 - avg_pm10
+
+        features = [
+            avg_pm2_5,
+            avg_pm10,
+            measurements["temperature"],
+            measurements["humidity"],
+            pd.to_datetime(measurements["time"]).dt.hour,
+            np.abs(measurements["s1_pm2_5"] - measurements["s2_pm2_5"]),
+            np.abs(measurements["s1_pm10"] - measurements["s2_pm10"]),
+            pm2_5_pm10,
+            pm2_5_pm10 / avg_pm10,
+        ]
 
-        pm_10_model_file = download_file_from_gcs(
-            bucket_name="airqo_prediction_bucket",
-            source_file="PM10_calibrate_model.pkl",
-            destination_file="pm10_model.pkl",
+        return np.ascontiguousarray(
+            np.column_stack(
+                [pd.to_numeric(feature).to_numpy(np.float64) for feature in features]
+            ),
+            dtype=np.float32,
         )
 
-        rf_regressor = pickle.load(open(pm_2_5_model_file, "rb"))
-        lasso_regressor = pickle.load(open(pm_10_model_file, "rb"))
-
-        calibrated_measurements = []
-
-        for _, row in measurements:
-            try:
-                calibrated_row = row
-                hour = pd.to_datetime(row["time"]).hour
-                s1_pm2_5 = row["s1_pm2_5"]
-                s2_pm2_5 = row["s2_pm2_5"]
-                s1_pm10 = row["s1_pm10"]
-                s2_pm10 = row["s2_pm10"]
-                temperature = row["temperature"]
-                humidity = row["humidity"]
-
-                input_variables = pd.DataFrame(
-                    [
-                        [
-                            s1_pm2_5,
-                            s2_pm2_5,
-                            s1_pm10,
-                            s2_pm10,
-                            temperature,
-                            humidity,
-                            hour,
-                        ]
-                    ],
-                    columns=[
-                        "s1_pm2_5",
-                        "s2_pm2_5",
-                        "s1_pm10",
-                        "s2_pm10",
-                        "temperature",
-                        "humidity",
-                        "hour",
-                    ],
-                    dtype="float",
-                    index=["input"],
-                )
-
-                input_variables["avg_pm2_5"] = (
-                    input_variables[["s1_pm2_5", "s2_pm2_5"]].mean(axis=1).round(2)
-                )
-                input_variables["avg_pm10"] = (
-                    input_variables[["s1_pm10", "s2_pm10"]].mean(axis=1).round(2)
-                )
-                input_variables["error_pm10"] = np.abs(
-                    input_variables["s1_pm10"] - input_variables["s2_pm10"]
-                )
-                input_variables["error_pm2_5"] = np.abs(
-                    input_variables["s1_pm2_5"] - input_variables["s2_pm2_5"]
-                )
-                input_variables["pm2_5_pm10"] = (
-                    input_variables["avg_pm2_5"] - input_variables["avg_pm10"]
-                )
-                input_variables["pm2_5_pm10_mod"] = (
-                    input_variables["pm2_5_pm10"] / input_variables["avg_pm10"]
-                )
-                input_variables = input_variables.drop(
-                    ["s1_pm2_5", "s2_pm2_5", "s1_pm10", "s2_pm10"], axis=1
-                )
-
-                # reorganise columns
-                input_variables = input_variables[
-                    [
-                        "avg_pm2_5",
-                        "avg_pm10",
-                        "temperature",
-                        "humidity",
-                        "hour",
-                        "error_pm2_5",
-                        "error_pm10",
-                        "pm2_5_pm10",
-                        "pm2_5_pm10_mod",
-                    ]
-                ]
-
-                calibrated_pm2_5 = rf_regressor.predict(input_variables)[0]
-                calibrated_pm10 = lasso_regressor.predict(input_variables)[0]
-
-                calibrated_row["calibrated_pm2_5"] = calibrated_pm2_5
-                calibrated_row["calibrated_pm10"] = calibrated_pm10
+    @staticmethod
+    def calibrate_using_pickle_file(
+        measurements: pd.DataFrame, model_store=None, n_jobs: int = None
+    ) -> list:
+        """
+        Adds calibrated_pm2_5 and calibrated_pm10 values predicted by the pickled
+        PM2.5 (random forest) and PM10 (lasso) models.
+        Measurements whose input variables are incomplete are left out.
 
-                calibrated_measurements.append(calibrated_row.to_dict(orient="records"))
+        :param measurements: dataframe with time, s1/s2 pm2_5 and pm10, temperature and humidity
+        :param model_store: store serving the model files, the calibration models bucket by default
+        :param n_jobs: number of jobs used by the random forest to predict
+        """
+        if measurements.empty:
+            return []
 
-            except Exception as ex:
-                traceback.print_exc()
-                print(ex)
-                continue
+        if model_store is None:
+            model_store = GCSModelStore(configuration.CALIBRATION_MODELS_BUCKET)
 
-        return calibrated_measurements
+        rf_regressor = ModelRegistry.get_model(
+            store=model_store, source_file="PM2.5_calibrate_model.pkl"
+        )
+        lasso_regressor = ModelRegistry.get_model(
+            store=model_store, source_file="PM10_calibrate_model.pkl"
+        )
+        if n_jobs is not None:
+            # A shallow copy shares the fitted trees without changing the cached model
+            rf_regressor = copy.copy(rf_regressor).set_params(n_jobs=n_jobs)
+
+        features = AirQoDataUtils.calibration_features(measurements)
+        valid_rows = np.isfinite(features).all(axis=1)
+        if not valid_rows.all():
+            print(f"{(~valid_rows).sum()} measurements have incomplete input variables")
+
+        calibrated_measurements = measurements[valid_rows].copy()
+        features = features[valid_rows]
+        calibrated_pm2_5 = np.empty(len(features), dtype=np.float64)
+        calibrated_pm10 = np.empty(len(features), dtype=np.float64)
+
+        batch_size = configuration.CALIBRATION_BATCH_SIZE
+        for start in range(0, len(features), batch_size):
+            batch = features[start : start + batch_size]
+            calibrated_pm2_5[start : start + batch_size] = rf_regressor.predict(batch)
+            calibrated_pm10[start : start + batch_size] = lasso_regressor.predict(batch)
+
+        calibrated_measurements["calibrated_pm2_5"] = calibrated_pm2_5
+        calibrated_measurements["calibrated_pm10"] = calibrated_pm10
+
+        return calibrated_measurements.to_dict(orient="records")
 
     @staticmethod
     def extract_devices_deployment_logs() -> pd.DataFrame:
@@ -1,14 +1,21 @@
 import os
+import uuid
 from datetime import datetime
 
 import pandas as pd
 from google.cloud import bigquery
 from google.oauth2 import service_account
 
+from .bigquery_merge import (
+    MergeAction,
+    TableMergeSpec,
+    TABLE_MERGE_SPECS,
+    compose_merge_query,
+)
 from .config import configuration
 from .constants import JobAction, ColumnDataType, Tenant, QueryType
 from .date import date_to_str
-from .utils import Utils
+from .schema_registry import SchemaRegistry, ALL_TABLES_SCHEMA
 
 
 class BigQueryApi:
@@ -112,7 +119,8 @@ class BigQueryApi:
         float_columns=None,
         integer_columns=None,
     ) -> pd.DataFrame:
-        valid_cols = self.get_columns(table=table)
+        schema = SchemaRegistry.get_schema(self.get_schema_file(table=table))
+        valid_cols = list(schema.get_columns())
         dataframe_cols = dataframe.columns.to_list()
 
         if set(valid_cols).issubset(set(dataframe_cols)):
@@ -129,19 +137,19 @@ class BigQueryApi:
         date_time_columns = (
             date_time_columns
             if date_time_columns
-            else self.get_columns(table=table, column_type=ColumnDataType.TIMESTAMP)
+            else list(schema.get_columns(column_type=ColumnDataType.TIMESTAMP))
         )
 
         float_columns = (
             float_columns
             if float_columns
-            else self.get_columns(table=table, column_type=ColumnDataType.FLOAT)
+            else list(schema.get_columns(column_type=ColumnDataType.FLOAT))
         )
 
         integer_columns = (
             integer_columns
             if integer_columns
-            else self.get_columns(table=table, column_type=ColumnDataType.INTEGER)
+            else list(schema.get_columns(column_type=ColumnDataType.INTEGER))
         )
 
         from .data_validator import DataValidationUtils
@@ -155,95 +163,57 @@ class BigQueryApi:
 
         return dataframe.drop_duplicates(keep="first")
 
+    def get_schema_file(self, table: str) -> str:
+        schema_files = [
+            (
+                [self.hourly_measurements_table, self.daily_measurements_table],
+                "measurements.json",
+            ),
+            ([self.raw_measurements_table], "raw_measurements.json"),
+            ([self.hourly_weather_table, self.raw_weather_table], "weather_data.json"),
+            ([self.latest_measurements_table], "latest_measurements.json"),
+            ([self.consolidated_data_table], "data_warehouse.json"),
+            ([self.airqlouds_table], "airqlouds.json"),
+            ([self.airqlouds_sites_table], "airqlouds_sites.json"),
+            ([self.grids_table], "grids.json"),
+            ([self.cohorts_table], "cohorts.json"),
+            ([self.grids_sites_table], "grids_sites.json"),
+            ([self.cohorts_devices_table], "cohorts_devices.json"),
+            ([self.sites_table], "sites.json"),
+            ([self.sites_meta_data_table], "sites_meta_data.json"),
+            ([self.sensor_positions_table], "sensor_positions.json"),
+            ([self.devices_table], "devices.json"),
+            (
+                [
+                    self.clean_mobile_raw_measurements_table,
+                    self.unclean_mobile_raw_measurements_table,
+                ],
+                "mobile_measurements.json",
+            ),
+            ([self.airqo_mobile_measurements_table], "airqo_mobile_measurements.json"),
+            ([self.bam_measurements_table], "bam_measurements.json"),
+            ([self.raw_bam_measurements_table], "bam_raw_measurements.json"),
+        ]
+
+        for tables, schema_file in schema_files:
+            if table in tables:
+                return schema_file
+
+        if table == ALL_TABLES_SCHEMA:
+            return ALL_TABLES_SCHEMA
+
+        raise Exception("Invalid table")
+
     def get_columns(
         self, table: str, column_type: ColumnDataType = ColumnDataType.NONE
     ) -> list:
-        if (
-            table == self.hourly_measurements_table
-            or table == self.daily_measurements_table
-        ):
-            schema_file = "measurements.json"
-        elif table == self.raw_measurements_table:
-            schema_file = "raw_measurements.json"
-        elif table == self.hourly_weather_table or table == self.raw_weather_table:
-            schema_file = "weather_data.json"
-        elif table == self.latest_measurements_table:
-            schema_file = "latest_measurements.json"
-        elif table == self.consolidated_data_table:
-            schema_file = "data_warehouse.json"
-        elif table == self.airqlouds_table:
-            schema_file = "airqlouds.json"
-        elif table == self.airqlouds_sites_table:
-            schema_file = "airqlouds_sites.json"
-        elif table == self.grids_table:
-            schema_file = "grids.json"
-        elif table == self.cohorts_table:
-            schema_file = "cohorts.json"
-        elif table == self.grids_sites_table:
-            schema_file = "grids_sites.json"
-        elif table == self.cohorts_devices_table:
-            schema_file = "cohorts_devices.json"
-        elif table == self.sites_table:
-            schema_file = "sites.json"
-        elif table == self.sites_meta_data_table:
-            schema_file = "sites_meta_data.json"
-
-        elif table == self.sensor_positions_table:
-            schema_file = "sensor_positions.json"
-        elif table == self.devices_table:
-            schema_file = "devices.json"
-        elif (
-            table == self.clean_mobile_raw_measurements_table
-            or table == self.unclean_mobile_raw_measurements_table
-        ):
-            schema_file = "mobile_measurements.json"
-        elif table == self.airqo_mobile_measurements_table:
-            schema_file = "airqo_mobile_measurements.json"
-        elif table == self.bam_measurements_table:
-            schema_file = "bam_measurements.json"
-        elif table == self.raw_bam_measurements_table:
-            schema_file = "bam_raw_measurements.json"
-        elif table == "all":
-            schema_file = None
-        else:
-            raise Exception("Invalid table")
+        schema_file = self.get_schema_file(table=table)
+        return list(
+            SchemaRegistry.get_columns(schema_file=schema_file, column_type=column_type)
+        )
 
-        if schema_file:
-            schema = Utils.load_schema(file_name=schema_file)
-        else:
-            schema = []
-            for file in [
-                "measurements",
-                "raw_measurements",
-                "weather_data",
-                "latest_measurements",
-                "data_warehouse",
-                "sites",
-                "sensor_positions",
-                "devices",
-                "mobile_measurements",
-                "airqo_mobile_measurements",
-                "bam_measurements",
-                "bam_raw_measurements",
-            ]:
-                file_schema = Utils.load_schema(file_name=f"{file}.json")
-                schema.extend(file_schema)
-
-            # with os.scandir(os.path.join("path", "schema")) as iterator:
-            #     for entry in iterator:
-            #         if entry.name.endswith(".json") and entry.is_file():
-            #
-            #             file_schema = Utils.load_schema(file_path=entry.path)
-            #             schema.extend(file_schema)
-
-        columns = []
-        if column_type != ColumnDataType.NONE:
-            for column in schema:
-                if column["type"] == str(column_type):
-                    columns.append(column["name"])
-        else:
-            columns = [column["name"] for column in schema]
-        return list(set(columns))
+    def get_dtypes(self, table: str) -> dict:
+        return SchemaRegistry.get_dtypes(schema_file=self.get_schema_file(table=table))
 
     def load_data(
         self,
@@ -283,134 +253,108 @@ class BigQueryApi:
     def device_unique_col(tenant: str, device_id: str, device_number: int):
         return str(f"{tenant}:{device_id}:{device_number}").lower()
 
-    def update_airqlouds(self, dataframe: pd.DataFrame, table=None) -> None:
-        if table is None:
-            table = self.airqlouds_table
-        unique_cols = ["id", "tenant"]
-
+    def upsert_data(
+        self,
+        dataframe: pd.DataFrame,
+        table: str,
+        unique_cols: list = None,
+        action: MergeAction = None,
+        case_insensitive_cols: list = None,
+    ) -> None:
+        """
+        Loads the rows into a temporary staging table and applies them to the table
+        with a single MERGE statement. Unique columns, the merge action and the
+        unique columns compared lowercased default to the table's declaration in
+        TABLE_MERGE_SPECS.
+        """
         dataframe.reset_index(drop=True, inplace=True)
-        dataframe = self.validate_data(
-            dataframe=dataframe,
-            table=table,
-        )
+        dataframe = self.validate_data(dataframe=dataframe, table=table)
+        columns = dataframe.columns.to_list()
 
-        available_data = (
-            self.client.query(query=f"SELECT * FROM `{table}`").result().to_dataframe()
+        merge_spec = TABLE_MERGE_SPECS.get(
+            self.get_schema_file(table=table), TableMergeSpec()
         )
-
-        up_to_date_data = pd.concat([available_data, dataframe], ignore_index=True)
-        up_to_date_data.drop_duplicates(subset=unique_cols, inplace=True, keep="first")
-
-        self.load_data(
-            dataframe=up_to_date_data, table=table, job_action=JobAction.OVERWRITE
+        unique_cols = (
+            list(unique_cols) if unique_cols else merge_spec.get_unique_cols(columns)
         )
+        action = action if action else merge_spec.action
+        case_insensitive_cols = [
+            col
+            for col in (
+                merge_spec.case_insensitive_cols
+                if case_insensitive_cols is None
+                else case_insensitive_cols
+            )
+            if col in unique_cols
+        ]
 
-    def update_grids(self, dataframe: pd.DataFrame, table=None) -> None:
-        if table is None:
-            table = self.grids_table
-        unique_cols = ["id", "tenant"]
-
-        dataframe.reset_index(drop=True, inplace=True)
-        dataframe = self.validate_data(
-            dataframe=dataframe,
-            table=table,
+        keys = dataframe[unique_cols].apply(
+            lambda col: (
+                col.astype("string").str.lower()
+                if col.name in case_insensitive_cols
+                else col
+            )
         )
+        dataframe = dataframe[~keys.duplicated(keep="first")]
+        if dataframe.empty:
+            print(f"No rows to merge into {table}")
+            return
 
-        available_data = (
-            self.client.query(query=f"SELECT * FROM `{table}`").result().to_dataframe()
+        staging_table = f"{table}_staging_{uuid.uuid4().hex}"
+        job_config = bigquery.LoadJobConfig(
+            schema=self.client.get_table(table).schema,
+            write_disposition=JobAction.OVERWRITE.get_name(),
         )
 
-        up_to_date_data = pd.concat([available_data, dataframe], ignore_index=True)
-        up_to_date_data.drop_duplicates(subset=unique_cols, inplace=True, keep="first")
+        try:
+            job = self.client.load_table_from_dataframe(
+                dataframe, staging_table, job_config=job_config
+            )
+            job.result()
+
+            query = compose_merge_query(
+                target_table=table,
+                staging_table=staging_table,
+                columns=columns,
+                unique_cols=unique_cols,
+                action=action,
+                case_insensitive_cols=case_insensitive_cols,
+            )
+            self.client.query(query=query).result()
+        finally:
+            self.client.delete_table(staging_table, not_found_ok=True)
 
-        self.load_data(
-            dataframe=up_to_date_data, table=table, job_action=JobAction.OVERWRITE
-        )
+        print(f"Merged {len(dataframe)} rows into {table}")
 
-    def update_cohorts(self, dataframe: pd.DataFrame, table=None) -> None:
+    def update_airqlouds(self, dataframe: pd.DataFrame, table=None) -> None:
         if table is None:
-            table = self.cohorts_table
-        unique_cols = ["id", "tenant"]
-
-        dataframe.reset_index(drop=True, inplace=True)
-        dataframe = self.validate_data(
-            dataframe=dataframe,
-            table=table,
-        )
-
-        available_data = (
-            self.client.query(query=f"SELECT * FROM `{table}`").result().to_dataframe()
-        )
+            table = self.airqlouds_table
+        self.upsert_data(dataframe=dataframe, table=table)
 
-        up_to_date_data = pd.concat([available_data, dataframe], ignore_index=True)
-        up_to_date_data.drop_duplicates(subset=unique_cols, inplace=True, keep="first")
+    def update_grids(self, dataframe: pd.DataFrame, table=None) -> None:
+        if table is None:
+            table = self.grids_table
+        self.upsert_data(dataframe=dataframe, table=table)
 
-        self.load_data(
-            dataframe=up_to_date_data, table=table, job_action=JobAction.OVERWRITE
-        )
+    def update_cohorts(self, dataframe: pd.DataFrame, table=None) -> None:
+        if table is None:
+            table = self.cohorts_table
+        self.upsert_data(dataframe=dataframe, table=table)
 
     def update_airqlouds_sites_table(self, dataframe: pd.DataFrame, table=None) -> None:
         if table is None:
             table = self.airqlouds_sites_table
-
-        dataframe.reset_index(drop=True, inplace=True)
-        dataframe = self.validate_data(
-            dataframe=dataframe,
-            table=table,
-        )
-
-        available_data = (
-            self.client.query(query=f"SELECT * FROM `{table}`").result().to_dataframe()
-        )
-
-        up_to_date_data = pd.concat([available_data, dataframe], ignore_index=True)
-        up_to_date_data.drop_duplicates(inplace=True, keep="first")
-
-        self.load_data(
-            dataframe=up_to_date_data, table=table, job_action=JobAction.OVERWRITE
-        )
+        self.upsert_data(dataframe=dataframe, table=table)
 
     def update_grids_sites_table(self, dataframe: pd.DataFrame, table=None) -> None:
         if table is None:
             table = self.grids_sites_table
-
-        dataframe.reset_index(drop=True, inplace=True)
-        dataframe = self.validate_data(
-            dataframe=dataframe,
-            table=table,
-        )
-
-        available_data = (
-            self.client.query(query=f"SELECT * FROM `{table}`").result().to_dataframe()
-        )
-
-        up_to_date_data = pd.concat([available_data, dataframe], ignore_index=True)
-        up_to_date_data.drop_duplicates(inplace=True, keep="first")
-
-        self.load_data(
-            dataframe=up_to_date_data, table=table, job_action=JobAction.OVERWRITE
-        )
+        self.upsert_data(dataframe=dataframe, table=table)
 
     def update_cohorts_devices_table(self, dataframe: pd.DataFrame, table=None) -> None:
         if table is None:
             table = self.cohorts_devices_table
-
-        dataframe.reset_index(drop=True, inplace=True)
-        dataframe = self.validate_data(
-            dataframe=dataframe,
-            table=table,
-        )
-
-        available_data = (
-            self.client.query(query=f"SELECT * FROM `{table}`").result().to_dataframe()
-        )
-
-        up_to_date_data = pd.concat([available_data, dataframe], ignore_index=True)
-        up_to_date_data.drop_duplicates(inplace=True, keep="first")
-
-        self.load_data(
-            dataframe=up_to_date_data, table=table, job_action=JobAction.OVERWRITE
-        )
+        self.upsert_data(dataframe=dataframe, table=table)
 
     def update_sites_and_devices(
         self,
@@ -418,115 +362,36 @@ class BigQueryApi:
         table: str,
         component: str,
     ) -> None:
-        dataframe.reset_index(drop=True, inplace=True)
-        dataframe = self.validate_data(dataframe=dataframe, table=table)
-
         if component == "sites":
-            unique_id = "id"
-
+            merge_spec = TABLE_MERGE_SPECS["sites.json"]
         elif component == "devices":
-            unique_id = "unique_id"
-            dataframe = self.add_unique_id(dataframe)
-
+            merge_spec = TABLE_MERGE_SPECS["devices.json"]
         else:
             raise Exception("Invalid component. Valid values are sites and devices.")
 
-        dataframe.drop_duplicates(subset=[unique_id], inplace=True, keep="first")
-
-        available_data = (
-            self.client.query(query=f"SELECT * FROM `{table}`").result().to_dataframe()
-        )
-
-        if available_data.empty:
-            up_to_date_data = dataframe
-        else:
-            if component == "devices":
-                available_data = self.add_unique_id(available_data)
-
-            available_data.drop_duplicates(
-                subset=[unique_id], inplace=True, keep="first"
-            )
-            data_not_for_updating = available_data.loc[
-                ~available_data[unique_id].isin(dataframe[unique_id].to_list())
-            ]
-            up_to_date_data = pd.concat(
-                [data_not_for_updating, dataframe], ignore_index=True
-            )
-
-        if component == "devices":
-            del up_to_date_data[unique_id]
-
-        self.load_data(
-            dataframe=up_to_date_data, table=table, job_action=JobAction.OVERWRITE
+        self.upsert_data(
+            dataframe=dataframe,
+            table=table,
+            unique_cols=merge_spec.unique_cols,
+            action=MergeAction.UPSERT,
+            case_insensitive_cols=merge_spec.case_insensitive_cols,
         )
 
     def update_sites_meta_data(self, dataframe: pd.DataFrame) -> None:
-        dataframe.reset_index(drop=True, inplace=True)
-        table = self.sites_meta_data_table
-        dataframe = self.validate_data(dataframe=dataframe, table=table)
-
-        unique_id = "site_id"
-
-        dataframe.drop_duplicates(subset=[unique_id], inplace=True, keep="first")
-
-        available_data = (
-            self.client.query(query=f"SELECT * FROM `{table}`").result().to_dataframe()
-        )
-
-        if available_data.empty:
-            up_to_date_data = dataframe
-        else:
-            available_data.drop_duplicates(
-                subset=[unique_id], inplace=True, keep="first"
-            )
-            data_not_for_updating = available_data.loc[
-                ~available_data[unique_id].isin(dataframe[unique_id].to_list())
-            ]
-            up_to_date_data = pd.concat(
-                [data_not_for_updating, dataframe], ignore_index=True
-            )
-
-        self.load_data(
-            dataframe=up_to_date_data, table=table, job_action=JobAction.OVERWRITE
-        )
+        self.upsert_data(dataframe=dataframe, table=self.sites_meta_data_table)
 
     def update_data(
         self,
         dataframe: pd.DataFrame,
         table: str,
     ) -> None:
-        dataframe.reset_index(drop=True, inplace=True)
-        dataframe = self.validate_data(dataframe=dataframe, table=table)
-        dataframe = self.add_unique_id(dataframe=dataframe)
-        dataframe.drop_duplicates(subset=["unique_id"], inplace=True, keep="first")
-
-        available_data = (
-            self.client.query(query=f"SELECT * FROM `{table}`").result().to_dataframe()
-        )
-
-        if available_data.empty:
-            up_to_date_data = dataframe
-        else:
-            available_data["timestamp"] = available_data["timestamp"].apply(
-                pd.to_datetime
-            )
-            available_data = self.add_unique_id(dataframe=available_data)
-
-            available_data.drop_duplicates(
-                subset=["unique_id"], inplace=True, keep="first"
-            )
-            data_not_for_updating = available_data.loc[
-                ~available_data["unique_id"].isin(dataframe["unique_id"].to_list())
-            ]
-            up_to_date_data = pd.concat(
-                [data_not_for_updating, dataframe], ignore_index=True
-            )
-
-        up_to_date_data["timestamp"] = up_to_date_data["timestamp"].apply(date_to_str)
-        del up_to_date_data["unique_id"]
-
-        self.load_data(
-            dataframe=up_to_date_data, table=table, job_action=JobAction.OVERWRITE
+        merge_spec = TABLE_MERGE_SPECS["devices.json"]
+        self.upsert_data(
+            dataframe=dataframe,
+            table=table,
+            unique_cols=merge_spec.unique_cols,
+            action=MergeAction.UPSERT,
+            case_insensitive_cols=merge_spec.case_insensitive_cols,
         )
 
     def compose_query(
@@ -0,0 +1,112 @@
+from enum import Enum
+
+
+class MergeAction(Enum):
+    INSERT_NEW = 1
+    UPSERT = 2
+
+    def __str__(self) -> str:
+        if self == self.INSERT_NEW:
+            return "insert_new"
+        elif self == self.UPSERT:
+            return "upsert"
+        else:
+            return ""
+
+
+class TableMergeSpec:
+    """
+    Declares how staged rows are merged into a table.
+    unique_cols: columns identifying a row. None means every column of the table.
+    action: INSERT_NEW keeps existing rows and only inserts unseen keys,
+            UPSERT replaces existing rows with the staged ones.
+    case_insensitive_cols: unique columns whose values are compared lowercased.
+    """
+
+    def __init__(
+        self,
+        unique_cols: list = None,
+        action=MergeAction.UPSERT,
+        case_insensitive_cols: list = None,
+    ):
+        self.unique_cols = None if unique_cols is None else tuple(unique_cols)
+        self.action = action
+        self.case_insensitive_cols = tuple(case_insensitive_cols or ())
+
+    def get_unique_cols(self, columns: list) -> list:
+        return list(columns) if self.unique_cols is None else list(self.unique_cols)
+
+
+# Keyed by the table's schema file, see BigQueryApi.get_schema_file
+TABLE_MERGE_SPECS = {
+    "airqlouds.json": TableMergeSpec(["id", "tenant"], MergeAction.INSERT_NEW),
+    "grids.json": TableMergeSpec(["id", "tenant"], MergeAction.INSERT_NEW),
+    "cohorts.json": TableMergeSpec(["id", "tenant"], MergeAction.INSERT_NEW),
+    "airqlouds_sites.json": TableMergeSpec(action=MergeAction.INSERT_NEW),
+    "grids_sites.json": TableMergeSpec(action=MergeAction.INSERT_NEW),
+    "cohorts_devices.json": TableMergeSpec(action=MergeAction.INSERT_NEW),
+    "sites.json": TableMergeSpec(["id"], MergeAction.UPSERT),
+    # Devices have always been told apart by their lowercased tenant and device id
+    "devices.json": TableMergeSpec(
+        ["tenant", "device_id", "device_number"],
+        MergeAction.UPSERT,
+        case_insensitive_cols=["tenant", "device_id"],
+    ),
+    "sites_meta_data.json": TableMergeSpec(["site_id"], MergeAction.UPSERT),
+}
+
+
+def quote_identifier(identifier: str) -> str:
+    return f"`{identifier}`"
+
+
+def compose_merge_query(
+    target_table: str,
+    staging_table: str,
+    columns: list,
+    unique_cols: list,
+    action: MergeAction = MergeAction.UPSERT,
+    case_insensitive_cols: list = (),
+) -> str:
+    """
+    Generates a MERGE statement applying the rows of staging_table to target_table.
+    Unique columns are compared null-safely to match pandas drop_duplicates semantics,
+    and lowercased when they are case_insensitive_cols.
+    """
+    if not columns:
+        raise Exception("No columns to merge")
+
+    missing_cols = [col for col in unique_cols if col not in columns]
+    if not unique_cols or missing_cols:
+        raise Exception(f"Invalid unique columns {missing_cols or unique_cols}")
+
+    def key(table: str, col: str) -> str:
+        if col in case_insensitive_cols:
+            return f"LOWER({table}.{col})"
+        return f"{table}.{col}"
+
+    on_clause = "\n  AND ".join(
+        f"{key('target', col)} IS NOT DISTINCT FROM {key('source', col)}"
+        for col in unique_cols
+    )
+    insert_cols = ", ".join(columns)
+    insert_values = ", ".join(f"source.{col}" for col in columns)
+
+    query = (
+        f"MERGE INTO {quote_identifier(target_table)} AS target\n"
+        f"USING {quote_identifier(staging_table)} AS source\n"
+        f"ON {on_clause}\n"
+    )
+
+    # Matched rows take the staged spelling of case insensitive unique columns
+    update_cols = [
+        col for col in columns if col not in unique_cols or col in case_insensitive_cols
+    ]
+    if action == MergeAction.UPSERT and update_cols:
+        update_set = ",\n  ".join(f"{col} = source.{col}" for col in update_cols)
+        query += f"WHEN MATCHED THEN UPDATE SET\n  {update_set}\n"
+
+    query += f"WHEN NOT MATCHED THEN INSERT ({insert_cols})\n"
+    query += f"  VALUES ({insert_values})"
+
+    return query
@@ -21,6 +21,14 @@ class Config:
     # Thingspeak
     THINGSPEAK_API_KEY = os.getenv("THINGSPEAK_API_KEY")
     THINGSPEAK_CHANNEL_URL = os.getenv("THINGSPEAK_CHANNEL_URL")
+    THINGSPEAK_MAX_CONCURRENT_REQUESTS = int(
+        os.getenv("THINGSPEAK_MAX_CONCURRENT_REQUESTS", 10)
+    )
+    THINGSPEAK_REQUESTS_PER_SECOND = float(
+        os.getenv("THINGSPEAK_REQUESTS_PER_SECOND", 5)
+    )
+    THINGSPEAK_MAX_RETRIES = int(os.getenv("THINGSPEAK_MAX_RETRIES", 3))
+    THINGSPEAK_RETRY_BACKOFF = float(os.getenv("THINGSPEAK_RETRY_BACKOFF", 1))
 
     # Aggregated data
     BIGQUERY_HOURLY_EVENTS_TABLE = os.getenv("BIGQUERY_HOURLY_EVENTS_TABLE")
@@ -81,6 +89,9 @@ class Config:
     TAHMO_API_MAX_PERIOD = os.getenv("TAHMO_API_MAX_PERIOD")
     TAHMO_API_KEY = os.getenv("TAHMO_API_CREDENTIALS_USERNAME")
     TAHMO_API_SECRET = os.getenv("TAHMO_API_CREDENTIALS_PASSWORD")
+    TAHMO_MAX_CONCURRENT_REQUESTS = int(os.getenv("TAHMO_MAX_CONCURRENT_REQUESTS", 10))
+    TAHMO_MAX_RETRIES = int(os.getenv("TAHMO_MAX_RETRIES", 5))
+    TAHMO_RETRY_BACKOFF = float(os.getenv("TAHMO_RETRY_BACKOFF", 5))
 
     # OpenWeather
     OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
@@ -90,6 +101,14 @@ class Config:
     BOOTSTRAP_SERVERS = os.getenv("BOOTSTRAP_SERVERS", "localhost:9092").split(",")
     TOPIC_PARTITIONS = os.getenv("TOPIC_PARTITIONS", "1,2,3,4").split(",")
     SCHEMA_REGISTRY_URL = os.getenv("SCHEMA_REGISTRY_URL")
+    # gzip is read by every consumer, including kafkajs in device-registry.
+    # lz4 and zstd need the lz4 or zstandard package installed next to
+    # kafka-python, and consumers of the topic that can decompress them.
+    KAFKA_COMPRESSION_TYPE = os.getenv("KAFKA_COMPRESSION_TYPE", "gzip")
+    KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", 50))
+    KAFKA_BATCH_SIZE = int(os.getenv("KAFKA_BATCH_SIZE", 262144))
+    KAFKA_MESSAGE_SIZE = int(os.getenv("KAFKA_MESSAGE_SIZE", 50))
+    KAFKA_MESSAGE_SERIALIZER = os.getenv("KAFKA_MESSAGE_SERIALIZER", "json")
 
     # Kafka Topics
     WEATHER_MEASUREMENTS_TOPIC = os.getenv("WEATHER_MEASUREMENTS_TOPIC")
@@ -179,6 +198,13 @@ class Config:
     DAILY_FORECAST_HORIZON = os.getenv("DAILY_FORECAST_HORIZON")
     MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI")
     FORECAST_MODELS_BUCKET = os.getenv("FORECAST_MODELS_BUCKET")
+    CALIBRATION_MODELS_BUCKET = os.getenv(
+        "CALIBRATION_MODELS_BUCKET", "airqo_prediction_bucket"
+    )
+    CALIBRATION_MODELS_CACHE_DIR = os.getenv(
+        "CALIBRATION_MODELS_CACHE_DIR", "/tmp/calibration_models"
+    )
+    CALIBRATION_BATCH_SIZE = int(os.getenv("CALIBRATION_BATCH_SIZE", 100000))
     MONGO_URI = os.getenv("MONGO_URI")
     MONGO_DATABASE_NAME = os.getenv("MONGO_DATABASE_NAME", "airqo_db")
     ENVIRONMENT = os.getenv("ENVIRONMENT")
@@ -6,6 +6,71 @@ import pandas as pd
 from airqo_etl_utils.bigquery_api import BigQueryApi
 from airqo_etl_utils.constants import Tenant, ColumnDataType, Frequency
 from airqo_etl_utils.date import date_to_str
+from airqo_etl_utils.schema_registry import SchemaRegistry, ALL_TABLES_SCHEMA
+
+
+class ValidRange:
+    """
+    Range of valid values for a measurement. Values below the minimum (or equal
+    to it when min_inclusive is False) or above the maximum are outliers.
+    """
+
+    def __init__(self, minimum=-np.inf, maximum=np.inf, min_inclusive=True):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.min_inclusive = min_inclusive
+
+    def is_outlier(self, value) -> bool:
+        below_minimum = (
+            value < self.minimum if self.min_inclusive else value <= self.minimum
+        )
+        return bool(below_minimum or value > self.maximum)
+
+
+VALID_VALUE_RANGES = {
+    "pm2_5": ValidRange(1, 1000),
+    "pm10": ValidRange(1, 1000),
+    "latitude": ValidRange(-90, 90),
+    "longitude": ValidRange(-180, 180),
+    "battery": ValidRange(2.7, 5),
+    "no2": ValidRange(0, 2049),
+    "altitude": ValidRange(0, min_inclusive=False),
+    "hdop": ValidRange(0, min_inclusive=False),
+    "satellites": ValidRange(0, 50, min_inclusive=False),
+    "temperature": ValidRange(0, 45, min_inclusive=False),
+    "humidity": ValidRange(0, 99, min_inclusive=False),
+    "pressure": ValidRange(30, 110),
+}
+
+# Columns validated against the range of another measurement
+COLUMN_ALIASES = {
+    "pm2_5": [
+        "s1_pm2_5",
+        "s2_pm2_5",
+        "pm2_5_pi",
+        "pm2_5_raw_value",
+        "pm2_5_calibrated_value",
+    ],
+    "pm10": [
+        "s1_pm10",
+        "s2_pm10",
+        "pm10_pi",
+        "pm10_raw_value",
+        "pm10_calibrated_value",
+    ],
+    "humidity": ["device_humidity"],
+    "temperature": ["device_temperature"],
+    "no2": ["no2_raw_value", "no2_calibrated_value"],
+}
+
+COLUMN_VALID_RANGES = {
+    **VALID_VALUE_RANGES,
+    **{
+        alias: VALID_VALUE_RANGES[name]
+        for name, aliases in COLUMN_ALIASES.items()
+        for alias in aliases
+    },
+}
 
 
 class DataValidationUtils:
@@ -37,47 +102,32 @@ class DataValidationUtils:
 
     @staticmethod
     def get_valid_value(value, name):
-        if (name == "pm2_5" or name == "pm10") and (value < 1 or value > 1000):
-            return None
-        elif name == "latitude" and (value < -90 or value > 90):
-            return None
-        elif name == "longitude" and (value < -180 or value > 180):
-            return None
-        elif name == "battery" and (value < 2.7 or value > 5):
-            return None
-        elif name == "no2" and (value < 0 or value > 2049):
-            return None
-        elif (name == "altitude" or name == "hdop") and value <= 0:
-            return None
-        elif name == "satellites" and (value <= 0 or value > 50):
-            return None
-        elif (name == "temperature") and (value <= 0 or value > 45):
+        valid_range = VALID_VALUE_RANGES.get(name)
+        if valid_range and valid_range.is_outlier(value):
             return None
-        elif (name == "humidity") and (value <= 0 or value > 99):
-            return None
-        elif name == "pressure" and (value < 30 or value > 110):
-            return None
-        else:
-            pass
 
         return value
 
     @staticmethod
     def remove_outliers(data: pd.DataFrame) -> pd.DataFrame:
-        big_query_api = BigQueryApi()
-        float_columns = set(
-            big_query_api.get_columns(table="all", column_type=ColumnDataType.FLOAT)
-        )
-        integer_columns = set(
-            big_query_api.get_columns(table="all", column_type=ColumnDataType.INTEGER)
-        )
-        timestamp_columns = set(
-            big_query_api.get_columns(table="all", column_type=ColumnDataType.TIMESTAMP)
-        )
+        schema = SchemaRegistry.get_schema(ALL_TABLES_SCHEMA)
+        data_columns = set(data.columns)
 
-        float_columns = list(float_columns & set(data.columns))
-        integer_columns = list(integer_columns & set(data.columns))
-        timestamp_columns = list(timestamp_columns & set(data.columns))
+        float_columns = [
+            col
+            for col in schema.get_columns(column_type=ColumnDataType.FLOAT)
+            if col in data_columns
+        ]
+        integer_columns = [
+            col
+            for col in schema.get_columns(column_type=ColumnDataType.INTEGER)
+            if col in data_columns
+        ]
+        timestamp_columns = [
+            col
+            for col in schema.get_columns(column_type=ColumnDataType.TIMESTAMP)
+            if col in data_columns
+        ]
 
         data = DataValidationUtils.format_data_types(
             data=data,
@@ -86,46 +136,55 @@ class DataValidationUtils:
             timestamps=timestamp_columns,
         )
 
-        columns = []
-        columns.extend(float_columns)
-        columns.extend(integer_columns)
-        columns.extend(timestamp_columns)
-
-        for col in columns:
-            name = col
-            if name in [
-                "pm2_5",
-                "s1_pm2_5",
-                "s2_pm2_5",
-                "pm2_5_pi",
-                "pm2_5_raw_value",
-                "pm2_5_calibrated_value",
-            ]:
-                name = "pm2_5"
-            elif name in [
-                "pm10",
-                "s1_pm10",
-                "s2_pm10",
-                "pm10_pi",
-                "pm10_raw_value",
-                "pm10_calibrated_value",
-            ]:
-                name = "pm10"
-            elif name in ["device_humidity", "humidity"]:
-                name = "humidity"
-            elif col in ["device_temperature", "temperature"]:
-                name = "temperature"
-            elif name in ["no2", "no2_raw_value", "no2_calibrated_value"]:
-                name = "no2"
-            elif name in ["pm1", "pm1_raw_value", "pm1_pi"]:
-                name = "pm1"
-
-            data.loc[:, col] = data[col].apply(
-                lambda x: DataValidationUtils.get_valid_value(x, name)
-            )
+        columns = [
+            col
+            for col in float_columns + integer_columns
+            if COLUMN_VALID_RANGES.get(col)
+        ]
+        if not columns:
+            return data
+
+        ranges = [COLUMN_VALID_RANGES[col] for col in columns]
+        minimums = np.array([valid_range.minimum for valid_range in ranges])
+        maximums = np.array([valid_range.maximum for valid_range in ranges])
+        inclusive = np.array([valid_range.min_inclusive for valid_range in ranges])
+
+        values = data[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        outliers = np.where(inclusive, values < minimums, values <= minimums)
+        outliers |= values > maximums
+
+        for index in np.flatnonzero(outliers.any(axis=0)):
+            col = columns[index]
+            data[col] = data[col].where(~outliers[:, index])
 
         return data
 
+    @staticmethod
+    def merge_duplicates(data: pd.DataFrame, unique_cols: list) -> pd.DataFrame:
+        """
+        Collapses rows sharing the unique columns into a single row holding the first
+        non-null value of each column. Rows without duplicates are returned first,
+        followed by the merged rows ordered by the unique columns. A "duplicated"
+        column flags the merged rows.
+        """
+        data["duplicated"] = data.duplicated(keep=False, subset=unique_cols)
+
+        if not data["duplicated"].any():
+            return data
+
+        duplicated_data = data.loc[data["duplicated"]].sort_values(
+            by=unique_cols, kind="stable"
+        )
+        not_duplicated_data = data.loc[~data["duplicated"]]
+
+        merged_data = (
+            duplicated_data.groupby(by=unique_cols, sort=False)
+            .first()
+            .reset_index()[data.columns]
+        )
+
+        return pd.concat([not_duplicated_data, merged_data], ignore_index=True)
+
     @staticmethod
     def fill_missing_columns(data: pd.DataFrame, cols: list) -> pd.DataFrame:
         for col in cols:
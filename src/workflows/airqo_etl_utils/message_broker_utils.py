@@ -1,4 +1,4 @@
-import json
+import threading
 
 import numpy as np
 import pandas as pd
@@ -8,67 +8,102 @@ from .config import configuration
 from airqo_etl_utils.airqo_api import AirQoApi
 from airqo_etl_utils.constants import Tenant
 from .date import date_to_str
+from .message_serializers import get_serializer
 
 
 class MessageBrokerUtils:
-    def __init__(self):
-        self.__partitions = configuration.TOPIC_PARTITIONS
+    # Producers are long-lived and shared by all instances in the process
+    __producers = {}
+    __producers_lock = threading.Lock()
+
+    def __init__(self, serializer: str = None, compression_type: str = None):
         self.__bootstrap_servers = configuration.BOOTSTRAP_SERVERS
-        self.__partitions = [0, 1, 2]
+        self.__compression_type = (
+            compression_type
+            if compression_type
+            else configuration.KAFKA_COMPRESSION_TYPE
+        )
+        self.__serializer = get_serializer(
+            serializer if serializer else configuration.KAFKA_MESSAGE_SERIALIZER
+        )
+        self.__message_size = configuration.KAFKA_MESSAGE_SIZE
         self.bam_measurements_topic = configuration.BAM_MEASUREMENTS_TOPIC
 
-    def __get_partition(self, current_partition) -> int:
-        current_partition = current_partition + 1
-        if current_partition in self.__partitions:
-            return current_partition
-        return self.__partitions[0]
+    def __get_producer(self) -> KafkaProducer:
+        key = (tuple(self.__bootstrap_servers), self.__compression_type)
+        with MessageBrokerUtils.__producers_lock:
+            if key not in MessageBrokerUtils.__producers:
+                MessageBrokerUtils.__producers[key] = KafkaProducer(
+                    bootstrap_servers=self.__bootstrap_servers,
+                    api_version_auto_timeout_ms=300000,
+                    retries=5,
+                    request_timeout_ms=300000,
+                    linger_ms=configuration.KAFKA_LINGER_MS,
+                    batch_size=configuration.KAFKA_BATCH_SIZE,
+                    compression_type=self.__compression_type,
+                    key_serializer=lambda key: (
+                        None if key is None else str(key).encode("utf-8")
+                    ),
+                )
+            return MessageBrokerUtils.__producers[key]
 
     @classmethod
-    def __on_success(cls, record_metadata):
-        print("\nSuccessfully sent message")
-        print(f"Topic : {record_metadata.topic}")
-        print(f"Partition : {record_metadata.partition}")
-        print(f"Offset : {record_metadata.offset}")
+    def close_producers(cls):
+        with cls.__producers_lock:
+            for producer in cls.__producers.values():
+                producer.close()
+            cls.__producers.clear()
 
     @classmethod
     def __on_error(cls, exception):
         print("\nFailed to send message")
         print(exception)
 
-    def __send_data(self, topic: str, data: pd.DataFrame, partition: int = None):
-        data.to_csv("message_broker_data.csv", index=False)
-        producer = KafkaProducer(
-            bootstrap_servers=self.__bootstrap_servers,
-            api_version_auto_timeout_ms=300000,
-            retries=5,
-            request_timeout_ms=300000,
-        )
-
-        print("Dataframe info : ")
-        print(data.info())
-        print("Dataframe description : ")
-        print(data.describe())
-
-        chunks = int(len(data) / 50)
-        chunks = chunks if chunks > 0 else 1
-        dataframes = np.array_split(data, chunks)
-        current_partition = -1
-        for dataframe in dataframes:
-            dataframe = pd.DataFrame(dataframe).replace(np.nan, None)
-            message = {"data": dataframe.to_dict("records")}
-
-            current_partition = (
-                partition
-                if partition or partition == 0
-                else self.__get_partition(current_partition=current_partition)
-            )
-            kafka_message = json.dumps(message, allow_nan=True).encode("utf-8")
-            print(kafka_message)
+    def __messages(self, data: pd.DataFrame, key_column: str):
+        """
+        Yields (key, message) pairs. Records of the same key are grouped into
+        messages of at most KAFKA_MESSAGE_SIZE records.
+        """
+        records = data.replace(np.nan, None).to_dict("records")
+
+        if key_column in data.columns:
+            groups = data.groupby(by=key_column, sort=False, dropna=False).indices
+        else:
+            groups = {None: np.arange(len(records))}
+
+        for key, positions in groups.items():
+            key = None if pd.isna(key) else key
+            for index in range(0, len(positions), self.__message_size):
+                chunk = positions[index : index + self.__message_size]
+                yield key, {"data": [records[position] for position in chunk]}
+
+    def __send_data(
+        self,
+        topic: str,
+        data: pd.DataFrame,
+        partition: int = None,
+        key_column: str = "device_id",
+    ) -> int:
+        producer = self.__get_producer()
+        sent_bytes = 0
+        messages = 0
+
+        for key, message in self.__messages(data=data, key_column=key_column):
+            value = self.__serializer.serialize(message)
+            sent_bytes += len(value)
+            messages += 1
             producer.send(
                 topic=topic,
-                value=kafka_message,
-                partition=current_partition,
-            ).add_callback(self.__on_success).add_errback(self.__on_error)
+                key=key,
+                value=value,
+                partition=partition,
+            ).add_errback(self.__on_error)
+
+        producer.flush()
+        print(
+            f"Sent {len(data)} records in {messages} messages ({sent_bytes} bytes) to {topic}"
+        )
+        return messages
 
     @staticmethod
     def update_hourly_data_topic(data: pd.DataFrame):
@@ -0,0 +1,84 @@
+import io
+import json
+import os
+
+
+class JsonSerializer:
+    name = "json"
+
+    def serialize(self, message: dict) -> bytes:
+        return json.dumps(message, allow_nan=True).encode("utf-8")
+
+    def deserialize(self, value: bytes) -> dict:
+        return json.loads(value)
+
+
+class OrjsonSerializer:
+    """JSON output compatible with JsonSerializer, encoded with orjson."""
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self.orjson = orjson
+
+    def serialize(self, message: dict) -> bytes:
+        return self.orjson.dumps(message, option=self.orjson.OPT_SERIALIZE_NUMPY)
+
+    def deserialize(self, value: bytes) -> dict:
+        return self.orjson.loads(value)
+
+
+class MsgpackSerializer:
+    name = "msgpack"
+
+    def __init__(self):
+        import msgpack
+
+        self.msgpack = msgpack
+
+    def serialize(self, message: dict) -> bytes:
+        return self.msgpack.packb(message, use_bin_type=True)
+
+    def deserialize(self, value: bytes) -> dict:
+        return self.msgpack.unpackb(value, raw=False)
+
+
+class AvroSerializer:
+    """Schemaless Avro encoding against a schema stored in the schema folder."""
+
+    name = "avro"
+
+    def __init__(self, schema_file: str = "hourly_measurements.avsc"):
+        import fastavro
+
+        self.fastavro = fastavro
+        path, _ = os.path.split(__file__)
+        with open(os.path.join(path, "schema", schema_file)) as file:
+            self.schema = fastavro.parse_schema(json.load(file))
+
+    def serialize(self, message: dict) -> bytes:
+        buffer = io.BytesIO()
+        self.fastavro.schemaless_writer(buffer, self.schema, message)
+        return buffer.getvalue()
+
+    def deserialize(self, value: bytes) -> dict:
+        return self.fastavro.schemaless_reader(io.BytesIO(value), self.schema)
+
+
+MESSAGE_SERIALIZERS = {
+    JsonSerializer.name: JsonSerializer,
+    OrjsonSerializer.name: OrjsonSerializer,
+    MsgpackSerializer.name: MsgpackSerializer,
+    AvroSerializer.name: AvroSerializer,
+}
+
+
+def get_serializer(name: str):
+    try:
+        return MESSAGE_SERIALIZERS[name]()
+    except KeyError:
+        raise Exception(
+            f"Invalid serializer {name}. Valid values are {list(MESSAGE_SERIALIZERS.keys())}"
+        )
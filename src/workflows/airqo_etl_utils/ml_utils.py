@@ -1,5 +1,5 @@
 import json
-from datetime import datetime, timedelta
+from datetime import datetime
 
 import gcsfs
 import joblib
@@ -19,6 +19,31 @@ additional_columns = ["site_id"]
 
 pd.options.mode.chained_assignment = None
 
+# Lag and rolling window features of the target, see get_lag_and_roll_features
+LAG_AND_ROLL_FEATURES = {
+    "daily": {
+        "unit": "day",
+        "lags": [1, 2, 3, 7],
+        "windows": [2, 3, 7],
+        "functions": ["mean", "std", "max", "min"],
+        "step": pd.Timedelta(days=1),
+    },
+    "hourly": {
+        "unit": "hour",
+        "lags": [1, 2, 6, 12],
+        "windows": [3, 6, 12, 24],
+        "functions": ["mean", "std", "median", "skew"],
+        "step": pd.Timedelta(hours=1),
+    },
+}
+
+# Timestamp attributes encoded as cyclic features and their periods,
+# see get_time_and_cyclic_features
+CYCLIC_FEATURES = {
+    "daily": {"year": 2023, "month": 12, "day": 30, "dayofweek": 7},
+    "hourly": {"year": 2023, "month": 12, "day": 30, "dayofweek": 7, "hour": 23},
+}
+
 
 class GCSUtils:
     """Utility class for saving and retrieving models from GCS"""
@@ -121,33 +146,16 @@ class ForecastUtils:
         df["timestamp"] = pd.to_datetime(df["timestamp"])
 
         df1 = df.copy()  # use copy to prevent terminal warning
-        if freq == "daily":
-            shifts = [1, 2, 3, 7]
-            for s in shifts:
-                df1[f"pm2_5_last_{s}_day"] = df1.groupby(["device_id"])[
-                    target_col
-                ].shift(s)
-            shifts = [2, 3, 7]
-            functions = ["mean", "std", "max", "min"]
-            for s in shifts:
-                for f in functions:
-                    df1[f"pm2_5_{f}_{s}_day"] = (
-                        df1.groupby(["device_id"])[target_col]
-                        .shift(1)
-                        .rolling(s)
-                        .agg(f)
-                    )
-        elif freq == "hourly":
-            shifts = [1, 2, 6, 12]
-            for s in shifts:
-                df1[f"pm2_5_last_{s}_hour"] = df1.groupby(["device_id"])[
+        if freq in LAG_AND_ROLL_FEATURES:
+            spec = LAG_AND_ROLL_FEATURES[freq]
+            unit = spec["unit"]
+            for s in spec["lags"]:
+                df1[f"pm2_5_last_{s}_{unit}"] = df1.groupby(["device_id"])[
                     target_col
                 ].shift(s)
-            shifts = [3, 6, 12, 24]
-            functions = ["mean", "std", "median", "skew"]
-            for s in shifts:
-                for f in functions:
-                    df1[f"pm2_5_{f}_{s}_hour"] = (
+            for s in spec["windows"]:
+                for f in spec["functions"]:
+                    df1[f"pm2_5_{f}_{s}_{unit}"] = (
                         df1.groupby(["device_id"])[target_col]
                         .shift(1)
                         .rolling(s)
@@ -430,149 +438,19 @@ class ForecastUtils:
         data = data.dropna(subset=["device_id"])
         data["timestamp"] = pd.to_datetime(data["timestamp"])
         data.columns = data.columns.str.strip()
-        # data["margin_of_error"] = data["adjusted_forecast"] = 0
 
-        def get_forecasts(
-            df_tmp,
-            forecast_model,
-            frequency,
-            horizon,
-        ):
-            """This method generates forecasts for a given device dataframe basing on horizon provided"""
-            for i in range(int(horizon)):
-                df_tmp = pd.concat([df_tmp, df_tmp.iloc[-1:]], ignore_index=True)
-                df_tmp_no_ts = df_tmp.drop(
-                    columns=["timestamp", "device_id", "site_id"], axis=1, inplace=False
-                )
-                # daily frequency
-                if frequency == "daily":
-                    df_tmp.tail(1)["timestamp"] += timedelta(days=1)
-                    shifts1 = [1, 2, 3, 7]
-                    for s in shifts1:
-                        df_tmp[f"pm2_5_last_{s}_day"] = df_tmp.shift(s, axis=0)["pm2_5"]
-                    # rolling features
-                    shifts2 = [2, 3, 7]
-                    functions = ["mean", "std", "max", "min"]
-                    for s in shifts2:
-                        for f in functions:
-                            df_tmp[f"pm2_5_{f}_{s}_day"] = (
-                                df_tmp_no_ts.shift(1, axis=0).rolling(s).agg(f)
-                            )["pm2_5"]
-
-                elif frequency == "hourly":
-                    df_tmp.iloc[-1, df_tmp.columns.get_loc("timestamp")] = df_tmp.iloc[
-                        -2, df_tmp.columns.get_loc("timestamp")
-                    ] + pd.Timedelta(hours=1)
-
-                    # lag features
-                    shifts1 = [1, 2, 6, 12]
-                    for s in shifts1:
-                        df_tmp[f"pm2_5_last_{s}_hour"] = df_tmp.shift(s, axis=0)[
-                            "pm2_5"
-                        ]
-
-                    # rolling features
-                    shifts2 = [3, 6, 12, 24]
-                    functions = ["mean", "std", "median", "skew"]
-                    for s in shifts2:
-                        for f in functions:
-                            df_tmp[f"pm2_5_{f}_{s}_hour"] = (
-                                df_tmp_no_ts.shift(1, axis=0).rolling(s).agg(f)
-                            )["pm2_5"]
-
-                attributes = ["year", "month", "day", "dayofweek"]
-                max_vals = [2023, 12, 30, 7]
-                if frequency == "hourly":
-                    attributes.append("hour")
-                    max_vals.append(23)
-                for a, m in zip(attributes, max_vals):
-                    df_tmp.tail(1)[f"{a}_sin"] = np.sin(
-                        2
-                        * np.pi
-                        * df_tmp.tail(1)["timestamp"].dt.__getattribute__(a)
-                        / m
-                    )
-                    df_tmp.tail(1)[f"{a}_cos"] = np.cos(
-                        2
-                        * np.pi
-                        * df_tmp.tail(1)["timestamp"].dt.__getattribute__(a)
-                        / m
-                    )
-                df_tmp.tail(1)["week_sin"] = np.sin(
-                    2 * np.pi * df_tmp.tail(1)["timestamp"].dt.isocalendar().week / 52
-                )
-                df_tmp.tail(1)["week_cos"] = np.cos(
-                    2 * np.pi * df_tmp.tail(1)["timestamp"].dt.isocalendar().week / 52
-                )
-
-                excluded_columns = [
-                    "device_id",
-                    "site_id",
-                    "pm2_5",
-                    "timestamp",
-                    "latitude",
-                    "longitude",
-                    # "margin_of_error",
-                    # "adjusted_forecast",
-                ]
-                # excluded_columns_2 = [
-                #     "timestamp",
-                #     "margin_of_error",
-                #     "adjusted_forecast",
-                # ]
-                df_tmp.loc[df_tmp.index[-1], "pm2_5"] = forecast_model.predict(
-                    df_tmp.drop(excluded_columns, axis=1).tail(1).values.reshape(1, -1)
-                )
-                # df_tmp.loc[df_tmp.index[-1], "margin_of_error"] = error_model.predict(
-                #     df_tmp.drop(excluded_columns_2, axis=1)
-                #     .tail(1)
-                #     .values.reshape(1, -1)
-                # )
-                # df_tmp.loc[df_tmp.index[-1], "adjusted_forecast"] = (
-                #     df_tmp.loc[df_tmp.index[-1], "pm2_5"]
-                #     + df_tmp.loc[df_tmp.index[-1], "margin_of_error"]
-                # )
-
-            return df_tmp.iloc[-int(horizon) :, :]
-
-        forecasts = pd.DataFrame()
         forecast_model = GCSUtils.get_trained_model_from_gcs(
             project_name, bucket_name, f"{frequency}_forecast_model.pkl"
         )
-        # error_model = GCSUtils.get_trained_model_from_gcs(
-        #     project_name, bucket_name, f"{frequency}_error_model.pkl"
-        # )
-
-        df_tmp = data.copy()
-        for device in df_tmp["device_id"].unique():
-            test_copy = df_tmp[df_tmp["device_id"] == device]
-            horizon = (
-                configuration.HOURLY_FORECAST_HORIZON
-                if frequency == "hourly"
-                else configuration.DAILY_FORECAST_HORIZON
-            )
-            device_forecasts = get_forecasts(
-                test_copy,
-                forecast_model,
-                frequency,
-                horizon,
-            )
-
-            forecasts = pd.concat([forecasts, device_forecasts], ignore_index=True)
-
-        forecasts["pm2_5"] = forecasts["pm2_5"].astype(float)
-        # forecasts["margin_of_error"] = forecasts["margin_of_error"].astype(float)
+        horizon = (
+            configuration.HOURLY_FORECAST_HORIZON
+            if frequency == "hourly"
+            else configuration.DAILY_FORECAST_HORIZON
+        )
 
-        return forecasts[
-            [
-                "device_id",
-                "site_id",
-                "timestamp",
-                "pm2_5",
-                # "margin_of_error",
-                # "adjusted_forecast",
-            ]
-        ]
+        return RecursiveForecaster(data=data, frequency=frequency).forecast(
+            forecast_model=forecast_model, horizon=int(horizon)
+        )
 
     @staticmethod
     def save_forecasts_to_mongo(data, frequency):
@@ -615,3 +493,160 @@ class ForecastUtils:
                 print(
                     f"Failed to update forecast for device {doc['device_id']}: {str(e)}"
                 )
+
+
+class RecursiveForecaster:
+    """
+    Forecasts all devices together, one step at a time, feeding each step's
+    predictions back as the history of the next step.
+
+    The most recent pm2_5 values of each device are kept in a ring buffer
+    (devices x window), so lag and rolling features of a step are read from a
+    fixed size window instead of being recomputed over the whole history, and
+    the model is called once per step for all devices.
+    """
+
+    EXCLUDED_COLUMNS = [
+        "device_id",
+        "site_id",
+        "pm2_5",
+        "timestamp",
+        "latitude",
+        "longitude",
+    ]
+
+    def __init__(self, data: pd.DataFrame, frequency: str):
+        if frequency not in LAG_AND_ROLL_FEATURES:
+            raise ValueError("Invalid frequency")
+
+        self.frequency = frequency
+        self.spec = LAG_AND_ROLL_FEATURES[frequency]
+        self.window = max(self.spec["lags"] + self.spec["windows"])
+
+        self.feature_columns = [
+            column for column in data.columns if column not in self.EXCLUDED_COLUMNS
+        ]
+        self.column_index = {
+            column: index for index, column in enumerate(self.feature_columns)
+        }
+
+        devices = data.groupby("device_id", sort=False)
+        self.last_rows = devices.tail(1).reset_index(drop=True)
+        self.features = self.last_rows[self.feature_columns].to_numpy(
+            dtype=np.float64, na_value=np.nan
+        )
+
+        # Devices with a shorter history are padded with NaNs, which makes
+        # the features depending on the missing values NaN as with pandas
+        self.values = np.full((len(self.last_rows), self.window), np.nan)
+        history = devices.tail(self.window)
+        rows = pd.Index(self.last_rows["device_id"]).get_indexer(history["device_id"])
+        positions = history.groupby("device_id", sort=False).cumcount(ascending=False)
+        self.values[rows, self.window - 1 - positions.to_numpy()] = history[
+            "pm2_5"
+        ].to_numpy(dtype=np.float64)
+        self.head = 0
+
+    def push(self, values: np.ndarray):
+        self.values[:, self.head] = values
+        self.head = (self.head + 1) % self.window
+
+    def recent_values(self) -> np.ndarray:
+        """The buffered values of each device, oldest first."""
+        order = (self.head + np.arange(self.window)) % self.window
+        return self.values[:, order]
+
+    @staticmethod
+    def rolling_aggregate(window: np.ndarray, function: str) -> np.ndarray:
+        """Aggregates each row of window as pandas' rolling aggregations do."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if function == "mean":
+                return window.mean(axis=1)
+            if function == "max":
+                return window.max(axis=1)
+            if function == "min":
+                return window.min(axis=1)
+            if function == "median":
+                return np.median(window, axis=1)
+
+            constant = (window == window[:, :1]).all(axis=1)
+            if function == "std":
+                return np.where(constant, 0.0, window.std(axis=1, ddof=1))
+            if function == "skew":
+                n = window.shape[1]
+                deviations = window - window.mean(axis=1, keepdims=True)
+                m2 = (deviations**2).mean(axis=1)
+                m3 = (deviations**3).mean(axis=1)
+                skew = np.sqrt(n * (n - 1)) / (n - 2) * m3 / m2**1.5
+                skew = np.where(m2 <= 1e-14, np.nan, skew)
+                return np.where(constant, 0.0, skew)
+
+        raise ValueError(f"Invalid rolling function {function}")
+
+    def update_lag_and_roll_features(self, features: np.ndarray):
+        recent = self.recent_values()
+        unit = self.spec["unit"]
+
+        for lag in self.spec["lags"]:
+            index = self.column_index.get(f"pm2_5_last_{lag}_{unit}")
+            if index is not None:
+                features[:, index] = recent[:, -lag]
+
+        for window in self.spec["windows"]:
+            for function in self.spec["functions"]:
+                index = self.column_index.get(f"pm2_5_{function}_{window}_{unit}")
+                if index is not None:
+                    features[:, index] = self.rolling_aggregate(
+                        recent[:, -window:], function
+                    )
+
+    def cyclic_features(self, timestamps: pd.Series) -> dict:
+        features = {}
+        for attribute, period in CYCLIC_FEATURES[self.frequency].items():
+            values = getattr(timestamps.dt, attribute).to_numpy(dtype=np.float64)
+            features[f"{attribute}_sin"] = np.sin(2 * np.pi * values / period)
+            features[f"{attribute}_cos"] = np.cos(2 * np.pi * values / period)
+
+        week = timestamps.dt.isocalendar().week.to_numpy(dtype=np.float64)
+        features["week_sin"] = np.sin(2 * np.pi * week / 52)
+        features["week_cos"] = np.cos(2 * np.pi * week / 52)
+
+        return {
+            column: values
+            for column, values in features.items()
+            if column in self.column_index
+        }
+
+    def forecast(self, forecast_model, horizon: int) -> pd.DataFrame:
+        devices = len(self.last_rows)
+        steps = np.arange(1, horizon + 1)
+
+        # Forecasts are laid out device by device, step by step
+        timestamps = self.last_rows["timestamp"].repeat(horizon).reset_index(
+            drop=True
+        ) + pd.Series(np.tile(steps, devices) * self.spec["step"])
+        cyclic_features = {
+            column: values.reshape(devices, horizon)
+            for column, values in self.cyclic_features(timestamps).items()
+        }
+
+        predictions = np.empty((devices, horizon), dtype=np.float64)
+        features = self.features.copy()
+        for step in range(horizon):
+            self.update_lag_and_roll_features(features)
+            for column, values in cyclic_features.items():
+                features[:, self.column_index[column]] = values[:, step]
+
+            if devices:
+                predictions[:, step] = forecast_model.predict(features)
+            self.push(predictions[:, step])
+
+        forecasts = pd.DataFrame(
+            {
+                "device_id": self.last_rows["device_id"].repeat(horizon).to_numpy(),
+                "site_id": self.last_rows["site_id"].repeat(horizon).to_numpy(),
+                "timestamp": timestamps,
+                "pm2_5": predictions.reshape(-1),
+            }
+        )
+        return forecasts
@@ -0,0 +1,98 @@
+import os
+import pickle
+import shutil
+import threading
+import uuid
+
+from .config import configuration
+
+
+class GCSModelStore:
+    def __init__(self, bucket_name: str):
+        from google.cloud import storage
+
+        self.bucket_name = bucket_name
+        self.bucket = storage.Client().bucket(bucket_name)
+
+    def get_generation(self, source_file: str) -> str:
+        blob = self.bucket.get_blob(source_file)
+        if blob is None:
+            raise Exception(f"{source_file} not found in bucket {self.bucket_name}")
+        return str(blob.generation or blob.etag)
+
+    def download(self, source_file: str, destination_file: str):
+        self.bucket.blob(source_file).download_to_filename(destination_file)
+        print(
+            f"file: {destination_file} downloaded from bucket: {self.bucket_name} successfully"
+        )
+        return destination_file
+
+
+class LocalModelStore:
+    """Filesystem stand-in for a GCS bucket of model files."""
+
+    def __init__(self, root: str):
+        self.bucket_name = root
+        self.root = root
+        self.downloads = 0
+
+    def get_generation(self, source_file: str) -> str:
+        stat = os.stat(os.path.join(self.root, source_file))
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def download(self, source_file: str, destination_file: str):
+        self.downloads += 1
+        shutil.copyfile(os.path.join(self.root, source_file), destination_file)
+        return destination_file
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of pickled models. Models are kept in memory and on
+    local disk, keyed by the generation of the stored object, so a model is
+    downloaded and deserialized again only after it is replaced in the bucket.
+    """
+
+    _models = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_model(cls, store, source_file: str, cache_dir: str = None):
+        generation = store.get_generation(source_file)
+        key = (store.bucket_name, source_file)
+
+        with cls._lock:
+            cached = cls._models.get(key)
+            if cached and cached[0] == generation:
+                return cached[1]
+
+            cache_dir = cache_dir or configuration.CALIBRATION_MODELS_CACHE_DIR
+            model_file = cls.__cached_file(store, source_file, generation, cache_dir)
+            with open(model_file, "rb") as file:
+                model = pickle.load(file)
+
+            cls._models[key] = (generation, model)
+            return model
+
+    @staticmethod
+    def __cached_file(store, source_file: str, generation: str, cache_dir: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        model_file = os.path.join(
+            cache_dir, f"{generation}-{os.path.basename(source_file)}"
+        )
+        if not os.path.exists(model_file):
+            temp_file = f"{model_file}.{uuid.uuid4().hex}.tmp"
+            store.download(source_file=source_file, destination_file=temp_file)
+            os.replace(temp_file, model_file)
+
+            # Drop the files of replaced generations
+            suffix = f"-{os.path.basename(source_file)}"
+            for entry in os.scandir(cache_dir):
+                if entry.name.endswith(suffix) and entry.path != model_file:
+                    os.remove(entry.path)
+        return model_file
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._models = {}
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+
+from .constants import ColumnDataType
+
+ALL_TABLES_SCHEMA = "all"
+
+# Schema files combined when columns are requested for table="all"
+ALL_TABLES_SCHEMA_FILES = [
+    "measurements",
+    "raw_measurements",
+    "weather_data",
+    "latest_measurements",
+    "data_warehouse",
+    "sites",
+    "sensor_positions",
+    "devices",
+    "mobile_measurements",
+    "airqo_mobile_measurements",
+    "bam_measurements",
+    "bam_raw_measurements",
+]
+
+PANDAS_DTYPES = {
+    str(ColumnDataType.FLOAT): "float64",
+    str(ColumnDataType.INTEGER): "int64",
+    str(ColumnDataType.TIMESTAMP): "datetime64[ns]",
+    str(ColumnDataType.STRING): "object",
+}
+
+
+class TableSchema:
+    """Pre-computed, read-only view of a BigQuery schema file."""
+
+    def __init__(self, fields: list):
+        self.columns = tuple(dict.fromkeys(field["name"] for field in fields))
+
+        columns_by_type = {}
+        for field in fields:
+            columns_by_type.setdefault(field["type"], {})[field["name"]] = None
+        self.columns_by_type = {
+            column_type: tuple(columns)
+            for column_type, columns in columns_by_type.items()
+        }
+
+        dtypes = {}
+        for field in fields:
+            dtype = PANDAS_DTYPES.get(field["type"])
+            if dtype:
+                dtypes.setdefault(field["name"], dtype)
+        self.dtypes = dtypes
+
+    def get_columns(self, column_type: ColumnDataType = ColumnDataType.NONE) -> tuple:
+        if column_type == ColumnDataType.NONE:
+            return self.columns
+        return self.columns_by_type.get(str(column_type), ())
+
+
+class SchemaRegistry:
+    """
+    Process-wide registry of the BigQuery schema files in the schema folder.
+    Each file is parsed once, on first access, and served from memory afterwards.
+    """
+
+    _schemas = None
+    _lock = threading.Lock()
+    schema_directory = os.path.join(os.path.dirname(__file__), "schema")
+
+    @classmethod
+    def load(cls) -> dict:
+        if cls._schemas is not None:
+            return cls._schemas
+
+        with cls._lock:
+            if cls._schemas is None:
+                fields = {}
+                with os.scandir(cls.schema_directory) as iterator:
+                    for entry in iterator:
+                        if entry.is_file() and entry.name.endswith(".json"):
+                            with open(entry.path) as file_json:
+                                fields[entry.name] = json.load(file_json)
+
+                schemas = {
+                    file_name: TableSchema(file_fields)
+                    for file_name, file_fields in fields.items()
+                }
+
+                all_fields = []
+                for file in ALL_TABLES_SCHEMA_FILES:
+                    all_fields.extend(fields.get(f"{file}.json", []))
+                schemas[ALL_TABLES_SCHEMA] = TableSchema(all_fields)
+
+                cls._schemas = schemas
+
+        return cls._schemas
+
+    @classmethod
+    def get_schema(cls, schema_file: str) -> TableSchema:
+        try:
+            return cls.load()[schema_file]
+        except KeyError:
+            raise Exception(f"Invalid schema file {schema_file}")
+
+    @classmethod
+    def get_columns(
+        cls, schema_file: str, column_type: ColumnDataType = ColumnDataType.NONE
+    ) -> tuple:
+        return cls.get_schema(schema_file).get_columns(column_type=column_type)
+
+    @classmethod
+    def get_dtypes(cls, schema_file: str = ALL_TABLES_SCHEMA) -> dict:
+        return dict(cls.get_schema(schema_file).dtypes)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._schemas = None
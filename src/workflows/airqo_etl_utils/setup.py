@@ -12,10 +12,11 @@ setup(
     description=DESCRIPTION,
     long_description=LONG_DESCRIPTION,
     packages=find_packages(),
-    package_data={"": ["*.json"]},
+    package_data={"": ["*.json", "*.avsc"]},
     install_requires=[
         "pandas",
         "requests",
+        "aiohttp",
         "simplejson",
         "kafka-python",
         "numpy",
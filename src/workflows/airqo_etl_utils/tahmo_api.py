@@ -1,82 +1,157 @@
-import pandas as pd
-
+import asyncio
 import json
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 
+import aiohttp
+import pandas as pd
 import urllib3
-from urllib3.util.retry import Retry
 
 from .config import configuration
 from .utils import Utils
 
 
 class TahmoApi:
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    MEASUREMENT_COLUMNS = ["value", "variable", "station", "time"]
+
     def __init__(self):
         self.BASE_URL = Utils.remove_suffix(configuration.TAHMO_BASE_URL, suffix="/")
         self.API_MAX_PERIOD = configuration.TAHMO_API_MAX_PERIOD
         self.API_KEY = configuration.TAHMO_API_KEY
         self.API_SECRET = configuration.TAHMO_API_SECRET
+        self.max_concurrent_requests = configuration.TAHMO_MAX_CONCURRENT_REQUESTS
+        self.max_retries = configuration.TAHMO_MAX_RETRIES
+        self.retry_backoff = configuration.TAHMO_RETRY_BACKOFF
+        self.timeout = 300.0
 
     def get_measurements(self, start_time, end_time, station_codes=None):
-        if station_codes is None:
-            station_codes = []
-
-        params = {
-            "start": start_time,
-            "end": end_time,
-        }
-
-        stations = set(station_codes)
-        columns = ["value", "variable", "station", "time"]
-        measurements = pd.DataFrame(columns=columns)
-
-        for code in stations:
-            try:
-                response = self.__request(
-                    f"/services/measurements/v2/stations/{code}/measurements/controlled",
-                    params,
-                )
-
-                if response and "results" in response:
-                    results = response["results"]
-                    values = results[0]["series"][0]["values"]
-                    columns = results[0]["series"][0]["columns"]
-
-                    station_measurements = pd.DataFrame(data=values, columns=columns)
-
-                    measurements = pd.concat(
-                        [measurements, station_measurements[columns]], ignore_index=True
-                    )
-
-            except Exception as ex:
-                print(ex)
-                continue
-
+        measurements = self.query_measurements(
+            dates=[(start_time, end_time)], station_codes=station_codes
+        )
         return measurements.to_dict(orient="records")
 
-    def __request(self, endpoint, params):
-        url = f"{self.BASE_URL}{endpoint}"
-        retry_strategy = Retry(
-            total=5,
-            backoff_factor=5,
-        )
+    def query_measurements(
+        self, dates: list, station_codes: list = None
+    ) -> pd.DataFrame:
+        """
+        Queries the measurements of every station over every date range concurrently
+        over one HTTP session.
+
+        :param dates: (start, end) date ranges
+        :param station_codes: codes of the stations to query
+        :return: a dataframe with the value, variable, station and time of each
+        measurement. Queries that fail after all retries are left out.
+        """
+        queries = [
+            (code, start, end)
+            for code in dict.fromkeys(station_codes or [])
+            for start, end in dates
+        ]
+        measurements = {column: [] for column in self.MEASUREMENT_COLUMNS}
+        responses = asyncio.run(self.__query_measurements(queries))
+        for response in responses:
+            self.extend_measurements(measurements, response)
+        return pd.DataFrame(measurements, columns=self.MEASUREMENT_COLUMNS)
+
+    @staticmethod
+    def extend_measurements(measurements: dict, response):
+        """Appends the values of each column of a response series to measurements"""
+        try:
+            series = response["results"][0]["series"][0]
+            column_values = dict(zip(series["columns"], zip(*series["values"])))
+            if not column_values:
+                return
+            series_measurements = {
+                column: column_values[column] for column in measurements.keys()
+            }
+        except (KeyError, IndexError, TypeError):
+            return
+
+        for column, values in series_measurements.items():
+            measurements[column].extend(values)
+
+    @staticmethod
+    def retry_after(response: aiohttp.ClientResponse):
+        """Seconds to wait given by a Retry-After header, in seconds or as a date"""
+        retry_after = response.headers.get("Retry-After")
+        if not retry_after:
+            return None
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+            return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+        except (TypeError, ValueError):
+            return None
 
-        http = urllib3.PoolManager(retries=retry_strategy)
+    async def __query_measurements(self, queries: list) -> list:
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrent_requests, keepalive_timeout=60
+        )
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        headers = urllib3.util.make_headers(
+            basic_auth=f"{self.API_KEY}:{self.API_SECRET}"
+        )
 
-        try:
-            headers = urllib3.util.make_headers(
-                basic_auth=f"{self.API_KEY}:{self.API_SECRET}"
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout, headers=headers
+        ) as session:
+            return await asyncio.gather(
+                *[
+                    self.__fetch(
+                        session=session,
+                        semaphore=semaphore,
+                        code=code,
+                        start=start,
+                        end=end,
+                    )
+                    for code, start, end in queries
+                ]
             )
-            response = http.request("GET", url, fields=params, headers=headers)
 
-            response_data = response.data
-            print("Tahmo API request: %s" % response._request_url)
-
-            if response.status == 200:
-                return json.loads(response_data)
-            else:
-                Utils.handle_api_error(response)
-                return None
+    async def __fetch(
+        self,
+        session: aiohttp.ClientSession,
+        semaphore: asyncio.Semaphore,
+        code: str,
+        start,
+        end,
+    ):
+        url = f"{self.BASE_URL}/services/measurements/v2/stations/{code}/measurements/controlled"
+        params = {"start": str(start), "end": str(end)}
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                async with semaphore:
+                    async with session.get(url, params=params) as response:
+                        if response.status in self.RETRY_STATUSES:
+                            error = f"status {response.status}"
+                            retry_after = self.retry_after(response)
+                        elif response.status >= 400:
+                            print(
+                                f"{code} measurements query failed with status {response.status}"
+                            )
+                            return None
+                        else:
+                            return json.loads(await response.text())
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as ex:
+                error = repr(ex)
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(
+                    retry_after
+                    if retry_after is not None
+                    else random.uniform(0, self.retry_backoff * 2**attempt)
+                )
 
-        except urllib3.exceptions.HTTPError as e:
-            print(f"HTTPError: {e}")
-            return None
+        print(
+            f"{code} measurements query between {start} and {end} "
+            f"failed after {self.max_retries + 1} attempts: {error}"
+        )
+        return None
@@ -0,0 +1,6 @@
+MERGE INTO `airqo.metadata.airqlouds` AS target
+USING `airqo.metadata.airqlouds_staging` AS source
+ON target.id IS NOT DISTINCT FROM source.id
+  AND target.tenant IS NOT DISTINCT FROM source.tenant
+WHEN NOT MATCHED THEN INSERT (tenant, id, name)
+  VALUES (source.tenant, source.id, source.name)
@@ -0,0 +1,7 @@
+MERGE INTO `airqo.metadata.airqlouds_sites` AS target
+USING `airqo.metadata.airqlouds_sites_staging` AS source
+ON target.tenant IS NOT DISTINCT FROM source.tenant
+  AND target.airqloud_id IS NOT DISTINCT FROM source.airqloud_id
+  AND target.site_id IS NOT DISTINCT FROM source.site_id
+WHEN NOT MATCHED THEN INSERT (tenant, airqloud_id, site_id)
+  VALUES (source.tenant, source.airqloud_id, source.site_id)
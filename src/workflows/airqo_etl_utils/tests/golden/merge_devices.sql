@@ -0,0 +1,19 @@
+MERGE INTO `airqo.metadata.devices` AS target
+USING `airqo.metadata.devices_staging` AS source
+ON LOWER(target.tenant) IS NOT DISTINCT FROM LOWER(source.tenant)
+  AND LOWER(target.device_id) IS NOT DISTINCT FROM LOWER(source.device_id)
+  AND target.device_number IS NOT DISTINCT FROM source.device_number
+WHEN MATCHED THEN UPDATE SET
+  tenant = source.tenant,
+  latitude = source.latitude,
+  longitude = source.longitude,
+  approximate_latitude = source.approximate_latitude,
+  approximate_longitude = source.approximate_longitude,
+  site_id = source.site_id,
+  device_id = source.device_id,
+  name = source.name,
+  description = source.description,
+  device_manufacturer = source.device_manufacturer,
+  device_category = source.device_category
+WHEN NOT MATCHED THEN INSERT (tenant, latitude, longitude, approximate_latitude, approximate_longitude, site_id, device_id, device_number, name, description, device_manufacturer, device_category)
+  VALUES (source.tenant, source.latitude, source.longitude, source.approximate_latitude, source.approximate_longitude, source.site_id, source.device_id, source.device_number, source.name, source.description, source.device_manufacturer, source.device_category)
@@ -0,0 +1,19 @@
+MERGE INTO `airqo.metadata.sites` AS target
+USING `airqo.metadata.sites_staging` AS source
+ON target.id IS NOT DISTINCT FROM source.id
+WHEN MATCHED THEN UPDATE SET
+  tenant = source.tenant,
+  latitude = source.latitude,
+  longitude = source.longitude,
+  approximate_latitude = source.approximate_latitude,
+  approximate_longitude = source.approximate_longitude,
+  name = source.name,
+  location = source.location,
+  display_name = source.display_name,
+  display_location = source.display_location,
+  description = source.description,
+  country = source.country,
+  region = source.region,
+  city = source.city
+WHEN NOT MATCHED THEN INSERT (tenant, id, latitude, longitude, approximate_latitude, approximate_longitude, name, location, display_name, display_location, description, country, region, city)
+  VALUES (source.tenant, source.id, source.latitude, source.longitude, source.approximate_latitude, source.approximate_longitude, source.name, source.location, source.display_name, source.display_location, source.description, source.country, source.region, source.city)
@@ -1,14 +1,22 @@
+import os
+import pickle
 import unittest
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 import pymongo as pm
 import pytest
+from hypothesis import given, settings, strategies as st
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import Lasso
 
 import airqo_etl_utils.tests.conftest as ct
 from airqo_etl_utils.airqo_utils import AirQoDataUtils
 from airqo_etl_utils.config import configuration
+from airqo_etl_utils.constants import DeviceCategory
 from airqo_etl_utils.date import date_to_str
+from airqo_etl_utils.model_registry import LocalModelStore, ModelRegistry
 from airqo_etl_utils.tests.conftest import FaultDetectionFixtures
 
 
@@ -139,3 +147,260 @@ def test_save_faulty_devices():
         "missing_data_fault": 1,
         "created_at": datetime(2021, 1, 1),
     }
+
+
+def row_wise_field_8(field_8: pd.Series, device_category: DeviceCategory):
+    data = field_8.apply(
+        lambda x: AirQoDataUtils.flatten_field_8(
+            device_category=device_category, field_8=x
+        )
+    )
+    for column in data.columns:
+        if column != "timestamp":
+            data[column] = pd.to_numeric(data[column], errors="coerce")
+    return data
+
+
+field_8_tokens = st.one_of(
+    st.floats(allow_nan=True, allow_infinity=True).map(str),
+    st.integers(-1000, 1000).map(str),
+    st.sampled_from(["", " ", "nan", "abc", "2023-01-01T00:00:00Z", "1e3", "-0"]),
+)
+field_8_records = st.one_of(
+    st.lists(field_8_tokens, min_size=0, max_size=15).map(",".join),
+    st.text(alphabet="0123456789.,-e ", max_size=40),
+)
+
+
+@pytest.mark.parametrize("engine", ["pandas", "pyarrow"])
+@pytest.mark.parametrize(
+    "device_category", [DeviceCategory.LOW_COST, DeviceCategory.BAM]
+)
+@settings(max_examples=100, deadline=None)
+@given(records=st.lists(field_8_records, min_size=1, max_size=20))
+def test_decode_field_8_matches_row_wise_flatten(records, device_category, engine):
+    field_8 = pd.Series(records, index=range(10, 10 + len(records)))
+
+    expected = row_wise_field_8(field_8, device_category)
+    actual = AirQoDataUtils.decode_field_8(
+        field_8=field_8, device_category=device_category, engine=engine
+    )
+
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    assert all(
+        actual[column].dtype == np.float64
+        for column in actual.columns
+        if column != "timestamp"
+    )
+
+
+@pytest.mark.parametrize("engine", ["pandas", "pyarrow"])
+def test_decode_field_8_handles_missing_records(engine):
+    field_8 = pd.Series(["0.3,32.5,1200", None, np.nan, ""])
+
+    data = AirQoDataUtils.decode_field_8(
+        field_8=field_8, device_category=DeviceCategory.LOW_COST, engine=engine
+    )
+
+    assert data["latitude"].to_list()[0] == 0.3
+    assert data["altitude"].to_list()[0] == 1200
+    assert data.iloc[1:].isna().all().all()
+    assert data["vapor_pressure"].isna().all()
+
+
+def row_wise_calibration(measurements, rf_regressor, lasso_regressor):
+    calibrated_measurements = []
+    for _, row in measurements.iterrows():
+        try:
+            calibrated_row = row.copy()
+            input_variables = pd.DataFrame(
+                [
+                    [
+                        row["s1_pm2_5"],
+                        row["s2_pm2_5"],
+                        row["s1_pm10"],
+                        row["s2_pm10"],
+                        row["temperature"],
+                        row["humidity"],
+                        pd.to_datetime(row["time"]).hour,
+                    ]
+                ],
+                columns=[
+                    "s1_pm2_5",
+                    "s2_pm2_5",
+                    "s1_pm10",
+                    "s2_pm10",
+                    "temperature",
+                    "humidity",
+                    "hour",
+                ],
+                dtype="float",
+            )
+            input_variables["avg_pm2_5"] = (
+                input_variables[["s1_pm2_5", "s2_pm2_5"]].mean(axis=1).round(2)
+            )
+            input_variables["avg_pm10"] = (
+                input_variables[["s1_pm10", "s2_pm10"]].mean(axis=1).round(2)
+            )
+            input_variables["error_pm10"] = np.abs(
+                input_variables["s1_pm10"] - input_variables["s2_pm10"]
+            )
+            input_variables["error_pm2_5"] = np.abs(
+                input_variables["s1_pm2_5"] - input_variables["s2_pm2_5"]
+            )
+            input_variables["pm2_5_pm10"] = (
+                input_variables["avg_pm2_5"] - input_variables["avg_pm10"]
+            )
+            input_variables["pm2_5_pm10_mod"] = (
+                input_variables["pm2_5_pm10"] / input_variables["avg_pm10"]
+            )
+            input_variables = input_variables[CALIBRATION_FEATURES]
+
+            calibrated_row["calibrated_pm2_5"] = rf_regressor.predict(
+                input_variables.values
+            )[0]
+            calibrated_row["calibrated_pm10"] = lasso_regressor.predict(
+                input_variables.values
+            )[0]
+            calibrated_measurements.append(calibrated_row.to_dict())
+        except Exception:
+            continue
+
+    return calibrated_measurements
+
+
+CALIBRATION_FEATURES = [
+    "avg_pm2_5",
+    "avg_pm10",
+    "temperature",
+    "humidity",
+    "hour",
+    "error_pm2_5",
+    "error_pm10",
+    "pm2_5_pm10",
+    "pm2_5_pm10_mod",
+]
+
+
+def calibration_measurements(rows, seed=0):
+    random = np.random.default_rng(seed)
+    s1_pm2_5 = random.uniform(5, 150, rows).round(2)
+    s1_pm10 = s1_pm2_5 + random.uniform(1, 50, rows).round(2)
+    return pd.DataFrame(
+        {
+            "device_id": [f"aq_{i % 7}" for i in range(rows)],
+            "time": pd.date_range("2023-06-01", periods=rows, freq="H").strftime(
+                "%Y-%m-%dT%H:%M:%SZ"
+            ),
+            "s1_pm2_5": s1_pm2_5,
+            "s2_pm2_5": (s1_pm2_5 + random.normal(0, 3, rows)).round(2),
+            "s1_pm10": s1_pm10,
+            "s2_pm10": (s1_pm10 + random.normal(0, 3, rows)).round(2),
+            "temperature": random.uniform(15, 35, rows).round(1),
+            "humidity": random.uniform(30, 95, rows).round(1),
+        }
+    )
+
+
+@pytest.fixture
+def calibration_model_store(tmp_path, monkeypatch):
+    training_data = calibration_measurements(500, seed=1)
+    features = AirQoDataUtils.calibration_features(training_data)
+    target = training_data["s1_pm2_5"] * 0.6 + training_data["humidity"] * 0.1
+
+    bucket = tmp_path / "bucket"
+    bucket.mkdir()
+    models = {
+        "PM2.5_calibrate_model.pkl": RandomForestRegressor(
+            n_estimators=10, max_depth=6, random_state=0
+        ).fit(features, target),
+        "PM10_calibrate_model.pkl": Lasso(alpha=0.1).fit(features, target),
+    }
+    for name, model in models.items():
+        with open(bucket / name, "wb") as file:
+            pickle.dump(model, file)
+
+    ModelRegistry.clear()
+    monkeypatch.setattr(
+        configuration, "CALIBRATION_MODELS_CACHE_DIR", str(tmp_path / "cache")
+    )
+    yield LocalModelStore(str(bucket)), models
+    ModelRegistry.clear()
+
+
+def test_calibrate_using_pickle_file_matches_row_wise_predictions(
+    calibration_model_store, monkeypatch
+):
+    store, models = calibration_model_store
+    measurements = calibration_measurements(300)
+    measurements.loc[3, "s1_pm2_5"] = np.nan
+    measurements.loc[4, ["s1_pm10", "s2_pm10"]] = np.nan
+    measurements.loc[5, "humidity"] = np.nan
+
+    expected = pd.DataFrame(
+        row_wise_calibration(
+            measurements,
+            models["PM2.5_calibrate_model.pkl"],
+            models["PM10_calibrate_model.pkl"],
+        )
+    )
+    monkeypatch.setattr(configuration, "CALIBRATION_BATCH_SIZE", 64)
+    calibrated = pd.DataFrame(
+        AirQoDataUtils.calibrate_using_pickle_file(measurements, model_store=store)
+    )
+
+    assert len(calibrated) == len(expected) == 297
+    pd.testing.assert_frame_equal(
+        calibrated.drop(columns=["calibrated_pm2_5", "calibrated_pm10"]),
+        expected.drop(columns=["calibrated_pm2_5", "calibrated_pm10"]),
+        check_dtype=False,
+    )
+    # The forest predicts on float32 inputs either way
+    np.testing.assert_array_equal(
+        calibrated["calibrated_pm2_5"], expected["calibrated_pm2_5"]
+    )
+    np.testing.assert_allclose(
+        calibrated["calibrated_pm10"], expected["calibrated_pm10"], rtol=1e-5
+    )
+
+
+def test_calibration_models_are_loaded_once_per_generation(calibration_model_store):
+    store, _ = calibration_model_store
+    measurements = calibration_measurements(20)
+
+    for _ in range(3):
+        AirQoDataUtils.calibrate_using_pickle_file(measurements, model_store=store)
+    assert store.downloads == 2
+
+    pm2_5_model = os.path.join(store.root, "PM2.5_calibrate_model.pkl")
+    os.utime(pm2_5_model, ns=(0, 0))
+    AirQoDataUtils.calibrate_using_pickle_file(measurements, model_store=store)
+    assert store.downloads == 3
+    assert (
+        len(
+            [
+                name
+                for name in os.listdir(configuration.CALIBRATION_MODELS_CACHE_DIR)
+                if name.endswith("PM2.5_calibrate_model.pkl")
+            ]
+        )
+        == 1
+    )
+
+
+def test_calibrate_using_pickle_file_with_parallel_forest(calibration_model_store):
+    store, _ = calibration_model_store
+    measurements = calibration_measurements(50)
+
+    serial = AirQoDataUtils.calibrate_using_pickle_file(measurements, model_store=store)
+    parallel = AirQoDataUtils.calibrate_using_pickle_file(
+        measurements, model_store=store, n_jobs=2
+    )
+
+    serial, parallel = pd.DataFrame(serial), pd.DataFrame(parallel)
+    pd.testing.assert_frame_equal(serial, parallel, check_exact=False)
+    # The model cached for other callers keeps its own n_jobs
+    cached_model = ModelRegistry.get_model(
+        store=store, source_file="PM2.5_calibrate_model.pkl"
+    )
+    assert cached_model.n_jobs is None
@@ -1,9 +1,14 @@
+import json
+import os
 from unittest import mock
 
 import pandas as pd
 import pytest
 
 from airqo_etl_utils.bigquery_api import BigQueryApi
+from airqo_etl_utils.constants import ColumnDataType
+from airqo_etl_utils.schema_registry import SchemaRegistry, ALL_TABLES_SCHEMA_FILES
+from airqo_etl_utils.utils import Utils
 
 
 @pytest.fixture
@@ -121,3 +126,82 @@ def test_fetch_raw_readings_empty(mock_bigquery_client):
     with pytest.raises(Exception) as e:
         df = api.fetch_raw_readings()
         assert "No data found" in str(e.value)
+
+
+@pytest.fixture
+def bq_api():
+    with mock.patch("airqo_etl_utils.bigquery_api.bigquery.Client"):
+        api = BigQueryApi()
+    api.hourly_measurements_table = "hourly_measurements"
+    api.raw_measurements_table = "raw_measurements"
+    return api
+
+
+def _schema_columns(file_names, column_type=None):
+    columns = set()
+    for file_name in file_names:
+        for field in Utils.load_schema(file_name=file_name):
+            if column_type is None or field["type"] == str(column_type):
+                columns.add(field["name"])
+    return columns
+
+
+@pytest.mark.parametrize(
+    "column_type",
+    [
+        ColumnDataType.NONE,
+        ColumnDataType.FLOAT,
+        ColumnDataType.INTEGER,
+        ColumnDataType.TIMESTAMP,
+        ColumnDataType.STRING,
+    ],
+)
+def test_get_columns_matches_schema_files(bq_api, column_type):
+    expected_type = None if column_type == ColumnDataType.NONE else column_type
+
+    columns = bq_api.get_columns(
+        table=bq_api.hourly_measurements_table, column_type=column_type
+    )
+    assert set(columns) == _schema_columns(["measurements.json"], expected_type)
+    assert len(columns) == len(set(columns))
+
+    all_columns = bq_api.get_columns(table="all", column_type=column_type)
+    assert set(all_columns) == _schema_columns(
+        [f"{file}.json" for file in ALL_TABLES_SCHEMA_FILES], expected_type
+    )
+
+
+def test_get_columns_returns_a_new_list(bq_api):
+    columns = bq_api.get_columns(table=bq_api.hourly_measurements_table)
+    columns.append("battery")
+    assert "battery" not in bq_api.get_columns(table=bq_api.hourly_measurements_table)
+
+
+def test_get_columns_invalid_table(bq_api):
+    with pytest.raises(Exception, match="Invalid table"):
+        bq_api.get_columns(table="unknown_table")
+
+
+def test_schema_registry_parses_files_once():
+    SchemaRegistry.clear()
+    with mock.patch(
+        "airqo_etl_utils.schema_registry.json.load", wraps=json.load
+    ) as json_load:
+        for _ in range(3):
+            SchemaRegistry.get_columns("all", column_type=ColumnDataType.FLOAT)
+            SchemaRegistry.get_columns("measurements.json")
+    assert json_load.call_count == len(
+        [
+            name
+            for name in os.listdir(SchemaRegistry.schema_directory)
+            if name.endswith(".json")
+        ]
+    )
+
+
+def test_schema_registry_dtypes():
+    dtypes = SchemaRegistry.get_dtypes("measurements.json")
+    assert dtypes["pm2_5"] == "float64"
+    assert dtypes["device_number"] == "int64"
+    assert dtypes["timestamp"] == "datetime64[ns]"
+    assert dtypes["site_id"] == "object"
@@ -0,0 +1,331 @@
+import os
+from unittest import mock
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
+
+from airqo_etl_utils.bigquery_api import BigQueryApi
+from airqo_etl_utils.bigquery_merge import (
+    MergeAction,
+    TABLE_MERGE_SPECS,
+    compose_merge_query,
+)
+from airqo_etl_utils.schema_registry import SchemaRegistry
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden")
+
+TABLES = {
+    "airqlouds_table": "airqo.metadata.airqlouds",
+    "grids_table": "airqo.metadata.grids",
+    "cohorts_table": "airqo.metadata.cohorts",
+    "airqlouds_sites_table": "airqo.metadata.airqlouds_sites",
+    "grids_sites_table": "airqo.metadata.grids_sites",
+    "cohorts_devices_table": "airqo.metadata.cohorts_devices",
+    "sites_table": "airqo.metadata.sites",
+    "devices_table": "airqo.metadata.devices",
+    "sites_meta_data_table": "airqo.metadata.sites_meta_data",
+}
+
+
+class DuckDBClient:
+    """Stand-in for bigquery.Client executing loads and queries on DuckDB."""
+
+    def __init__(self):
+        self.connection = duckdb.connect()
+        self.loaded_rows = 0
+        self.queries = []
+
+    def create_table(self, table: str, schema_file: str, data: pd.DataFrame):
+        dtypes = SchemaRegistry.get_dtypes(schema_file)
+        data = data[list(SchemaRegistry.get_columns(schema_file))].astype(dtypes)
+        self.connection.register("data", data)
+        self.connection.execute(f'CREATE TABLE "{table}" AS SELECT * FROM data')
+        self.connection.unregister("data")
+
+    def get_table(self, table: str):
+        return mock.Mock(schema=[])
+
+    def load_table_from_dataframe(self, dataframe, destination, job_config=None):
+        self.loaded_rows += len(dataframe)
+        self.connection.register("data", dataframe)
+        self.connection.execute(
+            f'CREATE OR REPLACE TABLE "{destination}" AS SELECT * FROM data'
+        )
+        self.connection.unregister("data")
+        return mock.Mock()
+
+    def query(self, query: str, job_config=None):
+        self.queries.append(query)
+        self.connection.execute(query.replace("`", '"'))
+        return mock.Mock()
+
+    def delete_table(self, table: str, not_found_ok=False):
+        self.connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+
+    def read_table(self, table: str) -> pd.DataFrame:
+        return self.connection.execute(f'SELECT * FROM "{table}"').df()
+
+    def tables(self) -> list:
+        return [row[0] for row in self.connection.execute("SHOW TABLES").fetchall()]
+
+
+@pytest.fixture
+def bq_api():
+    with mock.patch("airqo_etl_utils.bigquery_api.bigquery.Client"):
+        api = BigQueryApi()
+    for attribute, table in TABLES.items():
+        setattr(api, attribute, table)
+    api.client = DuckDBClient()
+    return api
+
+
+def sort_frame(data: pd.DataFrame) -> pd.DataFrame:
+    data = data.astype(object).where(data.notna(), None)
+    return data.sort_values(by=list(data.columns), key=lambda col: col.astype(str))[
+        sorted(data.columns)
+    ].reset_index(drop=True)
+
+
+def overwrite_insert_new(available, data, unique_cols=None):
+    """Reference implementation of the previous read, concat and overwrite flow."""
+    up_to_date_data = pd.concat([available, data], ignore_index=True)
+    return up_to_date_data.drop_duplicates(subset=unique_cols, keep="first")
+
+
+def overwrite_upsert(available, data, unique_cols):
+    data = data.drop_duplicates(subset=unique_cols, keep="first")
+    available = available.drop_duplicates(subset=unique_cols, keep="first")
+    available_keys = available.set_index(unique_cols).index
+    data_keys = data.set_index(unique_cols).index
+    data_not_for_updating = available.loc[~available_keys.isin(data_keys)]
+    return pd.concat([data_not_for_updating, data], ignore_index=True)
+
+
+def random_sites(rng, ids, tenant="airqo"):
+    return pd.DataFrame(
+        {
+            "tenant": tenant,
+            "id": ids,
+            "latitude": rng.uniform(-1, 1, len(ids)),
+            "longitude": rng.uniform(30, 33, len(ids)),
+            "approximate_latitude": rng.uniform(-1, 1, len(ids)),
+            "approximate_longitude": rng.uniform(30, 33, len(ids)),
+            "name": [f"site {i}" for i in ids],
+            "location": None,
+            "display_name": [f"Site {i}" for i in ids],
+            "display_location": None,
+            "description": rng.choice(["a", "b", None], len(ids)),
+            "country": "Uganda",
+            "region": "Central",
+            "city": "Kampala",
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "schema_file",
+    ["airqlouds.json", "airqlouds_sites.json", "sites.json", "devices.json"],
+)
+def test_compose_merge_query_matches_golden_file(schema_file):
+    merge_spec = TABLE_MERGE_SPECS[schema_file]
+    columns = list(SchemaRegistry.get_columns(schema_file))
+    name = schema_file.replace(".json", "")
+
+    query = compose_merge_query(
+        target_table=f"airqo.metadata.{name}",
+        staging_table=f"airqo.metadata.{name}_staging",
+        columns=columns,
+        unique_cols=merge_spec.get_unique_cols(columns),
+        action=merge_spec.action,
+        case_insensitive_cols=merge_spec.case_insensitive_cols,
+    )
+
+    with open(os.path.join(GOLDEN_DIR, f"merge_{name}.sql")) as golden_file:
+        assert query == golden_file.read().strip()
+
+
+def test_compose_merge_query_invalid_unique_cols():
+    with pytest.raises(Exception, match="Invalid unique columns"):
+        compose_merge_query("target", "staging", ["id", "name"], ["tenant"])
+    with pytest.raises(Exception, match="No columns"):
+        compose_merge_query("target", "staging", [], ["id"])
+
+
+def test_update_airqlouds_keeps_existing_rows(bq_api):
+    available = pd.DataFrame(
+        {
+            "tenant": ["airqo", "airqo", "kcca"],
+            "id": ["1", "2", "1"],
+            "name": ["one", "two", "kcca one"],
+        }
+    )
+    data = pd.DataFrame(
+        {
+            "tenant": ["airqo", "airqo", "airqo", "kcca"],
+            "id": ["2", "3", "3", "2"],
+            "name": ["two updated", "three", "three duplicate", "kcca two"],
+        }
+    )
+    bq_api.client.create_table(bq_api.airqlouds_table, "airqlouds.json", available)
+
+    bq_api.update_airqlouds(data.copy())
+
+    pd.testing.assert_frame_equal(
+        sort_frame(bq_api.client.read_table(bq_api.airqlouds_table)),
+        sort_frame(overwrite_insert_new(available, data, ["id", "tenant"])),
+    )
+
+
+def test_update_grids_sites_table_inserts_unseen_rows(bq_api):
+    available = pd.DataFrame(
+        {"tenant": ["airqo", "airqo"], "grid_id": ["g1", "g1"], "site_id": ["1", "2"]}
+    )
+    data = pd.DataFrame(
+        {
+            "tenant": ["airqo", "airqo", "airqo"],
+            "grid_id": ["g1", "g2", "g2"],
+            "site_id": ["2", "2", "2"],
+        }
+    )
+    bq_api.client.create_table(bq_api.grids_sites_table, "grids_sites.json", available)
+
+    bq_api.update_grids_sites_table(data.copy())
+
+    pd.testing.assert_frame_equal(
+        sort_frame(bq_api.client.read_table(bq_api.grids_sites_table)),
+        sort_frame(overwrite_insert_new(available, data)),
+    )
+
+
+def test_update_sites_and_devices_matches_overwrite_semantics(bq_api):
+    rng = np.random.default_rng(7)
+    available = random_sites(rng, [str(i) for i in range(200)])
+    data = random_sites(rng, [str(i) for i in rng.integers(150, 260, 80)])
+    bq_api.client.create_table(bq_api.sites_table, "sites.json", available)
+
+    bq_api.update_sites_and_devices(
+        dataframe=data.copy(), table=bq_api.sites_table, component="sites"
+    )
+
+    pd.testing.assert_frame_equal(
+        sort_frame(bq_api.client.read_table(bq_api.sites_table)),
+        sort_frame(overwrite_upsert(available, data, ["id"])),
+    )
+
+
+def test_update_devices_merges_on_device_keys(bq_api):
+    available = pd.DataFrame(
+        {
+            "tenant": ["airqo", "airqo"],
+            "latitude": [0.1, 0.2],
+            "longitude": [32.1, 32.2],
+            "approximate_latitude": [0.1, 0.2],
+            "approximate_longitude": [32.1, 32.2],
+            "site_id": ["s1", "s2"],
+            "device_id": ["aq_1", "aq_2"],
+            "device_number": [1, 2],
+            "name": ["aq_1", "aq_2"],
+            "description": [None, None],
+            "device_manufacturer": ["airqo", "airqo"],
+            "device_category": ["lowcost", "lowcost"],
+        }
+    )
+    data = available.copy()
+    data["site_id"] = ["s3", "s2"]
+    data["device_number"] = [1, 3]
+    bq_api.client.create_table(bq_api.devices_table, "devices.json", available)
+
+    bq_api.update_sites_and_devices(
+        dataframe=data.copy(), table=bq_api.devices_table, component="devices"
+    )
+
+    pd.testing.assert_frame_equal(
+        sort_frame(bq_api.client.read_table(bq_api.devices_table)),
+        sort_frame(
+            overwrite_upsert(available, data, ["tenant", "device_id", "device_number"])
+        ),
+    )
+
+
+def test_update_devices_matches_device_ids_in_any_case(bq_api):
+    available = pd.DataFrame(
+        {
+            "tenant": ["airqo", "airqo"],
+            "latitude": [0.1, 0.2],
+            "longitude": [32.1, 32.2],
+            "approximate_latitude": [0.1, 0.2],
+            "approximate_longitude": [32.1, 32.2],
+            "site_id": ["s1", "s2"],
+            "device_id": ["aq_1", "aq_2"],
+            "device_number": [1, 2],
+            "name": ["aq_1", "aq_2"],
+            "description": [None, None],
+            "device_manufacturer": ["airqo", "airqo"],
+            "device_category": ["lowcost", "lowcost"],
+        }
+    )
+    data = available.copy()
+    data["tenant"] = ["AirQo", "airqo"]
+    data["device_id"] = ["AQ_1", "aq_2"]
+    data["site_id"] = ["s3", "s4"]
+    # A second spelling of a staged device is a duplicate
+    data = pd.concat([data, data.iloc[[1]].assign(device_id="Aq_2", site_id="s5")])
+    bq_api.client.create_table(bq_api.devices_table, "devices.json", available)
+
+    bq_api.update_sites_and_devices(
+        dataframe=data.copy(), table=bq_api.devices_table, component="devices"
+    )
+
+    devices = bq_api.client.read_table(bq_api.devices_table)
+    assert sorted(devices["device_id"]) == ["AQ_1", "aq_2"]
+    assert sorted(devices["site_id"]) == ["s3", "s4"]
+
+
+def test_update_sites_and_devices_invalid_component(bq_api):
+    with pytest.raises(Exception, match="Invalid component"):
+        bq_api.update_sites_and_devices(
+            dataframe=pd.DataFrame(), table=bq_api.sites_table, component="grids"
+        )
+
+
+def test_upsert_moves_only_the_delta(bq_api):
+    rng = np.random.default_rng(11)
+    available = random_sites(rng, [str(i) for i in range(5000)])
+    data = random_sites(rng, [str(i) for i in range(4990, 5010)])
+    bq_api.client.create_table(bq_api.sites_table, "sites.json", available)
+
+    bq_api.update_sites_and_devices(
+        dataframe=data.copy(), table=bq_api.sites_table, component="sites"
+    )
+
+    assert bq_api.client.loaded_rows == len(data)
+    assert len(bq_api.client.queries) == 1
+    assert bq_api.client.queries[0].startswith("MERGE INTO")
+    assert "SELECT" not in bq_api.client.queries[0]
+    assert bq_api.client.tables() == [bq_api.sites_table]
+    assert len(bq_api.client.read_table(bq_api.sites_table)) == 5010
+
+
+def test_upsert_drops_staging_table_on_failure(bq_api):
+    bq_api.client.query = mock.Mock(side_effect=Exception("merge failed"))
+    bq_api.client.create_table(
+        bq_api.cohorts_table,
+        "cohorts.json",
+        pd.DataFrame({"tenant": ["airqo"], "id": ["1"], "name": ["one"]}),
+    )
+
+    with pytest.raises(Exception, match="merge failed"):
+        bq_api.update_cohorts(
+            pd.DataFrame({"tenant": ["airqo"], "id": ["2"], "name": ["two"]})
+        )
+
+    assert bq_api.client.tables() == [bq_api.cohorts_table]
+
+
+def test_upsert_empty_dataframe_does_nothing(bq_api):
+    bq_api.client.query = mock.Mock()
+    bq_api.update_cohorts(pd.DataFrame(columns=["tenant", "id", "name"]))
+    bq_api.client.query.assert_not_called()
+    assert MergeAction.INSERT_NEW == TABLE_MERGE_SPECS["cohorts.json"].action
@@ -0,0 +1,247 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from airqo_etl_utils.constants import ColumnDataType
+from airqo_etl_utils.data_validator import DataValidationUtils
+from airqo_etl_utils.schema_registry import SchemaRegistry, ALL_TABLES_SCHEMA
+
+
+def row_wise_valid_value(value, name):
+    """Previous scalar implementation, kept as the parity reference."""
+    if (name == "pm2_5" or name == "pm10") and (value < 1 or value > 1000):
+        return None
+    elif name == "latitude" and (value < -90 or value > 90):
+        return None
+    elif name == "longitude" and (value < -180 or value > 180):
+        return None
+    elif name == "battery" and (value < 2.7 or value > 5):
+        return None
+    elif name == "no2" and (value < 0 or value > 2049):
+        return None
+    elif (name == "altitude" or name == "hdop") and value <= 0:
+        return None
+    elif name == "satellites" and (value <= 0 or value > 50):
+        return None
+    elif (name == "temperature") and (value <= 0 or value > 45):
+        return None
+    elif (name == "humidity") and (value <= 0 or value > 99):
+        return None
+    elif name == "pressure" and (value < 30 or value > 110):
+        return None
+    return value
+
+
+def row_wise_remove_outliers(data: pd.DataFrame) -> pd.DataFrame:
+    schema = SchemaRegistry.get_schema(ALL_TABLES_SCHEMA)
+    float_columns = [
+        col for col in schema.get_columns(ColumnDataType.FLOAT) if col in data
+    ]
+    integer_columns = [
+        col for col in schema.get_columns(ColumnDataType.INTEGER) if col in data
+    ]
+    timestamp_columns = [
+        col for col in schema.get_columns(ColumnDataType.TIMESTAMP) if col in data
+    ]
+    data = DataValidationUtils.format_data_types(
+        data=data,
+        floats=float_columns,
+        integers=integer_columns,
+        timestamps=timestamp_columns,
+    )
+
+    for col in float_columns + integer_columns + timestamp_columns:
+        name = col
+        if name in [
+            "pm2_5",
+            "s1_pm2_5",
+            "s2_pm2_5",
+            "pm2_5_pi",
+            "pm2_5_raw_value",
+            "pm2_5_calibrated_value",
+        ]:
+            name = "pm2_5"
+        elif name in [
+            "pm10",
+            "s1_pm10",
+            "s2_pm10",
+            "pm10_pi",
+            "pm10_raw_value",
+            "pm10_calibrated_value",
+        ]:
+            name = "pm10"
+        elif name in ["device_humidity", "humidity"]:
+            name = "humidity"
+        elif col in ["device_temperature", "temperature"]:
+            name = "temperature"
+        elif name in ["no2", "no2_raw_value", "no2_calibrated_value"]:
+            name = "no2"
+
+        data.loc[:, col] = data[col].apply(lambda x: row_wise_valid_value(x, name))
+
+    return data
+
+
+def random_measurements(rng, rows: int) -> pd.DataFrame:
+    def values(low, high, integers=False):
+        column = rng.uniform(low, high, rows)
+        if integers:
+            column = np.round(column)
+        column[rng.random(rows) < 0.1] = np.nan
+        return column
+
+    return pd.DataFrame(
+        {
+            "timestamp": pd.date_range("2023-01-01", periods=rows, freq="H"),
+            "device_id": rng.choice(["aq_1", "aq_2"], rows),
+            "device_number": rng.integers(1, 100, rows),
+            "pm2_5": values(-10, 1100),
+            "s1_pm2_5": values(0, 1010, integers=True),
+            "pm10_calibrated_value": values(-5, 1200),
+            "latitude": values(-100, 100),
+            "longitude": values(-200, 200),
+            "battery": values(2, 6),
+            "no2": values(-10, 2100),
+            "altitude": values(-5, 5, integers=True),
+            "hdop": values(-1, 3),
+            "satellites": values(-2, 60, integers=True),
+            "device_temperature": values(-5, 50, integers=True),
+            "humidity": values(-5, 105),
+            "pressure": values(20, 120),
+            "wind_speed": values(-5, 50),
+            "pm1": values(-5, 50),
+        }
+    )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_remove_outliers_matches_row_wise_implementation(seed):
+    rng = np.random.default_rng(seed)
+    data = random_measurements(rng, 500)
+
+    pd.testing.assert_frame_equal(
+        DataValidationUtils.remove_outliers(data.copy()),
+        row_wise_remove_outliers(data.copy()),
+    )
+
+
+def test_remove_outliers_boundaries():
+    data = pd.DataFrame(
+        {
+            "pm2_5": [0.99, 1, 1000, 1000.01],
+            "altitude": [-1, 0, 0.01, 10000],
+            "satellites": [0, 1, 50, 51],
+            "battery": [2.69, 2.7, 5, 5.01],
+        }
+    )
+
+    data = DataValidationUtils.remove_outliers(data)
+
+    assert data["pm2_5"].isna().to_list() == [True, False, False, True]
+    assert data["altitude"].isna().to_list() == [True, True, False, False]
+    assert data["satellites"].isna().to_list() == [True, False, False, True]
+    assert data["battery"].isna().to_list() == [True, False, False, True]
+
+
+def test_remove_outliers_keeps_valid_columns_untouched():
+    data = pd.DataFrame({"pm2_5": [10, 20], "device_number": [1, 2]})
+
+    data = DataValidationUtils.remove_outliers(data)
+
+    assert data["pm2_5"].dtype == np.int64
+    assert data["device_number"].to_list() == [1, 2]
+
+
+@pytest.mark.parametrize(
+    "value, name",
+    [(0.5, "pm2_5"), (5, "pm10"), (0, "humidity"), (np.nan, "pressure"), (3, "pm1")],
+)
+def test_get_valid_value_matches_row_wise_implementation(value, name):
+    expected = row_wise_valid_value(value, name)
+    actual = DataValidationUtils.get_valid_value(value, name)
+    assert actual is expected or (np.isnan(actual) and np.isnan(expected))
+
+
+def nested_loop_remove_duplicates(data: pd.DataFrame, key: str) -> pd.DataFrame:
+    """Previous per-group implementation, kept as the parity reference."""
+    cols = data.columns.to_list()
+    cols.remove("timestamp")
+    cols.remove(key)
+    data.dropna(subset=cols, how="all", inplace=True)
+    data["timestamp"] = pd.to_datetime(data["timestamp"])
+    data["duplicated"] = data.duplicated(keep=False, subset=[key, "timestamp"])
+
+    if True not in data["duplicated"].values:
+        return data
+
+    duplicated_data = data.loc[data["duplicated"]]
+    not_duplicated_data = data.loc[~data["duplicated"]]
+
+    for _, by_key in duplicated_data.groupby(by=key):
+        for _, by_timestamp in by_key.groupby(by="timestamp"):
+            by_timestamp = by_timestamp.ffill().bfill()
+            by_timestamp.drop_duplicates(
+                subset=[key, "timestamp"], inplace=True, keep="first"
+            )
+            not_duplicated_data = pd.concat(
+                [not_duplicated_data, by_timestamp], ignore_index=True
+            )
+
+    return not_duplicated_data
+
+
+def duplicate_heavy_data(rng, rows: int, key: str, keys) -> pd.DataFrame:
+    def values():
+        column = rng.uniform(0, 100, rows)
+        column[rng.random(rows) < 0.4] = np.nan
+        return column
+
+    return pd.DataFrame(
+        {
+            key: rng.choice(keys, rows),
+            "timestamp": rng.choice(
+                pd.date_range("2023-01-01", periods=12, freq="H").astype(str), rows
+            ),
+            "pm2_5": values(),
+            "pm10": values(),
+            "site_id": rng.choice(["site_1", "site_2", None], rows),
+        }
+    )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_airqo_remove_duplicates_matches_nested_loop(seed):
+    from airqo_etl_utils.airqo_utils import AirQoDataUtils
+
+    rng = np.random.default_rng(seed)
+    data = duplicate_heavy_data(rng, 400, "device_number", [1, 2, 3, 4])
+
+    pd.testing.assert_frame_equal(
+        AirQoDataUtils.remove_duplicates(data.copy()),
+        nested_loop_remove_duplicates(data.copy(), "device_number"),
+    )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_weather_remove_duplicates_matches_nested_loop(seed):
+    from airqo_etl_utils.weather_data_utils import WeatherDataUtils
+
+    rng = np.random.default_rng(seed)
+    data = duplicate_heavy_data(rng, 400, "station_code", ["TA1", "TA2", "TA3"])
+
+    pd.testing.assert_frame_equal(
+        WeatherDataUtils.remove_duplicates(data.copy()),
+        nested_loop_remove_duplicates(data.copy(), "station_code"),
+    )
+
+
+def test_merge_duplicates_without_duplicates_keeps_index():
+    data = pd.DataFrame(
+        {"device_number": [1, 2], "timestamp": ["2023-01-01", "2023-01-01"]},
+        index=[5, 7],
+    )
+
+    data = DataValidationUtils.merge_duplicates(data, ["device_number", "timestamp"])
+
+    assert data.index.to_list() == [5, 7]
+    assert not data["duplicated"].any()
@@ -0,0 +1,153 @@
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+from kafka.partitioner.default import murmur2
+
+from airqo_etl_utils.message_broker_utils import MessageBrokerUtils
+from airqo_etl_utils.message_serializers import MESSAGE_SERIALIZERS, get_serializer
+
+PARTITIONS = 3
+
+
+class FakeKafkaProducer:
+    """In-process stand-in for KafkaProducer recording what would be sent."""
+
+    instances = []
+
+    def __init__(self, **configs):
+        self.configs = configs
+        self.messages = []
+        self.flushes = 0
+        FakeKafkaProducer.instances.append(self)
+
+    def send(self, topic, key=None, value=None, partition=None):
+        key_bytes = self.configs["key_serializer"](key)
+        if partition is None and key_bytes is not None:
+            partition = (murmur2(key_bytes) & 0x7FFFFFFF) % PARTITIONS
+        self.messages.append(
+            {"topic": topic, "key": key, "value": value, "partition": partition}
+        )
+        return mock.Mock()
+
+    def flush(self):
+        self.flushes += 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_producer():
+    FakeKafkaProducer.instances = []
+    MessageBrokerUtils.close_producers()
+    with mock.patch(
+        "airqo_etl_utils.message_broker_utils.KafkaProducer", FakeKafkaProducer
+    ):
+        yield FakeKafkaProducer
+    MessageBrokerUtils.close_producers()
+
+
+def hourly_data(rows: int, devices: int = 10) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    pm2_5 = rng.uniform(1, 100, rows)
+    pm2_5[::7] = np.nan
+    return pd.DataFrame(
+        {
+            "device_id": [f"device_{i % devices}" for i in range(rows)],
+            "device_name": [f"aq_{i % devices}" for i in range(rows)],
+            "site_id": [f"site_{i % devices}" for i in range(rows)],
+            "device_number": [i % devices for i in range(rows)],
+            "tenant": "airqo",
+            "network": "airqo",
+            "timestamp": "2023-01-01T00:00:00Z",
+            "pm2_5": pm2_5,
+            "pm10": rng.uniform(1, 100, rows),
+        }
+    )
+
+
+def send(data: pd.DataFrame, **kwargs):
+    return MessageBrokerUtils(**kwargs)._MessageBrokerUtils__send_data(
+        topic="hourly-measurements-topic", data=data
+    )
+
+
+def test_send_data_reuses_one_producer(fake_producer):
+    send(hourly_data(120))
+    send(hourly_data(120))
+    send(hourly_data(120), compression_type="zstd")
+
+    assert len(fake_producer.instances) == 2
+    producer = fake_producer.instances[0]
+    assert producer.configs["compression_type"] == "gzip"
+    assert producer.configs["linger_ms"] > 0
+    assert producer.configs["batch_size"] > 16384
+    assert producer.flushes == 2
+    assert fake_producer.instances[1].configs["compression_type"] == "zstd"
+
+
+def test_send_data_partitions_messages_by_device(fake_producer):
+    data = hourly_data(1000, devices=10)
+
+    messages = send(data)
+
+    sent = fake_producer.instances[0].messages
+    assert messages == len(sent) == 10 * 2
+    serializer = get_serializer("json")
+    received = []
+    partitions = {}
+    for message in sent:
+        records = serializer.deserialize(message["value"])["data"]
+        assert 0 < len(records) <= 50
+        assert {record["device_id"] for record in records} == {message["key"]}
+        partitions.setdefault(message["key"], set()).add(message["partition"])
+        received.extend(records)
+
+    assert all(len(partition) == 1 for partition in partitions.values())
+    assert len(received) == len(data)
+    assert (
+        sum(record["pm2_5"] is None for record in received)
+        == data["pm2_5"].isna().sum()
+    )
+
+
+def test_send_data_without_key_column(fake_producer):
+    data = hourly_data(75).drop(columns=["device_id"])
+
+    send(data)
+
+    sent = fake_producer.instances[0].messages
+    assert [message["key"] for message in sent] == [None, None]
+    assert [message["partition"] for message in sent] == [None, None]
+
+
+@pytest.mark.parametrize("serializer", MESSAGE_SERIALIZERS.keys())
+def test_serializers_round_trip(fake_producer, serializer):
+    data = hourly_data(60, devices=1)
+
+    send(data, serializer=serializer)
+
+    message = fake_producer.instances[0].messages[0]
+    records = get_serializer(serializer).deserialize(message["value"])["data"]
+    expected = data.iloc[:50].replace(np.nan, None).to_dict("records")
+    for record, expected_record in zip(records, expected):
+        assert {key: record[key] for key in expected_record} == expected_record
+
+
+def test_binary_serializers_are_smaller_than_json():
+    message = {"data": hourly_data(50).replace(np.nan, None).to_dict("records")}
+    sizes = {
+        name: len(get_serializer(name).serialize(message))
+        for name in MESSAGE_SERIALIZERS.keys()
+    }
+
+    assert sizes["orjson"] <= sizes["json"]
+    assert sizes["msgpack"] < sizes["json"]
+    assert sizes["avro"] < sizes["msgpack"]
+
+
+def test_invalid_serializer():
+    with pytest.raises(Exception, match="Invalid serializer"):
+        get_serializer("xml")
@@ -0,0 +1,166 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from lightgbm import LGBMRegressor
+
+from airqo_etl_utils.ml_utils import ForecastUtils, RecursiveForecaster
+
+
+def reference_forecasts(data, forecast_model, frequency, horizon):
+    """The per device, per step implementation RecursiveForecaster replaced."""
+
+    def get_forecasts(df_tmp):
+        for i in range(int(horizon)):
+            df_tmp = pd.concat([df_tmp, df_tmp.iloc[-1:]], ignore_index=True)
+            df_tmp_no_ts = df_tmp.drop(
+                columns=["timestamp", "device_id", "site_id"], axis=1, inplace=False
+            )
+            if frequency == "daily":
+                df_tmp.tail(1)["timestamp"] += timedelta(days=1)
+                for s in [1, 2, 3, 7]:
+                    df_tmp[f"pm2_5_last_{s}_day"] = df_tmp.shift(s, axis=0)["pm2_5"]
+                for s in [2, 3, 7]:
+                    for f in ["mean", "std", "max", "min"]:
+                        df_tmp[f"pm2_5_{f}_{s}_day"] = (
+                            df_tmp_no_ts.shift(1, axis=0).rolling(s).agg(f)
+                        )["pm2_5"]
+            elif frequency == "hourly":
+                df_tmp.iloc[-1, df_tmp.columns.get_loc("timestamp")] = df_tmp.iloc[
+                    -2, df_tmp.columns.get_loc("timestamp")
+                ] + pd.Timedelta(hours=1)
+                for s in [1, 2, 6, 12]:
+                    df_tmp[f"pm2_5_last_{s}_hour"] = df_tmp.shift(s, axis=0)["pm2_5"]
+                for s in [3, 6, 12, 24]:
+                    for f in ["mean", "std", "median", "skew"]:
+                        df_tmp[f"pm2_5_{f}_{s}_hour"] = (
+                            df_tmp_no_ts.shift(1, axis=0).rolling(s).agg(f)
+                        )["pm2_5"]
+
+            excluded_columns = RecursiveForecaster.EXCLUDED_COLUMNS
+            df_tmp.loc[df_tmp.index[-1], "pm2_5"] = forecast_model.predict(
+                df_tmp.drop(excluded_columns, axis=1).tail(1).values.reshape(1, -1)
+            )
+
+        return df_tmp.iloc[-int(horizon) :, :]
+
+    forecasts = pd.DataFrame()
+    for device in data["device_id"].unique():
+        device_forecasts = get_forecasts(data[data["device_id"] == device])
+        forecasts = pd.concat([forecasts, device_forecasts], ignore_index=True)
+
+    forecasts["pm2_5"] = forecasts["pm2_5"].astype(float)
+    return forecasts[["device_id", "site_id", "timestamp", "pm2_5"]]
+
+
+def synthetic_measurements(frequency, devices=4, periods=120, seed=1):
+    random = np.random.default_rng(seed)
+    step = "H" if frequency == "hourly" else "D"
+    frames = []
+    for device in range(devices):
+        timestamps = pd.date_range("2023-03-01", periods=periods, freq=step)
+        cycle = np.sin(2 * np.pi * np.arange(periods) / 24)
+        frames.append(
+            pd.DataFrame(
+                {
+                    "device_id": f"aq_{device}",
+                    "site_id": f"site_{device}",
+                    "timestamp": timestamps,
+                    "pm2_5": 30
+                    + 10 * device
+                    + 8 * cycle
+                    + random.normal(0, 2, periods),
+                    "latitude": 0.3 + device / 10,
+                    "longitude": 32.5 + device / 10,
+                }
+            )
+        )
+    return pd.concat(frames, ignore_index=True)
+
+
+def model_inputs(data, frequency, cyclic_features=False):
+    data = ForecastUtils.get_lag_and_roll_features(data, "pm2_5", frequency)
+    if cyclic_features:
+        data = ForecastUtils.get_time_and_cyclic_features(data, frequency)
+    return ForecastUtils.get_location_features(data)
+
+
+def train_model(data):
+    features = data.drop(columns=RecursiveForecaster.EXCLUDED_COLUMNS)
+    model = LGBMRegressor(n_estimators=20, random_state=42, verbosity=-1)
+    model.fit(features.to_numpy(dtype=float), data["pm2_5"])
+    return model
+
+
+@pytest.mark.parametrize("frequency", ["hourly", "daily"])
+def test_forecasts_match_reference_implementation(frequency):
+    data = model_inputs(synthetic_measurements(frequency), frequency)
+    model = train_model(data)
+    horizon = 30
+
+    expected = reference_forecasts(data, model, frequency, horizon)
+    forecasts = RecursiveForecaster(data, frequency).forecast(model, horizon)
+
+    pd.testing.assert_frame_equal(
+        forecasts[["device_id", "site_id", "timestamp"]],
+        expected[["device_id", "site_id", "timestamp"]],
+    )
+    np.testing.assert_allclose(forecasts["pm2_5"], expected["pm2_5"], rtol=1e-9)
+
+
+def test_short_histories_match_reference_implementation():
+    data = synthetic_measurements("hourly")
+    data = data[(data["device_id"] != "aq_1") | (data.index % 120 >= 110)]
+    data = model_inputs(data.reset_index(drop=True), "hourly")
+    model = train_model(data)
+
+    expected = reference_forecasts(data, model, "hourly", 24)
+    forecasts = RecursiveForecaster(data, "hourly").forecast(model, 24)
+
+    np.testing.assert_allclose(forecasts["pm2_5"], expected["pm2_5"], rtol=1e-9)
+
+
+@pytest.mark.parametrize(
+    "window",
+    [
+        [1.0, 2.0, 3.5, 3.5, 0.25, 9.0],
+        [4.0, 4.0, 4.0, 4.0, 4.0, 4.0],
+        [1.0, 1 + 1e-9, 1 - 1e-9, 1.0, 1.0, 1.0],
+        [1.0, np.nan, 2.0, 3.0, 4.0, 5.0],
+    ],
+)
+@pytest.mark.parametrize("function", ["mean", "std", "median", "skew", "max", "min"])
+def test_rolling_aggregate_matches_pandas(window, function):
+    expected = pd.Series(window).rolling(len(window)).agg(function).iloc[-1]
+    result = RecursiveForecaster.rolling_aggregate(np.array([window]), function)[0]
+
+    np.testing.assert_allclose(result, expected, rtol=1e-9, atol=1e-12)
+
+
+def test_cyclic_features_follow_the_forecast_timestamps():
+    data = model_inputs(synthetic_measurements("hourly"), "hourly", True)
+    model = train_model(data)
+    horizon = 5
+
+    inputs = []
+
+    class RecordingModel:
+        def predict(self, features):
+            inputs.append(features.copy())
+            return model.predict(features)
+
+    forecasts = RecursiveForecaster(data, "hourly").forecast(RecordingModel(), horizon)
+
+    columns = [c for c in data.columns if c not in RecursiveForecaster.EXCLUDED_COLUMNS]
+    expected = ForecastUtils.get_time_and_cyclic_features(
+        forecasts[["timestamp"]], "hourly"
+    )
+    devices = data["device_id"].nunique()
+    for step in range(horizon):
+        for column in ["hour_sin", "hour_cos", "day_sin", "week_cos"]:
+            np.testing.assert_allclose(
+                inputs[step][:, columns.index(column)],
+                expected[column].to_numpy(dtype=float)[step::horizon],
+            )
+    assert len(forecasts) == devices * horizon
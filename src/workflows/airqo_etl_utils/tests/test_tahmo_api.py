@@ -0,0 +1,232 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import pandas as pd
+import pytest
+from aiohttp import web
+
+from airqo_etl_utils.tahmo_api import TahmoApi
+from airqo_etl_utils.weather_data_utils import WeatherDataUtils
+
+SERIES_COLUMNS = [
+    "time",
+    "duration",
+    "quality",
+    "qualityFlag",
+    "sensor",
+    "station",
+    "value",
+    "variable",
+]
+VARIABLES = ["te", "rh"]
+
+
+def station_series(code: str, start: str, hours: int = 24) -> list:
+    start = pd.Timestamp(start)
+    return [
+        [
+            (start + pd.Timedelta(hours=hour)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            300,
+            1,
+            None,
+            f"SN{code}",
+            code,
+            round(hour + index / 10, 2),
+            variable,
+        ]
+        for hour in range(hours)
+        for index, variable in enumerate(VARIABLES)
+    ]
+
+
+def expected_measurements(codes, starts) -> pd.DataFrame:
+    rows = [
+        row for code in codes for start in starts for row in station_series(code, start)
+    ]
+    return pd.DataFrame(rows, columns=SERIES_COLUMNS)[TahmoApi.MEASUREMENT_COLUMNS]
+
+
+def sort_measurements(measurements: pd.DataFrame) -> pd.DataFrame:
+    return measurements.sort_values(["station", "time", "variable"]).reset_index(
+        drop=True
+    )
+
+
+class StubTahmoServer:
+    """Local server returning synthetic TAHMO measurement series."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.failures = {}
+        self.retry_after = None
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    async def measurements(self, request: web.Request):
+        code = request.match_info["code"]
+        self.requests.append((code, request.query["start"], time.monotonic()))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active -= 1
+
+        if request.headers.get("Authorization") is None:
+            return web.Response(status=401)
+        if self.failures.get(code, 0) > 0:
+            self.failures[code] -= 1
+            headers = {"Retry-After": self.retry_after} if self.retry_after else {}
+            return web.Response(status=429, headers=headers)
+        if code.startswith("MISSING"):
+            return web.Response(status=404)
+        if code.startswith("EMPTY"):
+            return web.json_response({"results": [{"statement_id": 0}]})
+
+        return web.json_response(
+            {
+                "results": [
+                    {
+                        "statement_id": 0,
+                        "series": [
+                            {
+                                "name": "controlled",
+                                "columns": SERIES_COLUMNS,
+                                "values": station_series(code, request.query["start"]),
+                            }
+                        ],
+                    }
+                ]
+            }
+        )
+
+    def start(self) -> str:
+        app = web.Application()
+        app.router.add_get(
+            "/services/measurements/v2/stations/{code}/measurements/controlled",
+            self.measurements,
+        )
+        self.runner = web.AppRunner(app)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.runner.setup(), self.loop).result()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        asyncio.run_coroutine_threadsafe(site.start(), self.loop).result()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/"
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubTahmoServer(latency=0.05)
+    server.url = server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def tahmo_api(stub_server):
+    with mock.patch.multiple(
+        "airqo_etl_utils.tahmo_api.configuration",
+        TAHMO_BASE_URL=stub_server.url,
+        TAHMO_API_KEY="key",
+        TAHMO_API_SECRET="secret",
+        TAHMO_MAX_CONCURRENT_REQUESTS=4,
+        TAHMO_MAX_RETRIES=2,
+        TAHMO_RETRY_BACKOFF=0.01,
+    ):
+        yield TahmoApi()
+
+
+DATES = [
+    ("2023-01-01T00:00:00Z", "2023-01-02T00:00:00Z"),
+    ("2023-01-02T00:00:00Z", "2023-01-03T00:00:00Z"),
+    ("2023-01-03T00:00:00Z", "2023-01-04T00:00:00Z"),
+]
+
+
+def test_query_measurements_over_stations_and_dates(tahmo_api, stub_server):
+    codes = [f"TA0000{number}" for number in range(5)]
+
+    started_at = time.monotonic()
+    measurements = tahmo_api.query_measurements(
+        dates=DATES, station_codes=codes + codes[:2]
+    )
+    elapsed = time.monotonic() - started_at
+
+    assert len(stub_server.requests) == len(codes) * len(DATES)
+    pd.testing.assert_frame_equal(
+        sort_measurements(measurements),
+        sort_measurements(expected_measurements(codes, [start for start, _ in DATES])),
+    )
+    assert 1 < stub_server.max_active <= tahmo_api.max_concurrent_requests
+    assert elapsed < len(stub_server.requests) * stub_server.latency
+
+
+def test_query_measurements_waits_as_told_by_retry_after(tahmo_api, stub_server):
+    stub_server.failures = {"TA00001": 1}
+    stub_server.retry_after = "0.3"
+
+    measurements = tahmo_api.query_measurements(
+        dates=DATES[:1], station_codes=["TA00001"]
+    )
+
+    first, second = stub_server.requests
+    assert second[2] - first[2] >= 0.3
+    assert len(measurements) == 24 * len(VARIABLES)
+
+
+def test_query_measurements_leaves_out_failed_queries(tahmo_api, stub_server):
+    stub_server.failures = {"TA00002": 10}
+
+    measurements = tahmo_api.query_measurements(
+        dates=DATES[:1],
+        station_codes=["TA00001", "TA00002", "MISSING", "EMPTY"],
+    )
+
+    requests = [request[0] for request in stub_server.requests]
+    assert requests.count("TA00002") == tahmo_api.max_retries + 1
+    assert requests.count("MISSING") == 1
+    assert list(measurements.columns) == TahmoApi.MEASUREMENT_COLUMNS
+    assert set(measurements["station"]) == {"TA00001"}
+
+
+def test_query_measurements_without_stations(tahmo_api):
+    measurements = tahmo_api.query_measurements(dates=DATES, station_codes=[])
+
+    assert measurements.empty
+    assert list(measurements.columns) == TahmoApi.MEASUREMENT_COLUMNS
+
+
+def test_get_measurements(tahmo_api):
+    measurements = tahmo_api.get_measurements(
+        *DATES[0], station_codes=["TA00001", "TA00002"]
+    )
+
+    assert sort_measurements(pd.DataFrame(measurements)).equals(
+        sort_measurements(expected_measurements(["TA00001", "TA00002"], [DATES[0][0]]))
+    )
+
+
+def test_query_raw_data_from_tahmo(tahmo_api, stub_server):
+    measurements = WeatherDataUtils.query_raw_data_from_tahmo(
+        start_date_time="2023-01-01T00:00:00Z",
+        end_date_time="2023-01-04T00:00:00Z",
+        station_codes=["TA00001", "TA00002"],
+    )
+
+    starts = sorted({request[1] for request in stub_server.requests})
+    assert len(stub_server.requests) == 2 * len(starts)
+    pd.testing.assert_frame_equal(
+        sort_measurements(measurements),
+        sort_measurements(expected_measurements(["TA00001", "TA00002"], starts)),
+    )
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import threading
+import time
+from unittest import mock
+
+import pandas as pd
+import pytest
+from aiohttp import web
+
+from airqo_etl_utils.airqo_utils import AirQoDataUtils
+from airqo_etl_utils.constants import DeviceCategory, DataSource
+from airqo_etl_utils.thingspeak_api import ThingspeakApi, TokenBucket
+from airqo_etl_utils.utils import Utils
+
+
+class StubThingspeakServer:
+    """Local server returning synthetic feeds.json responses."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.failures = {}
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    async def feeds(self, request: web.Request):
+        device_number = int(request.match_info["device_number"])
+        self.requests.append((device_number, request.query["start"]))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active -= 1
+
+        if self.failures.get(device_number, 0) > 0:
+            self.failures[device_number] -= 1
+            return web.Response(status=503)
+        if device_number < 0:
+            return web.json_response(-1)
+
+        start = pd.Timestamp(request.query["start"])
+        feeds = [
+            {
+                "created_at": (start + pd.Timedelta(minutes=minute)).isoformat(),
+                "entry_id": minute,
+                "field1": str(device_number + minute),
+                "field2": str(device_number + minute + 1),
+                "field3": str(device_number + minute),
+                "field4": str(device_number + minute + 1),
+                "field7": "3.9",
+                "field8": "0.3,32.5,1200,2,6,1.5,30,60,25,70,900",
+            }
+            for minute in range(0, 60, 10)
+        ]
+        return web.json_response(
+            {"channel": {"id": device_number, "latitude": "0.3"}, "feeds": feeds}
+        )
+
+    def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/channels/{device_number}/feeds.json", self.feeds)
+        self.runner = web.AppRunner(app)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.runner.setup(), self.loop).result()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        asyncio.run_coroutine_threadsafe(site.start(), self.loop).result()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/channels/"
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubThingspeakServer(latency=0.05)
+    url = server.start()
+    server.url = url
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def thingspeak_api(stub_server):
+    api = ThingspeakApi()
+    api.THINGSPEAK_CHANNEL_URL = stub_server.url
+    api.max_concurrent_requests = 8
+    api.requests_per_second = 0
+    api.retry_backoff = 0.01
+    api.max_retries = 2
+    return api
+
+
+def device_queries(device_numbers, hours=3):
+    return [
+        {
+            "device_number": device_number,
+            "start_date_time": f"2023-01-01T0{hour}:00:00Z",
+            "end_date_time": f"2023-01-01T0{hour}:59:59Z",
+            "read_key": f"key_{device_number}",
+        }
+        for device_number in device_numbers
+        for hour in range(hours)
+    ]
+
+
+def test_query_devices_data_concurrently(thingspeak_api, stub_server):
+    queries = device_queries(range(1, 11))
+
+    started_at = time.monotonic()
+    results = thingspeak_api.query_devices_data(queries)
+    elapsed = time.monotonic() - started_at
+
+    assert len(results) == len(queries)
+    for query, data in zip(queries, results):
+        assert len(data) == 6
+        assert data.attrs["meta_data"]["id"] == query["device_number"]
+        assert data["created_at"].iloc[0].startswith(query["start_date_time"][:13])
+
+    assert 1 < stub_server.max_active <= thingspeak_api.max_concurrent_requests
+    assert elapsed < len(queries) * stub_server.latency
+
+
+def test_query_devices_data_retries_failed_requests(thingspeak_api, stub_server):
+    stub_server.failures = {1: 2, 2: 10}
+
+    results = thingspeak_api.query_devices_data(device_queries([1, 2, -3], hours=1))
+
+    assert len(results[0]) == 6
+    assert results[1].empty
+    assert results[2].empty
+    assert len([request for request in stub_server.requests if request[0] == 2]) == 3
+
+
+def test_query_devices_data_resumes_from_checkpoint(
+    thingspeak_api, stub_server, tmp_path
+):
+    checkpoint_file = str(tmp_path / "checkpoint.jsonl")
+    queries = device_queries([1, 2, 3])
+    stub_server.failures = {3: 10}
+
+    first_results = thingspeak_api.query_devices_data(queries, checkpoint_file)
+    assert [data.empty for data in first_results] == [False] * 6 + [True] * 3
+
+    with open(checkpoint_file, "a") as file:
+        file.write('{"key": "interrupted')
+
+    stub_server.requests.clear()
+    stub_server.failures = {}
+    results = thingspeak_api.query_devices_data(queries, checkpoint_file)
+
+    assert sorted(stub_server.requests) == sorted(
+        (3, query["start_date_time"]) for query in queries[6:]
+    )
+    for first, data in zip(first_results[:6], results[:6]):
+        pd.testing.assert_frame_equal(first, data)
+    assert all(len(data) == 6 for data in results)
+
+
+def test_token_bucket_limits_request_rate():
+    async def acquire_all(bucket, count):
+        for _ in range(count):
+            await bucket.acquire()
+
+    bucket = TokenBucket(rate=50, capacity=1)
+    started_at = time.monotonic()
+    asyncio.run(acquire_all(bucket, 11))
+    assert time.monotonic() - started_at >= 0.19
+
+
+def test_extract_devices_data(stub_server):
+    devices = [
+        {"device_number": 1, "device_id": "aq_1", "site_id": "site_1"},
+        {"device_number": 2, "device_id": "aq_2", "site_id": "site_2"},
+        {"device_number": 3, "device_id": "aq_3", "site_id": "site_3"},
+    ]
+
+    with mock.patch("airqo_etl_utils.airqo_utils.AirQoApi") as airqo_api, mock.patch(
+        "airqo_etl_utils.thingspeak_api.configuration.THINGSPEAK_CHANNEL_URL",
+        stub_server.url,
+    ):
+        airqo_api.return_value.get_devices.return_value = devices
+        airqo_api.return_value.get_thingspeak_read_keys.return_value = {
+            1: "key_1",
+            2: "key_2",
+        }
+        data = AirQoDataUtils.extract_devices_data(
+            start_date_time="2023-01-01T00:00:00Z",
+            end_date_time="2023-01-01T23:59:59Z",
+            device_category=DeviceCategory.LOW_COST,
+            remove_outliers=False,
+            checkpoint=True,
+        )
+
+    assert sorted(data["device_number"].unique()) == [1, 2]
+    dates = Utils.query_dates_array(
+        data_source=DataSource.THINGSPEAK,
+        start_date_time="2023-01-01T00:00:00Z",
+        end_date_time="2023-01-01T23:59:59Z",
+    )
+    assert len(data) == 2 * len(dates) * 6
+    assert set(data["device_id"]) == {"aq_1", "aq_2"}
+    assert data["s1_pm2_5"].notna().all()
+    assert (data["latitude"] == 0.3).all()
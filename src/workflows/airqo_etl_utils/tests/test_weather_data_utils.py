@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from airqo_etl_utils.data_validator import DataValidationUtils
+from airqo_etl_utils.utils import Utils
+from airqo_etl_utils.weather_data_utils import WeatherDataUtils
+
+
+def row_wise_transform_raw_data(data: pd.DataFrame) -> pd.DataFrame:
+    """The TAHMO pivot as transform_raw_data used to compute it"""
+    data = data.copy()
+    data["value"] = pd.to_numeric(data["value"], errors="coerce", downcast="float")
+    data["time"] = pd.to_datetime(data["time"], errors="coerce")
+    parameter_mappings = WeatherDataUtils.TAHMO_PARAMETERS
+    weather_data = []
+    for _, station_group in data.groupby("station"):
+        station = station_group.iloc[0]["station"]
+        for _, time_group in station_group.groupby("time"):
+            timestamp = time_group.iloc[0]["time"]
+            timestamp_data = {"timestamp": timestamp, "station_code": station}
+            for _, row in time_group.iterrows():
+                if row["variable"] in parameter_mappings.keys():
+                    parameter = parameter_mappings[row["variable"]]
+                    value = row["value"]
+                    if parameter == "humidity":
+                        value = value * 100
+                    timestamp_data[parameter] = value
+            weather_data.append(timestamp_data)
+
+    weather_data = pd.DataFrame(weather_data)
+    weather_data = Utils.populate_missing_columns(
+        data=weather_data, cols=list(parameter_mappings.values())
+    )
+    return DataValidationUtils.remove_outliers(weather_data)
+
+
+def long_readings(stations=5, hours=24, seed=0) -> pd.DataFrame:
+    """
+    Shuffled TAHMO readings with repeated, missing, unparseable and unknown
+    readings, and readings without a valid time
+    """
+    rng = np.random.default_rng(seed)
+    variables = [*WeatherDataUtils.TAHMO_PARAMETERS.keys(), "lw", "st"]
+    times = pd.date_range("2023-01-01", periods=hours, freq="H")
+    readings = pd.DataFrame(
+        [
+            {
+                "value": rng.uniform(-10, 110),
+                "variable": variable,
+                "station": f"TA{station:05d}",
+                "time": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            }
+            for station in range(stations)
+            for time in times
+            for variable in variables
+            if rng.random() < 0.9
+        ]
+    )
+    readings.loc[readings["variable"] == "rh", "value"] /= 100
+    readings = pd.concat(
+        [readings, readings.sample(frac=0.1, random_state=seed)], ignore_index=True
+    )
+    readings = readings.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+    readings["value"] = readings["value"].astype(object)
+    missing = readings.sample(frac=0.05, random_state=seed + 1).index
+    readings.loc[missing, "value"] = None
+    unparseable = readings.sample(frac=0.01, random_state=seed + 2).index
+    readings.loc[unparseable, "value"] = "n/a"
+    invalid_times = readings.sample(frac=0.01, random_state=seed + 3).index
+    readings.loc[invalid_times, "time"] = "not a time"
+    return readings
+
+
+def assert_same_weather_data(actual: pd.DataFrame, expected: pd.DataFrame):
+    pd.testing.assert_frame_equal(
+        actual.astype({"station_code": object}),
+        expected[list(actual.columns)],
+        check_dtype=False,
+    )
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_transform_raw_data_matches_row_wise_pivot(seed):
+    readings = long_readings(seed=seed)
+
+    expected = row_wise_transform_raw_data(readings)
+    actual = WeatherDataUtils.transform_raw_data(readings.copy())
+
+    assert list(actual.columns) == [
+        "timestamp",
+        "station_code",
+        *WeatherDataUtils.TAHMO_PARAMETERS.values(),
+    ]
+    assert_same_weather_data(actual, expected)
+
+
+def test_transform_raw_data_with_arrow_dtypes():
+    readings = long_readings()
+
+    actual = WeatherDataUtils.transform_raw_data(
+        readings.copy(), dtype_backend="pyarrow"
+    )
+
+    assert all(
+        isinstance(actual[parameter].dtype, pd.ArrowDtype)
+        for parameter in ["temperature", "humidity", "wind_speed"]
+    )
+    assert_same_weather_data(
+        actual.astype(
+            {
+                parameter: "float64"
+                for parameter in WeatherDataUtils.TAHMO_PARAMETERS.values()
+            }
+        ),
+        row_wise_transform_raw_data(readings),
+    )
+
+
+def test_transform_raw_data_keeps_times_without_known_variables():
+    readings = pd.DataFrame(
+        {
+            "value": ["21.5", "0.5", "3", "0.6"],
+            "variable": ["te", "rh", "lw", "rh"],
+            "station": ["TA00001", "TA00001", "TA00002", "TA00001"],
+            "time": [
+                "2023-01-01T00:00:00Z",
+                "2023-01-01T00:00:00Z",
+                "2023-01-01T00:00:00Z",
+                "2023-01-01T00:00:00Z",
+            ],
+        }
+    )
+
+    weather_data = WeatherDataUtils.transform_raw_data(readings)
+
+    assert weather_data["station_code"].to_list() == ["TA00001", "TA00002"]
+    assert weather_data["temperature"].to_list()[0] == 21.5
+    assert weather_data["humidity"].to_list()[0] == pytest.approx(60)
+    assert weather_data.iloc[1, 2:].isna().all()
@@ -1,15 +1,57 @@
+import asyncio
 import json
+import os
+import random
+import time
 import traceback
 
+import aiohttp
 import pandas as pd
 import requests
 
 from .config import configuration
 
 
+class TokenBucket:
+    """
+    Async token bucket allowing `rate` requests per second, with bursts of up to
+    `capacity` requests. A rate of zero or less disables rate limiting.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
 class ThingspeakApi:
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
     def __init__(self):
         self.THINGSPEAK_CHANNEL_URL = configuration.THINGSPEAK_CHANNEL_URL
+        self.max_concurrent_requests = configuration.THINGSPEAK_MAX_CONCURRENT_REQUESTS
+        self.requests_per_second = configuration.THINGSPEAK_REQUESTS_PER_SECOND
+        self.max_retries = configuration.THINGSPEAK_MAX_RETRIES
+        self.retry_backoff = configuration.THINGSPEAK_RETRY_BACKOFF
+        self.timeout = 100.0
 
     def query_data(
         self,
@@ -25,15 +67,145 @@ class ThingspeakApi:
             print(f"{url}")
 
             response = json.loads(
-                requests.get(url, timeout=100.0).content.decode("utf-8")
+                requests.get(url, timeout=self.timeout).content.decode("utf-8")
             )
-
-            if (response != -1) and ("feeds" in response):
-                data = pd.DataFrame(response["feeds"])
-                data.attrs["meta_data"] = response["channel"]
+            data = self.to_dataframe(response)
 
         except Exception as ex:
             print(ex)
             traceback.print_exc()
 
         return data
+
+    @staticmethod
+    def to_dataframe(response) -> pd.DataFrame:
+        data = pd.DataFrame([])
+        if response and (response != -1) and ("feeds" in response):
+            data = pd.DataFrame(response["feeds"])
+            data.attrs["meta_data"] = response["channel"]
+        return data
+
+    def query_devices_data(self, queries: list, checkpoint_file: str = None) -> list:
+        """
+        Queries several channels concurrently over one pooled HTTP session.
+
+        :param queries: dicts with device_number, start_date_time, end_date_time and read_key
+        :param checkpoint_file: optional file recording completed queries. Queries found in it
+        are not requested again, so an interrupted extraction resumes where it stopped.
+        :return: a dataframe for each query, in the order of the queries. Queries that fail
+        after all retries return an empty dataframe.
+        """
+        completed = self.load_checkpoint(checkpoint_file)
+        responses = asyncio.run(
+            self.__query_devices_data(
+                queries=queries, completed=completed, checkpoint_file=checkpoint_file
+            )
+        )
+        return [self.to_dataframe(response) for response in responses]
+
+    @staticmethod
+    def checkpoint_key(query: dict) -> str:
+        return f"{query['device_number']}:{query['start_date_time']}:{query['end_date_time']}"
+
+    @staticmethod
+    def load_checkpoint(checkpoint_file: str) -> dict:
+        completed = {}
+        if not checkpoint_file or not os.path.exists(checkpoint_file):
+            return completed
+
+        with open(checkpoint_file) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                    completed[entry["key"]] = entry["response"]
+                except (ValueError, KeyError):
+                    # A partially written last line from an interrupted run
+                    continue
+
+        print(f"Resuming from {len(completed)} completed queries in {checkpoint_file}")
+        return completed
+
+    async def __query_devices_data(
+        self, queries: list, completed: dict, checkpoint_file: str = None
+    ) -> list:
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        rate_limiters = {}
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrent_requests, keepalive_timeout=60
+        )
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        checkpoint = open(checkpoint_file, "a") if checkpoint_file else None
+
+        async def query_device_data(query: dict):
+            key = self.checkpoint_key(query)
+            if key in completed:
+                return completed[key]
+
+            read_key = query["read_key"]
+            if read_key not in rate_limiters:
+                rate_limiters[read_key] = TokenBucket(rate=self.requests_per_second)
+
+            completed_query, response = await self.__fetch(
+                session=session,
+                semaphore=semaphore,
+                rate_limiter=rate_limiters[read_key],
+                query=query,
+            )
+
+            if completed_query and checkpoint:
+                checkpoint.write(json.dumps({"key": key, "response": response}) + "\n")
+                checkpoint.flush()
+
+            return response
+
+        try:
+            async with aiohttp.ClientSession(
+                connector=connector, timeout=timeout
+            ) as session:
+                return await asyncio.gather(
+                    *[query_device_data(query) for query in queries]
+                )
+        finally:
+            if checkpoint:
+                checkpoint.close()
+
+    async def __fetch(
+        self,
+        session: aiohttp.ClientSession,
+        semaphore: asyncio.Semaphore,
+        rate_limiter: TokenBucket,
+        query: dict,
+    ):
+        device_number = query["device_number"]
+        url = f"{self.THINGSPEAK_CHANNEL_URL}{device_number}/feeds.json"
+        params = {
+            "start": query["start_date_time"],
+            "end": query["end_date_time"],
+            "api_key": query["read_key"],
+        }
+
+        for attempt in range(self.max_retries + 1):
+            await rate_limiter.acquire()
+            try:
+                async with semaphore:
+                    async with session.get(url, params=params) as response:
+                        if response.status in self.RETRY_STATUSES:
+                            error = f"status {response.status}"
+                        elif response.status >= 400:
+                            print(
+                                f"{device_number} query failed with status {response.status}"
+                            )
+                            return False, None
+                        else:
+                            return True, json.loads(await response.text())
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as ex:
+                error = repr(ex)
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(random.uniform(0, self.retry_backoff * 2**attempt))
+
+        print(
+            f"{device_number} query between {params['start']} and {params['end']} "
+            f"failed after {self.max_retries + 1} attempts: {error}"
+        )
+        return False, None
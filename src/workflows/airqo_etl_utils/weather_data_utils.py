@@ -2,6 +2,7 @@ import concurrent.futures
 import time
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
 from .airqo_api import AirQoApi
@@ -15,6 +16,20 @@ from .utils import Utils
 
 
 class WeatherDataUtils:
+    TAHMO_PARAMETERS = {
+        "te": "temperature",
+        "rh": "humidity",
+        "ws": "wind_speed",
+        "ap": "atmospheric_pressure",
+        "ra": "radiation",
+        "vp": "vapor_pressure",
+        "wg": "wind_gusts",
+        "pr": "precipitation",
+        "wd": "wind_direction",
+    }
+    # TAHMO reports relative humidity as a fraction
+    TAHMO_UNIT_CONVERSIONS = {"humidity": 100}
+
     @staticmethod
     def extract_hourly_weather_data(start_date_time, end_date_time) -> pd.DataFrame:
         bigquery_api = BigQueryApi()
@@ -87,8 +102,8 @@ class WeatherDataUtils:
     def query_raw_data_from_tahmo(
         start_date_time, end_date_time, station_codes: list = None
     ) -> pd.DataFrame:
-        airqo_api = AirQoApi()
         if not station_codes:
+            airqo_api = AirQoApi()
             sites = airqo_api.get_sites()
             station_codes = []
             for site in sites:
@@ -97,7 +112,6 @@ class WeatherDataUtils:
 
         station_codes = list(set(station_codes))
 
-        measurements = []
         tahmo_api = TahmoApi()
 
         dates = Utils.query_dates_array(
@@ -106,17 +120,7 @@ class WeatherDataUtils:
             data_source=DataSource.TAHMO,
         )
 
-        for start, end in dates:
-            range_measurements = tahmo_api.get_measurements(start, end, station_codes)
-            measurements.extend(range_measurements)
-
-        measurements = (
-            pd.DataFrame(data=measurements)
-            if measurements
-            else pd.DataFrame([], columns=["value", "variable", "time", "station"])
-        )
-
-        return measurements
+        return tahmo_api.query_measurements(dates=dates, station_codes=station_codes)
 
     @staticmethod
     def extract_hourly_data(start_date_time, end_date_time) -> pd.DataFrame:
@@ -127,49 +131,73 @@ class WeatherDataUtils:
         return WeatherDataUtils.aggregate_data(cleaned_data)
 
     @staticmethod
-    def transform_raw_data(data: pd.DataFrame) -> pd.DataFrame:
+    def transform_raw_data(
+        data: pd.DataFrame, dtype_backend: str = None
+    ) -> pd.DataFrame:
+        """
+        Pivots long TAHMO readings, one row per station, time and variable, into one
+        row per station and time with a column for each weather parameter. Of
+        repeated readings of a variable, the last one is kept.
+
+        :param data: dataframe with the value, variable, station and time of each reading
+        :param dtype_backend: "pyarrow" to factorize the stations as Arrow strings and
+        return the station codes and parameters with Arrow-backed dtypes
+        :return: a dataframe with the timestamp, station_code and weather parameters,
+        ordered by station and time, with outliers removed
+        """
         if data.empty:
             return data
 
-        data["value"] = pd.to_numeric(data["value"], errors="coerce", downcast="float")
-        data["time"] = pd.to_datetime(data["time"], errors="coerce")
-        parameter_mappings = {
-            "te": "temperature",
-            "rh": "humidity",
-            "ws": "wind_speed",
-            "ap": "atmospheric_pressure",
-            "ra": "radiation",
-            "vp": "vapor_pressure",
-            "wg": "wind_gusts",
-            "pr": "precipitation",
-            "wd": "wind_direction",
-        }
-        weather_data = []
-        station_groups = data.groupby("station")
-        for _, station_group in station_groups:
-            station = station_group.iloc[0]["station"]
-            time_groups = station_group.groupby("time")
+        stations = data["station"]
+        if dtype_backend == "pyarrow":
+            import pyarrow as pa
 
-            for _, time_group in time_groups:
-                timestamp = time_group.iloc[0]["time"]
-                timestamp_data = {"timestamp": timestamp, "station_code": station}
+            stations = stations.astype(pd.ArrowDtype(pa.string()))
 
-                for _, row in time_group.iterrows():
-                    if row["variable"] in parameter_mappings.keys():
-                        parameter = parameter_mappings[row["variable"]]
-                        value = row["value"]
-                        if parameter == "humidity":
-                            value = value * 100
+        variables = list(WeatherDataUtils.TAHMO_PARAMETERS.keys())
+        parameters = list(WeatherDataUtils.TAHMO_PARAMETERS.values())
 
-                        timestamp_data[parameter] = value
+        station_codes, station_values = pd.factorize(stations, sort=True)
+        time_codes, time_values = pd.factorize(
+            pd.to_datetime(data["time"], errors="coerce"), sort=True
+        )
+        parameter_codes = pd.Categorical(data["variable"], categories=variables).codes
+        values = (
+            pd.to_numeric(data["value"], errors="coerce", downcast="float")
+            .astype("float64")
+            .to_numpy()
+        )
 
-                weather_data.append(timestamp_data)
+        # Rows of the output, one for each station and time, ordered by station and time
+        valid = (station_codes >= 0) & (time_codes >= 0)
+        rows, row_keys = pd.factorize(
+            station_codes[valid].astype("int64") * len(time_values) + time_codes[valid],
+            sort=True,
+        )
 
-        weather_data = pd.DataFrame(weather_data)
+        known = parameter_codes[valid] >= 0
+        rows = rows[known]
+        columns = parameter_codes[valid][known].astype("int64")
+        values = values[valid][known]
 
-        cols = [value for value in parameter_mappings.values()]
+        # The last reading of each parameter at a station and time
+        last = ~pd.Series(rows * len(parameters) + columns).duplicated(keep="last")
+        last = last.to_numpy()
 
-        weather_data = Utils.populate_missing_columns(data=weather_data, cols=cols)
+        readings = np.full((len(row_keys), len(parameters)), np.nan)
+        readings[rows[last], columns[last]] = values[last]
+
+        weather_data = pd.DataFrame(readings, columns=parameters)
+        for parameter, factor in WeatherDataUtils.TAHMO_UNIT_CONVERSIONS.items():
+            weather_data[parameter] = weather_data[parameter] * factor
+
+        if dtype_backend == "pyarrow":
+            weather_data = weather_data.astype(pd.ArrowDtype(pa.float64()))
+
+        weather_data.insert(0, "timestamp", time_values[row_keys % len(time_values)])
+        weather_data.insert(
+            1, "station_code", station_values[row_keys // len(time_values)]
+        )
 
         return DataValidationUtils.remove_outliers(weather_data)
 
@@ -216,30 +244,10 @@ class WeatherDataUtils:
         data.dropna(subset=cols, how="all", inplace=True)
         data["timestamp"] = pd.to_datetime(data["timestamp"])
 
-        data["duplicated"] = data.duplicated(
-            keep=False, subset=["station_code", "timestamp"]
+        return DataValidationUtils.merge_duplicates(
+            data=data, unique_cols=["station_code", "timestamp"]
         )
 
-        if True not in data["duplicated"].values:
-            return data
-
-        duplicated_data = data.loc[data["duplicated"]]
-        not_duplicated_data = data.loc[~data["duplicated"]]
-
-        for _, by_station in duplicated_data.groupby(by="station_code"):
-            for _, by_timestamp in by_station.groupby(by="timestamp"):
-                by_timestamp = by_timestamp.copy()
-                by_timestamp.fillna(inplace=True, method="ffill")
-                by_timestamp.fillna(inplace=True, method="bfill")
-                by_timestamp.drop_duplicates(
-                    subset=["station_code", "timestamp"], inplace=True, keep="first"
-                )
-                not_duplicated_data = pd.concat(
-                    [not_duplicated_data, by_timestamp], ignore_index=True
-                )
-
-        return not_duplicated_data
-
     @staticmethod
     def transform_for_bigquery(data: pd.DataFrame) -> pd.DataFrame:
         bigquery = BigQueryApi()
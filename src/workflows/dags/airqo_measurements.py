@@ -222,6 +222,7 @@ def airqo_historical_raw_measurements():
             start_date_time=start_date_time,
             end_date_time=end_date_time,
             device_category=DeviceCategory.LOW_COST,
+            checkpoint=True,
         )
 
     @task()
@@ -1,6 +1,7 @@
 from airflow.decorators import dag, task
 
 from airqo_etl_utils.workflows_custom_utils import AirflowUtils
+from airqo_etl_utils.airqo_api import AirQoApi
 from airqo_etl_utils.bigquery_api import BigQueryApi
 from airqo_etl_utils.config import configuration
 from airqo_etl_utils.ml_utils import ForecastUtils
@@ -61,6 +62,10 @@ def make_forecasts():
     def save_hourly_forecasts_to_mongo(data):
         ForecastUtils.save_forecasts_to_mongo(data, "hourly")
 
+    @task()
+    def materialize_hourly_forecasts():
+        AirQoApi().materialize_forecasts("hourly")
+
     # Daily forecast tasks
     @task()
     def get_historical_data_for_daily_forecasts():
@@ -105,6 +110,10 @@ def make_forecasts():
     def save_daily_forecasts_to_mongo(data):
         ForecastUtils.save_forecasts_to_mongo(data, "daily")
 
+    @task()
+    def materialize_daily_forecasts():
+        AirQoApi().materialize_forecasts("daily")
+
     # Hourly forecast pipeline
     hourly_data = get_historical_data_for_hourly_forecasts()
     hourly_preprocessed_data = preprocess_historical_data_hourly_forecast(hourly_data)
@@ -119,7 +128,7 @@ def make_forecasts():
     )
     hourly_forecasts = make_hourly_forecasts(hourly_location_features)
     save_hourly_forecasts_to_bigquery(hourly_forecasts)
-    save_hourly_forecasts_to_mongo(hourly_forecasts)
+    save_hourly_forecasts_to_mongo(hourly_forecasts) >> materialize_hourly_forecasts()
 
     # Daily forecast pipeline
     daily_data = get_historical_data_for_daily_forecasts()
@@ -135,7 +144,7 @@ def make_forecasts():
     )
     daily_forecasts = make_daily_forecasts(daily_location_features)
     save_daily_forecasts_to_bigquery(daily_forecasts)
-    save_daily_forecasts_to_mongo(daily_forecasts)
+    save_daily_forecasts_to_mongo(daily_forecasts) >> materialize_daily_forecasts()
 
 
 make_forecasts()